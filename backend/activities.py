@@ -5,32 +5,185 @@ from pydantic import BaseModel
 import requests
 import time
 import logging
-from models import User, Activity, Threshold
-from utils import calculate_utl
-from config import get_db, SessionLocal
+from datetime import datetime
+from models import User, Activity, ActivityMetrics, Threshold, WellnessData
+from activity_metrics import record_activity_features, metrics_features
+from utl_batch import calculate_utl_batch, utl_fingerprint
+from config import get_db, SessionLocal, STRAVA_API_BASE_URL
 from research_threshold_calculator import update_thresholds_from_activity_streams
+from upstream_budget import strava_budget, UpstreamBudgetExceeded
+from job_queue import enqueue, PRIORITY_BACKFILL
+from data_events import publish, ACTIVITIES_CHANGED
+from metrics import observe_upstream, count_work, ACTIVITIES_INGESTED
+import training_rollups  # noqa: F401 - its session hook keeps the rollups current as activities are written
 
 router = APIRouter()
 
 class ActivityImportRequest(BaseModel):
     user_id: int
 
+STRAVA_STREAM_KEYS = "time,latlng,distance,altitude,velocity_smooth,heartrate,cadence,watts"
+
+
+def _strava_get(url: str, headers: dict, params: dict = None, timeout: int = 10):
+    """GET a Strava API URL within the current lane's share of the rate limit."""
+    strava_budget.acquire()
+    start = time.perf_counter()
+    try:
+        resp = requests.get(url, headers=headers, params=params, timeout=timeout)
+    except requests.exceptions.RequestException:
+        observe_upstream("strava", time.perf_counter() - start, None)
+        raise
+    observe_upstream("strava", time.perf_counter() - start, resp.status_code)
+    strava_budget.observe(resp.headers)
+    return resp
+
+
+def _fetch_activity_streams(strava_id: str, headers: dict, user_id: int):
+    """Fetch the detailed streams for one Strava activity (None if unavailable)."""
+    stream_url = f"{STRAVA_API_BASE_URL}/activities/{strava_id}/streams"
+    stream_params = {"keys": STRAVA_STREAM_KEYS, "key_by_type": True}
+    try:
+        stream_resp = _strava_get(stream_url, headers, params=stream_params, timeout=15)
+        stream_resp.raise_for_status()
+        return stream_resp.json()
+    except requests.exceptions.RequestException as e:
+        logging.warning(f"Could not fetch streams for activity {strava_id} for user {user_id}: {e}. UTL calculation may be less accurate.")
+        return None
+
+
+def _activity_start(activity_date):
+    """
+    Strava start_date (ISO string or datetime) as the naive datetime the start_date column stores,
+    keeping the wall-clock time like Postgres does for a timestamp column; None if missing.
+    """
+    if not activity_date:
+        return None
+    if isinstance(activity_date, str):
+        activity_date = datetime.fromisoformat(activity_date.replace('Z', '+00:00'))
+    return activity_date.replace(tzinfo=None)
+
+
+def _activity_day(activity_date):
+    """Calendar date of a Strava start_date (ISO string or datetime); None if missing."""
+    start = _activity_start(activity_date)
+    return start.date() if start else None
+
+
+def _wellness_for_days(user_id: int, days, db: Session) -> dict:
+    """Wellness modifiers dicts for the given dates, keyed by date, in one query."""
+    days = {day for day in days if day}
+    if not days:
+        return {}
+    entries = db.query(WellnessData).filter(
+        WellnessData.user_id == user_id,
+        WellnessData.date.in_(days)
+    ).all()
+    return {
+        entry.date: {
+            'hrv': entry.hrv,
+            'sleepScore': entry.sleep_score,
+            'readiness': entry.readiness_score,
+            'restingHR': entry.resting_hr
+        }
+        for entry in entries
+    }
+
+
+def _get_wellness_for_activity(user_id: int, activity_date, db: Session, strava_id: str = None):
+    """Return the wellness modifiers dict for the activity's date, if any."""
+    try:
+        day = _activity_day(activity_date)
+        return _wellness_for_days(user_id, [day], db).get(day)
+    except Exception as e:
+        logging.warning(f"Could not fetch wellness data for activity {strava_id}: {e}")
+    return None
+
+
+def _apply_activity_summary(activity: Activity, act_summary: dict, activity_streams):
+    """Copy Strava summary fields (and streams) onto an Activity row."""
+    activity.name = act_summary.get("name")
+    activity.type = act_summary.get("type")
+    activity.distance = act_summary.get("distance")
+    activity.moving_time = act_summary.get("moving_time")
+    activity.elapsed_time = act_summary.get("elapsed_time")
+    activity.start_date = _activity_start(act_summary.get("start_date"))  # Flush hooks read it as a datetime
+    activity.average_speed = act_summary.get("average_speed")
+    activity.max_speed = act_summary.get("max_speed")
+    activity.total_elevation_gain = act_summary.get("total_elevation_gain")
+    activity.data = {
+        **act_summary,  # Store all summary data
+        "streams": activity_streams  # Add streams data
+    }
+
+
+def _score_activity(activity: Activity, act_summary: dict, threshold, activity_streams, user_id: int, db: Session,
+                    wellness_by_day: dict = None):
+    """
+    Store an activity's stream features, then calculate UTL using thresholds and same-day wellness data.
+    Batch imports pass the page's wellness (from _wellness_for_days) instead of a query per activity.
+    """
+    strava_id = activity.strava_activity_id
+    # Features are stored even without thresholds, so later rescoring never needs the streams
+    metrics = record_activity_features(db, activity, activity_streams)
+    if not threshold:
+        logging.warning(f"No threshold data for user {user_id}, skipping UTL calculation for activity {strava_id}")
+        return
+
+    # Get wellness data for the activity date (if available)
+    if wellness_by_day is not None:
+        wellness_data = wellness_by_day.get(_activity_day(act_summary.get("start_date")))
+    else:
+        wellness_data = _get_wellness_for_activity(user_id, act_summary.get("start_date"), db, strava_id)
+    
+    # Score from the extracted features (same result as calculate_utl on summary, streams and wellness)
+    features = [metrics_features(metrics)] if metrics else None
+    utl_score, method = calculate_utl_batch([act_summary], threshold, [activity_streams], [wellness_data], features)[0]
+    activity.utl_score = float(utl_score)  # Ensure it's a Python float, not numpy
+    activity.calculation_method = method
+    if metrics:
+        if "running_intensity" in features[0]:
+            metrics.running_intensity_checked = True
+            metrics.running_intensity = features[0]["running_intensity"]
+        metrics.utl_fingerprint = utl_fingerprint(act_summary, threshold, features[0], wellness_data)
+    
+    wellness_info = " (with wellness data)" if wellness_data else ""
+    logging.info(f"Calculated UTL {utl_score:.2f} using {method} for activity {strava_id}{wellness_info}")
+
+
+def _analyze_activity_thresholds(act_summary: dict, activity_streams, strava_id: str, user_id: int):
+    """Analyze streams for threshold updates if this is a significant activity."""
+    if activity_streams and (act_summary.get("type") in ["Ride", "VirtualRide", "Run", "VirtualRun"]):
+        try:
+            threshold_analysis = update_thresholds_from_activity_streams(
+                strava_id, user_id
+            )
+            if threshold_analysis.get('thresholds_updated'):
+                logging.info(f"Updated thresholds from activity {strava_id}: {threshold_analysis}")
+        except Exception as e:
+            logging.warning(f"Could not analyze thresholds for activity {strava_id}: {e}")
+
+
 def _fetch_and_process_activities(user_id: int, db: Session, backfill_days: int = 90):
     """
     Fetches activities for a user from Strava, calculates UTL, and stores them.
     - PRD specifies Garmin API, but current implementation uses Strava. This should be reconciled.
     - Fetches activity streams for accurate UTL calculation.
+    - Duplicate checks and same-day wellness are one query per page, not per activity.
+
+    Returns:
+        Number of newly imported activities
     """
     user = db.query(User).filter_by(user_id=user_id).first()
     if not user or not user.strava_oauth_token:
         logging.warning(f"No Strava token for user {user_id}")
-        return
+        return 0
 
     threshold = db.query(Threshold).filter_by(user_id=user_id).first()
     access_token = user.strava_oauth_token
     headers = {"Authorization": f"Bearer {access_token}"}
     
-    activities_url = "https://www.strava.com/api/v3/athlete/activities"
+    activities_url = f"{STRAVA_API_BASE_URL}/athlete/activities"
     per_page = 200
     after_timestamp = int(time.time()) - backfill_days * 24 * 60 * 60
     page = 1
@@ -39,7 +192,7 @@ def _fetch_and_process_activities(user_id: int, db: Session, backfill_days: int
     while True:
         params = {"per_page": per_page, "page": page, "after": after_timestamp}
         try:
-            resp = requests.get(activities_url, headers=headers, params=params, timeout=10)
+            resp = _strava_get(activities_url, headers, params=params)
             resp.raise_for_status()
         except requests.exceptions.RequestException as e:
             logging.error(f"Strava API error fetching activities for user {user_id}: {e}")
@@ -49,94 +202,35 @@ def _fetch_and_process_activities(user_id: int, db: Session, backfill_days: int
         if not activities:
             break
 
+        page_ids = [str(act_summary["id"]) for act_summary in activities]
+        existing_ids = {row.strava_activity_id for row in db.query(Activity.strava_activity_id).filter(
+            Activity.strava_activity_id.in_(page_ids))}
+        new_summaries = [act_summary for act_summary in activities if str(act_summary["id"]) not in existing_ids]
+        wellness_by_day = {}
+        if threshold and new_summaries:
+            try:
+                wellness_by_day = _wellness_for_days(
+                    user_id, [_activity_day(act_summary.get("start_date")) for act_summary in new_summaries], db)
+            except Exception as e:
+                logging.warning(f"Could not fetch wellness data for user {user_id}: {e}")
+
         for act_summary in activities:
             strava_id = str(act_summary["id"])
-            if db.query(Activity).filter_by(strava_activity_id=strava_id).first():
+            if strava_id in existing_ids:
                 logging.info(f"Skipping duplicate activity {strava_id} for user {user_id}")
                 continue
 
             # Fetch activity stream for detailed data
-            stream_url = f"https://www.strava.com/api/v3/activities/{strava_id}/streams"
-            stream_params = {"keys": "time,latlng,distance,altitude,velocity_smooth,heartrate,cadence,watts", "key_by_type": True}
-            try:
-                stream_resp = requests.get(stream_url, headers=headers, params=stream_params, timeout=15)
-                stream_resp.raise_for_status()
-                activity_streams = stream_resp.json()
-            except requests.exceptions.RequestException as e:
-                logging.warning(f"Could not fetch streams for activity {strava_id} for user {user_id}: {e}. UTL calculation may be less accurate.")
-                activity_streams = None
-
-            activity = Activity(
-                strava_activity_id=strava_id,
-                user_id=user.user_id,
-                name=act_summary.get("name"),
-                type=act_summary.get("type"),
-                distance=act_summary.get("distance"),
-                moving_time=act_summary.get("moving_time"),
-                elapsed_time=act_summary.get("elapsed_time"),
-                start_date=act_summary.get("start_date"),
-                average_speed=act_summary.get("average_speed"),
-                max_speed=act_summary.get("max_speed"),
-                total_elevation_gain=act_summary.get("total_elevation_gain"),
-                data={
-                    **act_summary,  # Store all summary data
-                    "streams": activity_streams  # Add streams data
-                }
-            )
+            activity_streams = _fetch_activity_streams(strava_id, headers, user_id)
 
-            if threshold:
-                # Get wellness data for the activity date (if available)
-                activity_date = act_summary.get("start_date")
-                wellness_data = None
-                if activity_date:
-                    try:
-                        from datetime import datetime
-                        from models import WellnessData
-                        # Parse the activity date
-                        if isinstance(activity_date, str):
-                            activity_dt = datetime.fromisoformat(activity_date.replace('Z', '+00:00'))
-                        else:
-                            activity_dt = activity_date
-                        
-                        # Look for wellness data on the same date
-                        wellness_entry = db.query(WellnessData).filter(
-                            WellnessData.user_id == user_id,
-                            WellnessData.date == activity_dt.date()
-                        ).first()
-                        
-                        if wellness_entry:
-                            wellness_data = {
-                                'hrv': wellness_entry.hrv,
-                                'sleepScore': wellness_entry.sleep_score,
-                                'readiness': wellness_entry.readiness_score,  # Fixed: use readiness_score
-                                'restingHR': wellness_entry.resting_hr
-                            }
-                    except Exception as e:
-                        logging.warning(f"Could not fetch wellness data for activity {strava_id}: {e}")
-                
-                # Pass summary, stream data, and wellness data to UTL calculation
-                utl_score, method = calculate_utl(act_summary, threshold, activity_streams, wellness_data)
-                activity.utl_score = float(utl_score)  # Ensure it's a Python float, not numpy
-                activity.calculation_method = method
-                
-                wellness_info = " (with wellness data)" if wellness_data else ""
-                logging.info(f"Calculated UTL {utl_score:.2f} using {method} for activity {strava_id}{wellness_info}")
-            else:
-                logging.warning(f"No threshold data for user {user_id}, skipping UTL calculation for activity {strava_id}")
+            activity = Activity(strava_activity_id=strava_id, user_id=user.user_id)
+            _apply_activity_summary(activity, act_summary, activity_streams)
+            _score_activity(activity, act_summary, threshold, activity_streams, user_id, db, wellness_by_day)
 
             db.add(activity)
             total_imported += 1
             
-            # Analyze streams for threshold updates if this is a significant activity
-            if activity_streams and (act_summary.get("type") in ["Ride", "VirtualRide", "Run", "VirtualRun"]):
-                try:
-                    threshold_analysis = update_thresholds_from_activity_streams(
-                        strava_id, user_id
-                    )
-                    if threshold_analysis.get('thresholds_updated'):
-                        logging.info(f"Updated thresholds from activity {strava_id}: {threshold_analysis}")
-                except Exception as e:
-                    logging.warning(f"Could not analyze thresholds for activity {strava_id}: {e}")
+            _analyze_activity_thresholds(act_summary, activity_streams, strava_id, user_id)
             
             logging.info(f"Imported activity {strava_id}: {act_summary.get('name')} for user {user_id}")
 
@@ -146,6 +240,72 @@ def _fetch_and_process_activities(user_id: int, db: Session, backfill_days: int
         page += 1
 
     logging.info(f"Imported {total_imported} new Strava activities for user {user_id}")
+    if total_imported:
+        ACTIVITIES_INGESTED.inc(total_imported, source="import")
+        count_work("activities", total_imported)
+        publish(ACTIVITIES_CHANGED, user_id)
+    return total_imported
+
+
+def _fetch_and_process_single_activity(user_id: int, strava_activity_id: str, db: Session) -> str:
+    """
+    Fetch one Strava activity (summary plus streams) and insert or refresh it.
+    Used by the webhook receiver so a single upload costs two API calls instead of a full poll.
+
+    Returns:
+        "created", "updated", or "skipped"
+    """
+    user = db.query(User).filter_by(user_id=user_id).first()
+    if not user or not user.strava_oauth_token:
+        logging.warning(f"No Strava token for user {user_id}")
+        return "skipped"
+
+    strava_id = str(strava_activity_id)
+    headers = {"Authorization": f"Bearer {user.strava_oauth_token}"}
+    try:
+        resp = _strava_get(f"{STRAVA_API_BASE_URL}/activities/{strava_id}", headers)
+        resp.raise_for_status()
+        act_summary = resp.json()
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Strava API error fetching activity {strava_id} for user {user_id}: {e}")
+        return "skipped"
+
+    activity_streams = _fetch_activity_streams(strava_id, headers, user_id)
+    threshold = db.query(Threshold).filter_by(user_id=user_id).first()
+
+    activity = db.query(Activity).filter_by(strava_activity_id=strava_id).first()
+    outcome = "updated" if activity else "created"
+    if not activity:
+        activity = Activity(strava_activity_id=strava_id, user_id=user.user_id)
+
+    _apply_activity_summary(activity, act_summary, activity_streams)
+    _score_activity(activity, act_summary, threshold, activity_streams, user_id, db)
+    db.add(activity)
+    db.commit()
+    if outcome == "created":
+        ACTIVITIES_INGESTED.inc(source="webhook")
+    count_work("activities")
+    publish(ACTIVITIES_CHANGED, user_id)
+
+    _analyze_activity_thresholds(act_summary, activity_streams, strava_id, user_id)
+    logging.info(f"Webhook {outcome} activity {strava_id}: {act_summary.get('name')} for user {user_id}")
+    return outcome
+
+
+def _delete_activity(user_id: int, strava_activity_id: str, db: Session) -> bool:
+    """Remove an activity that was deleted on Strava."""
+    activity = db.query(Activity).filter_by(
+        strava_activity_id=str(strava_activity_id), user_id=user_id
+    ).first()
+    if not activity:
+        return False
+    db.query(ActivityMetrics).filter_by(activity_id=activity.activity_id).delete()
+    db.delete(activity)
+    db.commit()
+    count_work("activities")
+    publish(ACTIVITIES_CHANGED, user_id)
+    logging.info(f"Deleted activity {strava_activity_id} for user {user_id} (removed on Strava)")
+    return True
 
 @router.post("/import_activities")
 def import_activities(request: ActivityImportRequest, background_tasks: BackgroundTasks):
@@ -154,6 +314,14 @@ def import_activities(request: ActivityImportRequest, background_tasks: Backgrou
         db = SessionLocal()
         try:
             _fetch_and_process_activities(request.user_id, db)
+        except UpstreamBudgetExceeded as e:
+            # Hand the rest to the queue; activities already imported are skipped as duplicates
+            db.rollback()
+            logging.warning(f"⏳ Strava budget exhausted importing for user {request.user_id}, "
+                            f"resuming from the queue in {e.retry_after:.0f}s: {e}")
+            enqueue(db, "sync_user", user_id=request.user_id, payload={"backfill_days": 90, "wellness_days": 0},
+                    priority=PRIORITY_BACKFILL, dedup_key=f"sync_user:{request.user_id}:import",
+                    delay_seconds=int(e.retry_after) + 1)
         finally:
             db.close()
             
@@ -169,7 +337,14 @@ def sync_strava_activities():
         for user in users:
             logging.info(f"Checking for new activities for user {user.user_id}")
             # Sync last 7 days for existing users
-            _fetch_and_process_activities(user.user_id, db, backfill_days=7)
+            try:
+                _fetch_and_process_activities(user.user_id, db, backfill_days=7)
+            except UpstreamBudgetExceeded as e:
+                # The budget is shared, so the remaining users would fail too; the next run catches up
+                db.rollback()
+                logging.warning(f"⏳ Strava budget exhausted, stopping sync at user {user.user_id} "
+                                f"(frees up in {e.retry_after:.0f}s): {e}")
+                break
     finally:
         db.close()
     logging.info("Finished scheduled Strava activity sync.")
@@ -0,0 +1,411 @@
+# Per-activity derived metrics
+#
+# calculate_utl is split in two: extracting features from an activity's raw streams (normalized
+# power, average power and heart rate, the running pace-distribution class) and a cheap scoring
+# step over those features and the athlete's thresholds (utl_batch.py). Features depend only on
+# the streams, so they are extracted once at ingest and stored in activity_metrics; rescoring
+# after a threshold or wellness change reads these narrow rows instead of the streams JSON.
+#
+# The same row carries what threshold estimation reads (Strava's average_watts / max_heartrate,
+# stream maxima, which streams exist) and time histograms of heart rate, power and speed in
+# fixed-width bins. Zones depend on thresholds that change, so the histograms are stored in
+# absolute units and time-in-zone is derived from them for the current thresholds (zone_seconds).
+#
+# The pace-distribution analysis is slow and only matters for runs that have neither a usable
+# threshold pace nor heart rate, so it runs the first time such a run is scored and is stored then.
+#
+# Rows are written at ingest; `python background_processor.py --mode=metrics_backfill` fills in
+# activities imported before a FEATURES_VERSION bump (bumping also re-extracts lazily on use).
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+import logging
+import numbers
+
+import numpy as np
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from models import Activity, ActivityMetrics
+from histogram_sketch import HistogramSketch, merge_sketches
+from streams_analysis import analyze_running_intensity_distribution
+from utils import estimate_thresholds_from_activities, fold_stream_curves
+from metrics import cpu_timed
+
+FEATURES_VERSION = 3  # Bump when extraction changes; older rows are re-extracted on next use
+NP_WINDOW = 30  # Normalized power rolling window (samples)
+MAX_SAMPLE_SECONDS = 30  # Longer gaps between samples are pauses, not time in a bin
+BACKFILL_BATCH_SIZE = 200  # Activities (with their streams JSON) extracted per backfill commit
+STREAM_YIELD_PER = 5  # Rows with streams JSON (about 0.5 MB parsed per 1 Hz hour) fetched per round trip when streamed
+STREAM_CURVE_TYPES = ["Ride", "VirtualRide", "Run", "VirtualRun"]  # Types utils' power/pace curve estimation reads streams of
+
+# UTL scoring inputs (utl_batch.py); their values are part of the score fingerprint
+FEATURE_COLUMNS = ("has_watts", "watts_samples", "normalized_power", "avg_power",
+                   "has_heartrate", "hr_samples", "avg_hr", "has_distance")
+DERIVED_COLUMNS = ("has_streams", "has_velocity", "velocity_samples", "max_power", "max_hr",
+                   "average_watts", "max_heartrate", "hr_seconds", "power_seconds", "speed_seconds",
+                   "hr_sketch", "power_sketch", "speed_sketch")
+
+# Histograms (HistogramSketch bins): column -> (stream, lowest value, bin width, bins). Values
+# below the lowest bin are dropped (sensor dropouts); values above the top bin count in the top bin.
+# *_seconds columns hold time per bin (zones); *_sketch columns hold sample counts (percentiles).
+HISTOGRAMS = {
+    "hr_seconds": ("heartrate", 30, 1.0, 200),  # 1 bpm, 30-229 bpm
+    "power_seconds": ("watts", 0, 10.0, 200),  # 10 W, 0-1999 W
+    "speed_seconds": ("velocity_smooth", 0, 0.1, 100),  # 0.1 m/s, 0-9.9 m/s
+}
+SKETCHES = {
+    "hr_sketch": HISTOGRAMS["hr_seconds"],
+    "power_sketch": HISTOGRAMS["power_seconds"],
+    "speed_sketch": HISTOGRAMS["speed_seconds"],
+}
+
+# Zone lower bounds as fractions of the threshold (zone 1 starts at 0)
+HR_ZONES = (0.60, 0.70, 0.80, 0.90)  # % of max HR, 5 zones
+POWER_ZONES = (0.55, 0.75, 0.90, 1.05, 1.20, 1.50)  # % of FTP, Coggan's 7 zones
+PACE_ZONES = (0.81, 0.90, 0.95, 1.06, 1.20)  # % of threshold speed, as streams_analysis's pace zones
+
+
+def _numeric_stream(activity_streams: dict, key: str) -> np.ndarray:
+    """Stream values as a float array; raises ValueError for values calculate_utl would choke on."""
+    values = np.asarray(activity_streams[key]["data"])
+    if values.size and (values.ndim != 1 or values.dtype.kind not in "biuf"):
+        raise ValueError(f"non-numeric {key} stream")
+    return values.astype(float)
+
+
+def stream_features(activity_streams: Optional[dict]) -> dict:
+    """
+    Reduce an activity's streams to the values calculate_utl uses.
+
+    Returns:
+        Dict with has_watts/has_heartrate/has_distance flags (stream key present), sample counts,
+        normalized_power, avg_power and avg_hr (NaN when absent)
+
+    Raises:
+        ValueError, KeyError, TypeError: streams the vectorized path can't score exactly
+    """
+    features = {
+        "has_watts": False, "watts_samples": 0, "normalized_power": np.nan, "avg_power": np.nan,
+        "has_heartrate": False, "hr_samples": 0, "avg_hr": np.nan,
+        "has_distance": False,
+    }
+    if not activity_streams:
+        return features
+
+    if "watts" in activity_streams:
+        watts = _numeric_stream(activity_streams, "watts")
+        features["has_watts"] = True
+        features["watts_samples"] = watts.size
+        if watts.size:
+            features["avg_power"] = watts.mean()
+            if watts.size < NP_WINDOW:
+                features["normalized_power"] = watts.mean()
+            else:
+                # Rolling 30-sample means from a cumulative sum, then the fourth-power mean's fourth root
+                cumulative = np.concatenate(([0.0], np.cumsum(watts)))
+                rolling = (cumulative[NP_WINDOW:] - cumulative[:-NP_WINDOW]) / NP_WINDOW
+                features["normalized_power"] = np.power(np.mean(rolling ** 4), 0.25)
+
+    if "heartrate" in activity_streams:
+        heartrate = _numeric_stream(activity_streams, "heartrate")
+        features["has_heartrate"] = True
+        features["hr_samples"] = heartrate.size
+        if heartrate.size:
+            features["avg_hr"] = heartrate.mean()
+
+    features["has_distance"] = "distance" in activity_streams
+    return features
+
+
+def _sample_seconds(activity_streams: dict, count: int) -> np.ndarray:
+    """Seconds each sample stands for: time-stream deltas (pauses capped), else 1 s per sample."""
+    time_data = activity_streams.get("time", {}).get("data")
+    if time_data is None or len(time_data) != count or count == 0:
+        return np.ones(count)
+    times = np.asarray(time_data, dtype=float)
+    seconds = np.diff(times, prepend=times[0] - 1)
+    return np.clip(seconds, 0, MAX_SAMPLE_SECONDS)
+
+
+def _summary_number(summary: dict, key: str) -> Optional[float]:
+    value = summary.get(key) if summary else None
+    return float(value) if isinstance(value, numbers.Real) and not isinstance(value, bool) else None
+
+
+def derived_features(summary: Optional[dict], activity_streams: Optional[dict]) -> dict:
+    """
+    Values threshold estimation and zone analysis read: stream flags and maxima, the Strava
+    summary's average_watts / max_heartrate, time histograms and sample sketches (see HISTOGRAMS).
+
+    Raises:
+        ValueError, KeyError, TypeError: streams that can't be reduced (as stream_features)
+    """
+    features = {
+        "has_streams": bool(activity_streams), "has_velocity": False, "velocity_samples": 0,
+        "max_power": None, "max_hr": None,
+        "average_watts": _summary_number(summary, "average_watts"),
+        "max_heartrate": _summary_number(summary, "max_heartrate"),
+        "hr_seconds": None, "power_seconds": None, "speed_seconds": None,
+        "hr_sketch": None, "power_sketch": None, "speed_sketch": None,
+    }
+    if not activity_streams:
+        return features
+
+    for (column, (key, low, width, bins)), sketch_column in zip(HISTOGRAMS.items(), SKETCHES):
+        if key not in activity_streams:
+            continue
+        values = _numeric_stream(activity_streams, key)
+        seconds = _sample_seconds(activity_streams, values.size)
+        features[column] = HistogramSketch.from_values(values, low, width, bins, weights=seconds).to_list()
+        features[sketch_column] = HistogramSketch.from_values(values, low, width, bins).to_stored()
+        if values.size and key == "watts":
+            features["max_power"] = float(values.max())
+        elif values.size and key == "heartrate":
+            features["max_hr"] = float(values.max())
+        elif key == "velocity_smooth":
+            features["has_velocity"] = True
+            features["velocity_samples"] = int(values.size)
+    return features
+
+
+def zone_seconds(metrics: ActivityMetrics, threshold) -> Dict[str, Optional[List[int]]]:
+    """
+    Time in HR, power and pace zones for the given thresholds, from the stored histograms.
+
+    Returns:
+        {"hr": [...], "power": [...], "pace": [...]}, seconds per zone (zone 1 first); None where
+        the activity has no such stream or the threshold is unset
+    """
+    def zones(column, reference, fractions):
+        histogram = getattr(metrics, column)
+        if histogram is None or not reference or reference <= 0:
+            return None
+        _, low, width, bins = HISTOGRAMS[column]
+        centres = low + (np.arange(bins) + 0.5) * width
+        zone = np.searchsorted(np.array(fractions) * reference, centres, side="right")
+        return [int(x) for x in np.bincount(zone, weights=histogram, minlength=len(fractions) + 1)]
+
+    return {
+        "hr": zones("hr_seconds", threshold.max_hr, HR_ZONES),
+        "power": zones("power_seconds", threshold.ftp_watts, POWER_ZONES),
+        "pace": zones("speed_seconds", threshold.fthp_mps, PACE_ZONES),
+    }
+
+
+def running_intensity_class(activity_streams: dict) -> Optional[str]:
+    """Pace-distribution class of a run (calculate_utl step 4), or None if it can't classify."""
+    try:
+        distance_data = activity_streams["distance"]["data"]
+        time_data = activity_streams.get("time", {}).get("data", list(range(len(distance_data))))
+        hr_data = activity_streams.get("heartrate", {}).get("data", None)
+        intensity_analysis = analyze_running_intensity_distribution(distance_data, time_data, hr_data)
+        if "intensity_classification" in intensity_analysis:
+            return intensity_analysis["intensity_classification"]
+    except Exception as e:
+        logging.warning(f"Could not analyze running intensity: {str(e)}")
+    return None
+
+
+@cpu_timed("extract_features")
+def extract_features(summary: Optional[dict], activity_streams: Optional[dict]) -> dict:
+    """Everything a metrics row stores: stream_features() and derived_features()."""
+    return {**stream_features(activity_streams), **derived_features(summary, activity_streams)}
+
+
+def metrics_features(metrics: ActivityMetrics) -> dict:
+    """Feature dict (as from stream_features) for a stored row, with the pace class once known."""
+    features = {name: getattr(metrics, name) for name in FEATURE_COLUMNS}
+    for name in ("normalized_power", "avg_power", "avg_hr"):
+        if features[name] is None:
+            features[name] = np.nan
+    if metrics.running_intensity_checked:
+        features["running_intensity"] = metrics.running_intensity
+    return features
+
+
+def apply_features(metrics: ActivityMetrics, features: dict):
+    """Copy extracted features (scoring and derived) onto a metrics row; any stored score fingerprint is void."""
+    for name in FEATURE_COLUMNS + DERIVED_COLUMNS:
+        value = features[name]
+        if isinstance(value, (float, np.floating)):
+            value = None if np.isnan(value) else float(value)
+        elif isinstance(value, np.integer):
+            value = int(value)
+        setattr(metrics, name, value)
+    metrics.running_intensity_checked = "running_intensity" in features
+    metrics.running_intensity = features.get("running_intensity")
+    metrics.features_version = FEATURES_VERSION
+    metrics.utl_fingerprint = None
+    metrics.computed_at = datetime.now()
+
+
+def record_activity_features(db: Session, activity, activity_streams) -> Optional[ActivityMetrics]:
+    """
+    Extract an activity's metrics from its streams and stored summary and stage its metrics row
+    (inserted together with a new activity on commit).
+
+    Returns:
+        The metrics row, or None if the streams can't be featurized (scored by calculate_utl)
+    """
+    summary = activity.data if isinstance(activity.data, dict) else None
+    try:
+        features = extract_features(summary, activity_streams)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        logging.warning(f"Could not extract stream features for activity {activity.strava_activity_id}: {e}")
+        return None
+
+    metrics = db.get(ActivityMetrics, activity.activity_id) if activity.activity_id else None
+    if metrics is None:
+        metrics = ActivityMetrics(activity=activity)
+        db.add(metrics)
+    apply_features(metrics, features)
+    return metrics
+
+
+def load_activity_metrics(db: Session, activities: List) -> Dict[int, ActivityMetrics]:
+    """
+    Current metrics rows for `activities` (one query), extracting features for activities
+    without one. Only those activities' streams JSON is read.
+    """
+    ids = [activity.activity_id for activity in activities]
+    metrics_by_id = {
+        metrics.activity_id: metrics
+        for metrics in db.query(ActivityMetrics).filter(ActivityMetrics.activity_id.in_(ids))
+    } if ids else {}
+
+    for activity in activities:
+        metrics = metrics_by_id.get(activity.activity_id)
+        if metrics is not None and metrics.features_version == FEATURES_VERSION:
+            continue
+        streams = activity.data.get('streams') if activity.data and isinstance(activity.data, dict) else None
+        metrics = record_activity_features(db, activity, streams)
+        if metrics is not None:
+            metrics_by_id[activity.activity_id] = metrics
+        else:
+            metrics_by_id.pop(activity.activity_id, None)
+    return metrics_by_id
+
+
+def backfill_activity_metrics(db: Session, user_id: int = None, since: datetime = None,
+                              batch_size: int = BACKFILL_BATCH_SIZE, commit: bool = True) -> int:
+    """
+    Extract metrics for activities without a current activity_metrics row, `batch_size` per commit.
+    Rows are streamed (yield_per) and each activity's streams JSON is dropped once its metrics are
+    extracted, so memory holds a few activities at a time rather than a batch.
+
+    Args:
+        user_id: Limit to one user (default: everyone)
+        since: Limit to activities starting on or after this time
+        commit: Commit after each batch; otherwise rows are only staged for the caller's commit
+
+    Returns:
+        Number of metrics rows written
+    """
+    written = 0
+    last_id = 0
+    while True:
+        query = db.query(Activity).outerjoin(
+            ActivityMetrics, ActivityMetrics.activity_id == Activity.activity_id
+        ).filter(
+            Activity.activity_id > last_id,
+            or_(ActivityMetrics.activity_id.is_(None), ActivityMetrics.features_version != FEATURES_VERSION),
+        )
+        if user_id is not None:
+            query = query.filter(Activity.user_id == user_id)
+        if since is not None:
+            query = query.filter(Activity.start_date >= since)
+        batch_start = last_id
+        for activity in query.order_by(Activity.activity_id).limit(batch_size).yield_per(STREAM_YIELD_PER):
+            streams = activity.data.get('streams') if activity.data and isinstance(activity.data, dict) else None
+            if record_activity_features(db, activity, streams) is not None:
+                written += 1
+            last_id = activity.activity_id
+            db.expire(activity, ['data'])
+        if last_id == batch_start:
+            break
+        if commit:
+            db.commit()
+        else:
+            db.flush()
+        logging.info(f"📐 Activity metrics backfill: {written} rows written (through activity {last_id})")
+    return written
+
+
+def threshold_activity_summaries(db: Session, user_id: int, since: datetime = None) -> List[dict]:
+    """
+    The summary dicts threshold estimation takes (estimate_thresholds_from_activities), read from
+    the activities and activity_metrics columns in one query instead of each activity's JSON.
+    Missing metrics rows are extracted first and staged for the caller's commit.
+    """
+    backfill_activity_metrics(db, user_id, since, commit=False)
+    query = db.query(
+        Activity.activity_id, Activity.type, Activity.moving_time, Activity.average_speed,
+        Activity.distance, Activity.start_date, Activity.name,
+        ActivityMetrics.average_watts, ActivityMetrics.max_heartrate, ActivityMetrics.has_streams,
+    ).outerjoin(ActivityMetrics, ActivityMetrics.activity_id == Activity.activity_id).filter(
+        Activity.user_id == user_id
+    )
+    if since is not None:
+        query = query.filter(Activity.start_date >= since)
+    return [
+        {
+            'activity_id': row.activity_id,
+            'type': row.type,
+            'moving_time': row.moving_time,
+            'average_speed': row.average_speed,
+            'average_watts': row.average_watts,
+            'max_heartrate': row.max_heartrate,
+            'distance': row.distance,
+            'start_date': row.start_date,
+            'name': row.name,
+            'has_streams': bool(row.has_streams),
+        }
+        for row in query.order_by(Activity.activity_id)
+    ]
+
+
+def iter_activities_with_streams(db: Session, summaries: List[dict], types: List[str] = None) -> Iterator[tuple]:
+    """
+    (summary, streams) pairs for the summaries whose activity has streams, for stream-based
+    estimation. A generator: rows are fetched STREAM_YIELD_PER at a time, so folding the pairs
+    (utils.fold_stream_curves) holds a few activities' streams at once however many there are.
+
+    Args:
+        types: Only these activity types (e.g. the rides and runs power/pace curves use)
+    """
+    ids = [
+        summary['activity_id'] for summary in summaries
+        if summary.get('has_streams') and (types is None or summary.get('type') in types)
+    ]
+    by_id = {summary['activity_id']: summary for summary in summaries}
+    for start in range(0, len(ids), BACKFILL_BATCH_SIZE):
+        rows = db.query(Activity.activity_id, Activity.data).filter(
+            Activity.activity_id.in_(ids[start:start + BACKFILL_BATCH_SIZE])
+        ).order_by(Activity.activity_id).yield_per(STREAM_YIELD_PER)
+        for activity_id, data in rows:
+            if data and isinstance(data, dict) and data.get('streams'):
+                yield by_id[activity_id], data['streams']
+
+
+def merged_sketch(db: Session, user_id: int, column: str = "hr_sketch", since: datetime = None) -> HistogramSketch:
+    """One user's stored sketches for a stream (see SKETCHES), merged: percentiles over all their samples."""
+    query = db.query(getattr(ActivityMetrics, column)).join(
+        Activity, Activity.activity_id == ActivityMetrics.activity_id
+    ).filter(Activity.user_id == user_id)
+    if since is not None:
+        query = query.filter(Activity.start_date >= since)
+    _, low, width, bins = SKETCHES[column]
+    return merge_sketches((stored for stored, in query), low, width, bins)
+
+
+def estimate_thresholds_from_history(db: Session, user_id: int, gender: str, summaries: List[dict],
+                                     since: datetime = None) -> Optional[Dict]:
+    """
+    Threshold estimates from activity summaries (see threshold_activity_summaries), the user's
+    merged HR sketch and power/pace curves folded from their ride/run streams. The streams are
+    read a few rows at a time, and only here: callers use this when the research-based
+    calculation fails.
+    """
+    stream_curves = fold_stream_curves(iter_activities_with_streams(db, summaries, types=STREAM_CURVE_TYPES))
+    hr_sketch = merged_sketch(db, user_id, "hr_sketch", since=since)
+    return estimate_thresholds_from_activities(summaries, gender, hr_sketch=hr_sketch, stream_curves=stream_curves)
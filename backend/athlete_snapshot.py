@@ -0,0 +1,118 @@
+# Athlete snapshot: everything the recommendation engine reads, loaded in four queries
+#
+# - user + threshold (one outer join)
+# - the 84-day activity window, scalar columns only (no Strava JSON blobs)
+# - the weekly training rollups of the same window (training_rollups.py)
+# - the last 7 days of wellness
+#
+# Sport categories, weekly loads and the acute/chronic per-sport loads are computed once here and
+# shared by every sub-analysis instead of being re-derived from ORM objects per call.
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+
+from models import User, Threshold, Activity, WellnessData
+from training_rollups import rollup_series, period_start, week_key, WEEK
+
+HISTORY_DAYS = 84  # 12 weeks of history for trends
+CHRONIC_DAYS = 28  # ACWR chronic window
+ACUTE_DAYS = 7  # ACWR acute window and wellness lookback
+SPORTS = ("cycling", "running", "other")
+
+
+def history_sport(activity_type: str) -> str:
+    """Sport bucket used for weekly loads and patterns (exact Strava types)."""
+    activity_type = (activity_type or "").lower()
+    if activity_type in ('ride', 'virtualride'):
+        return "cycling"
+    if activity_type in ('run', 'virtualrun'):
+        return "running"
+    return "other"
+
+
+def acwr_sport(activity_type: str) -> str:
+    """Sport bucket used for sport-specific ACWR (substring match, so e.g. TrailRun counts as running)."""
+    activity_type = activity_type.lower() if activity_type else ""
+    if "run" in activity_type or "jog" in activity_type:
+        return "running"
+    if "ride" in activity_type or "cycling" in activity_type or "bike" in activity_type:
+        return "cycling"
+    return "other"
+
+
+class AthleteSnapshot:
+    """Read-only view of one athlete's recent data, with per-activity columns and per-sport window loads."""
+
+    def __init__(self, user_id: int, user, threshold, activity_rows, wellness_rows, now: datetime, weekly_rows=()):
+        self.user_id = user_id
+        self.user = user
+        self.threshold = threshold
+        self.now = now
+        self.wellness = wellness_rows  # Newest first
+
+        # Per-activity columns, newest first (the order the history analysis walks them in)
+        self.start_dates = [row.start_date for row in activity_rows]
+        self.types = [row.type for row in activity_rows]
+        self.utl = [row.utl_score for row in activity_rows]
+        self.moving_times = [row.moving_time for row in activity_rows]
+        self.history_sports = [history_sport(t) for t in self.types]
+        self.acwr_sports = [acwr_sport(t) for t in self.types]
+
+        # UTL per ISO week and sport bucket, from the weekly rollups (weeks without UTL are left out).
+        # A user whose rollups haven't been built yet falls back to the activity window.
+        if not weekly_rows and activity_rows:
+            weekly_rows = [(period_start(WEEK, start.date()), activity_type, utl)
+                           for start, activity_type, utl in zip(self.start_dates, self.types, self.utl)]
+        else:
+            weekly_rows = [(row.period_start, row.sport, row.utl) for row in weekly_rows]
+        self.weekly_loads = {}
+        for week_start, activity_type, utl in weekly_rows:
+            if not utl:
+                continue
+            week = self.weekly_loads.setdefault(week_key(week_start), {**{sport: 0 for sport in SPORTS}, "total": 0})
+            week[history_sport(activity_type)] += utl
+            week["total"] += utl
+
+        # UTL values per ACWR window, overall and per sport, newest first
+        chronic_start = now - timedelta(days=CHRONIC_DAYS)
+        acute_start = now - timedelta(days=ACUTE_DAYS)
+        self.window_utl = {window: [] for window in ("chronic", "acute")}
+        self.window_sport_utl = {window: {sport: [] for sport in SPORTS} for window in ("chronic", "acute")}
+        for start, sport, utl in zip(self.start_dates, self.acwr_sports, self.utl):
+            for window, window_start in (("chronic", chronic_start), ("acute", acute_start)):
+                if start >= window_start:
+                    self.window_utl[window].append(utl)
+                    self.window_sport_utl[window][sport].append(utl)
+
+    @classmethod
+    def load(cls, db: Session, user_id: int, now: datetime = None) -> "AthleteSnapshot":
+        now = now or datetime.now()
+
+        row = db.query(User, Threshold).outerjoin(
+            Threshold, Threshold.user_id == User.user_id
+        ).filter(User.user_id == user_id).first()
+        user, threshold = (row[0], row[1]) if row else (None, None)
+        if not user or not threshold:
+            return cls(user_id, user, threshold, [], [], now)  # Engine reports the missing data
+
+        activity_rows = db.query(
+            Activity.start_date, Activity.type, Activity.utl_score, Activity.moving_time
+        ).filter(
+            Activity.user_id == user_id,
+            Activity.start_date >= now - timedelta(days=HISTORY_DAYS),
+            Activity.utl_score.isnot(None)
+        ).order_by(Activity.start_date.desc()).all()
+
+        weekly_rows = rollup_series(db, user_id, WEEK, (now - timedelta(days=HISTORY_DAYS)).date())
+
+        wellness_rows = db.query(
+            WellnessData.date, WellnessData.hrv, WellnessData.sleep_score, WellnessData.readiness_score
+        ).filter(
+            WellnessData.user_id == user_id,
+            WellnessData.date >= (now - timedelta(days=ACUTE_DAYS)).date()
+        ).order_by(WellnessData.date.desc()).all()
+
+        return cls(user_id, user, threshold, activity_rows, wellness_rows, now, weekly_rows)
+
+    @property
+    def activity_count(self) -> int:
+        return len(self.start_dates)
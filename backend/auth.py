@@ -7,9 +7,11 @@ from pydantic import BaseModel
 import requests
 import os
 import logging
+import time
 from datetime import datetime
 from models import User
 from config import get_db
+from metrics import observe_upstream
 from research_threshold_calculator import calculate_initial_thresholds_for_new_user
 
 router = APIRouter()
@@ -77,7 +79,13 @@ def strava_callback(code: str, db: Session = Depends(get_db)):
         "code": code,
         "grant_type": "authorization_code"
     }
-    token_response = requests.post(token_url, data=data)
+    start = time.perf_counter()
+    try:
+        token_response = requests.post(token_url, data=data)
+    except requests.exceptions.RequestException:
+        observe_upstream("strava", time.perf_counter() - start, None)
+        raise
+    observe_upstream("strava", time.perf_counter() - start, token_response.status_code)
     if token_response.status_code != 200:
         logging.error(f"🔍 BACKEND DEBUG: Failed to get Strava token: {token_response.status_code}")
         raise HTTPException(status_code=400, detail="Failed to get Strava token")
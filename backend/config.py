@@ -15,6 +15,67 @@ DB_NAME = os.getenv("DB_NAME")
 
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+# Strava and intervals.icu API configuration (base URLs can point at local stubs for testing)
+STRAVA_API_BASE_URL = os.getenv("STRAVA_API_BASE_URL", "https://www.strava.com/api/v3").rstrip("/")
+INTERVALS_API_BASE_URL = os.getenv("INTERVALS_API_BASE_URL", "https://intervals.icu/api/v1").rstrip("/")
+STRAVA_WEBHOOK_VERIFY_TOKEN = os.getenv("STRAVA_WEBHOOK_VERIFY_TOKEN")
+STRAVA_WEBHOOKS_ENABLED = os.getenv("STRAVA_WEBHOOKS_ENABLED", "false").lower() in ("1", "true", "yes")
+# With webhooks delivering new uploads, polling only reconciles missed events
+RECONCILIATION_SYNC_HOURS = int(os.getenv("RECONCILIATION_SYNC_HOURS", "24"))
+
+# Adaptive polling: per-user sync times learned from upload cadence (replaces the fixed 3.5h quick sync)
+ADAPTIVE_SYNC_ENABLED = os.getenv("ADAPTIVE_SYNC_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Work queue: the API process drains the queue itself unless dedicated workers are running
+QUEUE_EMBEDDED_WORKER = os.getenv("QUEUE_EMBEDDED_WORKER", "true").lower() in ("1", "true", "yes")
+QUEUE_DRAIN_BATCH = int(os.getenv("QUEUE_DRAIN_BATCH", "20"))
+# Interactive lane items (onboarding, "sync now" buttons) are polled separately so they never wait behind a batch
+QUEUE_INTERACTIVE_POLL_SECONDS = int(os.getenv("QUEUE_INTERACTIVE_POLL_SECONDS", "2"))
+
+# Upstream API budgets (Strava defaults are the standard app limits: 100 per 15 minutes, 1000 per day)
+STRAVA_RATE_LIMIT_15MIN = int(os.getenv("STRAVA_RATE_LIMIT_15MIN", "100"))
+STRAVA_RATE_LIMIT_DAILY = int(os.getenv("STRAVA_RATE_LIMIT_DAILY", "1000"))
+INTERVALS_RATE_LIMIT_PER_MINUTE = int(os.getenv("INTERVALS_RATE_LIMIT_PER_MINUTE", "60"))
+# Share of each window that only interactive requests may use
+INTERACTIVE_RESERVED_SHARE = float(os.getenv("INTERACTIVE_RESERVED_SHARE", "0.2"))
+# Background requests wait at most this long for budget before failing (the queue retries them later)
+UPSTREAM_MAX_WAIT_SECONDS = int(os.getenv("UPSTREAM_MAX_WAIT_SECONDS", "900"))
+
+# Cached recommendations older than this are recomputed inline instead of served stale
+RECOMMENDATION_CACHE_MAX_STALE_HOURS = int(os.getenv("RECOMMENDATION_CACHE_MAX_STALE_HOURS", "24"))
+
+# Per-user response cache (view_cache.py); entries are dropped by data change events in this
+# process, the TTL bounds staleness for changes made by dedicated queue workers (0 disables)
+VIEW_CACHE_MAX_ENTRIES = int(os.getenv("VIEW_CACHE_MAX_ENTRIES", "1000"))
+DASHBOARD_CACHE_TTL_SECONDS = int(os.getenv("DASHBOARD_CACHE_TTL_SECONDS", "300"))
+
+# Scheduler leader election: a hung leader is replaced within lease + retry seconds
+LEADER_HEARTBEAT_SECONDS = int(os.getenv("LEADER_HEARTBEAT_SECONDS", "10"))
+LEADER_LEASE_SECONDS = int(os.getenv("LEADER_LEASE_SECONDS", "30"))
+LEADER_RETRY_SECONDS = int(os.getenv("LEADER_RETRY_SECONDS", "10"))
+
+# Default directory for the memory-mapped stream archive used by offline analysis (stream_archive.py)
+STREAM_ARCHIVE_DIR = os.getenv("STREAM_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "stream_archive"))
+
+# Per-request / per-job query statistics (query_stats.py). The X-DB-* response headers are a
+# debugging aid; a statement repeated this many times in one request or job is logged as a
+# suspected N+1, and units running at least QUERY_STATS_LOG_QUERIES statements log at INFO
+QUERY_STATS_HEADERS = os.getenv("QUERY_STATS_HEADERS", "false").lower() in ("1", "true", "yes")
+QUERY_STATS_N_PLUS_ONE = int(os.getenv("QUERY_STATS_N_PLUS_ONE", "10"))
+QUERY_STATS_LOG_QUERIES = int(os.getenv("QUERY_STATS_LOG_QUERIES", "50"))
+
+# Opt-in profiling (profiling.py). PROFILE_JOBS lists scheduler jobs and queue tasks to profile on
+# every run ("all" for everything), PROFILE_PATHS request path prefixes to profile; with
+# PROFILE_ON_DEMAND any request can ask with ?profile=1. Jobs use PROFILE_MODE (cprofile or
+# sample), requests always sample. Output goes to PROFILE_DIR, keeping the newest PROFILE_KEEP
+PROFILE_JOBS = {name.strip() for name in os.getenv("PROFILE_JOBS", "").split(",") if name.strip()}
+PROFILE_PATHS = tuple(path.strip() for path in os.getenv("PROFILE_PATHS", "").split(",") if path.strip())
+PROFILE_ON_DEMAND = os.getenv("PROFILE_ON_DEMAND", "false").lower() in ("1", "true", "yes")
+PROFILE_MODE = os.getenv("PROFILE_MODE", "cprofile")
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "logs", "profiles"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "100"))
+
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -1,15 +1,30 @@
 # Dashboard endpoints for user analytics and metrics
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import Session, defer
 from pydantic import BaseModel
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from typing import List, Optional, Dict
 import logging
+import time
+import numpy as np
 from models import User, Activity, Threshold, WellnessData
 from config import get_db
+from data_events import publish, ACTIVITIES_CHANGED, THRESHOLDS_CHANGED
+from view_cache import dashboard_cache, etag_matches
+from utl_batch import score_activities, load_wellness_by_date
+from training_rollups import period_totals, rebuild_rollups, WEEK, MONTH, YEAR
+from load_model import performance_management_chart, RESOLUTIONS, load_daily_utl, projection_points
+from athlete_snapshot import HISTORY_DAYS
+from training_recommendations import TrainingRecommendationEngine
 
 router = APIRouter()
 
+MAX_PROJECTION_PLANS = 5000
+MAX_PROJECTION_DAYS = 28
+PMC_MAX_DAYS = 20 * 366  # Longest /pmc range: the dense daily arrays grow with it
+projection_engine = TrainingRecommendationEngine()  # Owns the ACWR band plans are held to
+
 class UTLMethodExplanation(BaseModel):
     method: str
     name: str
@@ -86,7 +101,23 @@ class DashboardData(BaseModel):
     wellness_data: Optional[List[dict]] = None
 
 @router.get("/{user_id}", response_model=DashboardData)
-def get_dashboard_data(user_id: int, db: Session = Depends(get_db)):
+def get_dashboard_data(user_id: int, request: Request, db: Session = Depends(get_db)):
+    """
+    Dashboard data, served from the per-user view cache with an ETag.
+    Returns 304 Not Modified when the client's If-None-Match matches.
+    """
+    view = dashboard_cache.get(user_id)
+    if view is None:
+        view = dashboard_cache.set(user_id, jsonable_encoder(_build_dashboard_data(user_id, db)))
+
+    headers = {"ETag": view.etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), view.etag):
+        dashboard_cache.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=view.body, media_type="application/json", headers=headers)
+
+
+def _build_dashboard_data(user_id: int, db: Session) -> DashboardData:
     # Get user info
     user = db.query(User).filter_by(user_id=user_id).first()
     if not user:
@@ -147,67 +178,52 @@ def get_dashboard_data(user_id: int, db: Session = Depends(get_db)):
         recent_activities_data = []
         logging.warning(f"Could not fetch activities: {e}")
 
-    # Calculate activity summary
+    # Activity summary and period totals from the training rollups (one row per year, plus this
+    # week's and month's rows, instead of every activity)
     try:
-        # Use specific column selection to avoid missing column issues
-        activities_query = db.query(
-            Activity.distance,
-            Activity.moving_time,
-            Activity.total_elevation_gain,
-            Activity.start_date
-        ).filter_by(user_id=user_id)
-        activities = activities_query.all()
-        total_activities = len(activities)
-        total_distance = sum(act.distance or 0 for act in activities)
-        total_moving_time = sum(act.moving_time or 0 for act in activities)
-        total_elevation_gain = sum(act.total_elevation_gain or 0 for act in activities)
-
-        # Calculate average pace (min/km)
-        avg_pace = 0
-        if total_distance > 0 and total_moving_time > 0:
-            avg_pace = (total_moving_time / 60) / (total_distance / 1000)
+        totals = period_totals(db, user_id)
+        if totals["all_time"]["activities"] == 0:
+            # Rollups not built yet for this user (e.g. bulk-loaded activities): build them once
+            rebuild_rollups(db, user_id)
+            db.commit()
+            totals = period_totals(db, user_id)
     except Exception as e:
-        # If there's an issue with activities, use default values
-        total_activities = 0
-        total_distance = 0
-        total_moving_time = 0
-        total_elevation_gain = 0
-        avg_pace = 0
-        activities = []
-        logging.warning(f"Could not calculate activity summary: {e}")
+        db.rollback()
+        logging.warning(f"Could not read training rollups for user {user_id}: {e}")
+        totals = None
+
+    all_time = totals["all_time"] if totals else {}
+    total_distance = all_time.get("distance", 0)
+    total_moving_time = all_time.get("moving_time", 0)
+
+    # Calculate average pace (min/km)
+    avg_pace = 0
+    if total_distance > 0 and total_moving_time > 0:
+        avg_pace = (total_moving_time / 60) / (total_distance / 1000)
 
     activity_summary = ActivitySummary(
-        total_activities=total_activities,
+        total_activities=all_time.get("activities", 0),
         total_distance=round(total_distance, 2),
         total_moving_time=total_moving_time,
-        total_elevation_gain=round(total_elevation_gain, 2),
+        total_elevation_gain=round(all_time.get("elevation_gain", 0), 2),
         avg_pace=round(avg_pace, 2),
         recent_activities=recent_activities_data
     )
 
-    # Calculate training totals for different periods
-    now = datetime.now()
-    week_start = now - timedelta(days=now.weekday())
-    month_start = now.replace(day=1)
-    year_start = now.replace(month=1, day=1)
-
-    def calculate_period_totals(start_date):
-        try:
-            period_activities = [act for act in activities if act.start_date and act.start_date >= start_date]
-            return {
-                "activities": len(period_activities),
-                "distance": round(sum(act.distance or 0 for act in period_activities), 2),
-                "moving_time": sum(act.moving_time or 0 for act in period_activities),
-                "elevation_gain": round(sum(act.total_elevation_gain or 0 for act in period_activities), 2)
-            }
-        except Exception as e:
-            logging.warning(f"Could not calculate period totals: {e}")
-            return {"activities": 0, "distance": 0, "moving_time": 0, "elevation_gain": 0}
+    # Calendar week (from Monday), month and year to date
+    def period_summary(period):
+        period_total = totals[period] if totals else {}
+        return {
+            "activities": period_total.get("activities", 0),
+            "distance": round(period_total.get("distance", 0), 2),
+            "moving_time": period_total.get("moving_time", 0),
+            "elevation_gain": round(period_total.get("elevation_gain", 0), 2)
+        }
 
     training_totals = TrainingTotals(
-        this_week=calculate_period_totals(week_start),
-        this_month=calculate_period_totals(month_start),
-        this_year=calculate_period_totals(year_start)
+        this_week=period_summary(WEEK),
+        this_month=period_summary(MONTH),
+        this_year=period_summary(YEAR)
     )
 
     user_data = {
@@ -267,6 +283,91 @@ class ThresholdOverride(BaseModel):
     max_hr: Optional[int] = None
     resting_hr: Optional[int] = None
 
+@router.get("/{user_id}/pmc")
+def get_performance_management_chart(user_id: int, start: Optional[date] = None, end: Optional[date] = None,
+                                     resolution: str = "auto", db: Session = Depends(get_db)):
+    """
+    Performance Management Chart: daily UTL, CTL (42-day fitness), ATL (7-day fatigue), TSB (form)
+    and ACWR from `start` to `end` (default: the last 365 days). resolution=weekly returns one
+    point per ISO week; auto does so for ranges over a year.
+    """
+    end = end or date.today()
+    start = start or end - timedelta(days=364)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (end - start).days + 1 > PMC_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range must not exceed {PMC_MAX_DAYS} days")
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of {', '.join(RESOLUTIONS)}")
+    if not db.query(User.user_id).filter_by(user_id=user_id).first():
+        raise HTTPException(status_code=404, detail="User not found")
+    return performance_management_chart(db, user_id, start, end, resolution)
+
+class PlannedSession(BaseModel):
+    day: int  # Days from today (0 = today)
+    utl: float  # Estimated UTL
+    type: Optional[str] = None
+
+class CandidatePlan(BaseModel):
+    name: Optional[str] = None
+    sessions: List[PlannedSession]
+
+class LoadProjectionRequest(BaseModel):
+    plans: List[CandidatePlan]
+
+@router.post("/{user_id}/pmc/projection")
+def project_candidate_plans(user_id: int, request: LoadProjectionRequest, db: Session = Depends(get_db)):
+    """
+    What-if projection: simulate CTL, ATL, TSB and ACWR forward from today for each candidate plan
+    (sessions with estimated UTL; today's completed activities are included) and return the plan
+    with the largest CTL gain whose ACWR stays inside the recommendation engine's band every day,
+    or the one closest to the band if none does. With no load in the last 28 days the band cannot
+    be evaluated and the lightest plan that still trains is returned.
+    """
+    plans = request.plans
+    if not plans or len(plans) > MAX_PROJECTION_PLANS:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {MAX_PROJECTION_PLANS} plans")
+    sessions = [(index, session) for index, plan in enumerate(plans) for session in plan.sessions]
+    if any(not 0 <= session.day < MAX_PROJECTION_DAYS or session.utl < 0 for _, session in sessions):
+        raise HTTPException(status_code=400,
+                            detail=f"Session days must be 0-{MAX_PROJECTION_DAYS - 1} and UTL non-negative")
+    if not db.query(User.user_id).filter_by(user_id=user_id).first():
+        raise HTTPException(status_code=404, detail="User not found")
+
+    today = date.today()
+    daily = load_daily_utl(db, user_id, today - timedelta(days=HISTORY_DAYS), today)
+    compute_start = time.perf_counter()
+    days = max((session.day for _, session in sessions), default=0) + 1
+    plan_utl = np.zeros((len(plans), days))
+    if sessions:
+        np.add.at(plan_utl, ([index for index, _ in sessions], [session.day for _, session in sessions]),
+                  [session.utl for _, session in sessions])
+    plan_utl[:, 0] += daily[-1]
+    projection = projection_engine.project_plans(daily[:-1], plan_utl)
+    best = projection["best"]
+
+    summaries = [{
+        "index": index,
+        "name": plan.name,
+        "within_band": feasible,
+        "ctl_gain": round(ctl_gain, 1),
+        "max_acwr": round(max_acwr, 3),
+        "min_acwr": round(min_acwr, 3),
+    } for index, (plan, feasible, ctl_gain, max_acwr, min_acwr) in enumerate(zip(
+        plans, projection["feasible"].tolist(), projection["ctl_gain"].tolist(),
+        projection["acwr"].max(axis=1).tolist(), projection["acwr"].min(axis=1).tolist()))]
+    return {
+        "user_id": user_id,
+        "start": today.isoformat(),
+        "acwr_band": [projection_engine.MIN_ACW_RATIO, projection_engine.MAX_ACW_RATIO],
+        "band_applied": projection["band_applied"],
+        "current": {name: round(value, 3 if name == "acwr" else 1) for name, value in projection["start"].items()},
+        "feasible_plans": int(projection["feasible"].sum()),
+        "best": {**summaries[best], "days": projection_points(projection, plan_utl, best, today)},
+        "plans": summaries,
+        "compute_ms": round((time.perf_counter() - compute_start) * 1000, 2),
+    }
+
 @router.put("/{user_id}/thresholds")
 def update_user_thresholds(user_id: int, overrides: ThresholdOverride, db: Session = Depends(get_db)):
     user = db.query(User).filter_by(user_id=user_id).first()
@@ -290,6 +391,7 @@ def update_user_thresholds(user_id: int, overrides: ThresholdOverride, db: Sessi
 
     threshold.date_updated = datetime.now()
     db.commit()
+    publish(THRESHOLDS_CHANGED, user_id)
 
     return {
         "message": "Thresholds updated successfully",
@@ -309,8 +411,6 @@ def recalculate_utl_with_wellness(user_id: int, db: Session = Depends(get_db)):
     Recalculate UTL scores for existing activities using wellness data.
     This is useful after connecting intervals.icu to apply wellness modifiers retroactively.
     """
-    from utils import calculate_utl
-    
     user = db.query(User).filter_by(user_id=user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -321,66 +421,33 @@ def recalculate_utl_with_wellness(user_id: int, db: Session = Depends(get_db)):
     
     # Get activities from the last 90 days
     cutoff_date = datetime.now() - timedelta(days=90)
-    activities = db.query(Activity).filter(
+    # Scoring reads activity_metrics; the streams JSON is only loaded for rows that need it
+    activities = db.query(Activity).options(defer(Activity.data)).filter(
         Activity.user_id == user_id,
         Activity.start_date >= cutoff_date
     ).all()
     
     updated_count = 0
-    wellness_applied_count = 0
     
-    for activity in activities:
-        try:
-            # Get wellness data for this activity's date
-            activity_date = activity.start_date.date() if activity.start_date else None
-            wellness_data = None
-            
-            if activity_date:
-                wellness_entry = db.query(WellnessData).filter(
-                    WellnessData.user_id == user_id,
-                    WellnessData.date == activity_date
-                ).first()
-                
-                if wellness_entry:
-                    wellness_data = {
-                        'hrv': wellness_entry.hrv,
-                        'sleepScore': wellness_entry.sleep_score,
-                        'readiness': wellness_entry.readiness_score,  # Fixed: use readiness_score
-                        'restingHR': wellness_entry.resting_hr
-                    }
-                    wellness_applied_count += 1
-            
-            # Reconstruct activity summary for UTL calculation
-            activity_summary = {
-                'type': activity.type,
-                'moving_time': activity.moving_time,
-                'distance': activity.distance,
-                'average_speed': activity.average_speed,
-                'start_date': activity.start_date.isoformat() if activity.start_date else None
-            }
-            
-            # Get streams data from stored data
-            activity_streams = None
-            if activity.data and isinstance(activity.data, dict):
-                activity_streams = activity.data.get('streams')
-            
-            # Recalculate UTL
-            new_utl, new_method = calculate_utl(activity_summary, threshold, activity_streams, wellness_data)
+    # Same-day wellness for every activity from one query, then batch scoring
+    wellness_by_date = load_wellness_by_date(db, user_id, since=cutoff_date.date())
+    wellness_applied_count = sum(
+        1 for activity in activities if activity.start_date and activity.start_date.date() in wellness_by_date
+    )
+    scores = score_activities(db, activities, threshold, wellness_by_date)
+    
+    for activity, (new_utl, new_method) in zip(activities, scores):
+        # Update if the score or method changed
+        if activity.utl_score != new_utl or activity.calculation_method != new_method:
+            old_utl = activity.utl_score or 0
+            activity.utl_score = new_utl
+            activity.calculation_method = new_method
+            updated_count += 1
             
-            # Update if the score or method changed
-            if activity.utl_score != new_utl or activity.calculation_method != new_method:
-                old_utl = activity.utl_score
-                activity.utl_score = new_utl
-                activity.calculation_method = new_method
-                updated_count += 1
-                
-                logging.info(f"Updated activity {activity.strava_activity_id}: UTL {old_utl:.2f} -> {new_utl:.2f} ({new_method})")
-        
-        except Exception as e:
-            logging.error(f"Error recalculating UTL for activity {activity.strava_activity_id}: {str(e)}")
-            continue
+            logging.info(f"Updated activity {activity.strava_activity_id}: UTL {old_utl:.2f} -> {new_utl:.2f} ({new_method})")
     
     db.commit()
+    publish(ACTIVITIES_CHANGED, user_id)
     
     return {
         "message": f"Recalculated UTL for {len(activities)} activities",
@@ -395,8 +462,6 @@ def recalculate_utl_with_wellness_internal(user_id: int, db: Session):
     Internal function to recalculate UTL scores with wellness data.
     Used for automatic recalculation when wellness data is synced.
     """
-    from utils import calculate_utl
-    
     user = db.query(User).filter_by(user_id=user_id).first()
     if not user:
         return {"error": "User not found"}
@@ -407,69 +472,38 @@ def recalculate_utl_with_wellness_internal(user_id: int, db: Session):
     
     # Get activities from the last 90 days
     cutoff_date = datetime.now() - timedelta(days=90)
-    activities = db.query(Activity).filter(
+    # Scoring reads activity_metrics; the streams JSON is only loaded for rows that need it
+    activities = db.query(Activity).options(defer(Activity.data)).filter(
         Activity.user_id == user_id,
         Activity.start_date >= cutoff_date
     ).all()
     
     updated_count = 0
-    wellness_applied_count = 0
     
-    for activity in activities:
-        try:
-            # Get wellness data for this activity's date
-            activity_date = activity.start_date.date() if activity.start_date else None
-            wellness_data = None
-            
-            if activity_date:
-                wellness_entry = db.query(WellnessData).filter(
-                    WellnessData.user_id == user_id,
-                    WellnessData.date == activity_date
-                ).first()
-                
-                if wellness_entry:
-                    wellness_data = {
-                        'hrv': wellness_entry.hrv,
-                        'sleepScore': wellness_entry.sleep_score,
-                        'readiness': wellness_entry.readiness_score,  # Fixed: use readiness_score
-                        'restingHR': wellness_entry.resting_hr
-                    }
-                    wellness_applied_count += 1
+    # Only recalculate activities with wellness data for their date
+    wellness_by_date = load_wellness_by_date(db, user_id, since=cutoff_date.date())
+    with_wellness = [
+        activity for activity in activities
+        if activity.start_date and activity.start_date.date() in wellness_by_date
+    ]
+    wellness_applied_count = len(with_wellness)
+    scores = score_activities(db, with_wellness, threshold, wellness_by_date)
+    
+    for activity, (new_utl, new_method) in zip(with_wellness, scores):
+        if activity.utl_score is None:
+            continue  # Unscored activities are handled by fix-null-utl
+        # Update if the score changed significantly (more than 1% or method changed)
+        if abs(activity.utl_score - new_utl) > 0.01 * activity.utl_score or activity.calculation_method != new_method:
+            old_utl = activity.utl_score
+            activity.utl_score = new_utl
+            activity.calculation_method = new_method
+            updated_count += 1
             
-            # Only recalculate if we have wellness data for this date
-            if wellness_data:
-                # Reconstruct activity summary for UTL calculation
-                activity_summary = {
-                    'type': activity.type,
-                    'moving_time': activity.moving_time,
-                    'distance': activity.distance,
-                    'average_speed': activity.average_speed,
-                    'start_date': activity.start_date.isoformat() if activity.start_date else None
-                }
-                
-                # Get streams data from stored data
-                activity_streams = None
-                if activity.data and isinstance(activity.data, dict):
-                    activity_streams = activity.data.get('streams')
-                
-                # Recalculate UTL with wellness data
-                new_utl, new_method = calculate_utl(activity_summary, threshold, activity_streams, wellness_data)
-                
-                # Update if the score changed significantly (more than 1% or method changed)
-                if abs(activity.utl_score - new_utl) > 0.01 * activity.utl_score or activity.calculation_method != new_method:
-                    old_utl = activity.utl_score
-                    activity.utl_score = new_utl
-                    activity.calculation_method = new_method
-                    updated_count += 1
-                    
-                    logging.info(f"Auto-updated activity {activity.strava_activity_id}: UTL {old_utl:.2f} -> {new_utl:.2f} ({new_method})")
-        
-        except Exception as e:
-            logging.error(f"Error auto-recalculating UTL for activity {activity.strava_activity_id}: {str(e)}")
-            continue
+            logging.info(f"Auto-updated activity {activity.strava_activity_id}: UTL {old_utl:.2f} -> {new_utl:.2f} ({new_method})")
     
     if updated_count > 0:
         db.commit()
+        publish(ACTIVITIES_CHANGED, user_id)
     
     return {
         "message": f"Auto-recalculated UTL for {len(activities)} activities",
@@ -485,8 +519,6 @@ def fix_null_utl_scores(user_id: int, db: Session = Depends(get_db)):
     Fix activities that have null UTL scores by recalculating them.
     This can happen when activities are imported before thresholds are established.
     """
-    from utils import calculate_utl
-    
     user = db.query(User).filter_by(user_id=user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -496,44 +528,24 @@ def fix_null_utl_scores(user_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="No thresholds found. Please set up thresholds first.")
     
     # Get activities with null UTL scores
-    activities = db.query(Activity).filter(
+    activities = db.query(Activity).options(defer(Activity.data)).filter(
         Activity.user_id == user_id,
         Activity.utl_score.is_(None)
     ).all()
     
     updated_count = 0
     
-    for activity in activities:
-        try:
-            # Reconstruct activity summary for UTL calculation
-            activity_summary = {
-                'type': activity.type,
-                'moving_time': activity.moving_time,
-                'distance': activity.distance,
-                'average_speed': activity.average_speed,
-                'start_date': activity.start_date.isoformat() if activity.start_date else None
-            }
-            
-            # Get streams data from stored data
-            activity_streams = None
-            if activity.data and isinstance(activity.data, dict):
-                activity_streams = activity.data.get('streams')
-            
-            # Calculate UTL
-            utl_score, method = calculate_utl(activity_summary, threshold, activity_streams)
-            
-            # Update the activity
-            activity.utl_score = float(utl_score)
-            activity.calculation_method = method
-            updated_count += 1
-            
-            logging.info(f"Fixed null UTL for activity {activity.strava_activity_id}: {utl_score:.2f} using {method}")
-            
-        except Exception as e:
-            logging.error(f"Error fixing UTL for activity {activity.strava_activity_id}: {str(e)}")
-            continue
+    for activity, (utl_score, method) in zip(activities, score_activities(db, activities, threshold)):
+        # Update the activity
+        activity.utl_score = float(utl_score)
+        activity.calculation_method = method
+        updated_count += 1
+        
+        logging.info(f"Fixed null UTL for activity {activity.strava_activity_id}: {utl_score:.2f} using {method}")
     
     db.commit()
+    if updated_count:
+        publish(ACTIVITIES_CHANGED, user_id)
     
     return {
         "message": f"Fixed null UTL scores for {updated_count} activities",
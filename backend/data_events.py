@@ -0,0 +1,32 @@
+# In-process data change notifications
+#
+# Ingestion and rescoring paths publish an event after committing a change to a user's
+# activities, wellness or thresholds. Derived data (cached recommendations, ...) subscribes
+# and invalidates itself. Subscribers persist their own state, so a change published in a
+# queue worker is seen by every API process.
+from typing import Callable, Dict, List
+import logging
+
+ACTIVITIES_CHANGED = "activities_changed"  # New, updated, deleted or rescored activities
+WELLNESS_CHANGED = "wellness_changed"
+THRESHOLDS_CHANGED = "thresholds_changed"
+
+_subscribers: Dict[str, List[Callable]] = {}
+
+
+def subscribe(*events: str):
+    """Decorator registering handler(user_id, event) for the given events."""
+    def decorator(handler: Callable):
+        for event in events:
+            _subscribers.setdefault(event, []).append(handler)
+        return handler
+    return decorator
+
+
+def publish(event: str, user_id: int):
+    """Notify subscribers; a failing subscriber is logged and never breaks the publisher."""
+    for handler in _subscribers.get(event, []):
+        try:
+            handler(user_id, event)
+        except Exception as e:
+            logging.error(f"Data event handler {handler.__name__} failed for {event} (user {user_id}): {e}")
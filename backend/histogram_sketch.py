@@ -0,0 +1,125 @@
+# Mergeable fixed-memory histograms
+#
+# Percentiles over a year of streams (resting HR as the 5th percentile of every heart-rate sample)
+# used to need every sample in one list. A HistogramSketch counts values into fixed-width bins
+# instead: its size doesn't depend on how many samples it has seen, two sketches with the same
+# bins merge by adding counts, and quantiles come from the cumulative counts.
+#
+# Values on the bin grid (integer bpm in 1 bpm bins) are represented exactly, so quantiles equal
+# np.percentile over the raw samples; other values are rounded down to their bin's lower edge.
+# The exact minimum and maximum are tracked alongside the counts.
+from typing import List, Optional
+
+import numpy as np
+
+
+class HistogramSketch:
+    """
+    Counts of values in `bins` bins of `width` starting at `low`. Values below `low` are dropped
+    (sensor dropouts); values past the top bin count in the top bin.
+    """
+
+    def __init__(self, low: float, width: float, bins: int, counts=None,
+                 minimum: Optional[float] = None, maximum: Optional[float] = None):
+        self.low = low
+        self.width = width
+        self.bins = bins
+        self.counts = np.zeros(bins) if counts is None else np.asarray(counts, dtype=float)
+        self.minimum = minimum
+        self.maximum = maximum
+
+    @classmethod
+    def from_values(cls, values, low: float, width: float, bins: int, weights=None) -> "HistogramSketch":
+        """Sketch of `values` (optionally weighted, e.g. by seconds per sample)."""
+        sketch = cls(low, width, bins)
+        sketch.add(values, weights)
+        return sketch
+
+    @classmethod
+    def from_stored(cls, stored: Optional[dict], low: float, width: float, bins: int) -> "HistogramSketch":
+        """Sketch from to_stored()'s dict (an empty sketch for None)."""
+        if not stored:
+            return cls(low, width, bins)
+        return cls(low, width, bins, stored["counts"], stored.get("min"), stored.get("max"))
+
+    def add(self, values, weights=None):
+        values = np.asarray(values, dtype=float)
+        keep = values >= self.low
+        values = values[keep]
+        if not values.size:
+            return
+        weights = None if weights is None else np.asarray(weights, dtype=float)[keep]
+        index = np.minimum(((values - self.low) // self.width).astype(int), self.bins - 1)
+        self.counts += np.bincount(index, weights=weights, minlength=self.bins)
+        self._extend_range(float(values.min()), float(values.max()))
+
+    def merge(self, other: "HistogramSketch") -> "HistogramSketch":
+        """Add another sketch's counts into this one (bins must match); returns self."""
+        if (other.low, other.width, other.bins) != (self.low, self.width, self.bins):
+            raise ValueError("Cannot merge sketches with different bins")
+        self.counts += other.counts
+        if other.minimum is not None:
+            self._extend_range(other.minimum, other.maximum)
+        return self
+
+    def _extend_range(self, minimum: float, maximum: float):
+        self.minimum = minimum if self.minimum is None else min(self.minimum, minimum)
+        self.maximum = maximum if self.maximum is None else max(self.maximum, maximum)
+
+    @property
+    def total(self) -> float:
+        return float(self.counts.sum())
+
+    def quantile(self, q: float, above: float = None, below: float = None) -> Optional[float]:
+        """
+        The q-quantile (0-1) with np.percentile's linear interpolation between order statistics,
+        optionally only over values strictly between `above` and `below`.
+
+        Returns:
+            None if no values are in range
+        """
+        edges = self.low + np.arange(self.bins) * self.width
+        in_range = np.ones(self.bins, dtype=bool)
+        if above is not None:
+            in_range &= edges > above
+        if below is not None:
+            in_range &= edges < below
+        counts = np.where(in_range, self.counts, 0)
+        total = counts.sum()
+        if total <= 0:
+            return None
+
+        cumulative = np.cumsum(counts)
+        position = (total - 1) * q
+        lower_rank = np.floor(position)
+        lower = edges[np.searchsorted(cumulative, lower_rank, side="right")]
+        upper = edges[np.searchsorted(cumulative, min(lower_rank + 1, total - 1), side="right")]
+        return float(lower + (position - lower_rank) * (upper - lower))
+
+    def to_stored(self) -> dict:
+        """JSON-compatible form for an activity_metrics column."""
+        return {"counts": [_plain(x) for x in self.counts], "min": _plain(self.minimum), "max": _plain(self.maximum)}
+
+    def to_list(self) -> List[int]:
+        """Counts rounded to whole numbers (seconds for time-weighted sketches)."""
+        return [int(x) for x in np.rint(self.counts)]
+
+
+def _plain(value):
+    """Whole numbers as int (integer HR stays integer), others as float."""
+    if value is None:
+        return None
+    return int(value) if float(value).is_integer() else float(value)
+
+
+def merge_sketches(stored_sketches, low: float, width: float, bins: int) -> HistogramSketch:
+    """Merge stored sketch dicts (None entries skipped) into one sketch, in one array sum."""
+    stored_sketches = [stored for stored in stored_sketches if stored]
+    merged = HistogramSketch(low, width, bins)
+    if stored_sketches:
+        merged.counts = np.sum([stored["counts"] for stored in stored_sketches], axis=0, dtype=float)
+        minimums = [stored["min"] for stored in stored_sketches if stored.get("min") is not None]
+        maximums = [stored["max"] for stored in stored_sketches if stored.get("max") is not None]
+        merged.minimum = min(minimums) if minimums else None
+        merged.maximum = max(maximums) if maximums else None
+    return merged
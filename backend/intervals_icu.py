@@ -1,14 +1,19 @@
 # Intervals.icu Integration Module
 import requests
 import logging
+import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 
-from config import get_db
+from config import get_db, INTERVALS_API_BASE_URL
 from models import User, WellnessData
+from upstream_budget import intervals_budget, upstream_lane, LANE_INTERACTIVE
+from metrics import observe_upstream
+from job_queue import enqueue, PRIORITY_INTERACTIVE, PRIORITY_BACKFILL
+from data_events import publish, WELLNESS_CHANGED, THRESHOLDS_CHANGED
 import json
 
 router = APIRouter(tags=["intervals"])
@@ -33,7 +38,7 @@ class IntervalsICUClient:
     
     def __init__(self, api_key: str):
         self.api_key = api_key
-        self.base_url = "https://intervals.icu/api/v1"
+        self.base_url = INTERVALS_API_BASE_URL
         self.session = requests.Session()
         self.session.auth = ('API_KEY', api_key)
         self.session.headers.update({
@@ -41,15 +46,27 @@ class IntervalsICUClient:
             'User-Agent': 'TrainingLoad/1.0'
         })
     
+    def _get(self, url: str, **kwargs):
+        """GET within the current lane's share of the intervals.icu rate limit"""
+        intervals_budget.acquire()
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, **kwargs)
+        except requests.exceptions.RequestException:
+            observe_upstream("intervals_icu", time.perf_counter() - start, None)
+            raise
+        observe_upstream("intervals_icu", time.perf_counter() - start, response.status_code)
+        return response
+
     def test_connection(self, athlete_id: str = None) -> bool:
         """Test if the API key is valid"""
         try:
             # If athlete_id is provided, test with specific athlete endpoint
             if athlete_id:
-                response = self.session.get(f"{self.base_url}/athlete/{athlete_id}")
+                response = self._get(f"{self.base_url}/athlete/{athlete_id}")
             else:
                 # Fallback to a general endpoint that should work
-                response = self.session.get(f"{self.base_url}/heartrate")
+                response = self._get(f"{self.base_url}/heartrate")
             
             logging.info(f"intervals.icu API test response: {response.status_code}")
             if response.status_code != 200:
@@ -63,9 +80,9 @@ class IntervalsICUClient:
         """Get athlete information"""
         try:
             if athlete_id:
-                response = self.session.get(f"{self.base_url}/athlete/{athlete_id}")
+                response = self._get(f"{self.base_url}/athlete/{athlete_id}")
             else:
-                response = self.session.get(f"{self.base_url}/athlete")
+                response = self._get(f"{self.base_url}/athlete")
             
             if response.status_code == 200:
                 return response.json()
@@ -88,7 +105,7 @@ class IntervalsICUClient:
             wellness_data = []
             
             # Get wellness entries - intervals.icu stores this as "wellness" entries
-            response = self.session.get(
+            response = self._get(
                 f"{self.base_url}/athlete/{athlete_id}/wellness",
                 params={
                     'oldest': start_str,
@@ -139,11 +156,12 @@ async def connect_intervals_account(
         # Test the connection
         client = IntervalsICUClient(connection.api_key)
         
-        if not client.test_connection(connection.intervals_user_id):
-            raise HTTPException(status_code=400, detail="Invalid intervals.icu API key or athlete ID")
-        
-        # Get athlete info
-        athlete_info = client.get_athlete_info(connection.intervals_user_id)
+        with upstream_lane(LANE_INTERACTIVE):
+            if not client.test_connection(connection.intervals_user_id):
+                raise HTTPException(status_code=400, detail="Invalid intervals.icu API key or athlete ID")
+            
+            # Get athlete info
+            athlete_info = client.get_athlete_info(connection.intervals_user_id)
         if not athlete_info:
             raise HTTPException(status_code=400, detail="Could not retrieve athlete information")
         
@@ -165,6 +183,10 @@ async def connect_intervals_account(
         
         db.commit()
         
+        # Pull the wellness history in the backfill lane: ahead of routine syncs, behind interactive work
+        enqueue(db, "sync_wellness", user_id=user.user_id, payload={"days": 365},
+                priority=PRIORITY_BACKFILL, dedup_key=f"sync_wellness:{user.user_id}:backfill")
+        
         return {
             "message": "intervals.icu account connected successfully",
             "athlete_name": athlete_info.get('name'),
@@ -183,7 +205,6 @@ async def connect_intervals_account(
 async def sync_wellness_data(
     user_id: int,
     days: int = 365,  # Changed from 30 to 365 to match Strava sync timeframe (12 months)
-    background_tasks: BackgroundTasks = BackgroundTasks(),
     db: Session = Depends(get_db)
 ):
     """Sync wellness data from intervals.icu for the last 12 months (365 days)"""
@@ -201,15 +222,9 @@ async def sync_wellness_data(
         if not athlete_id:
             raise HTTPException(status_code=400, detail="intervals.icu athlete_id not found in user profile")
         
-        # Run sync in background
-        background_tasks.add_task(
-            _sync_wellness_data_task,
-            user_id,
-            intervals_config['api_key'],
-            athlete_id,
-            days,
-            db
-        )
+        # Run sync in the interactive lane: picked up within seconds, ahead of any scheduled batch
+        enqueue(db, "sync_wellness", user_id=user_id, payload={"days": days},
+                priority=PRIORITY_INTERACTIVE, dedup_key=f"sync_wellness:{user_id}:interactive")
         
         return {"message": f"Wellness data sync started for last {days} days"}
         
@@ -271,6 +286,8 @@ def _sync_wellness_data_task(user_id: int, api_key: str, athlete_id: str, days:
         
         db.commit()
         logging.info(f"Successfully synced {len(wellness_data)} wellness entries for user {user_id}")
+        if wellness_data:
+            publish(WELLNESS_CHANGED, user_id)
         
         # Automatically recalculate UTL scores with new wellness data
         if len(wellness_data) > 0:
@@ -348,6 +365,7 @@ def update_resting_hr_from_wellness(user_id: int, db: Session, lookback_days: in
         threshold.date_updated = datetime.now()
         
         db.commit()
+        publish(THRESHOLDS_CHANGED, user_id)
         
         logging.info(f"Updated resting HR threshold for user {user_id}: {old_resting_hr} -> {rounded_resting_hr} bpm")
         
@@ -0,0 +1,512 @@
+# Durable Postgres-backed work queue
+#
+# Scheduled jobs enqueue one small item per user instead of looping over every user inline.
+# Workers lease items with FOR UPDATE SKIP LOCKED, so any number of worker processes can
+# drain the queue concurrently. A lease that is not completed before it expires (worker
+# crash, deploy) becomes visible again and counts as an attempt; failures retry with exponential
+# backoff. After max_attempts (failed or expired) the item is parked as 'dead' for inspection.
+# Finished items are deleted by the leader's daily cleanup (purge_finished_jobs): done items
+# after DONE_RETENTION_DAYS, dead ones after DEAD_RETENTION_DAYS.
+#
+# Each item belongs to a priority lane (upstream_budget.py) derived from its priority. Lanes
+# order leasing, let a worker serve only interactive work, and set the rate-limit share the
+# handler's upstream calls may use.
+#
+# Deduplication is against queued and leased items. A caller whose event must not be lost to a
+# run that already started (webhook edits) passes rerun_if_running: the running item is flagged
+# and queued again once it completes. A caller that debounces a burst (debounce_max_seconds)
+# pushes the queued item's available_at back to delay_seconds from now with every call, but never
+# past debounce_max_seconds after the item was created, and merges its payload into the item's.
+#
+# A handler's waits for upstream budget end at half its lease; an item whose budget won't free up
+# by then is deferred (requeued until the reset, without using up an attempt) rather than
+# sleeping until its lease expires and another worker runs it a second time.
+#
+# Items enqueued by a recorded scheduled run carry its run_id; each attempt at them is written to
+# the job run ledger (job_runs.py).
+from sqlalchemy.orm import Session
+from sqlalchemy import and_, func, or_, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+import logging
+import socket
+import time
+import os
+
+from models import JobQueueItem
+from query_stats import track, KIND_JOB
+from metrics import QUEUE_TASK_SECONDS, queue_user_seconds, work_tally
+from job_runs import current_run_id, record_execution
+from profiling import profiled, should_profile
+from upstream_budget import upstream_lane, wait_deadline, UpstreamBudgetExceeded, LANES, LANE_INTERACTIVE, LANE_BACKFILL, LANE_ROUTINE, LANE_MAINTENANCE
+
+# Priorities (lower runs first)
+PRIORITY_INTERACTIVE = 0  # A user is waiting
+PRIORITY_BACKFILL = 5  # New-user history
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 50
+PRIORITY_LOW = 100
+
+DEFAULT_LEASE_SECONDS = 15 * 60
+DEFAULT_MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 60 * 60
+BUDGET_WAIT_SHARE = 0.5  # Share of the lease a handler may spend waiting for upstream budget
+
+ACTIVE_STATUSES = ("queued", "leased")
+RERUN_FLAG = "_rerun"  # Payload key set on a leased item that must run again when it completes
+DONE_RETENTION_DAYS = 7
+DEAD_RETENTION_DAYS = 30  # Longer, so failures can still be inspected and requeued
+
+# task_name -> {"handler": callable, "lease_seconds": int}
+TASK_REGISTRY: Dict[str, Dict] = {}
+
+
+def register_task(name: str, lease_seconds: int = DEFAULT_LEASE_SECONDS):
+    """
+    Decorator registering a queue task handler.
+
+    Handlers are called as handler(user_id=..., **payload) and manage their own sessions.
+    """
+    def decorator(func: Callable):
+        TASK_REGISTRY[name] = {"handler": func, "lease_seconds": lease_seconds}
+        return func
+    return decorator
+
+
+def lane_for_priority(priority: int) -> str:
+    if priority < PRIORITY_BACKFILL:
+        return LANE_INTERACTIVE
+    if priority < PRIORITY_HIGH:
+        return LANE_BACKFILL
+    if priority < PRIORITY_LOW:
+        return LANE_ROUTINE
+    return LANE_MAINTENANCE
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue(
+    db: Session,
+    task_name: str,
+    user_id: Optional[int] = None,
+    payload: Optional[dict] = None,
+    priority: int = PRIORITY_NORMAL,
+    dedup_key: Optional[str] = None,
+    delay_seconds: int = 0,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    rerun_if_running: bool = False,
+    debounce_max_seconds: Optional[int] = None,
+) -> bool:
+    """
+    Add a work item. If dedup_key is given and an item with that key is already queued or
+    leased, nothing is inserted; with rerun_if_running a leased (running) item is instead
+    flagged to be queued again when it completes, so work that started before this call
+    still sees its effect.
+
+    With debounce_max_seconds (implies rerun_if_running), a queued item with the key is pushed
+    back to delay_seconds from now, at most debounce_max_seconds after it was created, and this
+    call's payload is merged into the active item's.
+
+    Returns:
+        True if a new item was enqueued, False if it was deduplicated
+    """
+    now = datetime.utcnow()
+    values = {
+        "task_name": task_name,
+        "user_id": user_id,
+        "payload": payload or {},
+        "priority": priority,
+        "lane": lane_for_priority(priority),
+        "dedup_key": dedup_key,
+        "status": "queued",
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        "available_at": now + timedelta(seconds=delay_seconds),
+        "created_at": now,
+        "updated_at": now,
+        "run_id": current_run_id(),
+    }
+
+    debounce = {}
+    if debounce_max_seconds is not None:
+        debounce = {"payload": payload, "run_after": now + timedelta(seconds=delay_seconds),
+                    "max_wait_seconds": debounce_max_seconds}
+
+    dialect = db.get_bind().dialect.name
+    if dedup_key and dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert(JobQueueItem).values(**values).on_conflict_do_nothing(
+            index_elements=["dedup_key"],
+            index_where=text("status IN ('queued', 'leased')"),
+        ).returning(JobQueueItem.job_id)
+        # rowcount isn't reliable for ORM inserts on every driver; RETURNING is
+        inserted = db.execute(stmt).first() is not None
+        if not inserted and (rerun_if_running or debounce) and not _cover_with_active(db, dedup_key, **debounce):
+            inserted = db.execute(stmt).first() is not None  # The active item finished meanwhile
+        db.commit()
+        return inserted
+
+    if dedup_key:
+        if rerun_if_running or debounce:
+            covered = _cover_with_active(db, dedup_key, **debounce)
+        else:
+            covered = db.query(JobQueueItem.job_id).filter(
+                JobQueueItem.dedup_key == dedup_key,
+                JobQueueItem.status.in_(ACTIVE_STATUSES),
+            ).first() is not None
+        if covered:
+            db.commit()
+            return False
+
+    db.add(JobQueueItem(**values))
+    db.commit()
+    return True
+
+
+def _cover_with_active(db: Session, dedup_key: str, payload: Optional[dict] = None,
+                       run_after: Optional[datetime] = None, max_wait_seconds: Optional[int] = None) -> bool:
+    """
+    Make the active item with this key cover a new request: a queued one will run anyway, a
+    leased one is flagged to run again. When debouncing, `payload` is merged into the item's and
+    a queued item waits until `run_after` (capped at max_wait_seconds after it was created).
+    False if there is none (any more).
+    """
+    item = db.query(JobQueueItem).filter(
+        JobQueueItem.dedup_key == dedup_key,
+        JobQueueItem.status.in_(ACTIVE_STATUSES),
+    ).with_for_update().first()
+    if item is None:
+        return False
+    if payload:
+        item.payload = {**(item.payload or {}), **payload}
+    if item.status == "queued" and run_after is not None:
+        item.available_at = min(run_after, item.created_at + timedelta(seconds=max_wait_seconds))
+        item.updated_at = datetime.utcnow()
+    if item.status == "leased" and not (item.payload or {}).get(RERUN_FLAG):
+        item.payload = {**(item.payload or {}), RERUN_FLAG: True}
+        logging.info(f"🔁 Job {item.job_id} ({item.task_name}) is running; it will be queued again when done")
+    return True
+
+
+def lease_jobs(db: Session, worker_id: str, batch_size: int = 1, task_names=None, lanes=None):
+    """
+    Lease up to batch_size ready items: queued items whose available_at has passed, plus
+    leased items whose visibility timeout expired with attempts left. Optionally restricted to
+    tasks or lanes.
+    """
+    now = datetime.utcnow()
+    _park_exhausted_leases(db, now)
+    query = db.query(JobQueueItem).filter(
+        ((JobQueueItem.status == "queued") & (JobQueueItem.available_at <= now)) |
+        ((JobQueueItem.status == "leased") & (JobQueueItem.lease_expires_at < now) &
+         (JobQueueItem.attempts < JobQueueItem.max_attempts))
+    )
+    if task_names:
+        query = query.filter(JobQueueItem.task_name.in_(task_names))
+    if lanes:
+        query = query.filter(JobQueueItem.lane.in_(lanes))
+
+    jobs = query.order_by(
+        JobQueueItem.priority, JobQueueItem.available_at, JobQueueItem.job_id
+    ).limit(batch_size).with_for_update(skip_locked=True).all()
+
+    for job in jobs:
+        if job.status == "leased":
+            logging.warning(f"Job {job.job_id} ({job.task_name}) lease held by {job.leased_by} expired, re-leasing")
+        lease_seconds = TASK_REGISTRY.get(job.task_name, {}).get("lease_seconds", DEFAULT_LEASE_SECONDS)
+        job.status = "leased"
+        job.leased_by = worker_id
+        job.lease_expires_at = now + timedelta(seconds=lease_seconds)
+        job.attempts = (job.attempts or 0) + 1
+        job.started_at = job.started_at or now
+        job.updated_at = now
+
+    db.commit()
+    return jobs
+
+
+def _park_exhausted_leases(db: Session, now: datetime):
+    """
+    Mark items dead whose lease expired on their last attempt: a handler that hangs or kills its
+    worker never reaches fail_job, so this is where it stops being retried.
+    """
+    parked = db.query(JobQueueItem).filter(
+        JobQueueItem.status == "leased",
+        JobQueueItem.lease_expires_at < now,
+        JobQueueItem.attempts >= JobQueueItem.max_attempts,
+    ).update({
+        "status": "dead",
+        "lease_expires_at": None,
+        "updated_at": now,
+        "last_error": "Lease expired on the last attempt (handler hung or its worker died)",
+    }, synchronize_session=False)
+    if parked:
+        logging.error(f"❌ {parked} job(s) dead after their last lease expired")
+
+
+def _update_leased(db: Session, job: JobQueueItem, worker_id: str, values: dict):
+    """
+    Apply `values` to the item only while `worker_id` still holds its lease. A worker whose lease
+    expired and was taken over must not finish or requeue the item under the new holder.
+
+    Returns:
+        The updated row's payload, or None if the lease was lost (nothing is changed)
+    """
+    row = db.execute(
+        update(JobQueueItem).where(
+            JobQueueItem.job_id == job.job_id,
+            JobQueueItem.status == "leased",
+            JobQueueItem.leased_by == worker_id,
+        ).values(**values).returning(JobQueueItem.payload).execution_options(synchronize_session=False)
+    ).first()
+    db.commit()
+    if row is None:
+        logging.warning(f"Job {job.job_id} ({job.task_name}) lease lost by {worker_id}; outcome discarded")
+        return None
+    return row.payload or {}
+
+
+def complete_job(db: Session, job: JobQueueItem, worker_id: str) -> bool:
+    """
+    Mark the item done if `worker_id` still holds its lease, and queue it again if a rerun was
+    requested while it ran.
+    """
+    now = datetime.utcnow()
+    payload = _update_leased(db, job, worker_id, {
+        "status": "done", "completed_at": now, "updated_at": now, "lease_expires_at": None,
+    })
+    if payload is None:
+        return False
+    if payload.get(RERUN_FLAG):
+        enqueue(db, job.task_name, user_id=job.user_id, payload=_handler_payload(payload), priority=job.priority,
+                dedup_key=job.dedup_key, max_attempts=job.max_attempts, rerun_if_running=True)
+    return True
+
+
+def fail_job(db: Session, job: JobQueueItem, error: str, worker_id: str) -> bool:
+    """Schedule a retry with exponential backoff, or park the item as dead, if `worker_id` still holds its lease."""
+    now = datetime.utcnow()
+    values = {"last_error": error[:2000] if error else None, "lease_expires_at": None, "updated_at": now}
+
+    if job.attempts >= job.max_attempts:
+        values["status"] = "dead"
+        message = f"❌ Job {job.job_id} ({job.task_name}, user {job.user_id}) dead after {job.attempts} attempts: {error}"
+    else:
+        backoff = min(RETRY_BASE_SECONDS * (2 ** (job.attempts - 1)), RETRY_MAX_SECONDS)
+        values.update(status="queued", available_at=now + timedelta(seconds=backoff))
+        message = f"Job {job.job_id} ({job.task_name}, user {job.user_id}) failed (attempt {job.attempts}), retrying in {backoff}s: {error}"
+
+    if _update_leased(db, job, worker_id, values) is None:
+        return False
+    if values["status"] == "dead":
+        logging.error(message)
+    else:
+        logging.warning(message)
+    return True
+
+
+def defer_job(db: Session, job: JobQueueItem, seconds: float, reason: str, worker_id: str) -> bool:
+    """Put the item back for `seconds` without using up an attempt, if `worker_id` still holds its lease."""
+    now = datetime.utcnow()
+    deferred = _update_leased(db, job, worker_id, {
+        "status": "queued", "available_at": now + timedelta(seconds=seconds), "attempts": JobQueueItem.attempts - 1,
+        "lease_expires_at": None, "updated_at": now, "last_error": reason[:2000],
+    })
+    if deferred is not None:
+        logging.info(f"⏳ Job {job.job_id} ({job.task_name}, user {job.user_id}) deferred {seconds:.0f}s: {reason}")
+    return deferred is not None
+
+
+def _handler_payload(payload: Optional[dict]) -> dict:
+    return {key: value for key, value in (payload or {}).items() if key != RERUN_FLAG}
+
+
+def execute_job(db: Session, job: JobQueueItem, worker_id: str) -> bool:
+    """
+    Run a job leased by `worker_id` and record the outcome (dropped if the lease was lost
+    meanwhile). Returns True if the handler succeeded.
+    """
+    task = TASK_REGISTRY.get(job.task_name)
+    if not task:
+        fail_job(db, job, f"Unknown task '{job.task_name}'", worker_id)
+        return False
+
+    lane = job.lane or lane_for_priority(job.priority)
+    started_at, start = datetime.utcnow(), time.perf_counter()
+    deadline = time.time() + task["lease_seconds"] * BUDGET_WAIT_SHARE
+    try:
+        with upstream_lane(lane), wait_deadline(deadline), \
+                track(f"job {job.task_name} user {job.user_id}", kind=KIND_JOB) as stats, work_tally() as tally, \
+                profiled(f"task {job.task_name} user {job.user_id}", kind="task", enabled=should_profile(job.task_name)):
+            result = task["handler"](user_id=job.user_id, **_handler_payload(job.payload))
+    except UpstreamBudgetExceeded as e:
+        seconds = time.perf_counter() - start
+        _observe_task(job, lane, "deferred", seconds)
+        db.rollback()
+        record_execution(db, job, started_at, seconds, "deferred", tally, stats.statements, error=str(e))
+        defer_job(db, job, e.retry_after + 1, str(e), worker_id)
+        return False
+    except Exception as e:
+        seconds = time.perf_counter() - start
+        _observe_task(job, lane, "failed", seconds)
+        db.rollback()
+        error = f"{type(e).__name__}: {e}"
+        record_execution(db, job, started_at, seconds, "failed", tally, stats.statements, error=error)
+        fail_job(db, job, error, worker_id)
+        return False
+
+    seconds = time.perf_counter() - start
+    _observe_task(job, lane, "succeeded", seconds)
+    record_execution(db, job, started_at, seconds, "succeeded", tally, stats.statements, result=result)
+    complete_job(db, job, worker_id)
+    return True
+
+
+def _observe_task(job: JobQueueItem, lane: str, outcome: str, seconds: float):
+    QUEUE_TASK_SECONDS.observe(seconds, task=job.task_name, lane=lane, outcome=outcome)
+    if job.user_id is not None:
+        queue_user_seconds.add(job.user_id, seconds)
+
+
+def run_next(db: Session, worker_id: str = None, task_names=None, lanes=None) -> Optional[bool]:
+    """
+    Lease and run a single item.
+
+    Returns:
+        None if the queue had nothing ready, otherwise whether the job succeeded
+    """
+    worker_id = worker_id or default_worker_id()
+    jobs = lease_jobs(db, worker_id, batch_size=1, task_names=task_names, lanes=lanes)
+    if not jobs:
+        return None
+    return execute_job(db, jobs[0], worker_id)
+
+
+def drain(db: Session, worker_id: str = None, max_jobs: int = 100, task_names=None, lanes=None) -> dict:
+    """Run ready jobs until the queue is empty or max_jobs have been processed."""
+    summary = {"succeeded": 0, "failed": 0}
+    for _ in range(max_jobs):
+        outcome = run_next(db, worker_id, task_names, lanes)
+        if outcome is None:
+            break
+        summary["succeeded" if outcome else "failed"] += 1
+    return summary
+
+
+def queue_stats(db: Session) -> dict:
+    """Item counts by task and status, plus the age of the oldest ready item."""
+    rows = db.query(
+        JobQueueItem.task_name, JobQueueItem.status, func.count(JobQueueItem.job_id)
+    ).group_by(JobQueueItem.task_name, JobQueueItem.status).all()
+
+    by_task = {}
+    totals = {}
+    for task_name, status, count in rows:
+        by_task.setdefault(task_name, {})[status] = count
+        totals[status] = totals.get(status, 0) + count
+
+    oldest_ready = db.query(func.min(JobQueueItem.available_at)).filter(
+        JobQueueItem.status == "queued",
+        JobQueueItem.available_at <= datetime.utcnow()
+    ).scalar()
+
+    return {
+        "totals": totals,
+        "by_task": by_task,
+        "oldest_ready_age_seconds": (datetime.utcnow() - oldest_ready).total_seconds() if oldest_ready else 0,
+    }
+
+
+def lane_stats(db: Session, since_hours: int = 24) -> dict:
+    """
+    Per-lane backlog and queue wait (first lease minus available_at) for items started in the window.
+
+    Returns:
+        Dict keyed by lane with queued, leased, oldest_ready_age_seconds, started and
+        wait_seconds (avg, p50, p95, max)
+    """
+    now = datetime.utcnow()
+    stats = {
+        lane: {"queued": 0, "leased": 0, "oldest_ready_age_seconds": 0, "started": 0, "wait_seconds": None}
+        for lane in LANES
+    }
+
+    backlog = db.query(
+        JobQueueItem.lane, JobQueueItem.status, func.count(JobQueueItem.job_id)
+    ).filter(JobQueueItem.status.in_(ACTIVE_STATUSES)).group_by(JobQueueItem.lane, JobQueueItem.status).all()
+    for lane, status, count in backlog:
+        if lane in stats:
+            stats[lane][status] = count
+
+    oldest = db.query(JobQueueItem.lane, func.min(JobQueueItem.available_at)).filter(
+        JobQueueItem.status == "queued",
+        JobQueueItem.available_at <= now
+    ).group_by(JobQueueItem.lane).all()
+    for lane, available_at in oldest:
+        if lane in stats and available_at:
+            stats[lane]["oldest_ready_age_seconds"] = round((now - available_at).total_seconds(), 1)
+
+    started = db.query(JobQueueItem.lane, JobQueueItem.started_at, JobQueueItem.available_at, JobQueueItem.attempts).filter(
+        JobQueueItem.started_at >= now - timedelta(hours=since_hours)
+    ).all()
+    waits_by_lane = {}
+    for lane, started_at, available_at, attempts in started:
+        if attempts and attempts > 1:
+            continue  # available_at was moved by the retry backoff; the first wait is gone
+        waits_by_lane.setdefault(lane, []).append(max((started_at - available_at).total_seconds(), 0.0))
+
+    for lane, waits in waits_by_lane.items():
+        if lane not in stats:
+            continue
+        waits.sort()
+        stats[lane]["started"] = len(waits)
+        stats[lane]["wait_seconds"] = {
+            "avg": round(sum(waits) / len(waits), 1),
+            "p50": round(waits[len(waits) // 2], 1),
+            "p95": round(waits[min(int(len(waits) * 0.95), len(waits) - 1)], 1),
+            "max": round(waits[-1], 1),
+        }
+    return stats
+
+
+def requeue_dead_jobs(db: Session, task_name: str = None) -> int:
+    """Give dead items a fresh set of attempts."""
+    query = db.query(JobQueueItem).filter(JobQueueItem.status == "dead")
+    if task_name:
+        query = query.filter(JobQueueItem.task_name == task_name)
+
+    now = datetime.utcnow()
+    count = 0
+    for job in query.all():
+        if job.dedup_key and db.query(JobQueueItem.job_id).filter(
+            JobQueueItem.dedup_key == job.dedup_key,
+            JobQueueItem.status.in_(ACTIVE_STATUSES)
+        ).first():
+            continue  # A newer item for the same work is already pending
+        job.status = "queued"
+        job.attempts = 0
+        job.available_at = now
+        job.updated_at = now
+        count += 1
+    db.commit()
+    return count
+
+
+def purge_finished_jobs(db: Session, older_than_days: int = DONE_RETENTION_DAYS,
+                        dead_older_than_days: int = DEAD_RETENTION_DAYS) -> int:
+    """Delete completed items and dead items older than their retention windows."""
+    now = datetime.utcnow()
+    count = db.query(JobQueueItem).filter(
+        or_(
+            and_(JobQueueItem.status == "done",
+                 JobQueueItem.completed_at < now - timedelta(days=older_than_days)),
+            and_(JobQueueItem.status == "dead",
+                 JobQueueItem.updated_at < now - timedelta(days=dead_older_than_days)),
+        )
+    ).delete(synchronize_session=False)
+    db.commit()
+    return count
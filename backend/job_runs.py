@@ -0,0 +1,287 @@
+# Job run ledger: how long each scheduled run took, per user
+#
+# Scheduled jobs only enqueue per-user queue items (sync_tasks.enqueue_for_all_users); the work
+# happens later, on whichever worker leases each item. @recorded_job opens a JobRun row around
+# the scheduler call, and enqueue() stamps the open run's id on every item added inside it.
+# execute_job() then writes one JobRunUser row per attempt of those items: start/end, duration,
+# upstream API calls and activities touched (metrics.work_tally), database statements
+# (query_stats), outcome, error and the handler's result.
+#
+# A run has drained once none of its items are queued or leased; its finish time and totals are
+# derived when read, so a crashed worker never leaves a run marked finished or unfinished.
+# Items deduplicated against one still pending from an earlier run stay with that earlier run.
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import wraps
+from typing import Optional
+import contextvars
+import json
+import logging
+
+from sqlalchemy import func, case
+from sqlalchemy.orm import Session
+
+from config import SessionLocal
+from models import JobRun, JobRunUser, JobQueueItem
+
+TRIGGER_SCHEDULE = "schedule"
+TRIGGER_MANUAL = "manual"
+
+_current_run = contextvars.ContextVar("job_run", default=None)
+_trigger = contextvars.ContextVar("job_run_trigger", default=TRIGGER_SCHEDULE)
+
+
+def current_run_id() -> Optional[int]:
+    """The run whose scheduler call is in progress in this context (enqueue() tags items with it)."""
+    return _current_run.get()
+
+
+@contextmanager
+def manual_trigger():
+    """Runs recorded inside the block are marked as triggered manually (POST /scheduler/run)."""
+    token = _trigger.set(TRIGGER_MANUAL)
+    try:
+        yield
+    finally:
+        _trigger.reset(token)
+
+
+def recorded_job(job_name: str):
+    """
+    Decorator recording each call of a scheduled job as a JobRun.
+
+    Ledger failures are logged and never stop the job itself; the run then goes unrecorded.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            run_id = _start_run(job_name, _trigger.get())
+            if run_id is None:
+                return func(*args, **kwargs)
+
+            token = _current_run.set(run_id)
+            error = None
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                _current_run.reset(token)
+                _finish_run(run_id, error)
+        return wrapper
+    return decorator
+
+
+def _start_run(job_name: str, trigger: str) -> Optional[int]:
+    db = SessionLocal()
+    try:
+        run = JobRun(job_name=job_name, trigger=trigger, status="running", started_at=datetime.utcnow())
+        db.add(run)
+        db.commit()
+        return run.run_id
+    except Exception as e:
+        logging.warning(f"⚠️ Could not record {job_name} run: {e}")
+        return None
+    finally:
+        db.close()
+
+
+def _finish_run(run_id: int, error: Optional[str]):
+    db = SessionLocal()
+    try:
+        run = db.get(JobRun, run_id)
+        run.status = "failed" if error else "enqueued"
+        run.error = error
+        run.enqueued_at = datetime.utcnow()
+        run.users_enqueued = db.query(func.count(JobQueueItem.job_id)).filter(JobQueueItem.run_id == run_id).scalar()
+        db.commit()
+        logging.info(f"🗂️ Run {run_id} ({run.job_name}) enqueued {run.users_enqueued} items")
+    except Exception as e:
+        logging.warning(f"⚠️ Could not finish job run {run_id}: {e}")
+    finally:
+        db.close()
+
+
+def record_execution(db: Session, job: JobQueueItem, started_at: datetime, seconds: float, status: str,
+                     tally: dict = None, queries: int = 0, error: str = None, result=None):
+    """
+    Add the JobRunUser row for one attempt of a run's item to the session (the caller commits it
+    with the item's new status). Items without a run are ignored.
+    """
+    if job.run_id is None:
+        return
+    tally = tally or {}
+    db.add(JobRunUser(
+        run_id=job.run_id, queue_job_id=job.job_id, user_id=job.user_id, task_name=job.task_name,
+        attempt=job.attempts or 1, started_at=started_at, finished_at=started_at + timedelta(seconds=seconds),
+        duration_seconds=round(seconds, 3), api_calls=tally.get("api_calls", 0),
+        activities=tally.get("activities", 0), queries=queries, status=status,
+        error=error[:2000] if error else None, result=_json_result(result),
+    ))
+
+
+def _json_result(result):
+    if result is None:
+        return None
+    try:
+        json.dumps(result)
+    except (TypeError, ValueError):
+        return {"repr": repr(result)[:500]}
+    return result
+
+
+# --- Reports ---------------------------------------------------------------------------------------
+
+def _total(totals, name: str):
+    return (getattr(totals, name) or 0) if totals is not None else 0
+
+
+def _summaries(db: Session, runs: list) -> list:
+    """Run rows plus totals from their executions and pending items (two grouped queries for any number of runs)."""
+    run_ids = [run.run_id for run in runs]
+    if not run_ids:
+        return []
+
+    executions = {row.run_id: row for row in db.query(
+        JobRunUser.run_id,
+        func.count(func.distinct(JobRunUser.user_id)).label("users"),
+        func.count(JobRunUser.id).label("attempts"),
+        func.sum(case((JobRunUser.status == "failed", 1), else_=0)).label("failed_attempts"),
+        func.sum(JobRunUser.duration_seconds).label("work_seconds"),
+        func.max(JobRunUser.duration_seconds).label("max_seconds"),
+        func.sum(JobRunUser.api_calls).label("api_calls"),
+        func.sum(JobRunUser.activities).label("activities"),
+        func.max(JobRunUser.finished_at).label("last_finished_at"),
+    ).filter(JobRunUser.run_id.in_(run_ids)).group_by(JobRunUser.run_id)}
+
+    items = {}
+    for run_id, status, count in db.query(JobQueueItem.run_id, JobQueueItem.status, func.count(JobQueueItem.job_id)).filter(
+            JobQueueItem.run_id.in_(run_ids), JobQueueItem.status.in_(("queued", "leased", "dead"))
+    ).group_by(JobQueueItem.run_id, JobQueueItem.status):
+        items.setdefault(run_id, {})[status] = count
+
+    summaries = []
+    for run in runs:
+        totals = executions.get(run.run_id)
+        counts = items.get(run.run_id, {})
+        pending = counts.get("queued", 0) + counts.get("leased", 0)
+        if run.status in ("running", "failed"):
+            state = run.status
+        else:
+            state = "draining" if pending else "completed"
+        finished_at = (_total(totals, "last_finished_at") or run.enqueued_at) if state == "completed" else None
+        summaries.append({
+            "run_id": run.run_id,
+            "job_name": run.job_name,
+            "trigger": run.trigger,
+            "state": state,
+            "started_at": run.started_at.isoformat() if run.started_at else None,
+            "enqueued_at": run.enqueued_at.isoformat() if run.enqueued_at else None,
+            "finished_at": finished_at.isoformat() if finished_at else None,
+            "wall_seconds": round((finished_at - run.started_at).total_seconds(), 1) if finished_at else None,
+            "users_enqueued": run.users_enqueued or 0,
+            "users_processed": _total(totals, "users"),
+            "pending": pending,
+            "dead": counts.get("dead", 0),
+            "attempts": _total(totals, "attempts"),
+            "failed_attempts": int(_total(totals, "failed_attempts")),
+            "work_seconds": round(_total(totals, "work_seconds"), 2),
+            "max_user_seconds": round(_total(totals, "max_seconds"), 2),
+            "api_calls": int(_total(totals, "api_calls")),
+            "activities": int(_total(totals, "activities")),
+            "error": run.error,
+        })
+    return summaries
+
+
+def list_runs(db: Session, job_name: str = None, limit: int = 20) -> list:
+    """The most recent runs, newest first, optionally for one job."""
+    query = db.query(JobRun)
+    if job_name:
+        query = query.filter(JobRun.job_name == job_name)
+    return _summaries(db, query.order_by(JobRun.started_at.desc(), JobRun.run_id.desc()).limit(limit).all())
+
+
+def run_detail(db: Session, run_id: int) -> Optional[dict]:
+    """
+    One run's summary with every execution, slowest first.
+
+    Returns:
+        None if the run doesn't exist
+    """
+    run = db.get(JobRun, run_id)
+    if run is None:
+        return None
+    detail = _summaries(db, [run])[0]
+    executions = db.query(JobRunUser).filter(JobRunUser.run_id == run_id).order_by(
+        JobRunUser.duration_seconds.desc()).all()
+    detail["executions"] = [{
+        "user_id": row.user_id,
+        "task_name": row.task_name,
+        "queue_job_id": row.queue_job_id,
+        "attempt": row.attempt,
+        "status": row.status,
+        "started_at": row.started_at.isoformat(),
+        "duration_seconds": row.duration_seconds,
+        "api_calls": row.api_calls,
+        "activities": row.activities,
+        "queries": row.queries,
+        "error": row.error,
+        "result": row.result,
+    } for row in executions]
+    detail["errors"] = [{"user_id": row["user_id"], "attempt": row["attempt"], "error": row["error"]}
+                        for row in detail["executions"] if row["status"] == "failed"]
+    return detail
+
+
+def slowest_users(db: Session, days: int = 7, job_name: str = None, task_name: str = None, limit: int = 20) -> list:
+    """
+    Users ranked by the time their work took across runs in the window, per task.
+
+    Returns:
+        Dicts with user_id, task_name, executions, failures, total/mean/max seconds, api_calls
+        and activities, largest total first
+    """
+    since = datetime.utcnow() - timedelta(days=days)
+    query = db.query(
+        JobRunUser.user_id, JobRunUser.task_name,
+        func.count(JobRunUser.id).label("executions"),
+        func.sum(case((JobRunUser.status == "failed", 1), else_=0)).label("failures"),
+        func.sum(JobRunUser.duration_seconds).label("total_seconds"),
+        func.max(JobRunUser.duration_seconds).label("max_seconds"),
+        func.sum(JobRunUser.api_calls).label("api_calls"),
+        func.sum(JobRunUser.activities).label("activities"),
+    ).filter(JobRunUser.started_at >= since)
+    if task_name:
+        query = query.filter(JobRunUser.task_name == task_name)
+    if job_name:
+        query = query.join(JobRun, JobRun.run_id == JobRunUser.run_id).filter(JobRun.job_name == job_name)
+    rows = query.group_by(JobRunUser.user_id, JobRunUser.task_name).order_by(
+        func.sum(JobRunUser.duration_seconds).desc()).limit(limit).all()
+
+    return [{
+        "user_id": row.user_id,
+        "task_name": row.task_name,
+        "executions": row.executions,
+        "failures": int(row.failures or 0),
+        "total_seconds": round(row.total_seconds or 0, 2),
+        "mean_seconds": round((row.total_seconds or 0) / row.executions, 2),
+        "max_seconds": round(row.max_seconds or 0, 2),
+        "api_calls": int(row.api_calls or 0),
+        "activities": int(row.activities or 0),
+    } for row in rows]
+
+
+def purge_job_runs(db: Session, older_than_days: int = 90) -> int:
+    """Delete runs (and their executions) started before the retention window."""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    run_ids = [run_id for (run_id,) in db.query(JobRun.run_id).filter(JobRun.started_at < cutoff)]
+    if not run_ids:
+        return 0
+    db.query(JobRunUser).filter(JobRunUser.run_id.in_(run_ids)).delete(synchronize_session=False)
+    db.query(JobQueueItem).filter(JobQueueItem.run_id.in_(run_ids)).update(
+        {JobQueueItem.run_id: None}, synchronize_session=False)
+    count = db.query(JobRun).filter(JobRun.run_id.in_(run_ids)).delete(synchronize_session=False)
+    db.commit()
+    return count
@@ -0,0 +1,240 @@
+# Scheduler leader election
+#
+# Every API worker (and the background_processor daemon) starts its scheduler paused and
+# runs a LeaderElector. The process that holds a Postgres session-level advisory lock is
+# the leader and resumes its scheduler; everyone else stays on standby and retries.
+#
+# - Leader crash: Postgres drops the lock with the connection, so a standby takes over on
+#   its next retry (LEADER_RETRY_SECONDS).
+# - Leader hang / network partition: the leader stops heartbeating its lease row. Once the
+#   lease has expired, a standby terminates the stale backend holding the lock and takes
+#   over, so failover is bounded by LEADER_LEASE_SECONDS + LEADER_RETRY_SECONDS.
+#
+# The lock is session-level, so it lives as long as the connection holding it. That connection
+# is detached from the engine pool once the lock is taken: closing it always ends the session,
+# and a lock can never be handed to a request with a pooled connection. Every demotion unlocks
+# first and invalidates the connection if that fails.
+from sqlalchemy import text, func, update, select
+from sqlalchemy.dialects import postgresql
+from datetime import timedelta
+from typing import Callable, Optional
+import threading
+import logging
+import socket
+import zlib
+import os
+
+from config import engine, LEADER_HEARTBEAT_SECONDS, LEADER_LEASE_SECONDS, LEADER_RETRY_SECONDS
+from models import SchedulerLeader
+
+leader_table = SchedulerLeader.__table__
+
+
+def advisory_lock_key(name: str) -> int:
+    """Stable positive 31-bit key so the lock shows up as (classid=0, objid=key) in pg_locks."""
+    return zlib.crc32(f"trainingload:{name}".encode()) & 0x7FFFFFFF
+
+
+def db_utc_now():
+    """Database clock (UTC), so lease comparisons are immune to host clock skew."""
+    return func.timezone('utc', func.now())
+
+
+class LeaderElector:
+    """Keeps trying to become leader for `name`; calls on_elected/on_demoted on transitions."""
+
+    def __init__(
+        self,
+        name: str = "scheduler",
+        on_elected: Optional[Callable] = None,
+        on_demoted: Optional[Callable] = None,
+        heartbeat_seconds: int = LEADER_HEARTBEAT_SECONDS,
+        lease_seconds: int = LEADER_LEASE_SECONDS,
+        retry_seconds: int = LEADER_RETRY_SECONDS,
+        bind=None,
+    ):
+        self.name = name
+        self.identity = f"{socket.gethostname()}:{os.getpid()}"
+        self.lock_key = advisory_lock_key(name)
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.heartbeat_seconds = heartbeat_seconds
+        self.lease_seconds = lease_seconds
+        self.retry_seconds = retry_seconds
+        self.engine = bind or engine
+        self.is_leader = False
+        self._conn = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Make one election attempt immediately, then keep electing in a daemon thread."""
+        self._tick()
+        self._thread = threading.Thread(target=self._run, name=f"leader-election-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop electing and release leadership so a standby can take over immediately."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.heartbeat_seconds + 5)
+        self._release()
+
+    def _run(self):
+        while not self._stop.wait(self.heartbeat_seconds if self.is_leader else self.retry_seconds):
+            self._tick()
+
+    def _tick(self):
+        try:
+            if self.is_leader:
+                self._heartbeat()
+            else:
+                self._try_acquire()
+        except Exception as e:
+            logging.error(f"Leader election error ({self.name}, {self.identity}): {e}")
+            if self.is_leader:
+                self._demote()
+
+    def _try_acquire(self):
+        if self.engine.dialect.name != "postgresql":
+            # No advisory locks (e.g. SQLite in local dev): a single process is always leader
+            self._promote()
+            return
+
+        conn = self.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        try:
+            acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.lock_key}).scalar()
+            if not acquired:
+                self._take_over_stale_leader(conn)
+                conn.close()
+                return
+            conn.detach()  # Never back into the pool while it holds the lock
+
+            backend_pid = conn.execute(text("SELECT pg_backend_pid()")).scalar()
+            lease_expires = db_utc_now() + timedelta(seconds=self.lease_seconds)
+            stmt = postgresql.insert(leader_table).values(
+                name=self.name, holder=self.identity, backend_pid=backend_pid,
+                acquired_at=db_utc_now(), heartbeat_at=db_utc_now(), lease_expires_at=lease_expires,
+            )
+            conn.execute(stmt.on_conflict_do_update(
+                index_elements=[leader_table.c.name],
+                set_={
+                    "holder": stmt.excluded.holder,
+                    "backend_pid": stmt.excluded.backend_pid,
+                    "acquired_at": stmt.excluded.acquired_at,
+                    "heartbeat_at": stmt.excluded.heartbeat_at,
+                    "lease_expires_at": stmt.excluded.lease_expires_at,
+                },
+            ))
+        except Exception:
+            self._unlock_and_close(conn)
+            raise
+
+        self._conn = conn
+        self._promote()
+
+    def _take_over_stale_leader(self, conn):
+        """If the lock holder stopped heartbeating, terminate its backend to free the lock."""
+        stale = conn.execute(
+            select(leader_table.c.holder, leader_table.c.backend_pid).where(
+                leader_table.c.name == self.name,
+                leader_table.c.lease_expires_at < db_utc_now(),
+            )
+        ).first()
+        if not stale or not stale.backend_pid:
+            return
+
+        lock_holder_pid = conn.execute(text(
+            "SELECT pid FROM pg_locks WHERE locktype = 'advisory' AND granted "
+            "AND classid = 0 AND objid = :key AND objsubid = 1"
+        ), {"key": self.lock_key}).scalar()
+
+        if lock_holder_pid == stale.backend_pid:
+            logging.warning(
+                f"⚠️ {self.name} leader {stale.holder} missed its lease; "
+                f"terminating backend {stale.backend_pid} so {self.identity} can take over"
+            )
+            conn.execute(text("SELECT pg_terminate_backend(:pid)"), {"pid": stale.backend_pid})
+
+    def _heartbeat(self):
+        if self._conn is None:
+            return  # Non-Postgres single-process mode
+
+        result = self._conn.execute(
+            update(leader_table)
+            .where(leader_table.c.name == self.name, leader_table.c.holder == self.identity)
+            .values(heartbeat_at=db_utc_now(), lease_expires_at=db_utc_now() + timedelta(seconds=self.lease_seconds))
+        )
+        if result.rowcount == 0:
+            raise RuntimeError("lease row no longer held by this process")
+
+    def _promote(self):
+        if self.is_leader:
+            return
+        self.is_leader = True
+        logging.info(f"👑 {self.identity} elected {self.name} leader")
+        if self.on_elected:
+            self.on_elected()
+
+    def _demote(self):
+        was_leader = self.is_leader
+        self.is_leader = False
+        self._close_connection()
+        if was_leader:
+            if self._stop.is_set():
+                logging.info(f"{self.identity} released {self.name} leadership")
+            else:
+                logging.warning(f"{self.identity} lost {self.name} leadership, standing by")
+            if self.on_demoted:
+                self.on_demoted()
+
+    def _release(self):
+        if self._conn is not None:
+            try:
+                self._conn.execute(
+                    update(leader_table)
+                    .where(leader_table.c.name == self.name, leader_table.c.holder == self.identity)
+                    .values(lease_expires_at=db_utc_now())
+                )
+            except Exception as e:
+                logging.debug(f"Could not release {self.name} leadership cleanly: {e}")
+        self._demote()
+
+    def _close_connection(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._unlock_and_close(conn)
+
+    def _unlock_and_close(self, conn):
+        """Release the advisory lock, or drop the connection (and with it the session) if that fails."""
+        try:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.lock_key})
+        except Exception as e:
+            logging.debug(f"Could not unlock {self.name} on {self.identity}, invalidating its connection: {e}")
+            try:
+                conn.invalidate()
+            except Exception:
+                pass
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def status(self) -> dict:
+        """This process's view plus the current lease row."""
+        info = {"this_process": self.identity, "is_leader": self.is_leader, "leader": None}
+        try:
+            with self.engine.connect() as conn:
+                row = conn.execute(select(leader_table).where(leader_table.c.name == self.name)).first()
+            if row:
+                info["leader"] = {
+                    "holder": row.holder,
+                    "acquired_at": row.acquired_at.isoformat() if row.acquired_at else None,
+                    "heartbeat_at": row.heartbeat_at.isoformat() if row.heartbeat_at else None,
+                    "lease_expires_at": row.lease_expires_at.isoformat() if row.lease_expires_at else None,
+                }
+        except Exception as e:
+            info["error"] = f"Failed to read leader lease: {e}"
+        if info["leader"] is None and self.is_leader:
+            info["leader"] = {"holder": self.identity}
+        return info
@@ -0,0 +1,273 @@
+# Daily load model: fitness (CTL), fatigue (ATL), form (TSB) and ACWR over dense daily arrays
+#
+# The recommendation engine only looks at fixed 7- and 28-day sums. The Performance Management
+# Chart needs the same load model over years: CTL and ATL are exponentially weighted averages of
+# daily UTL (time constants 42 and 7 days, y[t] = y[t-1] + (utl[t] - y[t-1]) / days), TSB is
+# yesterday's CTL - ATL (form coming into the day), and ACWR is the engine's rolling 7-day sum
+# over the 28-day sum / 4.
+#
+# The recursive averages are computed as blocked linear recurrences: each block of BLOCK_DAYS is a
+# matrix product with a lower-triangular decay matrix (the response from a zero start), and only
+# the state carried between blocks is stepped in Python, so a 5-year series is ~30 steps of array
+# math instead of 1,800 iterations. Arrays may be 2-D (one series per row) to evaluate many
+# series at once. Decay powers never exceed one block, so the result matches the plain loop to
+# float rounding.
+#
+# project_plans() runs the same model forward for candidate plans: a (plans x days) matrix of
+# planned UTL is simulated in one batch from the athlete's current state, and the plan with the
+# largest CTL gain whose ACWR stays inside a band on every planned day is picked. With no load in
+# the last 28 days the ratio has nothing to compare against (any session reads as a spike), so no
+# plan is marked feasible and a fallback is picked instead: the caller's as-planned candidate, or
+# the lightest plan that still trains.
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional, Sequence, Tuple
+import time
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import Activity
+from athlete_snapshot import ACUTE_DAYS, CHRONIC_DAYS, HISTORY_DAYS
+
+CTL_DAYS = 42  # Chronic training load (fitness) time constant
+ATL_DAYS = 7  # Acute training load (fatigue) time constant
+WARMUP_DAYS = 6 * CTL_DAYS  # History loaded before the range so CTL has settled (< 0.3% of a start at zero)
+BLOCK_DAYS = 64
+DAILY_MAX_DAYS = 366  # resolution="auto" switches to weekly points for longer ranges
+RESOLUTIONS = ("auto", "daily", "weekly")
+
+
+def _decay_matrix(decay: float, size: int) -> np.ndarray:
+    """L[j, i] = decay ** (j - i) for i <= j, else 0."""
+    exponents = np.subtract.outer(np.arange(size), np.arange(size))
+    return np.where(exponents >= 0, decay ** np.maximum(exponents, 0), 0.0)
+
+
+def ewma(values, days: float, initial=0.0) -> np.ndarray:
+    """
+    Exponentially weighted average along the last axis: y[t] = y[t-1] + (x[t] - y[t-1]) / days.
+
+    Args:
+        values: 1-D series or 2-D array with one series per row
+        initial: State before the first value (scalar or one per row)
+
+    Returns:
+        Array of the same shape as `values`
+    """
+    x = np.asarray(values, dtype=float)
+    series = np.atleast_2d(x)
+    rows, n = series.shape
+    if n == 0:
+        return x.copy()
+    alpha = 1.0 / days
+    decay = 1.0 - alpha
+    size = min(BLOCK_DAYS, n)
+    blocks = -(-n // size)
+    padded = np.zeros((rows, blocks * size))
+    padded[:, :n] = series
+    padded = padded.reshape(rows, blocks, size)
+
+    # Response of each block from a zero state, then the carried state's decay added block by block
+    zero_state = alpha * padded @ _decay_matrix(decay, size).T
+    carry_decay = decay ** np.arange(1, size + 1)
+    state = np.broadcast_to(np.asarray(initial, dtype=float), (rows,)).copy()
+    result = np.empty_like(zero_state)
+    for block in range(blocks):
+        result[:, block] = zero_state[:, block] + state[:, None] * carry_decay
+        state = result[:, block, -1]
+    result = result.reshape(rows, blocks * size)[:, :n]
+    return result.reshape(x.shape)
+
+
+def rolling_sum(values, window: int) -> np.ndarray:
+    """Sum of the last `window` values (fewer at the start) along the last axis."""
+    x = np.asarray(values, dtype=float)
+    totals = np.cumsum(x, axis=-1)
+    shifted = np.zeros_like(totals)
+    if window < x.shape[-1]:
+        shifted[..., window:] = totals[..., :-window]
+    return totals - shifted
+
+
+def acwr(values) -> np.ndarray:
+    """The engine's ACWR per day: 7-day sum / (28-day sum / 4); 1.0 with no chronic load but some acute load."""
+    acute = rolling_sum(values, ACUTE_DAYS)
+    chronic = rolling_sum(values, CHRONIC_DAYS) / (CHRONIC_DAYS / ACUTE_DAYS)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(chronic > 0, acute / chronic, np.where(acute > 0, 1.0, 0.0))
+    return ratio
+
+
+def pmc_series(daily_utl, initial_ctl=0.0, initial_atl=0.0) -> Dict[str, np.ndarray]:
+    """CTL, ATL, TSB and ACWR for a dense daily UTL array (1-D or one series per row)."""
+    utl = np.asarray(daily_utl, dtype=float)
+    ctl = ewma(utl, CTL_DAYS, initial_ctl)
+    atl = ewma(utl, ATL_DAYS, initial_atl)
+    previous_ctl = np.concatenate([np.broadcast_to(np.asarray(initial_ctl, dtype=float), utl.shape[:-1])[..., None],
+                                   ctl[..., :-1]], axis=-1)
+    previous_atl = np.concatenate([np.broadcast_to(np.asarray(initial_atl, dtype=float), utl.shape[:-1])[..., None],
+                                   atl[..., :-1]], axis=-1)
+    return {"utl": utl, "ctl": ctl, "atl": atl, "tsb": previous_ctl - previous_atl, "acwr": acwr(utl)}
+
+
+def load_daily_utl(db: Session, user_id: int, start: date, end: date) -> np.ndarray:
+    """Dense array of UTL per calendar day from `start` to `end` inclusive (one grouped query)."""
+    day = func.date(Activity.start_date)
+    rows = db.query(day, func.sum(Activity.utl_score)).filter(
+        Activity.user_id == user_id,
+        Activity.start_date >= datetime.combine(start, datetime.min.time()),
+        Activity.start_date < datetime.combine(end + timedelta(days=1), datetime.min.time()),
+        Activity.utl_score.isnot(None),
+    ).group_by(day).all()
+
+    daily = np.zeros((end - start).days + 1)
+    if rows:
+        offsets = np.array([(date.fromisoformat(str(value)[:10]) - start).days for value, _ in rows])
+        daily[offsets] = [total or 0 for _, total in rows]
+    return daily
+
+
+def _weekly(series: Dict[str, np.ndarray], start: date) -> tuple:
+    """ISO weeks: UTL summed over the week's days, the other values as of its last day in the range."""
+    n = len(series["utl"])
+    weeks = (np.arange(n) + start.weekday()) // 7
+    last_days = np.r_[np.flatnonzero(np.diff(weeks)), n - 1]
+    points = {name: values[last_days] for name, values in series.items()}
+    points["utl"] = np.bincount(weeks, weights=series["utl"])
+    return points, last_days
+
+
+def performance_management_chart(db: Session, user_id: int, start: date, end: date,
+                                 resolution: str = "auto") -> dict:
+    """
+    Daily UTL, CTL, ATL, TSB and ACWR from `start` to `end`, daily or as weekly points.
+
+    History from WARMUP_DAYS before `start` is included in the averages (and the ACWR windows)
+    but not returned.
+
+    Returns:
+        Range, resolution, constants, points [{date, utl, ctl, atl, tsb, acwr}], the values on
+        `end` and compute_ms
+    """
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution {resolution!r}")
+    if resolution == "auto":
+        resolution = "weekly" if (end - start).days + 1 > DAILY_MAX_DAYS else "daily"
+
+    warmup_start = start - timedelta(days=WARMUP_DAYS)
+    daily = load_daily_utl(db, user_id, warmup_start, end)
+    compute_start = time.perf_counter()
+    series = {name: values[WARMUP_DAYS:] for name, values in pmc_series(daily).items()}
+    day_offsets = np.arange(len(series["utl"]))
+    if resolution == "weekly":
+        points, day_offsets = _weekly(series, start)
+    else:
+        points = series
+
+    columns = {name: np.round(values, 3 if name == "acwr" else 1).tolist() for name, values in points.items()}
+    dates = np.datetime_as_string(np.datetime64(start, "D") + day_offsets).tolist()
+    rows = [dict(zip(("date", *columns), values)) for values in zip(dates, *columns.values())]
+    compute_ms = (time.perf_counter() - compute_start) * 1000
+
+    return {
+        "user_id": user_id,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "resolution": resolution,
+        "constants": {"ctl_days": CTL_DAYS, "atl_days": ATL_DAYS, "acute_days": ACUTE_DAYS,
+                      "chronic_days": CHRONIC_DAYS, "warmup_days": WARMUP_DAYS},
+        "points": rows,
+        "current": {name: round(float(values[-1]), 3 if name == "acwr" else 1) for name, values in series.items()},
+        "compute_ms": round(compute_ms, 2),
+    }
+
+
+# --- What-if projection -------------------------------------------------------------------------
+
+def daily_history(start_dates: Sequence[datetime], utl: Sequence[float], today: date,
+                  days: int = HISTORY_DAYS) -> Tuple[np.ndarray, float]:
+    """
+    Dense UTL per day for the `days` days before `today` (oldest first) from per-activity columns,
+    and the UTL already done today.
+    """
+    history = np.zeros(days + 1)
+    offsets = np.array([(today - start.date()).days for start in start_dates], dtype=int)
+    values = np.array([value or 0 for value in utl], dtype=float)
+    keep = (offsets >= 0) & (offsets <= days)
+    np.add.at(history, days - offsets[keep], values[keep])
+    return history[:-1], float(history[-1])
+
+
+def project_plans(history_utl, plan_utl, min_ratio: float, max_ratio: float,
+                  fallback: Optional[int] = None) -> dict:
+    """
+    Simulate CTL, ATL, TSB and ACWR forward for a batch of candidate plans and pick the best one.
+
+    The history is usually the recommendation window (HISTORY_DAYS), too short for CTL to settle
+    from zero, so the averages start from its first 28 days' mean daily load (a steady state)
+    rather than from zero. Without any load in the last 28 days the band cannot be evaluated:
+    no plan is feasible and `fallback` is picked.
+
+    Args:
+        history_utl: Dense daily UTL up to yesterday, oldest first
+        plan_utl: (plans, days) planned UTL per candidate and day, day 0 = today
+        min_ratio, max_ratio: ACWR band every planned day should stay inside
+        fallback: Plan to pick when the band cannot be evaluated; defaults to the plan with the
+            smallest total load above zero (the first plan if none has any)
+
+    Returns:
+        ctl, atl, tsb, acwr as (plans, days) arrays; ctl_gain, violation (ACWR distance outside
+        the band, summed over the days) and feasible per plan; start {ctl, atl, acwr};
+        band_applied; best (the feasible plan with the largest CTL gain, else the one closest to
+        the band, or the fallback when the band was not applied)
+    """
+    history = np.asarray(history_utl, dtype=float)
+    plans = np.atleast_2d(np.asarray(plan_utl, dtype=float))
+    count = plans.shape[0]
+
+    seed = float(history[:CHRONIC_DAYS].mean()) if history.size else 0.0
+    start_ctl = float(ewma(history, CTL_DAYS, seed)[-1]) if history.size else seed
+    start_atl = float(ewma(history, ATL_DAYS, seed)[-1]) if history.size else seed
+
+    ctl = ewma(plans, CTL_DAYS, start_ctl)
+    atl = ewma(plans, ATL_DAYS, start_atl)
+    tsb = np.concatenate([np.full((count, 1), start_ctl - start_atl), (ctl - atl)[:, :-1]], axis=1)
+
+    # ACWR windows reach back into the history: prepend its last 27 days to every plan
+    tail = history[-(CHRONIC_DAYS - 1):]
+    ratio = acwr(np.concatenate([np.broadcast_to(tail, (count, tail.size)), plans], axis=1))[:, tail.size:]
+    start_acwr = float(acwr(history)[-1]) if history.size else 0.0
+
+    violation = (np.clip(min_ratio - ratio, 0, None) + np.clip(ratio - max_ratio, 0, None)).sum(axis=1)
+    band_applied = bool(tail.any())
+    feasible = (violation == 0) & band_applied
+    ctl_gain = ctl[:, -1] - start_ctl
+    if not band_applied:
+        if fallback is None:
+            totals = plans.sum(axis=1)
+            training = np.flatnonzero(totals > 0)
+            fallback = int(training[np.argmin(totals[training])]) if training.size else 0
+        best = int(fallback)
+    elif feasible.any():
+        candidates = np.flatnonzero(feasible)
+        best = int(candidates[np.argmax(ctl_gain[candidates])])
+    else:
+        best = int(np.lexsort((-ctl_gain, violation))[0])
+
+    return {
+        "ctl": ctl, "atl": atl, "tsb": tsb, "acwr": ratio,
+        "ctl_gain": ctl_gain, "violation": violation, "feasible": feasible,
+        "start": {"ctl": start_ctl, "atl": start_atl, "acwr": start_acwr},
+        "band_applied": band_applied,
+        "best": best,
+    }
+
+
+def projection_points(projection: dict, plan_utl, index: int, start: date) -> list:
+    """One candidate's projected days as [{date, utl, ctl, atl, tsb, acwr}], rounded like the PMC."""
+    plans = np.atleast_2d(np.asarray(plan_utl, dtype=float))
+    columns = {"utl": plans[index], **{name: projection[name][index] for name in ("ctl", "atl", "tsb", "acwr")}}
+    columns = {name: np.round(values, 3 if name == "acwr" else 1).tolist() for name, values in columns.items()}
+    dates = np.datetime_as_string(np.datetime64(start, "D") + np.arange(plans.shape[1])).tolist()
+    return [dict(zip(("date", *columns), values)) for values in zip(dates, *columns.values())]
@@ -1,4 +1,5 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Response
+from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 import logging
@@ -15,356 +16,161 @@ from thresholds import router as thresholds_router
 from onboarding import router as onboarding_router
 from dashboard import router as dashboard_router
 from intervals_icu import router as intervals_router
+from strava_webhook import router as strava_webhook_router
 
-# Import recommendation engine
+# Import recommendation engine (and its cache, which subscribes to data change events)
 from training_recommendations import TrainingRecommendationEngine
+from recommendation_cache import get_recommendations
 
 # Import config and models for scheduler
-from config import SessionLocal, get_db
-from models import User, Activity, Threshold
+from config import (SessionLocal, get_db, STRAVA_WEBHOOKS_ENABLED, RECONCILIATION_SYNC_HOURS,
+                    QUEUE_EMBEDDED_WORKER, QUEUE_DRAIN_BATCH, QUEUE_INTERACTIVE_POLL_SECONDS,
+                    ADAPTIVE_SYNC_ENABLED)
+from models import User, Activity
 from activities import sync_strava_activities, _fetch_and_process_activities
-from utils import calculate_utl, estimate_thresholds_from_activities
-from research_threshold_calculator import calculate_initial_thresholds_for_new_user
+from job_queue import (drain, queue_stats, lane_stats, requeue_dead_jobs, purge_finished_jobs, default_worker_id,
+                       PRIORITY_NORMAL, PRIORITY_LOW)
+from upstream_budget import upstream_lane, strava_budget, intervals_budget, LANE_INTERACTIVE
+from sync_tasks import enqueue_for_all_users
+from leader_election import LeaderElector
+from sync_policy import adaptive_sync_tick, sync_policy_report
+from query_stats import QueryStatsMiddleware
+from metrics import MetricsMiddleware, timed_job, render as render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from job_runs import recorded_job, manual_trigger, list_runs, run_detail, slowest_users, purge_job_runs
+from profiling import ProfilingMiddleware, profiled, profiled_job, list_profiles, profile_file
 
 logging.basicConfig(level=logging.INFO)
 
 # Background job functions
+#
+# Scheduled jobs only enqueue per-user work items; queue workers (queue_worker.py, or the
+# embedded drain job below) execute them with leases and per-user retries. @recorded_job
+# keeps a ledger of each run and its per-user executions (GET /job_runs).
+@timed_job("quick_sync")
+@recorded_job("quick_sync")
+@profiled_job("quick_sync")
 def quick_sync_job():
-    """Quick sync job (every 3-4 hours): fetch recent activities and wellness data."""
+    """Quick sync job (every 3-4 hours): enqueue recent activity and wellness sync per user."""
     logging.info("🚀 Starting quick sync job (3-4 hour interval)")
     try:
-        db = SessionLocal()
-        users = db.query(User).filter(User.strava_oauth_token.isnot(None)).all()
-        
-        total_new_activities = 0
-        total_users_synced = 0
-        
-        for user in users:
-            try:
-                logging.info(f"Quick sync for user {user.user_id}")
-                
-                # Import last 3 days (shorter timeframe for frequent sync)
-                pre_count = db.query(Activity).filter_by(user_id=user.user_id).count()
-                _fetch_and_process_activities(user.user_id, db, backfill_days=3)
-                post_count = db.query(Activity).filter_by(user_id=user.user_id).count()
-                new_activities = post_count - pre_count
-                total_new_activities += new_activities
-                
-                if new_activities > 0:
-                    logging.info(f"User {user.user_id}: imported {new_activities} new activities")
-                    
-                    # If new activities found, check for threshold updates
-                    from datetime import datetime, timedelta
-                    week_ago = datetime.now() - timedelta(days=7)
-                    recent_significant = db.query(Activity).filter(
-                        Activity.user_id == user.user_id,
-                        Activity.start_date >= week_ago,
-                        Activity.type.in_(['Ride', 'VirtualRide', 'Run', 'VirtualRun']),
-                        Activity.moving_time > 1800  # >30 minutes
-                    ).count()
-                    
-                    if recent_significant >= 3:
-                        logging.info(f"User {user.user_id}: {recent_significant} significant activities, updating thresholds")
-                        recalculate_thresholds_for_user(user.user_id)
-                
-                # Sync wellness data from intervals.icu (last 7 days)
-                try:
-                    if user.integrations and 'intervals_icu' in user.integrations:
-                        intervals_config = user.integrations['intervals_icu']
-                        if intervals_config.get('api_key') and intervals_config.get('athlete_id'):
-                            from intervals_icu import _sync_wellness_data_task
-                            _sync_wellness_data_task(
-                                user.user_id, 
-                                intervals_config['api_key'],
-                                intervals_config['athlete_id'], 
-                                7,  # Last 7 days for quick sync
-                                db
-                            )
-                            logging.info(f"User {user.user_id}: synced wellness data")
-                except Exception as wellness_error:
-                    logging.debug(f"User {user.user_id}: wellness sync failed: {wellness_error}")
-                
-                total_users_synced += 1
-                
-            except Exception as e:
-                logging.error(f"Quick sync error for user {user.user_id}: {e}")
-        
-        db.close()
-        logging.info(f"Quick sync completed: {total_new_activities} new activities across {total_users_synced} users")
-        
+        result = enqueue_for_all_users(
+            'sync_user', payload={'backfill_days': 3, 'wellness_days': 7},
+            priority=PRIORITY_NORMAL, dedup_variant='quick'
+        )
+        logging.info(f"Quick sync enqueued: {result}")
     except Exception as e:
         logging.error(f"Quick sync job failed: {e}")
 
 
+@timed_job("adaptive_sync")
+@recorded_job("adaptive_sync")
+@profiled_job("adaptive_sync")
+def adaptive_sync_job():
+    """Adaptive sync tick (every 15 minutes): enqueue users whose learned next-sync time has passed."""
+    try:
+        adaptive_sync_tick()
+    except Exception as e:
+        logging.error(f"Adaptive sync job failed: {e}")
+
+
+@timed_job("daily_sync")
+@recorded_job("daily_sync")
+@profiled_job("daily_sync")
 def daily_sync_job():
-    """Daily job: comprehensive sync and maintenance."""
+    """Daily job: enqueue comprehensive sync and resting HR update per user."""
     logging.info("🔄 Starting daily comprehensive sync job")
     try:
-        # Get all users with Strava tokens
-        db = SessionLocal()
-        users = db.query(User).filter(User.strava_oauth_token.isnot(None)).all()
-        
-        for user in users:
-            try:
-                logging.info(f"Daily comprehensive sync for user {user.user_id}")
-                
-                # Import last 14 days (longer lookback for daily comprehensive sync)
-                pre_count = db.query(Activity).filter_by(user_id=user.user_id).count()
-                _fetch_and_process_activities(user.user_id, db, backfill_days=14)
-                post_count = db.query(Activity).filter_by(user_id=user.user_id).count()
-                new_activities = post_count - pre_count
-                
-                logging.info(f"User {user.user_id}: imported {new_activities} new activities")
-                
-                # Check for threshold updates and wellness data sync
-                from datetime import datetime, timedelta
-                week_ago = datetime.now() - timedelta(days=7)
-                recent_significant = db.query(Activity).filter(
-                    Activity.user_id == user.user_id,
-                    Activity.start_date >= week_ago,
-                    Activity.type.in_(['Ride', 'VirtualRide', 'Run', 'VirtualRun']),
-                    Activity.moving_time > 1800  # >30 minutes
-                ).count()
-                
-                if recent_significant >= 3:
-                    logging.info(f"User {user.user_id}: {recent_significant} significant activities, updating thresholds")
-                    recalculate_thresholds_for_user(user.user_id)
-                
-                # Comprehensive wellness data sync (last 30 days for daily job)
-                try:
-                    if user.integrations and 'intervals_icu' in user.integrations:
-                        intervals_config = user.integrations['intervals_icu']
-                        if intervals_config.get('api_key') and intervals_config.get('athlete_id'):
-                            from intervals_icu import _sync_wellness_data_task
-                            _sync_wellness_data_task(
-                                user.user_id, 
-                                intervals_config['api_key'],
-                                intervals_config['athlete_id'], 
-                                30,  # Last 30 days for comprehensive daily sync
-                                db
-                            )
-                            logging.info(f"User {user.user_id}: comprehensive wellness data sync completed")
-                except Exception as wellness_error:
-                    logging.debug(f"User {user.user_id}: wellness sync failed: {wellness_error}")
-                
-                # Update resting HR from recent wellness data if available
-                try:
-                    from intervals_icu import update_resting_hr_from_wellness
-                    updated_rhr = update_resting_hr_from_wellness(user.user_id, db)
-                    if updated_rhr:
-                        logging.info(f"User {user.user_id}: updated resting HR to {updated_rhr} bpm from wellness data")
-                except Exception as rhr_error:
-                    logging.debug(f"User {user.user_id}: resting HR update failed: {rhr_error}")
-                
-            except Exception as e:
-                logging.error(f"Daily comprehensive sync error for user {user.user_id}: {e}")
-        
-        db.close()
-        logging.info("Daily comprehensive sync completed successfully")
-        
+        result = enqueue_for_all_users(
+            'sync_user',
+            payload={'backfill_days': 14, 'wellness_days': 30, 'update_resting_hr': True,
+                     'refresh_recommendations': True},
+            priority=PRIORITY_NORMAL, dedup_variant='daily'
+        )
+        logging.info(f"Daily comprehensive sync enqueued: {result}")
     except Exception as e:
         logging.error(f"Daily sync job failed: {e}")
 
 
+@timed_job("weekly_thresholds")
+@recorded_job("weekly_thresholds")
+@profiled_job("weekly_thresholds")
 def weekly_threshold_job():
-    """Weekly job: full threshold recalculation for all users."""
+    """Weekly job: enqueue full threshold recalculation for all users."""
     logging.info("🧮 Starting weekly threshold recalculation")
     try:
-        db = SessionLocal()
-        users = db.query(User).filter(User.strava_oauth_token.isnot(None)).all()
-        
-        for user in users:
-            try:
-                recalculate_thresholds_for_user(user.user_id)
-                
-                # Also update resting HR from wellness data (longer lookback for weekly job)
-                try:
-                    from intervals_icu import update_resting_hr_from_wellness
-                    updated_rhr = update_resting_hr_from_wellness(user.user_id, db, lookback_days=30)
-                    if updated_rhr:
-                        logging.info(f"User {user.user_id}: weekly resting HR update to {updated_rhr} bpm")
-                except Exception as rhr_error:
-                    logging.debug(f"User {user.user_id}: weekly resting HR update failed: {rhr_error}")
-                
-                logging.info(f"Weekly threshold update completed for user {user.user_id}")
-            except Exception as e:
-                logging.error(f"Weekly threshold update failed for user {user.user_id}: {e}")
-        
-        db.close()
-        
+        enqueue_for_all_users('recalculate_thresholds', priority=PRIORITY_LOW)
+        # Also update resting HR from wellness data (longer lookback for weekly job)
+        enqueue_for_all_users('update_resting_hr', payload={'lookback_days': 30},
+                              priority=PRIORITY_LOW, dedup_variant='weekly')
     except Exception as e:
         logging.error(f"Weekly threshold job failed: {e}")
 
 
+@timed_job("monthly_utl")
+@recorded_job("monthly_utl")
+@profiled_job("monthly_utl")
 def monthly_utl_job():
-    """Monthly job: recalculate UTL scores for accuracy."""
+    """Monthly job: enqueue UTL recalculation for all users."""
     logging.info("📊 Starting monthly UTL recalculation")
     try:
-        db = SessionLocal()
-        users = db.query(User).filter(User.strava_oauth_token.isnot(None)).all()
-        
-        for user in users:
-            try:
-                recalculate_utl_for_user(user.user_id, db)
-                logging.info(f"Monthly UTL recalc completed for user {user.user_id}")
-            except Exception as e:
-                logging.error(f"Monthly UTL recalc failed for user {user.user_id}: {e}")
-        
-        db.close()
-        
+        enqueue_for_all_users('recalculate_utl', priority=PRIORITY_LOW)
     except Exception as e:
         logging.error(f"Monthly UTL job failed: {e}")
 
 
+@timed_job("resting_hr_update")
+@recorded_job("resting_hr_update")
+@profiled_job("resting_hr_update")
 def resting_hr_update_job():
-    """Dedicated job: update resting HR from wellness data for all users."""
+    """Dedicated job: enqueue resting HR update from wellness data for all users."""
     logging.info("💓 Starting resting HR update job")
     try:
-        db = SessionLocal()
-        users = db.query(User).filter(User.strava_oauth_token.isnot(None)).all()
-        
-        updated_users = 0
-        for user in users:
-            try:
-                from intervals_icu import update_resting_hr_from_wellness
-                updated_rhr = update_resting_hr_from_wellness(user.user_id, db, lookback_days=14)
-                if updated_rhr:
-                    updated_users += 1
-                    logging.info(f"User {user.user_id}: updated resting HR to {updated_rhr} bpm")
-            except Exception as e:
-                logging.debug(f"User {user.user_id}: resting HR update failed: {e}")
-        
-        db.close()
-        logging.info(f"Resting HR update job completed: {updated_users} users updated")
-        
+        enqueue_for_all_users('update_resting_hr', payload={'lookback_days': 14}, priority=PRIORITY_LOW)
     except Exception as e:
         logging.error(f"Resting HR update job failed: {e}")
 
 
-def recalculate_thresholds_for_user(user_id: int):
-    """Recalculate thresholds for a specific user."""
+@timed_job("queue_drain")
+def queue_drain_job():
+    """Embedded queue worker: drain ready work items inside the API process."""
     db = SessionLocal()
     try:
-        user = db.query(User).filter_by(user_id=user_id).first()
-        if not user:
-            return
-        
-        # Get activities from the last 12 months
-        from datetime import datetime, timedelta
-        one_year_ago = datetime.now() - timedelta(days=365)
-        activities = db.query(Activity).filter(
-            Activity.user_id == user_id,
-            Activity.start_date >= one_year_ago
-        ).all()
-        
-        # Prepare activity data
-        activity_data = []
-        for act in activities:
-            activity_summary = {
-                'type': act.type,
-                'moving_time': act.moving_time,
-                'average_speed': act.average_speed,
-                'average_watts': act.data.get('average_watts') if act.data else None,
-                'max_heartrate': act.data.get('max_heartrate') if act.data else None,
-                'distance': act.distance,
-                'start_date': act.start_date,
-                'name': act.name
-            }
-            activity_data.append(activity_summary)
-        
-        # Calculate new thresholds
-        try:
-            estimates = calculate_initial_thresholds_for_new_user(user_id)
-        except Exception:
-            # Fall back to activity-based estimation
-            estimates = estimate_thresholds_from_activities(activity_data, user.gender or 'M', [])
-        
-        if estimates:
-            # Update thresholds in database
-            threshold = db.query(Threshold).filter_by(user_id=user_id).first()
-            if not threshold:
-                threshold = Threshold(user_id=user_id)
-                db.add(threshold)
-            
-            old_ftp = threshold.ftp_watts
-            old_fthp = threshold.fthp_mps
-            
-            if estimates.get('ftp_watts'):
-                threshold.ftp_watts = estimates['ftp_watts']
-            if estimates.get('fthp_mps'):
-                threshold.fthp_mps = estimates['fthp_mps']
-            if estimates.get('max_hr'):
-                threshold.max_hr = estimates['max_hr']
-            if estimates.get('resting_hr'):
-                threshold.resting_hr = estimates['resting_hr']
-            
-            threshold.date_updated = datetime.now()
-            
-            # Check for significant changes (>5%)
-            ftp_change = abs((threshold.ftp_watts or 0) - (old_ftp or 0)) / max(old_ftp or 1, 1)
-            fthp_change = abs((threshold.fthp_mps or 0) - (old_fthp or 0)) / max(old_fthp or 1, 1)
-            
-            if ftp_change > 0.05 or fthp_change > 0.05:
-                logging.info(f"Significant threshold change for user {user_id}, triggering UTL recalc")
-                db.commit()
-                recalculate_utl_for_user(user_id, db)
-            else:
-                db.commit()
-            
+        summary = drain(db, worker_id=f"api-{default_worker_id()}", max_jobs=QUEUE_DRAIN_BATCH)
+        if summary["succeeded"] or summary["failed"]:
+            logging.info(f"Queue drain: {summary}")
+    except Exception as e:
+        logging.error(f"Queue drain job failed: {e}")
     finally:
         db.close()
 
 
-def recalculate_utl_for_user(user_id: int, db_session=None):
-    """Recalculate UTL scores for a specific user."""
-    db = db_session or SessionLocal()
-    close_db = db_session is None
-    
+@timed_job("queue_cleanup")
+def queue_cleanup_job():
+    """Daily job: delete finished queue items and job run records past their retention windows."""
+    db = SessionLocal()
     try:
-        threshold = db.query(Threshold).filter_by(user_id=user_id).first()
-        if not threshold:
-            return
-        
-        # Get recent activities (last 90 days)
-        from datetime import datetime, timedelta
-        cutoff_date = datetime.now() - timedelta(days=90)
-        activities = db.query(Activity).filter(
-            Activity.user_id == user_id,
-            Activity.start_date >= cutoff_date
-        ).all()
-        
-        updated_count = 0
-        for activity in activities:
-            try:
-                activity_summary = {
-                    'type': activity.type,
-                    'moving_time': activity.moving_time,
-                    'distance': activity.distance,
-                    'average_speed': activity.average_speed,
-                    'start_date': activity.start_date.isoformat() if activity.start_date else None
-                }
-                
-                activity_streams = activity.data.get('streams') if activity.data else None
-                
-                # Recalculate UTL
-                new_utl, new_method = calculate_utl(activity_summary, threshold, activity_streams)
-                
-                # Update if significantly different
-                old_utl = activity.utl_score or 0
-                if abs(new_utl - old_utl) > 0.05 * max(old_utl, 1) or activity.calculation_method != new_method:
-                    activity.utl_score = float(new_utl)
-                    activity.calculation_method = new_method
-                    updated_count += 1
-            
-            except Exception as e:
-                logging.error(f"Error recalculating UTL for activity {activity.strava_activity_id}: {e}")
-        
-        db.commit()
-        logging.info(f"Updated UTL for {updated_count} activities for user {user_id}")
-        
+        items = purge_finished_jobs(db)
+        runs = purge_job_runs(db)
+        logging.info(f"🧹 Queue cleanup: {items} finished items and {runs} job runs purged")
+    except Exception as e:
+        logging.error(f"Queue cleanup job failed: {e}")
+    finally:
+        db.close()
+
+
+@timed_job("interactive_drain")
+def interactive_drain_job():
+    """Embedded interactive lane worker: runs alongside the batch drain so users never wait behind it."""
+    db = SessionLocal()
+    try:
+        summary = drain(db, worker_id=f"api-interactive-{default_worker_id()}", max_jobs=QUEUE_DRAIN_BATCH,
+                        lanes=[LANE_INTERACTIVE])
+        if summary["succeeded"] or summary["failed"]:
+            logging.info(f"Interactive queue drain: {summary}")
+    except Exception as e:
+        logging.error(f"Interactive queue drain job failed: {e}")
     finally:
-        if close_db:
-            db.close()
+        db.close()
 
 app = FastAPI(title="Training Load API", version="1.0.0")
 
@@ -377,6 +183,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Sampled request profiles for PROFILE_PATHS (and ?profile=1 with PROFILE_ON_DEMAND)
+app.add_middleware(ProfilingMiddleware)
+# Per-request query counts, rows and database time in the logs (and X-DB-* headers with QUERY_STATS_HEADERS)
+app.add_middleware(QueryStatsMiddleware)
+# Per-route latency histograms for /metrics
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(auth_router, prefix="/auth", tags=["Authentication"])
 app.include_router(activities_router, prefix="/activities", tags=["Activities"])
@@ -384,18 +197,20 @@ app.include_router(thresholds_router, prefix="/thresholds", tags=["Thresholds"])
 app.include_router(onboarding_router, prefix="/onboarding", tags=["Onboarding"])
 app.include_router(dashboard_router, prefix="/dashboard", tags=["Dashboard"])
 app.include_router(intervals_router, prefix="/intervals", tags=["Intervals.icu"])
+app.include_router(strava_webhook_router, prefix="/webhooks", tags=["Webhooks"])
 
 # Training Recommendations API
 recommendation_engine = TrainingRecommendationEngine()
 
 @app.get("/recommendations/{user_id}")
-async def get_training_recommendations(user_id: int, db: Session = Depends(get_db)):
+async def get_training_recommendations(user_id: int, refresh: bool = False, db: Session = Depends(get_db)):
     """
-    Generate science-based training recommendations for the next 5 days.
+    Science-based training recommendations for the next 5 days, served from the per-user
+    cache (recommendation_cache.py). Pass refresh=true to recompute regardless.
     """
     try:
-        recommendations = recommendation_engine.generate_recommendations(user_id, db)
-        return {"status": "success", "data": recommendations}
+        recommendations, cache_info = get_recommendations(db, user_id, recommendation_engine, refresh=refresh)
+        return {"status": "success", "data": recommendations, "cache": cache_info}
     except Exception as e:
         logging.error(f"Failed to generate recommendations for user {user_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -418,16 +233,45 @@ scheduler = BackgroundScheduler(
     job_defaults=job_defaults
 )
 
-@app.on_event("startup")
-def start_scheduler():
-    # Quick sync job (every 3.5 hours) - replaces old 30-minute Strava sync
-    scheduler.add_job(
-        func=quick_sync_job, 
-        trigger=IntervalTrigger(hours=3, minutes=30),  # Every 3.5 hours
-        id='quick_sync',
-        name='Quick Sync (Activities + Wellness)',
-        replace_existing=True
-    )
+# Per-process jobs: every API worker runs these (queue draining is safe to run concurrently). Cluster-wide schedules live on `scheduler`, which only the
+# elected leader runs.
+local_scheduler = BackgroundScheduler(job_defaults=job_defaults)
+
+scheduler_leader = None
+
+
+def add_scheduled_jobs():
+    """Register the cluster-wide schedules (called when this process becomes leader)."""
+    if STRAVA_WEBHOOKS_ENABLED:
+        # New uploads arrive via webhook; polling only reconciles missed events
+        quick_sync_trigger = IntervalTrigger(hours=RECONCILIATION_SYNC_HOURS)
+        quick_sync_name = 'Reconciliation Sync (Activities + Wellness)'
+    else:
+        quick_sync_trigger = IntervalTrigger(hours=3, minutes=30)  # Every 3.5 hours
+        quick_sync_name = 'Quick Sync (Activities + Wellness)'
+    
+    if ADAPTIVE_SYNC_ENABLED and not STRAVA_WEBHOOKS_ENABLED:
+        # Per-user sync times learned from upload cadence replace the fixed interval
+        if scheduler.get_job('quick_sync'):
+            scheduler.remove_job('quick_sync')
+        scheduler.add_job(
+            func=adaptive_sync_job,
+            trigger=IntervalTrigger(minutes=15),
+            id='adaptive_sync',
+            name='Adaptive Sync (Activities + Wellness)',
+            replace_existing=True
+        )
+    else:
+        if scheduler.get_job('adaptive_sync'):
+            scheduler.remove_job('adaptive_sync')
+        # Quick sync job (every 3.5 hours) - replaces old 30-minute Strava sync
+        scheduler.add_job(
+            func=quick_sync_job, 
+            trigger=quick_sync_trigger,
+            id='quick_sync',
+            name=quick_sync_name,
+            replace_existing=True
+        )
     
     # Daily comprehensive sync (every day at 2 AM)
     scheduler.add_job(
@@ -456,6 +300,15 @@ def start_scheduler():
         replace_existing=True
     )
     
+    # Queue housekeeping: finished items and old run records (every day at 1:30 AM)
+    scheduler.add_job(
+        func=queue_cleanup_job,
+        trigger=CronTrigger(hour=1, minute=30),
+        id='queue_cleanup',
+        name='Queue and Job Run Cleanup',
+        replace_existing=True
+    )
+    
     # Resting HR update from wellness data (every 3 days at 5 AM)
     scheduler.add_job(
         func=resting_hr_update_job,
@@ -464,18 +317,64 @@ def start_scheduler():
         name='Resting HR Update from Wellness Data',
         replace_existing=True
     )
-    
-    scheduler.start()
+
+
+def on_elected_scheduler_leader():
+    add_scheduled_jobs()
+    scheduler.resume()
     
     # Log all scheduled jobs
     jobs = scheduler.get_jobs()
-    logging.info(f"APScheduler started with {len(jobs)} background jobs:")
+    logging.info(f"APScheduler leader running {len(jobs)} background jobs:")
     for job in jobs:
         next_run = job.next_run_time
         logging.info(f"  • {job.name}: next run at {next_run}")
 
+
+def on_demoted_scheduler_leader():
+    scheduler.pause()
+    logging.info("APScheduler paused (standby)")
+
+
+@app.on_event("startup")
+def start_scheduler():
+    global scheduler_leader
+    
+    if QUEUE_EMBEDDED_WORKER:
+        # Drain per-user work items in-process (set QUEUE_EMBEDDED_WORKER=false when running queue_worker.py)
+        local_scheduler.add_job(
+            func=queue_drain_job,
+            trigger=IntervalTrigger(seconds=30),
+            id='queue_drain',
+            name='Work Queue Drain',
+            replace_existing=True
+        )
+        local_scheduler.add_job(
+            func=interactive_drain_job,
+            trigger=IntervalTrigger(seconds=QUEUE_INTERACTIVE_POLL_SECONDS),
+            id='interactive_drain',
+            name='Interactive Lane Drain',
+            replace_existing=True
+        )
+    
+    local_scheduler.start()
+    
+    # Every worker starts paused; only the elected leader resumes the shared schedules
+    scheduler.start(paused=True)
+    scheduler_leader = LeaderElector(
+        "scheduler",
+        on_elected=on_elected_scheduler_leader,
+        on_demoted=on_demoted_scheduler_leader,
+    )
+    scheduler_leader.start()
+    if not scheduler_leader.is_leader:
+        logging.info(f"APScheduler on standby; retrying leadership every {scheduler_leader.retry_seconds}s")
+
 @app.on_event("shutdown")
 def shutdown_scheduler():
+    if scheduler_leader:
+        scheduler_leader.stop()
+    local_scheduler.shutdown()
     scheduler.shutdown()
     logging.info("APScheduler shut down.")
 
@@ -499,7 +398,10 @@ def health_check():
         db_status = f"unhealthy: {str(e)}"
     
     # Check scheduler status
-    scheduler_status = "running" if scheduler.running else "stopped"
+    if not scheduler.running:
+        scheduler_status = "stopped"
+    else:
+        scheduler_status = "running" if scheduler_leader and scheduler_leader.is_leader else "standby"
     
     # Get environment info
     environment = os.getenv("ENVIRONMENT", "development")
@@ -513,26 +415,34 @@ def health_check():
         "version": "1.0.0"
     }
 
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text exposition: API latency, job durations, upstream usage and headroom, ingestion, analysis CPU."""
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/scheduler/jobs")
 def get_scheduled_jobs():
     """Get status of all scheduled background jobs."""
     try:
-        jobs = scheduler.get_jobs()
         job_status = []
         
-        for job in jobs:
-            job_info = {
-                "id": job.id,
-                "name": job.name,
-                "next_run_time": job.next_run_time.isoformat() if job.next_run_time else None,
-                "trigger": str(job.trigger),
-                "function": job.func.__name__ if hasattr(job.func, '__name__') else str(job.func)
-            }
-            job_status.append(job_info)
+        for scope, sched in (("leader", scheduler), ("process", local_scheduler)):
+            for job in sched.get_jobs():
+                job_info = {
+                    "id": job.id,
+                    "name": job.name,
+                    "scope": scope,
+                    "next_run_time": job.next_run_time.isoformat() if job.next_run_time else None,
+                    "trigger": str(job.trigger),
+                    "function": job.func.__name__ if hasattr(job.func, '__name__') else str(job.func)
+                }
+                job_status.append(job_info)
         
         return {
-            "total_jobs": len(jobs),
+            "total_jobs": len(job_status),
             "scheduler_running": scheduler.running,
+            "is_leader": bool(scheduler_leader and scheduler_leader.is_leader),
+            "leader": scheduler_leader.status() if scheduler_leader else None,
             "jobs": job_status
         }
         
@@ -540,75 +450,163 @@ def get_scheduled_jobs():
         return {"error": f"Failed to get job status: {str(e)}"}
 
 @app.post("/scheduler/run/{job_id}")
-def run_job_now(job_id: str):
-    """Manually trigger a scheduled job to run now."""
+def run_job_now(job_id: str, profile: bool = False):
+    """Manually trigger a scheduled job to run now (profile=1 writes a profile of this run)."""
     try:
-        job = scheduler.get_job(job_id)
+        job = scheduler.get_job(job_id) or local_scheduler.get_job(job_id)
         if not job:
             return {"error": f"Job {job_id} not found"}
         
-        # Run the job function directly
-        if job_id == 'quick_sync':
-            quick_sync_job()
-        elif job_id == 'sync_strava_activities':  # Keep for backward compatibility
-            sync_strava_activities()
-        elif job_id == 'daily_sync':
-            daily_sync_job()
-        elif job_id == 'weekly_thresholds':
-            weekly_threshold_job()
-        elif job_id == 'monthly_utl':
-            monthly_utl_job()
-        elif job_id == 'resting_hr_update':
-            resting_hr_update_job()
-        else:
-            return {"error": f"Job {job_id} cannot be run manually"}
+        # Run the job function directly (recorded runs are marked as manually triggered)
+        with manual_trigger(), profiled(f"job {job_id}", kind="job", enabled=profile) as run_profile:
+            if job_id == 'quick_sync':
+                quick_sync_job()
+            elif job_id == 'adaptive_sync':
+                adaptive_sync_job()
+            elif job_id == 'sync_strava_activities':  # Keep for backward compatibility
+                sync_strava_activities()
+            elif job_id == 'daily_sync':
+                daily_sync_job()
+            elif job_id == 'weekly_thresholds':
+                weekly_threshold_job()
+            elif job_id == 'monthly_utl':
+                monthly_utl_job()
+            elif job_id == 'resting_hr_update':
+                resting_hr_update_job()
+            elif job_id == 'queue_drain':
+                queue_drain_job()
+            elif job_id == 'interactive_drain':
+                interactive_drain_job()
+            elif job_id == 'queue_cleanup':
+                queue_cleanup_job()
+            else:
+                return {"error": f"Job {job_id} cannot be run manually"}
         
-        return {"message": f"Job {job_id} executed successfully"}
+        response = {"message": f"Job {job_id} executed successfully"}
+        if run_profile is not None:
+            response["profile"] = run_profile.base
+        return response
         
     except Exception as e:
         return {"error": f"Failed to run job {job_id}: {str(e)}"}
 
-@app.post("/sync/test/{user_id}")
-def test_user_sync(user_id: int, db: Session = Depends(get_db)):
-    """Test sync for a specific user (Strava + Intervals.icu)"""
+@app.get("/profiles")
+def get_profiles(limit: int = 20, kind: str = None):
+    """Recent profiles written by this host's API and background processes, newest first."""
+    return {"profiles": list_profiles(limit=limit, kind=kind)}
+
+@app.get("/profiles/{filename}")
+def get_profile_file(filename: str):
+    """Download a profile output file (.prof, .txt, .collapsed or .json)."""
+    path = profile_file(filename)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profile file {filename} not found")
+    return FileResponse(path, filename=filename)
+
+@app.get("/job_runs")
+def get_job_runs(job_name: str = None, limit: int = 20, db: Session = Depends(get_db)):
+    """Recent scheduled job runs: state, users enqueued and processed, duration, API calls, activities, errors."""
+    try:
+        return {"runs": list_runs(db, job_name=job_name, limit=limit)}
+    except Exception as e:
+        return {"error": f"Failed to list job runs: {str(e)}"}
+
+@app.get("/job_runs/slowest_users")
+def get_slowest_users(days: int = 7, job_name: str = None, task_name: str = None, limit: int = 20,
+                      db: Session = Depends(get_db)):
+    """Users whose queue work took longest over the last `days`, per task."""
+    try:
+        return {"days": days, "users": slowest_users(db, days=days, job_name=job_name, task_name=task_name, limit=limit)}
+    except Exception as e:
+        return {"error": f"Failed to build slowest users report: {str(e)}"}
+
+@app.get("/job_runs/{run_id}")
+def get_job_run(run_id: int, db: Session = Depends(get_db)):
+    """One job run with every per-user execution, slowest first, and its errors."""
+    detail = run_detail(db, run_id)
+    if detail is None:
+        raise HTTPException(status_code=404, detail=f"Job run {run_id} not found")
+    return detail
+
+@app.get("/queue/stats")
+def get_queue_stats(db: Session = Depends(get_db)):
+    """Work queue depth by task and status."""
+    try:
+        return queue_stats(db)
+    except Exception as e:
+        return {"error": f"Failed to get queue stats: {str(e)}"}
+
+@app.get("/queue/lanes")
+def get_queue_lanes(since_hours: int = 24, db: Session = Depends(get_db)):
+    """Backlog and queue wait per priority lane, plus this process's upstream API budget usage."""
     try:
-        user = db.query(User).filter_by(user_id=user_id).first()
-        if not user:
-            return {"error": f"User {user_id} not found"}
-        
-        # Test Strava sync
-        pre_count = db.query(Activity).filter_by(user_id=user_id).count()
-        _fetch_and_process_activities(user_id, db, backfill_days=3)
-        post_count = db.query(Activity).filter_by(user_id=user_id).count()
-        new_activities = post_count - pre_count
-        
-        # Test wellness sync
-        wellness_synced = False
-        if user.integrations and 'intervals_icu' in user.integrations:
-            intervals_config = user.integrations['intervals_icu']
-            if intervals_config.get('api_key') and intervals_config.get('athlete_id'):
-                try:
-                    from intervals_icu import _sync_wellness_data_task
-                    _sync_wellness_data_task(
-                        user_id, 
-                        intervals_config['api_key'],
-                        intervals_config['athlete_id'], 
-                        7,
-                        db
-                    )
-                    wellness_synced = True
-                except Exception as e:
-                    logging.error(f"Wellness sync failed: {e}")
-        
         return {
-            "message": f"Test sync completed for user {user_id}",
-            "new_activities": new_activities,
-            "wellness_synced": wellness_synced,
-            "has_strava": user.strava_oauth_token is not None,
-            "has_intervals": bool(user.integrations and 'intervals_icu' in user.integrations)
+            "lanes": lane_stats(db, since_hours=since_hours),
+            "upstream": {"strava": strava_budget.status(), "intervals_icu": intervals_budget.status()},
         }
-        
     except Exception as e:
-        logging.error(f"Test sync failed for user {user_id}: {e}")
-        return {"error": f"Test sync failed: {str(e)}"}
+        return {"error": f"Failed to get lane stats: {str(e)}"}
+
+@app.post("/queue/requeue_dead")
+def requeue_dead(task_name: str = None, db: Session = Depends(get_db)):
+    """Retry work items that exhausted their attempts."""
+    try:
+        count = requeue_dead_jobs(db, task_name)
+        return {"message": f"Requeued {count} dead jobs"}
+    except Exception as e:
+        return {"error": f"Failed to requeue dead jobs: {str(e)}"}
+
+@app.get("/sync/policy/report")
+def get_sync_policy_report(db: Session = Depends(get_db)):
+    """Adaptive sync schedule per user and Strava API calls saved versus the fixed 3.5h interval."""
+    try:
+        return sync_policy_report(db)
+    except Exception as e:
+        return {"error": f"Failed to build sync policy report: {str(e)}"}
+
+@app.post("/sync/test/{user_id}")
+def test_user_sync(user_id: int, db: Session = Depends(get_db)):
+    """Test sync for a specific user (Strava + Intervals.icu)"""
+    # Runs in the interactive lane: a person is waiting on the result
+    with upstream_lane(LANE_INTERACTIVE):
+        try:
+            user = db.query(User).filter_by(user_id=user_id).first()
+            if not user:
+                return {"error": f"User {user_id} not found"}
+        
+            # Test Strava sync
+            pre_count = db.query(Activity).filter_by(user_id=user_id).count()
+            _fetch_and_process_activities(user_id, db, backfill_days=3)
+            post_count = db.query(Activity).filter_by(user_id=user_id).count()
+            new_activities = post_count - pre_count
+        
+            # Test wellness sync
+            wellness_synced = False
+            if user.integrations and 'intervals_icu' in user.integrations:
+                intervals_config = user.integrations['intervals_icu']
+                if intervals_config.get('api_key') and intervals_config.get('athlete_id'):
+                    try:
+                        from intervals_icu import _sync_wellness_data_task
+                        _sync_wellness_data_task(
+                            user_id, 
+                            intervals_config['api_key'],
+                            intervals_config['athlete_id'], 
+                            7,
+                            db
+                        )
+                        wellness_synced = True
+                    except Exception as e:
+                        logging.error(f"Wellness sync failed: {e}")
+        
+            return {
+                "message": f"Test sync completed for user {user_id}",
+                "new_activities": new_activities,
+                "wellness_synced": wellness_synced,
+                "has_strava": user.strava_oauth_token is not None,
+                "has_intervals": bool(user.integrations and 'intervals_icu' in user.integrations)
+            }
+        
+        except Exception as e:
+            logging.error(f"Test sync failed for user {user_id}: {e}")
+            return {"error": f"Test sync failed: {str(e)}"}
     return {"status": "healthy"}
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Maintenance CLI: bulk per-user operations with parallel workers, checkpoints and dry runs
+
+Replaces the one-off scripts in maintenance/ (and their copies) that processed one user at a time
+with no progress tracking. Each subcommand runs one operation for every selected user:
+
+    rescore     Recompute UTL scores from activity_metrics and current thresholds
+    thresholds  Re-estimate FTP / FTHP / HR thresholds; rescores the user on a significant change
+    features    Write missing or outdated activity_metrics rows (FEATURES_VERSION bumps)
+    streams     Fetch streams from Strava for activities stored without them, then rescore those
+    rollups     Rebuild the weekly / monthly / yearly training rollups from the user's activities
+
+Usage (from backend/):
+    python maintenance_cli.py rescore --workers=4
+    python maintenance_cli.py thresholds --user_id=3 --user_id=7 --dry-run
+    python maintenance_cli.py features --active-within-days=90 --checkpoint=features.jsonl
+    python maintenance_cli.py streams --strava-only --since=2024-01-01 --checkpoint=streams.jsonl
+    python maintenance_cli.py rollups --workers=4
+
+--workers runs users in that many processes (each with its own database connections; Strava
+budgets are per process and reconcile through Strava's usage headers). --checkpoint appends one
+line per finished user, and a rerun with the same file skips them, so an interrupted run resumes
+where it stopped. --dry-run does the work inside a transaction that is rolled back and prints
+what would change instead.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import Session, sessionmaker, defer
+
+from models import User, Activity, ActivityMetrics, Threshold
+from activity_metrics import (
+    backfill_activity_metrics, threshold_activity_summaries, estimate_thresholds_from_history,
+    record_activity_features,
+)
+from utl_batch import score_activities
+from training_rollups import rebuild_rollups, rollup_differences
+from data_events import publish, ACTIVITIES_CHANGED, THRESHOLDS_CHANGED
+
+DIFF_LIMIT = 10  # Changed activities listed per user in dry-run output
+SIGNIFICANT_THRESHOLD_CHANGE = 0.05  # Same >5% rule as the scheduled threshold recalculation
+
+
+def _result(activities: int = 0, changed: int = 0, diff: List[str] = None, note: str = None) -> dict:
+    return {"activities": activities, "changed": changed, "diff": diff or [], "note": note}
+
+
+def rescore_user(db: Session, user_id: int, dry_run: bool = False, since: datetime = None) -> dict:
+    """Rescore the user's activities (since `since`) and update those whose score or method changed."""
+    threshold = db.query(Threshold).filter_by(user_id=user_id).first()
+    if not threshold:
+        return _result(note="no thresholds")
+
+    query = db.query(Activity).options(defer(Activity.data)).filter(Activity.user_id == user_id)
+    if since is not None:
+        query = query.filter(Activity.start_date >= since)
+    activities = query.order_by(Activity.start_date, Activity.activity_id).all()
+
+    diff = []
+    for activity, (new_utl, new_method) in zip(activities, score_activities(db, activities, threshold)):
+        old_utl = activity.utl_score
+        if old_utl is not None and math.isclose(old_utl, new_utl, abs_tol=0.05) and activity.calculation_method == new_method:
+            continue
+        date = activity.start_date.strftime('%Y-%m-%d') if activity.start_date else '?'
+        old_text = f"{old_utl:.1f}" if old_utl is not None else "none"
+        diff.append(f"activity {activity.activity_id} ({activity.type} {date}): "
+                    f"{old_text} {activity.calculation_method or ''} → {new_utl:.1f} {new_method}")
+        activity.utl_score = float(new_utl)
+        activity.calculation_method = new_method
+
+    if not dry_run:
+        db.commit()
+        if diff:
+            publish(ACTIVITIES_CHANGED, user_id)
+    return _result(len(activities), len(diff), diff)
+
+
+def _estimate_thresholds(db: Session, user: User, since: datetime) -> tuple:
+    """(estimates, activities analyzed), the way the scheduled threshold recalculation estimates them."""
+    from research_threshold_calculator import calculate_initial_thresholds_for_new_user
+
+    activity_data = threshold_activity_summaries(db, user.user_id, since=since)
+    db.commit()  # Metrics rows must be visible to the research calculator's own connection (even in a dry run)
+    try:
+        estimates = calculate_initial_thresholds_for_new_user(user.user_id)
+    except Exception as e:
+        logging.warning(f"Research-based calculation failed for user {user.user_id}, using activity analysis: {e}")
+        estimates = estimate_thresholds_from_history(db, user.user_id, user.gender or 'M', activity_data, since=since)
+    return estimates, len(activity_data)
+
+
+def rebuild_thresholds_user(db: Session, user_id: int, dry_run: bool = False, since: datetime = None) -> dict:
+    """
+    Re-estimate the user's thresholds from the last 12 months (or since `since`). On a significant
+    FTP/FTHP change the user's activities are rescored too (in a dry run, against the new values).
+    """
+    user = db.query(User).filter_by(user_id=user_id).first()
+    if not user:
+        return _result(note="user not found")
+    estimates, analyzed = _estimate_thresholds(db, user, since or datetime.now() - timedelta(days=365))
+    if not estimates:
+        return _result(analyzed, note="no estimate")
+
+    threshold = db.query(Threshold).filter_by(user_id=user_id).first()
+    if not threshold:
+        threshold = Threshold(user_id=user_id)
+        db.add(threshold)
+
+    diff = []
+    old = {field: getattr(threshold, field) for field in ("ftp_watts", "fthp_mps", "max_hr", "resting_hr")}
+    for field, old_value in old.items():
+        new_value = estimates.get(field)
+        if new_value and new_value != old_value:
+            diff.append(f"{field}: {old_value if old_value is not None else 'none'} → {round(float(new_value), 2)}")
+            setattr(threshold, field, new_value)
+    if not diff:
+        return _result(analyzed, note="unchanged")
+    changed = len(diff)
+    threshold.date_updated = datetime.now()
+
+    ftp_change = abs((threshold.ftp_watts or 0) - (old["ftp_watts"] or 0)) / max(old["ftp_watts"] or 1, 1)
+    fthp_change = abs((threshold.fthp_mps or 0) - (old["fthp_mps"] or 0)) / max(old["fthp_mps"] or 1, 1)
+    if not dry_run:
+        db.commit()
+        publish(THRESHOLDS_CHANGED, user_id)
+    if ftp_change > SIGNIFICANT_THRESHOLD_CHANGE or fthp_change > SIGNIFICANT_THRESHOLD_CHANGE:
+        rescored = rescore_user(db, user_id, dry_run=dry_run)
+        diff.append(f"rescored: {rescored['changed']} of {rescored['activities']} activities changed")
+        diff.extend(rescored["diff"])
+    return _result(analyzed, changed, diff)
+
+
+def backfill_features_user(db: Session, user_id: int, dry_run: bool = False, since: datetime = None) -> dict:
+    """Write activity_metrics rows for the user's activities that have none or an outdated one."""
+    query = db.query(func.count(Activity.activity_id)).filter(Activity.user_id == user_id)
+    if since is not None:
+        query = query.filter(Activity.start_date >= since)
+    total = query.scalar()
+    written = backfill_activity_metrics(db, user_id, since, commit=not dry_run)
+    diff = [f"{written} activity_metrics rows {'would be ' if dry_run else ''}written"] if written else []
+    return _result(total, written, diff)
+
+
+def migrate_streams_user(db: Session, user_id: int, dry_run: bool = False, since: datetime = None) -> dict:
+    """
+    Fetch Strava streams for the user's activities stored without them (imported before streams
+    were fetched, or when the streams call failed), extract their metrics and rescore them.
+    Strava calls run in the maintenance lane; each activity is committed as it is fetched.
+    """
+    from activities import _fetch_activity_streams
+    from upstream_budget import upstream_lane, LANE_MAINTENANCE
+
+    user = db.query(User).filter_by(user_id=user_id).first()
+    if not user:
+        return _result(note="user not found")
+    backfill_activity_metrics(db, user_id, since, commit=not dry_run)  # has_streams flags for every activity
+
+    query = db.query(Activity).join(ActivityMetrics, ActivityMetrics.activity_id == Activity.activity_id).filter(
+        Activity.user_id == user_id, ActivityMetrics.has_streams.is_(False), Activity.strava_activity_id.isnot(None),
+    )
+    if since is not None:
+        query = query.filter(Activity.start_date >= since)
+    missing = query.order_by(Activity.start_date.desc()).all()
+
+    if dry_run or not missing:
+        diff = [f"activity {a.activity_id} ({a.type} {a.start_date.strftime('%Y-%m-%d') if a.start_date else '?'}): "
+                f"fetch streams" for a in missing]
+        return _result(len(missing), len(missing), diff)
+    if not user.strava_oauth_token:
+        return _result(len(missing), note="no Strava token")
+
+    headers = {"Authorization": f"Bearer {user.strava_oauth_token}"}
+    migrated = []
+    with upstream_lane(LANE_MAINTENANCE):
+        for activity in missing:
+            streams = _fetch_activity_streams(activity.strava_activity_id, headers, user_id)
+            if not streams:
+                continue
+            activity.data = {**(activity.data or {}), "streams": streams}
+            record_activity_features(db, activity, streams)
+            db.commit()
+            db.expire(activity, ['data'])
+            migrated.append(activity)
+
+    threshold = db.query(Threshold).filter_by(user_id=user_id).first()
+    if migrated and threshold:
+        for activity, (utl_score, method) in zip(migrated, score_activities(db, migrated, threshold)):
+            activity.utl_score = float(utl_score)
+            activity.calculation_method = method
+        db.commit()
+        publish(ACTIVITIES_CHANGED, user_id)
+    diff = [f"activity {a.activity_id} ({a.type}): streams fetched" for a in migrated]
+    return _result(len(missing), len(migrated), diff)
+
+
+def rebuild_rollups_user(db: Session, user_id: int, dry_run: bool = False, since: datetime = None) -> dict:
+    """
+    Rebuild the user's training rollups from their activities (needed after writes that bypass the
+    ORM, such as bulk loads). Rollups are always rebuilt in full; `since` is ignored.
+    """
+    total = db.query(func.count(Activity.activity_id)).filter(Activity.user_id == user_id).scalar()
+    diff = rollup_differences(db, user_id)
+    if not dry_run:
+        rebuild_rollups(db, user_id)
+        db.commit()
+    return _result(total, len(diff), diff)
+
+
+OPERATIONS: Dict[str, Callable[..., dict]] = {
+    "rescore": rescore_user,
+    "thresholds": rebuild_thresholds_user,
+    "features": backfill_features_user,
+    "streams": migrate_streams_user,
+    "rollups": rebuild_rollups_user,
+}
+
+
+def select_users(db: Session, user_ids: List[int] = None, active_within_days: int = None,
+                 strava_only: bool = False) -> List[int]:
+    """Ids of the users matching every given filter, ascending."""
+    query = db.query(User.user_id)
+    if user_ids:
+        query = query.filter(User.user_id.in_(user_ids))
+    if strava_only:
+        query = query.filter(User.strava_user_id.isnot(None))
+    if active_within_days is not None:
+        cutoff = datetime.now() - timedelta(days=active_within_days)
+        query = query.filter(User.user_id.in_(
+            db.query(Activity.user_id).filter(Activity.start_date >= cutoff)
+        ))
+    return [user_id for user_id, in query.order_by(User.user_id)]
+
+
+def load_checkpoint(path: Optional[str], operation: str) -> set:
+    """User ids already finished for `operation` according to the checkpoint file."""
+    done = set()
+    if path and os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # A line cut short by the interruption
+                if entry.get("operation") == operation:
+                    done.add(entry["user_id"])
+    return done
+
+
+# Session factory of this process (each worker process builds its own)
+_sessions = None
+
+
+def _init_worker(database_url: Optional[str]):
+    global _sessions
+    if database_url:
+        worker_engine = create_engine(database_url)
+    else:
+        from config import engine as worker_engine
+        worker_engine.dispose(close=False)  # Don't share the parent's pooled connections after fork
+    _sessions = sessionmaker(autocommit=False, autoflush=False, bind=worker_engine)
+
+
+def _run_user(operation: str, user_id: int, dry_run: bool, since: Optional[datetime]) -> dict:
+    db = _sessions()
+    start = time.perf_counter()
+    try:
+        result = OPERATIONS[operation](db, user_id, dry_run=dry_run, since=since)
+    except Exception as e:
+        logging.exception(f"{operation} failed for user {user_id}")
+        result = _result(note=f"error: {e}")
+        result["error"] = True
+    finally:
+        db.rollback()  # Dry runs end here; real runs have committed already
+        db.close()
+    result.update(user_id=user_id, seconds=time.perf_counter() - start)
+    return result
+
+
+def run_operation(operation: str, user_ids: List[int], workers: int = 1, checkpoint: str = None,
+                  dry_run: bool = False, since: datetime = None, database_url: str = None,
+                  diff_limit: int = DIFF_LIMIT, out=sys.stdout) -> dict:
+    """
+    Run `operation` for each user, `workers` users at a time, and print progress and a throughput
+    report. Users listed in `checkpoint` are skipped and finished users are appended to it
+    (dry runs neither skip nor record).
+
+    Args:
+        database_url: Database to connect to (default: the app's)
+
+    Returns:
+        Totals: users, activities, changed, errors, seconds, activities_per_second
+    """
+    done = set() if dry_run else load_checkpoint(checkpoint, operation)
+    if checkpoint and not dry_run and os.path.exists(checkpoint) and os.path.getsize(checkpoint):
+        with open(checkpoint, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")  # Don't append to a line cut short by an interruption
+    pending = [user_id for user_id in user_ids if user_id not in done]
+    if done:
+        print(f"⏭️  Skipping {len(user_ids) - len(pending)} users already in {checkpoint}", file=out)
+
+    totals = {"users": 0, "activities": 0, "changed": 0, "errors": 0}
+    start = time.perf_counter()
+
+    def finished(result: dict):
+        totals["users"] += 1
+        totals["activities"] += result["activities"]
+        totals["changed"] += result["changed"]
+        status = f" ({result['note']})" if result["note"] else ""
+        print(f"[{totals['users']}/{len(pending)}] user {result['user_id']}: {result['activities']} activities, "
+              f"{result['changed']} {'would change' if dry_run else 'changed'}{status} "
+              f"in {result['seconds']:.1f} s", file=out)
+        if dry_run:
+            for line in result["diff"][:diff_limit]:
+                print(f"    {line}", file=out)
+            if len(result["diff"]) > diff_limit:
+                print(f"    ... and {len(result['diff']) - diff_limit} more", file=out)
+        if result.get("error"):
+            totals["errors"] += 1
+        elif checkpoint and not dry_run:
+            with open(checkpoint, "a") as f:
+                f.write(json.dumps({"operation": operation, "user_id": result["user_id"],
+                                    "activities": result["activities"], "changed": result["changed"],
+                                    "finished_at": datetime.now().isoformat()}) + "\n")
+
+    if workers <= 1:
+        _init_worker(database_url)
+        for user_id in pending:
+            finished(_run_user(operation, user_id, dry_run, since))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(database_url,)) as pool:
+            futures = [pool.submit(_run_user, operation, user_id, dry_run, since) for user_id in pending]
+            for future in as_completed(futures):
+                finished(future.result())
+
+    totals["seconds"] = time.perf_counter() - start
+    totals["activities_per_second"] = totals["activities"] / totals["seconds"] if totals["seconds"] else 0.0
+    print(f"📊 {operation}{' (dry run)' if dry_run else ''}: {totals['users']} users, {totals['activities']:,} activities "
+          f"in {totals['seconds']:.1f} s ({totals['activities_per_second']:.1f} activities/s), "
+          f"{totals['changed']} {'would change' if dry_run else 'changed'}, {totals['errors']} errors", file=out)
+    return totals
+
+
+def main():
+    from config import SessionLocal
+
+    parser = argparse.ArgumentParser(description='TrainingLoad maintenance operations')
+    parser.add_argument('operation', choices=list(OPERATIONS))
+    parser.add_argument('--user_id', type=int, action='append', help='Only this user (repeatable)')
+    parser.add_argument('--active-within-days', type=int, help='Only users with an activity in the last N days')
+    parser.add_argument('--strava-only', action='store_true', help='Only users connected to Strava')
+    parser.add_argument('--since', type=lambda s: datetime.strptime(s, '%Y-%m-%d'),
+                        help='Only activities starting on or after YYYY-MM-DD')
+    parser.add_argument('--workers', type=int, default=1, help='Users processed in parallel (processes)')
+    parser.add_argument('--checkpoint', help='Resume file: finished users are appended and skipped on rerun')
+    parser.add_argument('--dry-run', action='store_true', help='Print what would change without writing')
+    parser.add_argument('--diff-limit', type=int, default=DIFF_LIMIT, help='Changes listed per user in a dry run')
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        user_ids = select_users(db, args.user_id, args.active_within_days, args.strava_only)
+    finally:
+        db.close()
+    print(f"🔧 {args.operation}: {len(user_ids)} users selected, {args.workers} worker(s)")
+    totals = run_operation(args.operation, user_ids, args.workers, args.checkpoint, args.dry_run, args.since,
+                           diff_limit=args.diff_limit)
+    sys.exit(1 if totals["errors"] else 0)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
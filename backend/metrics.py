@@ -0,0 +1,371 @@
+# In-process metrics registry with Prometheus text exposition (GET /metrics)
+#
+# Counters, gauges and histograms with labels, rendered in the Prometheus text format (0.0.4) so
+# any scraper can read them; nothing here talks to an external service. Gauges may be backed by a
+# callback read at scrape time (rate limit headroom comes straight from the upstream budgets).
+#
+# What is measured, and where:
+#   http_*            - per-route latency and status (MetricsMiddleware, main.py)
+#   scheduler_job_*   - scheduled job runs and durations (@timed_job on the jobs in main.py)
+#   queue_task_*      - work queue task durations by task, lane and outcome; the users whose jobs
+#                       took longest in total (job_queue.execute_job)
+#   upstream_*        - Strava / intervals.icu calls, latency, 429s and budget headroom
+#                       (observe_upstream in the fetch paths, callbacks in upstream_budget.py)
+#   activities_ingested_total - new activities by source; rate() gives activities per minute
+#   stream_analysis_cpu_seconds_total - thread CPU time in the stream analysis entry points
+#                       (@cpu_timed; nested calls count towards each of their callers)
+#
+# work_tally() also counts the upstream calls and activities touched by one unit of work, for the
+# job run ledger (job_runs.py) rather than the scrape.
+#
+# Values are per process: with several API workers, scrape each one (or sum them in the scraper).
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Iterable, Optional, Tuple
+import contextvars
+import math
+import threading
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PREFIX = "trainingload_"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+JOB_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0, 1800.0, 3600.0)
+TOP_USERS = 20  # Users exposed in queue_task_user_seconds (the rest are summed, not labelled)
+
+_tally = contextvars.ContextVar("metrics_work_tally", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        """(suffix, formatted labels, value) triples."""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines += [f"{self.name}{suffix}{labels} {_format_value(value)}" for suffix, labels, value in self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """
+    A monotonically increasing total per label set. With `callback`, totals kept elsewhere are read
+    at scrape time from callback() -> iterable of (label values tuple, value).
+    """
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 callback: Optional[Callable[[], Iterable[Tuple[tuple, float]]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = defaultdict(float)
+        self.callback = callback
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] += amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        return _value_samples(self)
+
+
+class Gauge(_Metric):
+    """A value that goes up and down; `callback` works as for Counter."""
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 callback: Optional[Callable[[], Iterable[Tuple[tuple, float]]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        return _value_samples(self)
+
+
+def _value_samples(metric) -> list:
+    if metric.callback is not None:
+        items = sorted((tuple(key), value) for key, value in metric.callback())
+    else:
+        with metric._lock:
+            items = sorted(metric._values.items())
+    return [("", _format_labels(metric.labelnames, key), value) for key, value in items if value is not None]
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, with their sum and count, per label set."""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts: Dict[tuple, list] = {}
+        self._sums: Dict[tuple, float] = defaultdict(float)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock seconds the enclosed block takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            return sum(self._counts.get(self._key(labels), ()))
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(counts), self._sums[key]) for key, counts in self._counts.items())
+        samples = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(("_bucket", _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"'),
+                                cumulative))
+            samples.append(("_sum", _format_labels(self.labelnames, key), total))
+            samples.append(("_count", _format_labels(self.labelnames, key), cumulative))
+        return samples
+
+
+class Registry:
+    """Named metrics, rendered together."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(PREFIX + name)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def render() -> str:
+    """The registry in Prometheus text format."""
+    return REGISTRY.render()
+
+
+# --- Metric definitions ---------------------------------------------------------------------------
+
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "API request latency by route template.", ("method", "route", "status")))
+
+SCHEDULER_JOB_SECONDS = REGISTRY.register(Histogram(
+    "scheduler_job_duration_seconds", "Scheduled job run time.", ("job", "outcome"), buckets=JOB_BUCKETS))
+SCHEDULER_JOB_LAST_RUN = REGISTRY.register(Gauge(
+    "scheduler_job_last_run_timestamp_seconds", "Unix time the scheduled job last finished.", ("job",)))
+
+QUEUE_TASK_SECONDS = REGISTRY.register(Histogram(
+    "queue_task_duration_seconds", "Work queue task run time.", ("task", "lane", "outcome"), buckets=JOB_BUCKETS))
+
+UPSTREAM_REQUESTS = REGISTRY.register(Counter(
+    "upstream_requests_total", "Calls to upstream APIs by response status ('error' when no response).",
+    ("upstream", "status")))
+UPSTREAM_SECONDS = REGISTRY.register(Histogram(
+    "upstream_request_duration_seconds", "Upstream API call latency.", ("upstream",)))
+UPSTREAM_RATE_LIMITED = REGISTRY.register(Counter(
+    "upstream_rate_limited_total", "Upstream responses with status 429.", ("upstream",)))
+
+ACTIVITIES_INGESTED = REGISTRY.register(Counter(
+    "activities_ingested_total", "Newly stored activities by source.", ("source",)))
+
+STREAM_ANALYSIS_CPU = REGISTRY.register(Counter(
+    "stream_analysis_cpu_seconds_total", "Thread CPU time spent in stream analysis functions.", ("function",)))
+STREAM_ANALYSIS_CALLS = REGISTRY.register(Counter(
+    "stream_analysis_calls_total", "Calls to stream analysis functions.", ("function",)))
+
+
+class _UserSeconds:
+    """Cumulative queue task seconds per user; only the TOP_USERS largest are exposed as labels."""
+
+    def __init__(self, top: int = TOP_USERS):
+        self.top = top
+        self._seconds: Dict[int, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def add(self, user_id, seconds: float):
+        with self._lock:
+            self._seconds[user_id] += seconds
+
+    def samples(self):
+        with self._lock:
+            ranked = sorted(self._seconds.items(), key=lambda item: item[1], reverse=True)
+        rest = sum(seconds for _, seconds in ranked[self.top:])
+        return [((str(user_id),), seconds) for user_id, seconds in ranked[:self.top]] + ([(("other",), rest)] if rest else [])
+
+
+queue_user_seconds = _UserSeconds()
+REGISTRY.register(Gauge(
+    "queue_task_user_seconds", f"Cumulative work queue task seconds for the {TOP_USERS} most expensive users.",
+    ("user_id",), callback=queue_user_seconds.samples))
+
+
+# --- Instrumentation helpers ----------------------------------------------------------------------
+
+@contextmanager
+def work_tally():
+    """Count upstream calls and activities touched inside the block; yields the dict being filled."""
+    tally = {"api_calls": 0, "activities": 0}
+    token = _tally.set(tally)
+    try:
+        yield tally
+    finally:
+        _tally.reset(token)
+
+
+def count_work(key: str, amount: int = 1):
+    """Add to the enclosing work_tally(), if any ("api_calls" or "activities")."""
+    tally = _tally.get()
+    if tally is not None:
+        tally[key] = tally.get(key, 0) + amount
+
+
+def observe_upstream(upstream: str, seconds: float, status_code: Optional[int]):
+    """Record one upstream API call (status_code None when the request failed without a response)."""
+    count_work("api_calls")
+    UPSTREAM_REQUESTS.inc(upstream=upstream, status=str(status_code) if status_code is not None else "error")
+    UPSTREAM_SECONDS.observe(seconds, upstream=upstream)
+    if status_code == 429:
+        UPSTREAM_RATE_LIMITED.inc(upstream=upstream)
+
+
+def timed_job(job: str):
+    """Decorator recording a scheduled job's duration (outcome 'error' if it raised)."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start, outcome = time.perf_counter(), "error"
+            try:
+                result = func(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                SCHEDULER_JOB_SECONDS.observe(time.perf_counter() - start, job=job, outcome=outcome)
+                SCHEDULER_JOB_LAST_RUN.set(time.time(), job=job)
+        return wrapper
+    return decorator
+
+
+def cpu_timed(function: str):
+    """Decorator adding the calling thread's CPU time in the function to stream_analysis_cpu_seconds_total."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.thread_time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                STREAM_ANALYSIS_CPU.inc(time.thread_time() - start, function=function)
+                STREAM_ANALYSIS_CALLS.inc(function=function)
+        return wrapper
+    return decorator
+
+
+class MetricsMiddleware:
+    """ASGI middleware observing request latency by method, route template and status."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = {"code": 500}  # Unless a response starts, the request failed
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope["method"],
+                                         route=route_template(scope), status=str(status["code"]))
+
+
+def route_template(scope) -> str:
+    """
+    The matched route's path with parameters named, so /dashboard/1 and /dashboard/2 share a
+    series. Rebuilt from the path parameters the router stores in the scope (included routers
+    keep their prefix out of route.path); "unmatched" when no route matched.
+    """
+    if "endpoint" not in scope:
+        return "unmatched"
+    names = {str(value): "{" + name + "}" for name, value in scope.get("path_params", {}).items()}
+    return "/".join(names.get(segment, segment) for segment in scope["path"].split("/"))
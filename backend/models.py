@@ -1,6 +1,7 @@
 # User model and table creation for FastAPI/SQLAlchemy
-from sqlalchemy import Column, Integer, String, JSON, Float, DateTime, ForeignKey, Date
+from sqlalchemy import Column, Integer, String, JSON, Float, DateTime, ForeignKey, Date, Text, Index, Boolean, text
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
 from db import engine
 
 Base = declarative_base()
@@ -75,7 +76,164 @@ class WellnessData(Base):
     created_at = Column(DateTime)
     updated_at = Column(DateTime)
 
+class JobQueueItem(Base):
+    """Durable per-user work item drained by queue workers (see job_queue.py)."""
+    __tablename__ = "job_queue"
+    job_id = Column(Integer, primary_key=True, autoincrement=True)
+    task_name = Column(String(100), nullable=False)  # Registered handler, e.g. 'sync_user'
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=True)
+    payload = Column(JSON)  # Keyword arguments for the handler
+    priority = Column(Integer, nullable=False, default=50)  # Lower runs first
+    lane = Column(String(20), nullable=False, default="routine")  # interactive, backfill, routine, maintenance
+    dedup_key = Column(String(255))  # At most one queued/leased item per key
+    status = Column(String(20), nullable=False, default="queued")  # queued, leased, done, dead
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    available_at = Column(DateTime, nullable=False)  # Not visible to workers before this
+    leased_by = Column(String(255))
+    lease_expires_at = Column(DateTime)  # Visibility timeout; expired leases are re-leased
+    last_error = Column(Text)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    started_at = Column(DateTime)  # First lease; started_at - available_at is the queue wait
+    completed_at = Column(DateTime)
+    run_id = Column(Integer, ForeignKey("job_runs.run_id"), nullable=True)  # Scheduled run that enqueued it
+
+    __table_args__ = (
+        Index("ix_job_queue_ready", "status", "priority", "available_at"),
+        Index("ix_job_queue_lane", "lane", "status", "available_at"),
+        Index("ix_job_queue_run", "run_id", "status"),
+        Index(
+            "ux_job_queue_active_dedup", "dedup_key", unique=True,
+            postgresql_where=text("status IN ('queued', 'leased')"),
+            sqlite_where=text("status IN ('queued', 'leased')"),
+        ),
+    )
+
+class JobRun(Base):
+    """One run of a scheduled job; its per-user work is in JobRunUser (see job_runs.py)."""
+    __tablename__ = "job_runs"
+    run_id = Column(Integer, primary_key=True, autoincrement=True)
+    job_name = Column(String(100), nullable=False)  # Scheduler job id, e.g. 'daily_sync'
+    trigger = Column(String(20), nullable=False, default="schedule")  # schedule or manual
+    status = Column(String(20), nullable=False, default="running")  # running, enqueued, failed (of the scheduler call)
+    started_at = Column(DateTime, nullable=False)
+    enqueued_at = Column(DateTime)  # Scheduler call returned; the items drain after this
+    users_enqueued = Column(Integer, default=0)
+    error = Column(Text)
+
+    __table_args__ = (
+        Index("ix_job_runs_job_started", "job_name", "started_at"),
+    )
+
+class JobRunUser(Base):
+    """One execution (attempt) of a queue item enqueued by a job run: timing, work done and outcome."""
+    __tablename__ = "job_run_users"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    run_id = Column(Integer, ForeignKey("job_runs.run_id", ondelete="CASCADE"), nullable=False)
+    queue_job_id = Column(Integer)  # job_queue.job_id (purged items leave this dangling)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=True)
+    task_name = Column(String(100), nullable=False)
+    attempt = Column(Integer, nullable=False, default=1)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=False)
+    duration_seconds = Column(Float, nullable=False)
+    api_calls = Column(Integer, nullable=False, default=0)  # Strava / intervals.icu requests
+    activities = Column(Integer, nullable=False, default=0)  # Activities created, updated, rescored or deleted
+    queries = Column(Integer, nullable=False, default=0)  # Database statements
+    status = Column(String(20), nullable=False)  # succeeded or failed
+    error = Column(Text)
+    result = Column(JSON)  # The handler's return value, when it is JSON-serializable
+
+    __table_args__ = (
+        Index("ix_job_run_users_run", "run_id", "user_id"),
+        Index("ix_job_run_users_task_started", "task_name", "started_at"),
+    )
+
+class SchedulerLeader(Base):
+    """Lease row for the process that owns the background scheduler (see leader_election.py)."""
+    __tablename__ = "scheduler_leader"
+    name = Column(String(100), primary_key=True)  # Election name, e.g. 'scheduler'
+    holder = Column(String(255), nullable=False)  # hostname:pid of the leader
+    backend_pid = Column(Integer)  # Postgres backend holding the advisory lock
+    acquired_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+    lease_expires_at = Column(DateTime)
+
+class UserSyncState(Base):
+    """Adaptive polling state per user (see sync_policy.py)."""
+    __tablename__ = "user_sync_state"
+    user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
+    next_sync_at = Column(DateTime)  # UTC; the policy tick enqueues users that are due
+    last_sync_at = Column(DateTime)
+    tracking_since = Column(DateTime)  # Start of the window used for the savings report
+    polls = Column(Integer, default=0)
+    polls_with_new = Column(Integer, default=0)
+    new_activities_total = Column(Integer, default=0)
+    api_calls = Column(Integer, default=0)  # Approximate Strava calls made by adaptive polls
+    hit_rate = Column(Float)  # EWMA of polls that found new activities
+    profile = Column(JSON)  # Learned cadence: hour histogram, uploads/day, typical duration, reason
+    updated_at = Column(DateTime)
+
+class RecommendationCache(Base):
+    """Precomputed /recommendations payload per user (see recommendation_cache.py)."""
+    __tablename__ = "recommendation_cache"
+    user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)  # Hash of the inputs the payload was built from
+    payload = Column(JSON, nullable=False)
+    stale = Column(Boolean, nullable=False, default=False)  # Set by data change events
+    computed_at = Column(DateTime, nullable=False)
+    compute_ms = Column(Float)
+    invalidated_at = Column(DateTime)
+
+class TrainingRollup(Base):
+    """Activity totals per user, calendar period and sport (see training_rollups.py)."""
+    __tablename__ = "training_rollups"
+    user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
+    period = Column(String(10), primary_key=True)  # 'week' (ISO, from Monday), 'month' or 'year'
+    period_start = Column(Date, primary_key=True)  # First day of the period
+    sport = Column(String(50), primary_key=True)  # Strava activity type
+    activities = Column(Integer, nullable=False, default=0)
+    distance = Column(Float, nullable=False, default=0)  # meters
+    moving_time = Column(Integer, nullable=False, default=0)  # seconds
+    elevation_gain = Column(Float, nullable=False, default=0)  # meters
+    utl = Column(Float, nullable=False, default=0)  # Sum of utl_score
+    updated_at = Column(DateTime)
+
+class ActivityMetrics(Base):
+    """Derived per-activity metrics (UTL features, summary values, time histograms), extracted once at ingest (see activity_metrics.py)."""
+    __tablename__ = "activity_metrics"
+    activity_id = Column(Integer, ForeignKey("activities.activity_id", ondelete="CASCADE"), primary_key=True)
+    features_version = Column(Integer, nullable=False)  # Re-extracted from streams when this is behind
+    has_watts = Column(Boolean, nullable=False, default=False)  # Stream present (may be empty)
+    watts_samples = Column(Integer, nullable=False, default=0)
+    normalized_power = Column(Float)
+    avg_power = Column(Float)
+    has_heartrate = Column(Boolean, nullable=False, default=False)
+    hr_samples = Column(Integer, nullable=False, default=0)
+    avg_hr = Column(Float)
+    has_distance = Column(Boolean, nullable=False, default=False)
+    has_streams = Column(Boolean, nullable=False, default=False)  # Any streams were stored with the activity
+    has_velocity = Column(Boolean, nullable=False, default=False)  # velocity_smooth stream present
+    velocity_samples = Column(Integer, nullable=False, default=0)
+    max_power = Column(Float)  # Stream maxima
+    max_hr = Column(Float)
+    average_watts = Column(Float)  # Strava summary values (what threshold estimation uses)
+    max_heartrate = Column(Float)
+    hr_seconds = Column(JSON)  # Seconds per fixed-width bin (see activity_metrics.HISTOGRAMS); zones are derived per threshold
+    power_seconds = Column(JSON)
+    speed_seconds = Column(JSON)
+    hr_sketch = Column(JSON)  # Sample-count HistogramSketch per stream (same bins); merged for yearly percentiles
+    power_sketch = Column(JSON)
+    speed_sketch = Column(JSON)
+    running_intensity_checked = Column(Boolean, nullable=False, default=False)  # Pace analysis is run lazily
+    running_intensity = Column(String(50))  # Pace-distribution class, None if it couldn't classify
+    utl_fingerprint = Column(String(40))  # Inputs of the stored utl_score; rescoring skips on a match
+    computed_at = Column(DateTime)
+
+    activity = relationship("Activity")
+
 # Create the tables in the database
 if __name__ == "__main__":
     Base.metadata.create_all(bind=engine)
-    print("User, Threshold, Activity, and WellnessData tables created (if not exists)")
+    print("User, Threshold, Activity, WellnessData, JobQueue, JobRun, JobRunUser, SchedulerLeader, UserSyncState, RecommendationCache, TrainingRollup, and ActivityMetrics tables created (if not exists)")
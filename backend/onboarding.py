@@ -1,13 +1,15 @@
 # Onboarding related endpoints
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, defer
 from pydantic import BaseModel
 from datetime import datetime, timedelta
 import logging
 from models import User, Threshold, Activity
-from utils import estimate_thresholds_from_activities
 from research_threshold_calculator import ResearchBasedThresholdCalculator, calculate_initial_thresholds_for_new_user
 from config import get_db
+from utl_batch import score_activities
+from activity_metrics import threshold_activity_summaries, estimate_thresholds_from_history
+from data_events import publish, THRESHOLDS_CHANGED
 
 router = APIRouter()
 
@@ -55,12 +57,15 @@ def onboarding(questionnaire: OnboardingQuestionnaire, db: Session = Depends(get
     try:
         # Import activities from Strava
         from activities import _fetch_and_process_activities
+        from upstream_budget import upstream_lane, LANE_INTERACTIVE
         logging.info(f"Importing activities for user {questionnaire.user_id}")
-        _fetch_and_process_activities(questionnaire.user_id, db, backfill_days=90)
+        # The new user is waiting on their first dashboard: use the interactive share of the rate limit
+        with upstream_lane(LANE_INTERACTIVE):
+            _fetch_and_process_activities(questionnaire.user_id, db, backfill_days=90)
         
         # Now get the imported activities for threshold calculation
         three_months_ago = datetime.now() - timedelta(days=90)
-        activities = db.query(Activity).filter(
+        activities = db.query(Activity).options(defer(Activity.data)).filter(
             Activity.user_id == questionnaire.user_id,
             Activity.start_date >= three_months_ago
         ).all()
@@ -73,25 +78,9 @@ def onboarding(questionnaire: OnboardingQuestionnaire, db: Session = Depends(get
 
     # Estimate thresholds from recent activities
     if activities:
-        activity_data = []
-        activities_with_streams = []
-        
-        for act in activities:
-            activity_summary = {
-                'type': act.type,
-                'moving_time': act.moving_time,
-                'average_speed': act.average_speed,
-                'average_watts': act.data.get('average_watts') if act.data else None,
-                'max_heartrate': act.data.get('max_heartrate') if act.data else None,
-                'distance': act.distance,
-                'start_date': act.start_date,
-                'name': act.name
-            }
-            activity_data.append(activity_summary)
-            
-            # Check if activity has streams data
-            if act.data and 'streams' in act.data and act.data['streams']:
-                activities_with_streams.append((activity_summary, act.data['streams']))
+        # Summaries from the activity_metrics rows written at import (no JSON parsing)
+        activity_data = threshold_activity_summaries(db, questionnaire.user_id, since=three_months_ago)
+        db.commit()  # Metrics rows must be visible to the research calculator's own connection
 
         # Use research-based threshold calculation for new users
         try:
@@ -99,8 +88,8 @@ def onboarding(questionnaire: OnboardingQuestionnaire, db: Session = Depends(get
             logging.info(f"Using research-based threshold estimation for new user {questionnaire.user_id}: {estimates}")
         except Exception as e:
             logging.warning(f"Research-based threshold calculation failed, falling back to basic estimation: {e}")
-            # Fallback to original method
-            estimates = estimate_thresholds_from_activities(activity_data, user.gender, activities_with_streams)
+            estimates = estimate_thresholds_from_history(db, questionnaire.user_id, user.gender, activity_data,
+                                                         since=three_months_ago)
         
         if estimates:
             threshold = db.query(Threshold).filter_by(user_id=questionnaire.user_id).first()
@@ -118,40 +107,17 @@ def onboarding(questionnaire: OnboardingQuestionnaire, db: Session = Depends(get
             
             # Now recalculate UTL scores for the imported activities using the new thresholds
             logging.info(f"Recalculating UTL scores for {len(activities)} activities with new thresholds")
-            from utils import calculate_utl
-            
             updated_count = 0
-            for activity in activities:
-                try:
-                    # Reconstruct activity summary for UTL calculation
-                    activity_summary = {
-                        'type': activity.type,
-                        'moving_time': activity.moving_time,
-                        'distance': activity.distance,
-                        'average_speed': activity.average_speed,
-                        'start_date': activity.start_date.isoformat() if activity.start_date else None
-                    }
-                    
-                    # Get streams data from stored data
-                    activity_streams = None
-                    if activity.data and isinstance(activity.data, dict):
-                        activity_streams = activity.data.get('streams')
-                    
-                    # Calculate UTL with the new thresholds
-                    utl_score, method = calculate_utl(activity_summary, threshold, activity_streams)
-                    
-                    # Update the activity
-                    activity.utl_score = float(utl_score)
-                    activity.calculation_method = method
-                    updated_count += 1
-                    
-                    logging.info(f"Updated UTL for activity {activity.strava_activity_id}: {utl_score:.2f} using {method}")
-                    
-                except Exception as e:
-                    logging.error(f"Error calculating UTL for activity {activity.strava_activity_id}: {e}")
-                    continue
+            for activity, (utl_score, method) in zip(activities, score_activities(db, activities, threshold)):
+                # Update the activity
+                activity.utl_score = float(utl_score)
+                activity.calculation_method = method
+                updated_count += 1
+                
+                logging.info(f"Updated UTL for activity {activity.strava_activity_id}: {utl_score:.2f} using {method}")
             
             logging.info(f"Updated UTL scores for {updated_count} activities during onboarding")
 
     db.commit()
+    publish(THRESHOLDS_CHANGED, user.user_id)
     return {"message": "Onboarding questionnaire saved with threshold estimation.", "user_id": user.user_id}
@@ -0,0 +1,324 @@
+# Opt-in profiling for scheduler jobs, queue tasks, API requests and CLI runs
+#
+# Nothing is profiled unless asked for. PROFILE_JOBS and PROFILE_PATHS name what to profile on
+# every run, /scheduler/run/{job_id}?profile=1 profiles one manual run, any request can add
+# ?profile=1 when PROFILE_ON_DEMAND is on, and background_processor.py takes --profile. Each
+# profile is written under PROFILE_DIR as <timestamp>_<kind>_<name> with:
+#   .prof       - cProfile stats (python -m pstats, snakeviz), plus .txt with the top functions
+#   .collapsed  - sampled stacks, one "frame;frame;frame count" line each (flamegraph.pl, speedscope)
+#   .json       - what GET /profiles lists: name, kind, mode, seconds, files and top functions
+#
+# cProfile sees only the calling thread and slows call-heavy code down a lot; it is the default
+# for jobs and tasks, which run on one thread. The sampler reads sys._current_frames() every
+# PROFILE_SAMPLE_INTERVAL_MS from its own thread, so the profiled code runs at nearly full speed.
+# Requests are always sampled, across every busy thread: sync endpoints run on a threadpool
+# thread, so concurrent requests show up too. The sampler is also used when another cProfile is
+# already running, since only one can be active per process.
+#
+# Profiles don't nest: work inside a profiled block is part of that profile.
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from typing import Optional
+from urllib.parse import parse_qs
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+
+from config import (PROFILE_JOBS, PROFILE_PATHS, PROFILE_ON_DEMAND, PROFILE_MODE, PROFILE_SAMPLE_INTERVAL_MS,
+                    PROFILE_DIR, PROFILE_KEEP)
+
+MODE_CPROFILE = "cprofile"
+MODE_SAMPLE = "sample"
+MODES = (MODE_CPROFILE, MODE_SAMPLE)
+
+PROFILE_HEADER = "X-Profile"
+TOP_FUNCTIONS = 20
+OUTPUT_EXTENSIONS = (".prof", ".txt", ".collapsed", ".json")
+
+# Innermost Python frames of threads that are waiting rather than working; the sampler skips them
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+}
+
+_active = contextvars.ContextVar("profile_active", default=None)
+_cprofile_lock = threading.Lock()
+_prune_lock = threading.Lock()
+
+
+class SamplingProfiler:
+    """Counts the stacks of some threads (every busy one when thread_ids is None) from a background thread."""
+
+    def __init__(self, interval: float = None, thread_ids=None):
+        self.interval = interval if interval is not None else PROFILE_SAMPLE_INTERVAL_MS / 1000
+        self.thread_ids = set(thread_ids) if thread_ids is not None else None
+        self.stacks = Counter()  # "root;...;leaf" -> samples
+        self.ticks = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> "SamplingProfiler":
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            self.ticks += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (self.thread_ids is not None and ident not in self.thread_ids):
+                    continue
+                stack = _stack(frame)
+                if stack is None:
+                    continue
+                if self.thread_ids is None:
+                    if ident not in names:
+                        names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                    stack.insert(0, f"thread:{names.get(ident, ident)}")
+                self.stacks[";".join(stack)] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top(self, limit: int = TOP_FUNCTIONS) -> list:
+        """Functions by samples spent in them (self time)."""
+        total = sum(self.stacks.values())
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return [{"function": function, "samples": count, "share": round(count / total, 3)}
+                for function, count in leaves.most_common(limit)]
+
+
+def _stack(frame) -> Optional[list]:
+    """Root-first "file.py:function" frames, or None for an idle thread."""
+    leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+    if leaf in IDLE_FRAMES:
+        return None
+    stack = []
+    while frame is not None:
+        stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class Profile:
+    """One profiling session. `base` (the output file name without extension) is known up front."""
+
+    def __init__(self, name: str, kind: str, mode: str):
+        self.name = name
+        self.kind = kind
+        self.mode = mode
+        self.started_at = datetime.now()
+        self.base = f"{self.started_at:%Y%m%d-%H%M%S-%f}_{kind}_{_slug(name)}"
+        self.seconds = None
+
+
+def _slug(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "-", name).strip("-")[:80] or "unnamed"
+
+
+def should_profile(name: str) -> bool:
+    """Whether PROFILE_JOBS asks for this scheduler job or queue task to be profiled."""
+    return "all" in PROFILE_JOBS or name in PROFILE_JOBS
+
+
+def current_profile() -> Optional[Profile]:
+    return _active.get()
+
+
+@contextmanager
+def profiled(name: str, kind: str = "job", mode: str = None, enabled: bool = True, all_threads: bool = False):
+    """
+    Profile the enclosed block and write the result under PROFILE_DIR.
+
+    Args:
+        name: What ran, e.g. "job daily_sync" or "GET /dashboard/7"
+        kind: job, task, request or cli (part of the file name)
+        mode: MODE_CPROFILE or MODE_SAMPLE (default PROFILE_MODE)
+        enabled: False makes this a no-op, so call sites needn't branch
+        all_threads: Sample every busy thread rather than the calling one (always samples)
+
+    Yields:
+        The Profile, or None when not profiling (disabled, or already inside a profile)
+    """
+    if not enabled or _active.get() is not None:
+        yield None
+        return
+
+    mode = MODE_SAMPLE if all_threads else (mode or PROFILE_MODE)
+    if mode not in MODES:
+        raise ValueError(f"Unknown profile mode '{mode}' (expected one of {MODES})")
+    profiler = None
+    if mode == MODE_CPROFILE and _cprofile_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # Another tool holds the interpreter's profiling hooks
+            _cprofile_lock.release()
+            profiler = None
+    if profiler is None:
+        mode = MODE_SAMPLE
+        profiler = SamplingProfiler(thread_ids=None if all_threads else [threading.get_ident()]).start()
+
+    profile = Profile(name, kind, mode)
+    token = _active.set(profile)
+    start = time.perf_counter()
+    try:
+        yield profile
+    finally:
+        profile.seconds = time.perf_counter() - start
+        _active.reset(token)
+        if mode == MODE_CPROFILE:
+            profiler.disable()
+            _cprofile_lock.release()
+        else:
+            profiler.stop()
+        try:
+            _write(profile, profiler)
+        except Exception as e:
+            logging.warning(f"⚠️ Could not write profile for {name}: {e}")
+
+
+def _write(profile: Profile, profiler):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, profile.base)
+    meta = {
+        "profile": profile.base,
+        "name": profile.name,
+        "kind": profile.kind,
+        "mode": profile.mode,
+        "started_at": profile.started_at.isoformat(),
+        "seconds": round(profile.seconds, 3),
+        "pid": os.getpid(),
+    }
+
+    if profile.mode == MODE_CPROFILE:
+        profiler.dump_stats(path + ".prof")
+        report = io.StringIO()
+        stats = pstats.Stats(path + ".prof", stream=report)
+        stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS * 2)
+        with open(path + ".txt", "w") as f:
+            f.write(report.getvalue())
+        ranked = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]
+        meta["files"] = [profile.base + ".prof", profile.base + ".txt"]
+        meta["top"] = [{
+            "function": f"{os.path.basename(filename)}:{line}({function})",
+            "calls": calls,
+            "self_seconds": round(self_seconds, 4),
+            "cumulative_seconds": round(cumulative, 4),
+        } for (filename, line, function), (_, calls, self_seconds, cumulative, _) in ranked]
+    else:
+        with open(path + ".collapsed", "w") as f:
+            f.write(profiler.collapsed())
+        meta["files"] = [profile.base + ".collapsed"]
+        meta["samples"] = sum(profiler.stacks.values())
+        meta["interval_ms"] = profiler.interval * 1000
+        meta["top"] = profiler.top()
+
+    with open(path + ".json", "w") as f:
+        json.dump(meta, f, indent=1)
+    logging.info(f"🔬 Profiled {profile.name} ({profile.seconds:.2f}s, {profile.mode}): {path}")
+    _prune()
+
+
+def _prune(keep: int = None):
+    """Delete the oldest profiles beyond PROFILE_KEEP (file names sort by time)."""
+    keep = PROFILE_KEEP if keep is None else keep
+    with _prune_lock:
+        bases = sorted({name.rsplit(".", 1)[0] for name in os.listdir(PROFILE_DIR) if name.endswith(OUTPUT_EXTENSIONS)})
+        for base in bases[:max(len(bases) - keep, 0)]:
+            for extension in OUTPUT_EXTENSIONS:
+                try:
+                    os.remove(os.path.join(PROFILE_DIR, base + extension))
+                except FileNotFoundError:
+                    pass
+
+
+def list_profiles(limit: int = 20, kind: str = None) -> list:
+    """Recent profiles' metadata, newest first."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted((name for name in os.listdir(PROFILE_DIR) if name.endswith(".json")), reverse=True):
+        try:
+            with open(os.path.join(PROFILE_DIR, name)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue  # Being written or pruned by another process
+        if kind and meta.get("kind") != kind:
+            continue
+        profiles.append(meta)
+        if len(profiles) >= limit:
+            break
+    return profiles
+
+
+def profile_file(filename: str) -> Optional[str]:
+    """Path of a profile output file, or None if the name isn't one (no paths outside PROFILE_DIR)."""
+    if not re.fullmatch(r"[\w.-]+", filename) or not filename.endswith(OUTPUT_EXTENSIONS):
+        return None
+    path = os.path.join(PROFILE_DIR, filename)
+    return path if os.path.isfile(path) else None
+
+
+def profiled_job(job: str):
+    """Decorator profiling a scheduled job when PROFILE_JOBS names it."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with profiled(f"job {job}", kind="job", enabled=should_profile(job)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware sampling requests whose path starts with one of `paths`, or that ask with
+    ?profile=1 when `on_demand` is on. Profiled responses name their profile in X-Profile.
+    """
+
+    def __init__(self, app, paths=PROFILE_PATHS, on_demand: bool = PROFILE_ON_DEMAND):
+        self.app = app
+        self.paths = tuple(paths)
+        self.on_demand = on_demand
+
+    def wanted(self, scope) -> bool:
+        if self.paths and scope["path"].startswith(self.paths):
+            return True
+        if not self.on_demand:
+            return False
+        return parse_qs(scope.get("query_string", b"").decode()).get("profile", [""])[-1].lower() in ("1", "true")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.wanted(scope):
+            return await self.app(scope, receive, send)
+
+        with profiled(f"{scope['method']} {scope['path']}", kind="request", all_threads=True) as profile:
+            async def send_with_profile(message):
+                if profile is not None and message["type"] == "http.response.start":
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (PROFILE_HEADER.lower().encode(), profile.base.encode())]
+                await send(message)
+
+            await self.app(scope, receive, send_with_profile)
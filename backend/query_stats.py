@@ -0,0 +1,207 @@
+# Per-request and per-job database query statistics
+#
+# install() registers cursor events on every SQLAlchemy Engine. Work wrapped in track() - each API
+# request (QueryStatsMiddleware) and each queue job (job_queue.execute_job) - collects the number
+# of statements it ran, the rows they returned and the time spent waiting on the database. The
+# totals are logged when the unit finishes; a read that ran QUERY_STATS_N_PLUS_ONE times or more
+# inside one unit is logged as a suspected N+1 (a query issued from a loop that should be one
+# batched query). Writes aren't checked: an ORM flush may insert row by row on some dialects
+# (SQLite), which is the unit of work's business rather than a loop in our code. With
+# QUERY_STATS_HEADERS on, responses also carry the totals as X-DB-* headers.
+#
+# The unit lives in a context variable holding a mutable object, so the threadpool copies of a
+# request's context (sync endpoints, run_in_threadpool) add to the same totals. Threads started
+# with threading.Thread don't inherit it; their statements count as untracked.
+#
+# Rows are the driver's rowcount for statements that return rows: psycopg reports result sizes,
+# SQLite does not (its rows stay 0).
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+import contextvars
+import threading
+import logging
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import QUERY_STATS_HEADERS, QUERY_STATS_N_PLUS_ONE, QUERY_STATS_LOG_QUERIES
+
+QUERIES_HEADER = "X-DB-Queries"
+ROWS_HEADER = "X-DB-Rows"
+TIME_HEADER = "X-DB-Time-Ms"
+
+KIND_REQUEST = "request"
+KIND_JOB = "job"
+KIND_UNTRACKED = "untracked"
+
+_current = contextvars.ContextVar("query_stats", default=None)
+_installed = False
+_install_lock = threading.Lock()
+
+# Statements per unit kind since the process started (the load test reports background work from these)
+_totals = Counter()
+_totals_lock = threading.Lock()
+
+
+class QueryStats:
+    """Statements, rows and database time for one unit of work (a request or a job)."""
+
+    def __init__(self, name: str, kind: str = KIND_REQUEST, parent: "QueryStats" = None):
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.statements = 0
+        self.rows = 0
+        self.db_seconds = 0.0
+        self.by_statement = Counter()  # SQL text -> executions
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, rows: int, seconds: float):
+        stats = self
+        while stats is not None:  # Nested units also count towards the enclosing one
+            with stats._lock:
+                stats.statements += 1
+                stats.rows += rows
+                stats.db_seconds += seconds
+                stats.by_statement[statement] += 1
+            stats = stats.parent
+
+    def reads(self) -> int:
+        return sum(count for sql, count in self.by_statement.items() if _is_read(sql))
+
+    def repeated(self, threshold: int = QUERY_STATS_N_PLUS_ONE) -> list:
+        """(SQL, executions) for reads run at least `threshold` times, most frequent first."""
+        return [(sql, count) for sql, count in self.by_statement.most_common()
+                if count >= threshold and _is_read(sql)]
+
+    def headers(self) -> list:
+        """The totals as ASGI response headers."""
+        return [(QUERIES_HEADER.lower().encode(), str(self.statements).encode()),
+                (ROWS_HEADER.lower().encode(), str(self.rows).encode()),
+                (TIME_HEADER.lower().encode(), f"{self.db_seconds * 1000:.1f}".encode())]
+
+    def summary(self) -> str:
+        return f"{self.statements} queries, {self.rows} rows, {self.db_seconds * 1000:.1f} ms in database"
+
+    def describe(self, limit: int = 10) -> str:
+        """The most frequent statements, one per line, for assertion messages."""
+        lines = [f"  {count}x {' '.join(sql.split())[:200]}" for sql, count in self.by_statement.most_common(limit)]
+        return "\n".join([self.summary()] + lines)
+
+
+def _is_read(sql: str) -> bool:
+    return sql.lstrip()[:6].upper() in ("SELECT", "WITH")
+
+
+def current_stats() -> Optional[QueryStats]:
+    return _current.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_stats_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_stats_start")
+    if not starts:  # Started before install()
+        return
+    seconds = time.perf_counter() - starts.pop()
+    stats = _current.get()
+    kind = stats.kind if stats is not None else KIND_UNTRACKED
+    with _totals_lock:
+        _totals[kind] += 1
+    if stats is not None:
+        rows = cursor.rowcount if cursor.description is not None and cursor.rowcount > 0 else 0
+        stats.record(statement, rows, seconds)
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute doesn't fire for failed statements; drop their start time
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_stats_start"):
+        connection.info["query_stats_start"].pop()
+
+
+def install():
+    """Register the cursor events on all engines (idempotent)."""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+        _installed = True
+
+
+def statement_totals() -> dict:
+    """Statements executed in this process by unit kind (request, job, untracked)."""
+    with _totals_lock:
+        return dict(_totals)
+
+
+def log_stats(stats: QueryStats, threshold: int = QUERY_STATS_N_PLUS_ONE):
+    """Log a finished unit's totals, and any statement it repeated often enough to be an N+1."""
+    level = logging.INFO if stats.statements >= QUERY_STATS_LOG_QUERIES else logging.DEBUG
+    logging.log(level, f"🗄️ {stats.name}: {stats.summary()}")
+    for sql, count in stats.repeated(threshold):
+        logging.warning(f"⚠️ N+1 suspected in {stats.name}: {count}x {' '.join(sql.split())[:200]}")
+
+
+@contextmanager
+def track(name: str, kind: str = KIND_REQUEST, log: bool = True):
+    """
+    Collect query statistics for the enclosed work.
+
+    Args:
+        name: Label used in logs, e.g. "GET /dashboard/7" or "job sync_user user 7"
+        kind: KIND_REQUEST or KIND_JOB
+        log: Log the totals and suspected N+1 statements on exit
+
+    Yields:
+        The QueryStats being filled in
+    """
+    install()
+    stats = QueryStats(name, kind, parent=_current.get())
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        if log:
+            log_stats(stats)
+
+
+@contextmanager
+def assert_max_queries(limit: int, name: str = "assert_max_queries"):
+    """
+    Test helper: fail if the enclosed code runs more than `limit` statements.
+
+    The AssertionError lists the most frequent statements, so an N+1 shows up in the message.
+    """
+    with track(name, log=False) as stats:
+        yield stats
+    assert stats.statements <= limit, f"{name}: expected at most {limit} queries, got {stats.describe()}"
+
+
+class QueryStatsMiddleware:
+    """ASGI middleware tracking each HTTP request; adds X-DB-* headers when `headers` is on."""
+
+    def __init__(self, app, headers: bool = QUERY_STATS_HEADERS):
+        self.app = app
+        self.add_headers = headers
+        install()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        with track(f"{scope['method']} {scope['path']}") as stats:
+            async def send_with_stats(message):
+                if self.add_headers and message["type"] == "http.response.start":
+                    message["headers"] = list(message.get("headers", [])) + stats.headers()
+                await send(message)
+
+            await self.app(scope, receive, send_with_stats)
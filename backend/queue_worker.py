@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Work queue worker processes.
+
+Drains per-user work items (sync, thresholds, UTL, resting HR) from the job_queue table.
+Any number of workers - on one machine or several - can run against the same database;
+items are leased with FOR UPDATE SKIP LOCKED so each is processed once.
+
+Usage:
+    python queue_worker.py --workers 4            # Run 4 worker processes until stopped
+    python queue_worker.py --lane interactive --poll-interval 1   # Dedicated interactive worker
+    python queue_worker.py --once                 # Drain ready items and exit
+    python queue_worker.py --stats                # Show queue depth
+    python queue_worker.py --enqueue sync_user --user_id 1
+"""
+import argparse
+import logging
+import multiprocessing
+import signal
+import time
+
+from config import SessionLocal, engine
+from job_queue import (
+    run_next, drain, queue_stats, lane_stats, enqueue, default_worker_id, TASK_REGISTRY, PRIORITY_HIGH
+)
+from upstream_budget import LANES
+import sync_tasks  # noqa: F401 - registers task handlers
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(processName)s - %(levelname)s - %(message)s')
+
+
+def worker_loop(worker_index: int, poll_interval: float, task_names=None, lanes=None):
+    """Lease and run items until SIGINT/SIGTERM; sleep when the queue is empty."""
+    # Connections must not be shared across forked processes
+    engine.dispose(close=False)
+
+    stopping = {"flag": False}
+
+    def handle_stop(signum, frame):
+        stopping["flag"] = True
+
+    signal.signal(signal.SIGINT, handle_stop)
+    signal.signal(signal.SIGTERM, handle_stop)
+
+    worker_id = f"{default_worker_id()}-w{worker_index}"
+    logging.info(f"👷 Worker {worker_id} started")
+    processed = 0
+
+    while not stopping["flag"]:
+        db = SessionLocal()
+        try:
+            outcome = run_next(db, worker_id, task_names, lanes)
+        except Exception as e:
+            logging.error(f"Worker {worker_id} error: {e}")
+            outcome = None
+        finally:
+            db.close()
+
+        if outcome is None:
+            time.sleep(poll_interval)
+        else:
+            processed += 1
+
+    logging.info(f"Worker {worker_id} stopped after {processed} jobs")
+
+
+def run_workers(num_workers: int, poll_interval: float, task_names=None, lanes=None):
+    if num_workers == 1:
+        worker_loop(0, poll_interval, task_names, lanes)
+        return
+
+    processes = [
+        multiprocessing.Process(target=worker_loop, args=(i, poll_interval, task_names, lanes), name=f"worker-{i}")
+        for i in range(num_workers)
+    ]
+    for process in processes:
+        process.start()
+
+    def forward_stop(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGINT, forward_stop)
+    signal.signal(signal.SIGTERM, forward_stop)
+
+    for process in processes:
+        process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TrainingLoad work queue worker')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--poll-interval', type=float, default=5.0, help='Seconds to wait when the queue is empty')
+    parser.add_argument('--task', action='append', choices=sorted(TASK_REGISTRY.keys()),
+                        help='Only run these tasks (repeatable)')
+    parser.add_argument('--lane', action='append', choices=LANES,
+                        help='Only run items in these priority lanes (repeatable)')
+    parser.add_argument('--once', action='store_true', help='Drain ready items and exit')
+    parser.add_argument('--stats', action='store_true', help='Show queue statistics')
+    parser.add_argument('--enqueue', choices=sorted(TASK_REGISTRY.keys()), help='Enqueue a task for --user_id')
+    parser.add_argument('--user_id', type=int, help='User ID for --enqueue')
+
+    args = parser.parse_args()
+
+    if args.stats:
+        db = SessionLocal()
+        try:
+            print(queue_stats(db))
+            print(lane_stats(db))
+        finally:
+            db.close()
+        return
+
+    if args.enqueue:
+        if not args.user_id:
+            print("--user_id required for --enqueue")
+            return
+        db = SessionLocal()
+        try:
+            added = enqueue(db, args.enqueue, user_id=args.user_id, priority=PRIORITY_HIGH,
+                            dedup_key=f"{args.enqueue}:{args.user_id}:manual")
+            print("Enqueued" if added else "Already pending")
+        finally:
+            db.close()
+        return
+
+    if args.once:
+        db = SessionLocal()
+        try:
+            summary = drain(db, max_jobs=10_000, task_names=args.task, lanes=args.lane)
+            print(f"Drained queue: {summary}")
+        finally:
+            db.close()
+        return
+
+    run_workers(args.workers, args.poll_interval, args.task, args.lane)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# Recommendation cache
+#
+# /recommendations used to rebuild the 5-day plan on every page view although its inputs only
+# change when activities, wellness or thresholds do. The payload is now stored per user with a
+# fingerprint of those inputs (plus today's date, since the ACWR windows slide daily):
+#
+# - hit: fingerprint matches and no change event arrived -> served from the table
+# - stale: inputs changed -> the previous payload is served immediately while an interactive
+#   lane refresh recomputes it (stale-while-revalidate), unless it is older than
+#   RECOMMENDATION_CACHE_MAX_STALE_HOURS, in which case it is recomputed inline
+# - miss: computed inline and stored
+#
+# Ingestion and rescoring publish data events (data_events.py); the subscriber below marks
+# the user's entry stale and queues a background refresh, and the nightly sync refreshes
+# cached users after syncing them, so the first view of the day is usually a hit.
+from sqlalchemy.orm import Session
+from sqlalchemy import select, func, true
+from fastapi.encoders import jsonable_encoder
+from datetime import datetime, timedelta
+from typing import Optional
+import hashlib
+import logging
+import time
+
+from config import SessionLocal, RECOMMENDATION_CACHE_MAX_STALE_HOURS
+from models import Activity, WellnessData, Threshold, RecommendationCache
+from athlete_snapshot import HISTORY_DAYS, ACUTE_DAYS
+from data_events import subscribe, ACTIVITIES_CHANGED, WELLNESS_CHANGED, THRESHOLDS_CHANGED
+from job_queue import enqueue, PRIORITY_INTERACTIVE, PRIORITY_NORMAL
+from training_recommendations import TrainingRecommendationEngine
+
+# Coalesce the burst of events a sync produces into one refresh
+REFRESH_DELAY_SECONDS = 30
+
+_default_engine = TrainingRecommendationEngine()
+
+
+def input_fingerprint(db: Session, user_id: int, now: datetime = None) -> str:
+    """
+    Hash of everything the recommendation engine reads, in one round trip: the 84-day
+    activity window (count, newest ID, UTL sum so rescoring counts), the wellness window,
+    the threshold row and today's date.
+    """
+    now = now or datetime.now()
+    activities = select(
+        func.count(Activity.activity_id).label("activity_count"),
+        func.max(Activity.activity_id).label("latest_activity_id"),
+        func.sum(Activity.utl_score).label("utl_sum"),
+    ).where(
+        Activity.user_id == user_id,
+        Activity.start_date >= now - timedelta(days=HISTORY_DAYS),
+        Activity.utl_score.isnot(None)
+    ).subquery()
+    wellness = select(
+        func.count(WellnessData.wellness_id).label("wellness_count"),
+        func.max(WellnessData.wellness_id).label("latest_wellness_id"),
+        func.max(WellnessData.date).label("latest_wellness_date"),
+    ).where(
+        WellnessData.user_id == user_id,
+        WellnessData.date >= (now - timedelta(days=ACUTE_DAYS)).date()
+    ).subquery()
+    threshold = select(
+        Threshold.threshold_id, Threshold.ftp_watts, Threshold.fthp_mps,
+        Threshold.max_hr, Threshold.resting_hr, Threshold.date_updated,
+    ).where(Threshold.user_id == user_id).limit(1).subquery()
+
+    row = db.execute(
+        select(activities, wellness, threshold)
+        .select_from(activities)
+        .join(wellness, true())
+        .outerjoin(threshold, true())
+    ).one()
+
+    values = list(row)
+    values[2] = round(values[2], 6) if values[2] is not None else None  # Drivers differ in float repr
+    raw = repr((now.date().isoformat(), *values))
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def _cache_info(row: RecommendationCache, status: str, now: datetime) -> dict:
+    return {
+        "status": status,
+        "computed_at": row.computed_at.isoformat() if row else None,
+        "age_seconds": round(max((now - row.computed_at).total_seconds(), 0), 1) if row else None,
+    }
+
+
+def refresh_recommendations(db: Session, user_id: int, engine: TrainingRecommendationEngine = None,
+                            only_if_cached: bool = False, force: bool = False) -> Optional[dict]:
+    """
+    Recompute and store a user's recommendations if their inputs changed.
+
+    Args:
+        only_if_cached: Skip users without a cache entry (they never opened recommendations)
+        force: Recompute even if the fingerprint is unchanged
+
+    Returns:
+        The (possibly unchanged) payload, or None if skipped
+    """
+    engine = engine or _default_engine
+    started = datetime.now()
+    row = db.get(RecommendationCache, user_id)
+    if row is None and only_if_cached:
+        return None
+
+    fingerprint = input_fingerprint(db, user_id, started)
+    if row is not None and not force and not row.stale and row.fingerprint == fingerprint:
+        return row.payload
+
+    timer = time.perf_counter()
+    result = jsonable_encoder(engine.generate_recommendations(user_id, db))
+    compute_ms = (time.perf_counter() - timer) * 1000
+
+    # Re-read under a row lock: an event that arrived while computing must keep the entry stale
+    row = db.query(RecommendationCache).filter_by(user_id=user_id).populate_existing().with_for_update().first()
+    if "error" in result:
+        if row is not None:
+            db.delete(row)  # Don't serve a plan built from data that no longer qualifies
+        db.commit()
+        return result
+
+    if row is None:
+        row = RecommendationCache(user_id=user_id)
+        db.add(row)
+    row.fingerprint = fingerprint
+    row.payload = result
+    row.computed_at = started
+    row.compute_ms = round(compute_ms, 1)
+    row.stale = bool(row.invalidated_at and row.invalidated_at > started)
+    db.commit()
+    return result
+
+
+def get_recommendations(db: Session, user_id: int, engine: TrainingRecommendationEngine = None,
+                        refresh: bool = False):
+    """
+    Cached recommendations for the API.
+
+    Returns:
+        (payload, cache_info) where cache_info["status"] is 'hit', 'stale', 'miss' or 'refreshed'
+    """
+    now = datetime.now()
+    row = None if refresh else db.get(RecommendationCache, user_id)
+
+    if row is not None:
+        if not row.stale and row.fingerprint == input_fingerprint(db, user_id, now):
+            return row.payload, _cache_info(row, "hit", now)
+
+        if now - row.computed_at <= timedelta(hours=RECOMMENDATION_CACHE_MAX_STALE_HOURS):
+            # Serve the previous plan now; the interactive lane recomputes it within seconds
+            enqueue(db, "refresh_recommendations", user_id=user_id, priority=PRIORITY_INTERACTIVE,
+                    dedup_key=f"refresh_recommendations:{user_id}:interactive")
+            info = _cache_info(row, "stale", now)
+            info["refresh"] = "pending"
+            return row.payload, info
+
+    payload = refresh_recommendations(db, user_id, engine, force=refresh)
+    row = db.get(RecommendationCache, user_id)
+    return payload, _cache_info(row, "refreshed" if refresh else "miss", now)
+
+
+@subscribe(ACTIVITIES_CHANGED, WELLNESS_CHANGED, THRESHOLDS_CHANGED)
+def invalidate_recommendations(user_id: int, event: str):
+    """Mark a user's cached plan stale and queue a background refresh (cached users only)."""
+    db = SessionLocal()
+    try:
+        now = datetime.now()
+        updated = db.query(RecommendationCache).filter_by(user_id=user_id).update(
+            {"stale": True, "invalidated_at": now}, synchronize_session=False
+        )
+        db.commit()
+        if updated:
+            enqueue(db, "refresh_recommendations", user_id=user_id, priority=PRIORITY_NORMAL,
+                    dedup_key=f"refresh_recommendations:{user_id}", delay_seconds=REFRESH_DELAY_SECONDS)
+            logging.debug(f"Recommendations for user {user_id} invalidated by {event}")
+    finally:
+        db.close()
+
@@ -10,8 +10,11 @@ import sys
 import os
 sys.path.append('/Users/adam/src/TrainingLoad/backend')
 
-from config import engine
-from sqlalchemy import text
+from config import engine, SessionLocal
+from metrics import cpu_timed
+from sqlalchemy import text, bindparam
+from activity_metrics import backfill_activity_metrics, STREAM_YIELD_PER
+from data_events import publish, THRESHOLDS_CHANGED
 from streams_analysis import estimate_ftp_from_streams, estimate_functional_threshold_pace_from_streams
 import json
 import logging
@@ -39,6 +42,7 @@ class ResearchBasedThresholdCalculator:
             ("critical_speed", 1.0, "Critical speed modeling")
         ]
     
+    @cpu_timed("calculate_cycling_ftp_from_streams")
     def calculate_cycling_ftp_from_streams(self, power_data: List[int], time_data: List[int]) -> Dict:
         """
         Calculate FTP using multiple research-based methods and return comprehensive analysis.
@@ -118,6 +122,7 @@ class ResearchBasedThresholdCalculator:
         
         return results
     
+    @cpu_timed("calculate_running_threshold_from_streams")
     def calculate_running_threshold_from_streams(self, speed_data: List[float], time_data: List[int]) -> Dict:
         """
         Calculate running threshold using multiple research-based methods.
@@ -389,130 +394,102 @@ def calculate_initial_thresholds_for_new_user(user_id: int) -> Dict:
     Calculate initial thresholds for a new user using all their historical activities with stream analysis.
     This provides the most accurate initial threshold estimates using research-based methods.
     """
+    # Activities imported before activity_metrics existed get their rows first
+    db = SessionLocal()
+    try:
+        backfill_activity_metrics(db, user_id)
+    finally:
+        db.close()
+
     try:
         with engine.connect() as conn:
-            # Get all activities for this user that have streams data
+            # Pick candidates from the activity_metrics flags; only their streams JSON is loaded
             result = conn.execute(text("""
-                SELECT a.strava_activity_id, a.type, a.moving_time, a.distance, 
-                       a.average_speed, a.data
+                SELECT a.activity_id, a.strava_activity_id, a.type, a.moving_time, a.distance,
+                       m.has_watts, m.watts_samples, m.has_velocity, m.velocity_samples
                 FROM activities a
+                JOIN activity_metrics m ON m.activity_id = a.activity_id
                 WHERE a.user_id = :user_id
-                  AND a.data IS NOT NULL
-                  AND a.data::json->'streams' IS NOT NULL
+                  AND m.has_streams
                   AND a.moving_time > 600  -- At least 10 minutes
                 ORDER BY a.start_date DESC
             """), {"user_id": user_id})
             
-            activities = result.fetchall()
+            candidates = result.fetchall()
             
-            if not activities:
+            if not candidates:
                 logging.warning(f"No activities with streams found for new user {user_id}")
                 return {}
             
+            # Cycling activities with power data and running activities with speed data (sufficient samples)
+            cycling_candidates = [c for c in candidates
+                                  if c.type in ['Ride', 'VirtualRide'] and c.has_watts and c.watts_samples > 100]
+            running_candidates = [c for c in candidates
+                                  if c.type in ['Run', 'VirtualRun'] and c.has_velocity and c.velocity_samples > 100]
+            selected = cycling_candidates[:10] + running_candidates[:10]  # Top 10 recent activities of each
+            logging.info(f"Found {len(cycling_candidates)} cycling and {len(running_candidates)} running activities with streams")
+
             calculator = ResearchBasedThresholdCalculator()
-            cycling_activities = []
-            running_activities = []
-            
-            # Process each activity's streams
-            for activity in activities:
-                activity_id, activity_type, moving_time, distance, avg_speed, data = activity
-                
-                if not data or 'streams' not in data or not data['streams']:
-                    continue
-                    
-                streams = data['streams']
-                
-                # Collect cycling activities with power data
-                if activity_type in ['Ride', 'VirtualRide'] and 'watts' in streams:
-                    power_data = streams['watts']['data']
-                    time_data = streams['time']['data'] if 'time' in streams else list(range(len(power_data)))
-                    
-                    if power_data and len(power_data) > 100:  # Sufficient data
-                        cycling_activities.append({
-                            'power_data': power_data,
-                            'time_data': time_data,
-                            'activity_type': activity_type,
-                            'moving_time': moving_time,
-                            'activity_id': activity_id
-                        })
-                
-                # Collect running activities with speed/pace data
-                if activity_type in ['Run', 'VirtualRun'] and 'velocity_smooth' in streams:
-                    velocity_data = streams['velocity_smooth']['data']
-                    time_data = streams['time']['data'] if 'time' in streams else list(range(len(velocity_data)))
-                    
-                    if velocity_data and len(velocity_data) > 100:  # Sufficient data
-                        running_activities.append({
-                            'velocity_data': velocity_data,
-                            'time_data': time_data,
-                            'activity_type': activity_type,
-                            'moving_time': moving_time,
-                            'distance': distance,
-                            'activity_id': activity_id
-                        })
-            
+            candidates_by_id = {c.activity_id: c for c in selected}
             estimates = {}
-            
-            # Calculate cycling FTP using research-based methods
-            if cycling_activities:
-                logging.info(f"Analyzing {len(cycling_activities)} cycling activities for FTP estimation")
-                best_ftp = 0
-                best_analysis = None
-                
-                for activity in cycling_activities[:10]:  # Analyze top 10 recent activities
-                    try:
-                        analysis = calculator.calculate_cycling_ftp_from_streams(
-                            activity['power_data'], 
-                            activity['time_data']
-                        )
-                        
+            best_ftp, best_ftp_analysis = 0, None
+            best_threshold, best_threshold_analysis = 0, None
+
+            # Stream the selected rows (newest first, as ranked) and analyze each as it arrives, so
+            # only one activity's streams JSON is held at a time
+            rows = conn.execution_options(stream_results=True, yield_per=STREAM_YIELD_PER).execute(
+                text("""
+                    SELECT activity_id, data FROM activities WHERE activity_id IN :ids
+                    ORDER BY start_date DESC
+                """).bindparams(bindparam("ids", expanding=True)),
+                {"ids": [c.activity_id for c in selected]}
+            ) if selected else []
+            for activity_id, data in rows:
+                candidate = candidates_by_id[activity_id]
+                streams = (data or {}).get('streams') or {}
+                try:
+                    if candidate.type in ['Ride', 'VirtualRide']:
+                        power_data = streams['watts']['data']
+                        time_data = streams['time']['data'] if 'time' in streams else list(range(len(power_data)))
+                        analysis = calculator.calculate_cycling_ftp_from_streams(power_data, time_data)
+
                         if analysis.get('recommended_ftp', 0) > best_ftp:
                             best_ftp = analysis['recommended_ftp']
-                            best_analysis = analysis
-                            
-                        logging.info(f"Activity {activity['activity_id']}: FTP estimate {analysis.get('recommended_ftp', 0)}W")
-                    except Exception as e:
-                        logging.warning(f"Could not analyze activity {activity['activity_id']}: {e}")
-                
-                if best_ftp > 0:
-                    estimates['ftp_watts'] = best_ftp
-                    logging.info(f"Best FTP estimate: {best_ftp}W using {best_analysis.get('method_used', 'stream analysis')}")
-            
-            # Calculate running threshold using research-based methods
-            if running_activities:
-                logging.info(f"Analyzing {len(running_activities)} running activities for threshold pace estimation")
-                best_threshold = 0
-                best_analysis = None
-                
-                for activity in running_activities[:10]:  # Analyze top 10 recent activities
-                    try:
-                        analysis = calculator.calculate_running_threshold_from_streams(
-                            activity['velocity_data'],
-                            activity['time_data']
-                        )
-                        
+                            best_ftp_analysis = analysis
+
+                        logging.info(f"Activity {candidate.strava_activity_id}: FTP estimate {analysis.get('recommended_ftp', 0)}W")
+                    else:
+                        velocity_data = streams['velocity_smooth']['data']
+                        time_data = streams['time']['data'] if 'time' in streams else list(range(len(velocity_data)))
+                        analysis = calculator.calculate_running_threshold_from_streams(velocity_data, time_data)
+
                         if analysis.get('recommended_threshold_mps', 0) > best_threshold:
                             best_threshold = analysis['recommended_threshold_mps']
-                            best_analysis = analysis
-                            
+                            best_threshold_analysis = analysis
+
                         pace_min_km = (1000 / analysis.get('recommended_threshold_mps', 1)) / 60 if analysis.get('recommended_threshold_mps', 0) > 0 else 0
-                        logging.info(f"Activity {activity['activity_id']}: Threshold estimate {analysis.get('recommended_threshold_mps', 0):.2f} m/s ({pace_min_km:.1f} min/km)")
-                    except Exception as e:
-                        logging.warning(f"Could not analyze activity {activity['activity_id']}: {e}")
-                
-                if best_threshold > 0:
-                    estimates['fthp_mps'] = best_threshold
-                    pace_min_km = (1000 / best_threshold) / 60
-                    logging.info(f"Best threshold pace estimate: {best_threshold:.2f} m/s ({pace_min_km:.1f} min/km) using {best_analysis.get('method_used', 'stream analysis')}")
+                        logging.info(f"Activity {candidate.strava_activity_id}: Threshold estimate {analysis.get('recommended_threshold_mps', 0):.2f} m/s ({pace_min_km:.1f} min/km)")
+                except Exception as e:
+                    logging.warning(f"Could not analyze activity {candidate.strava_activity_id}: {e}")
+
+            # Cycling FTP and running threshold pace: the best research-based estimate of each
+            if best_ftp > 0:
+                estimates['ftp_watts'] = best_ftp
+                logging.info(f"Best FTP estimate: {best_ftp}W using {best_ftp_analysis.get('method_used', 'stream analysis')}")
+
+            if best_threshold > 0:
+                estimates['fthp_mps'] = best_threshold
+                pace_min_km = (1000 / best_threshold) / 60
+                logging.info(f"Best threshold pace estimate: {best_threshold:.2f} m/s ({pace_min_km:.1f} min/km) using {best_threshold_analysis.get('method_used', 'stream analysis')}")
             
             # Estimate heart rate values from activity data if available
             try:
                 hr_result = conn.execute(text("""
-                    SELECT MAX((a.data::json->>'max_heartrate')::float::int) as max_hr
+                    SELECT MAX(m.max_heartrate::int) as max_hr
                     FROM activities a
+                    JOIN activity_metrics m ON m.activity_id = a.activity_id
                     WHERE a.user_id = :user_id
-                      AND a.data::json->>'max_heartrate' IS NOT NULL
-                      AND (a.data::json->>'max_heartrate')::float > 120
+                      AND m.max_heartrate > 120
                 """), {"user_id": user_id})
                 
                 hr_row = hr_result.fetchone()
@@ -560,6 +537,7 @@ def update_user_ftp(user_id: int, ftp_watts: float, method: str):
                 WHERE user_id = :user_id
             """), {"ftp_watts": ftp_watts, "method": method, "user_id": user_id})
             conn.commit()
+        publish(THRESHOLDS_CHANGED, user_id)
     except Exception as e:
         print(f"Error updating FTP: {e}")
 
@@ -575,6 +553,7 @@ def update_user_fthp(user_id: int, fthp_mps: float, method: str):
                 WHERE user_id = :user_id
             """), {"fthp_mps": fthp_mps, "method": method, "user_id": user_id})
             conn.commit()
+        publish(THRESHOLDS_CHANGED, user_id)
     except Exception as e:
         print(f"Error updating FTHP: {e}")
 
@@ -596,23 +575,21 @@ def recalculate_all_thresholds_from_streams(user_id: int, lookback_days: int = 3
         calculator = ResearchBasedThresholdCalculator()
         
         with engine.connect() as conn:
-            # Get all activities with streams data
-            result = conn.execute(text("""
+            # Get all activities with streams data, streamed a few rows at a time rather than fetched at once
+            result = conn.execution_options(stream_results=True, yield_per=STREAM_YIELD_PER).execute(text("""
                 SELECT a.activity_id, a.name, a.type, a.start_date, a.data::json as activity_data
                 FROM activities a
                 WHERE a.user_id = :user_id 
                   AND a.data::json->'streams' IS NOT NULL
-                  AND a.start_date > CURRENT_DATE - INTERVAL :lookback_days DAY
+                  AND a.start_date > CURRENT_DATE - make_interval(days => :lookback_days)
                 ORDER BY a.start_date DESC
             """), {"user_id": user_id, "lookback_days": lookback_days})
             
-            activities = result.fetchall()
-            results['activities_analyzed'] = len(activities)
-            
             best_ftp = None
             best_fthp = None
             
-            for activity in activities:
+            for activity in result:
+                results['activities_analyzed'] += 1
                 activity_id, name, activity_type, start_date, activity_data = activity
                 streams = activity_data.get('streams', {})
                 
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for Strava push events.
+
+Two pieces let the webhook flow run end-to-end without Strava:
+
+    # 1. Serve a fake Strava API with synthetic activities + streams
+    python strava_event_simulator.py serve-stub --port 8089
+
+    # 2. Point the backend at it and enable webhooks
+    STRAVA_API_BASE_URL=http://localhost:8089/api/v3 STRAVA_WEBHOOKS_ENABLED=true uvicorn main:app
+
+    # 3. Fire a burst of events at the webhook receiver
+    python strava_event_simulator.py send --owner-id 12345 --activities 3 --updates 4 --delete 1
+
+Only the standard library is used so the simulator runs anywhere the backend does.
+"""
+import argparse
+import json
+import logging
+import math
+import random
+import time
+import urllib.request
+import zlib
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ACTIVITY_TYPES = ["Ride", "Run", "VirtualRide", "Walk"]
+
+
+def synthetic_activity(activity_id: int, seed: int = 0) -> dict:
+    """Deterministic activity summary for a given id."""
+    rng = random.Random(activity_id * 7919 + seed)
+    activity_type = rng.choice(ACTIVITY_TYPES)
+    moving_time = rng.randint(20, 150) * 60
+    speed = {"Ride": 8.0, "VirtualRide": 9.0, "Run": 3.2, "Walk": 1.4}[activity_type] * rng.uniform(0.85, 1.15)
+    start = datetime.now(timezone.utc) - timedelta(hours=rng.randint(1, 48))
+    summary = {
+        "id": activity_id,
+        "name": f"Synthetic {activity_type} {activity_id}",
+        "type": activity_type,
+        "distance": round(speed * moving_time, 1),
+        "moving_time": moving_time,
+        "elapsed_time": moving_time + rng.randint(0, 600),
+        "start_date": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "average_speed": round(speed, 3),
+        "max_speed": round(speed * 1.6, 3),
+        "total_elevation_gain": round(rng.uniform(0, 800), 1),
+        "average_heartrate": rng.randint(120, 160),
+    }
+    if activity_type in ("Ride", "VirtualRide"):
+        summary["average_watts"] = rng.randint(150, 260)
+    return summary
+
+
+def synthetic_streams(activity: dict, seed: int = 0) -> dict:
+    """1 Hz streams (key_by_type format) consistent with the summary."""
+    rng = random.Random(activity["id"] * 104729 + seed)
+    n = activity["moving_time"]
+    avg_hr = activity.get("average_heartrate", 140)
+    time_data = list(range(n))
+    heartrate = [int(avg_hr + 8 * math.sin(i / 300.0) + rng.uniform(-3, 3)) for i in time_data]
+    velocity = [max(0.0, activity["average_speed"] * (1 + 0.1 * math.sin(i / 120.0)) + rng.uniform(-0.2, 0.2)) for i in time_data]
+    distance = []
+    total = 0.0
+    for v in velocity:
+        total += v
+        distance.append(round(total, 1))
+
+    streams = {
+        "time": {"data": time_data, "series_type": "time", "original_size": n, "resolution": "high"},
+        "heartrate": {"data": heartrate, "series_type": "time", "original_size": n, "resolution": "high"},
+        "velocity_smooth": {"data": [round(v, 2) for v in velocity], "series_type": "time", "original_size": n, "resolution": "high"},
+        "distance": {"data": distance, "series_type": "time", "original_size": n, "resolution": "high"},
+    }
+    if "average_watts" in activity:
+        avg_w = activity["average_watts"]
+        watts = [max(0, int(avg_w + 40 * math.sin(i / 90.0) + rng.uniform(-15, 15))) for i in time_data]
+        streams["watts"] = {"data": watts, "series_type": "time", "original_size": n, "resolution": "high"}
+    return streams
+
+
+def athlete_feed_ids(access_token: str, feed_size: int) -> list:
+    """
+    Activity ids in an athlete's feed, derived from their access token so every user gets their
+    own activities (tokens ending in a number, e.g. "loadtest-42", map to that number).
+    """
+    digits = access_token[len(access_token.rstrip("0123456789")):]
+    athlete = int(digits) if digits else zlib.crc32(access_token.encode())
+    return [athlete * feed_size + i + 1 for i in range(feed_size)]
+
+
+class StubStravaHandler(BaseHTTPRequestHandler):
+    """Serves /api/v3/activities/{id}, /api/v3/activities/{id}/streams and /api/v3/athlete/activities."""
+
+    seed = 0
+    feed_size = 0  # Activities on the first page of each athlete's feed
+    deleted = set()
+    request_count = 0
+
+    def _send_json(self, status: int, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        StubStravaHandler.request_count += 1
+        path = self.path.split("?")[0].rstrip("/")
+        parts = path.split("/")
+
+        # /api/v3/activities/{id}[/streams]
+        if len(parts) >= 5 and parts[3] == "activities" and parts[4].isdigit():
+            activity_id = int(parts[4])
+            if activity_id in self.deleted:
+                return self._send_json(404, {"message": "Record Not Found"})
+            activity = synthetic_activity(activity_id, self.seed)
+            if len(parts) == 6 and parts[5] == "streams":
+                return self._send_json(200, synthetic_streams(activity, self.seed))
+            return self._send_json(200, activity)
+
+        # /api/v3/athlete/activities - empty unless feed_size is set (reconciliation sweeps find nothing new)
+        if path.endswith("/athlete/activities"):
+            if not self.feed_size or "page=1" not in self.path.split("?")[-1].split("&"):
+                return self._send_json(200, [])
+            token = self.headers.get("Authorization", "").replace("Bearer ", "")
+            return self._send_json(200, [synthetic_activity(activity_id, self.seed)
+                                         for activity_id in athlete_feed_ids(token, self.feed_size)])
+
+        self._send_json(404, {"message": "Not Found"})
+
+    def log_message(self, format, *args):
+        logging.info(f"stub strava: {format % args}")
+
+
+def serve_stub(port: int, seed: int, feed_size: int = 0, quiet: bool = False):
+    StubStravaHandler.seed = seed
+    StubStravaHandler.feed_size = feed_size
+    if quiet:
+        StubStravaHandler.log_message = lambda self, format, *args: None
+    server = ThreadingHTTPServer(("0.0.0.0", port), StubStravaHandler)
+    logging.info(f"🧪 Stub Strava API listening on http://localhost:{port}/api/v3")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logging.info(f"Stub Strava API served {StubStravaHandler.request_count} requests")
+
+
+def build_event_burst(owner_id: int, activity_ids, updates_per_activity: int = 0, delete_count: int = 0,
+                      subscription_id: int = 1):
+    """
+    Build the sequence of events Strava would send: a create per activity, followed by
+    title/type edits, with the last `delete_count` activities deleted at the end.
+    """
+    now = int(time.time())
+    events = []
+    for activity_id in activity_ids:
+        events.append({
+            "object_type": "activity", "object_id": activity_id, "aspect_type": "create",
+            "owner_id": owner_id, "subscription_id": subscription_id, "event_time": now, "updates": {},
+        })
+        for i in range(updates_per_activity):
+            events.append({
+                "object_type": "activity", "object_id": activity_id, "aspect_type": "update",
+                "owner_id": owner_id, "subscription_id": subscription_id, "event_time": now + i + 1,
+                "updates": {"title": f"Edited title {i + 1}"},
+            })
+    for activity_id in list(activity_ids)[len(activity_ids) - delete_count:] if delete_count else []:
+        events.append({
+            "object_type": "activity", "object_id": activity_id, "aspect_type": "delete",
+            "owner_id": owner_id, "subscription_id": subscription_id, "event_time": now + 60, "updates": {},
+        })
+    return events
+
+
+def send_events(target: str, events, interval: float = 0.0):
+    """POST events to the webhook receiver; returns the list of responses."""
+    responses = []
+    for event in events:
+        request = urllib.request.Request(
+            target, data=json.dumps(event).encode(),
+            headers={"Content-Type": "application/json"}, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=5) as resp:
+            payload = json.loads(resp.read().decode() or "{}")
+            responses.append(payload)
+            logging.info(f"{event['aspect_type']:>6} activity {event['object_id']}: {payload.get('message')}")
+        if interval:
+            time.sleep(interval)
+    return responses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Strava webhook event simulator")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    stub = subparsers.add_parser("serve-stub", help="Serve a fake Strava API")
+    stub.add_argument("--port", type=int, default=8089)
+    stub.add_argument("--seed", type=int, default=0)
+    stub.add_argument("--feed-size", type=int, default=0, help="Activities in each athlete's feed (onboarding imports)")
+
+    send = subparsers.add_parser("send", help="Send a burst of webhook events")
+    send.add_argument("--target", default="http://localhost:8000/webhooks/strava")
+    send.add_argument("--owner-id", type=int, required=True, help="Strava athlete id (User.strava_user_id)")
+    send.add_argument("--activities", type=int, default=1)
+    send.add_argument("--updates", type=int, default=2, help="Update events per activity")
+    send.add_argument("--delete", type=int, default=0, help="Delete the last N activities")
+    send.add_argument("--first-id", type=int, default=None)
+    send.add_argument("--interval", type=float, default=0.0, help="Seconds between events")
+
+    args = parser.parse_args()
+
+    if args.command == "serve-stub":
+        serve_stub(args.port, args.seed, args.feed_size)
+    elif args.command == "send":
+        first_id = args.first_id or int(time.time())
+        activity_ids = [first_id + i for i in range(args.activities)]
+        events = build_event_burst(args.owner_id, activity_ids, args.updates, args.delete)
+        send_events(args.target, events, args.interval)
+        logging.info(f"Sent {len(events)} events for {len(activity_ids)} activities")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# Strava webhook receiver (push-based ingestion)
+#
+# Strava sends one small POST per activity create/update/delete. Rather than fetching on
+# every event, each event goes straight onto the durable work queue as one debounced
+# sync_strava_activity item per activity: every new event pushes the item back until the
+# activity has been quiet for WEBHOOK_DEBOUNCE_SECONDS (at most WEBHOOK_MAX_WAIT_SECONDS after its
+# first event), so a burst (upload followed by title/description edits) results in a single
+# summary + streams fetch, and pending events survive restarts and deploys.
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+from typing import Optional, Dict, Any
+import logging
+
+from models import User, JobQueueItem
+from config import get_db, STRAVA_WEBHOOK_VERIFY_TOKEN
+from job_queue import enqueue, PRIORITY_HIGH
+import sync_tasks  # noqa: F401 - registers the sync_strava_activity handler
+
+router = APIRouter()
+
+# Seconds an activity must be quiet before its queued item runs
+WEBHOOK_DEBOUNCE_SECONDS = 60
+# Upper bound on how long a continuously-edited activity can be held back
+WEBHOOK_MAX_WAIT_SECONDS = 300
+
+
+class StravaWebhookEvent(BaseModel):
+    object_type: str
+    object_id: int
+    aspect_type: str
+    owner_id: int
+    subscription_id: Optional[int] = None
+    event_time: Optional[int] = None
+    updates: Optional[Dict[str, Any]] = None
+
+
+def queue_activity_event(db: Session, event: StravaWebhookEvent) -> Optional[bool]:
+    """
+    Debounce an activity event on the work queue, keyed by activity. A delete always wins:
+    later updates merge a payload without an action, so they never turn it back into a fetch.
+    An event for an activity whose item is already running queues it again afterwards.
+
+    Returns:
+        True if it started a new item, False if it was coalesced, None for an unknown athlete
+    """
+    user = db.query(User.user_id).filter_by(strava_user_id=str(event.owner_id)).first()
+    if not user:
+        logging.warning(f"Webhook event for unknown Strava athlete {event.owner_id}")
+        return None
+
+    payload = {"strava_activity_id": str(event.object_id)}
+    if event.aspect_type == "delete":
+        payload["action"] = "delete"
+    return enqueue(
+        db, "sync_strava_activity", user_id=user.user_id, payload=payload, priority=PRIORITY_HIGH,
+        dedup_key=f"sync_strava_activity:{event.object_id}",
+        delay_seconds=WEBHOOK_DEBOUNCE_SECONDS, debounce_max_seconds=WEBHOOK_MAX_WAIT_SECONDS,
+    )
+
+
+@router.get("/strava")
+def verify_strava_subscription(
+    hub_mode: str = Query(None, alias="hub.mode"),
+    hub_challenge: str = Query(None, alias="hub.challenge"),
+    hub_verify_token: str = Query(None, alias="hub.verify_token"),
+):
+    """Subscription validation handshake: echo hub.challenge if the verify token matches."""
+    if hub_mode != "subscribe" or not hub_challenge:
+        raise HTTPException(status_code=400, detail="Invalid subscription request")
+    if not STRAVA_WEBHOOK_VERIFY_TOKEN or hub_verify_token != STRAVA_WEBHOOK_VERIFY_TOKEN:
+        raise HTTPException(status_code=403, detail="Verify token mismatch")
+    return {"hub.challenge": hub_challenge}
+
+
+@router.post("/strava")
+def receive_strava_event(event: StravaWebhookEvent, db: Session = Depends(get_db)):
+    """
+    Accept a Strava push event. Strava expects a 200 within 2 seconds, so the event is only
+    queued here (one indexed upsert); a queue worker fetches the activity once it settles.
+    """
+    if event.object_type != "activity":
+        # Athlete events (e.g. deauthorization) are not handled yet
+        return {"message": "Event ignored", "object_type": event.object_type}
+
+    if event.aspect_type not in ("create", "update", "delete"):
+        return {"message": "Event ignored", "aspect_type": event.aspect_type}
+
+    queued = queue_activity_event(db, event)
+    if queued is None:
+        return {"message": "Event ignored", "owner_id": event.owner_id}
+    return {"message": "Event queued" if queued else "Event coalesced", "pending": _pending(db)}
+
+
+def _pending(db: Session) -> int:
+    return db.query(JobQueueItem).filter(
+        JobQueueItem.task_name == "sync_strava_activity", JobQueueItem.status == "queued"
+    ).count()
+
+
+@router.get("/strava/pending")
+def get_pending_events(db: Session = Depends(get_db)):
+    """Number of activity events queued and not yet fetched."""
+    return {"pending": _pending(db)}
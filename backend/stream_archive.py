@@ -0,0 +1,329 @@
+# Memory-mapped columnar archive of activity streams
+#
+# Offline analysis (tests/analyze_*.py, threshold and scaling research) used to query Postgres and
+# parse every activity's streams JSON on each run. An archive is exported once and read without a
+# database: each stream channel is one contiguous binary file holding every activity's samples
+# back to back, and a small index gives each activity's metadata and its offset and length in
+# every channel. Channel files are opened with np.memmap, so an activity's streams are zero-copy
+# NumPy views and only the pages actually read are loaded.
+#
+# Layout of an archive directory:
+#     manifest.json       format version, channels (dtype, columns), activity and sample counts
+#     index.npz           per-activity arrays: activity_id, user_id, strava_activity_id, type,
+#                         start_date, moving_time, and (activities x channels) starts / lengths
+#     <channel>.bin       raw little-endian samples of one channel (e.g. watts.bin)
+#
+# Export with `python stream_archive.py export [PATH] [--user_id=N] [--since=YYYY-MM-DD]`
+# (PATH defaults to STREAM_ARCHIVE_DIR) and load with StreamArchive(PATH). StreamArchiveWriter builds
+# an archive from other sources (synthetic_athletes.py writes generated streams straight into one).
+import argparse
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from models import Activity
+from activity_metrics import STREAM_YIELD_PER
+
+ARCHIVE_VERSION = 1
+# Strava stream key -> (dtype, columns). Sensor channels are float32 (integer bpm/watts stay exact);
+# time, distance and positions keep float64. Missing samples (null in the JSON) are NaN.
+CHANNELS = {
+    "time": ("<f8", 1),
+    "distance": ("<f8", 1),
+    "latlng": ("<f8", 2),
+    "altitude": ("<f4", 1),
+    "velocity_smooth": ("<f4", 1),
+    "heartrate": ("<f4", 1),
+    "cadence": ("<f4", 1),
+    "watts": ("<f4", 1),
+    "temp": ("<f4", 1),
+    "grade_smooth": ("<f4", 1),
+    "moving": ("|u1", 1),
+}
+
+
+def _channel_array(name: str, data) -> np.ndarray:
+    dtype, columns = CHANNELS[name]
+    values = np.asarray(data, dtype=float)  # None -> NaN
+    if columns > 1:
+        values = values.reshape(-1, columns)
+    return values.astype(dtype)
+
+
+def _archive_files() -> set:
+    return {"manifest.json", "index.npz", *(f"{name}.bin" for name in CHANNELS)}
+
+
+def _check_replaceable(path: str, partial: bool = False):
+    """
+    Refuse to delete anything at `path` but an archive: a missing path or an empty directory, a
+    directory holding this format's manifest.json, or (`partial`, for the .tmp directory of an
+    interrupted export) one holding nothing but archive files.
+
+    Raises:
+        ValueError: if `path` is something else
+    """
+    if not os.path.lexists(path):
+        return
+    if os.path.isdir(path) and not os.path.islink(path):
+        entries = set(os.listdir(path))
+        if not entries or (partial and entries <= _archive_files()):
+            return
+        try:
+            with open(os.path.join(path, "manifest.json")) as f:
+                manifest = json.load(f)
+            if isinstance(manifest, dict) and "version" in manifest and "channels" in manifest:
+                return
+        except (OSError, ValueError):
+            pass
+    raise ValueError(f"{path} exists and is not a stream archive; refusing to replace it")
+
+
+class StreamArchiveWriter:
+    """
+    Builds an archive at `path` one activity at a time; close() writes the index and moves the
+    finished archive into place (replacing any archive there, but nothing else). Used as a
+    context manager.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        _check_replaceable(self.path)
+        _check_replaceable(self.tmp_path, partial=True)
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.names = list(CHANNELS)
+        self.files = {name: open(os.path.join(self.tmp_path, f"{name}.bin"), "wb") for name in self.names}
+        self.totals = dict.fromkeys(self.names, 0)
+        self.index = {key: [] for key in ("activity_id", "user_id", "strava_activity_id", "type", "start_date", "moving_time")}
+        self.starts, self.lengths = [], []
+
+    def add(self, activity_id: int, user_id: int, strava_activity_id: Optional[str], activity_type: Optional[str],
+            start_date: Optional[datetime], moving_time: Optional[int], streams: dict):
+        """
+        Append one activity. `streams` maps channel names to Strava's key_by_type entries
+        ({"data": [...]}) or directly to arrays; unknown channels are ignored.
+        """
+        row_starts, row_lengths = [], []
+        for name in self.names:
+            data = streams.get(name)
+            if isinstance(data, dict):
+                data = data.get('data')
+            values = _channel_array(name, data) if data is not None and len(data) else None
+            row_starts.append(self.totals[name])
+            row_lengths.append(0 if values is None else len(values))
+            if values is not None:
+                values.tofile(self.files[name])
+                self.totals[name] += len(values)
+        self.starts.append(row_starts)
+        self.lengths.append(row_lengths)
+        self.index["activity_id"].append(activity_id)
+        self.index["user_id"].append(user_id)
+        self.index["strava_activity_id"].append(strava_activity_id or "")
+        self.index["type"].append(activity_type or "")
+        self.index["start_date"].append(np.datetime64(start_date, "s") if start_date else np.datetime64("NaT"))
+        self.index["moving_time"].append(moving_time or 0)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def close(self) -> int:
+        """Finish the archive; returns the number of activities written."""
+        for handle in self.files.values():
+            handle.close()
+        count = len(self.starts)
+        np.savez(
+            os.path.join(self.tmp_path, "index.npz"),
+            activity_id=np.array(self.index["activity_id"], dtype=np.int64),
+            user_id=np.array(self.index["user_id"], dtype=np.int64),
+            strava_activity_id=np.array(self.index["strava_activity_id"], dtype=str),
+            type=np.array(self.index["type"], dtype=str),
+            start_date=np.array(self.index["start_date"], dtype="datetime64[s]"),
+            moving_time=np.array(self.index["moving_time"], dtype=np.int64),
+            starts=np.array(self.starts, dtype=np.int64).reshape(count, len(self.names)),
+            lengths=np.array(self.lengths, dtype=np.int64).reshape(count, len(self.names)),
+        )
+        with open(os.path.join(self.tmp_path, "manifest.json"), "w") as f:
+            json.dump({
+                "version": ARCHIVE_VERSION,
+                "created_at": datetime.now().isoformat(),
+                "activities": count,
+                "channels": {name: {"dtype": CHANNELS[name][0], "columns": CHANNELS[name][1],
+                                    "samples": self.totals[name]} for name in self.names},
+            }, f, indent=2)
+        _check_replaceable(self.path)  # Again: the path may have been created while exporting
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp_path, self.path)
+        return count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            for handle in self.files.values():
+                handle.close()
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+def export_stream_archive(db: Session, path: str, user_id: int = None, since: datetime = None) -> int:
+    """
+    Write every activity with streams (optionally one user's, or those starting on or after
+    `since`) to an archive at `path`, replacing any archive there. Rows are streamed
+    STREAM_YIELD_PER at a time and written as they arrive; the archive appears at `path` only once
+    complete.
+
+    Returns:
+        Number of activities archived
+    """
+    query = db.query(
+        Activity.activity_id, Activity.user_id, Activity.strava_activity_id, Activity.type,
+        Activity.start_date, Activity.moving_time, Activity.data,
+    )
+    if user_id is not None:
+        query = query.filter(Activity.user_id == user_id)
+    if since is not None:
+        query = query.filter(Activity.start_date >= since)
+    query = query.order_by(Activity.user_id, Activity.start_date, Activity.activity_id)
+
+    with StreamArchiveWriter(path) as writer:
+        for row in query.yield_per(STREAM_YIELD_PER):
+            streams = row.data.get('streams') if row.data and isinstance(row.data, dict) else None
+            if streams:
+                writer.add(row.activity_id, row.user_id, row.strava_activity_id, row.type,
+                           row.start_date, row.moving_time, streams)
+    logging.info(f"🗄️ Stream archive: {len(writer)} activities written to {path}")
+    return len(writer)
+
+
+class StreamArchive:
+    """
+    Read-only view of an exported archive. Activities are addressed by position (0..len-1, in
+    user_id, start_date order) or by activity_id via position_of().
+
+    Example:
+        archive = StreamArchive("stream_archive")
+        for info, streams in archive.activities(types=["Ride", "VirtualRide"]):
+            watts = streams.get("watts")  # np.memmap view, no copy
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        if self.manifest["version"] != ARCHIVE_VERSION:
+            raise ValueError(f"Stream archive {path} is version {self.manifest['version']}, expected {ARCHIVE_VERSION}")
+        with np.load(os.path.join(path, "index.npz")) as index:
+            self.index = {key: index[key] for key in index.files}
+        self.channel_names = list(self.manifest["channels"])
+        self._columns = {name: position for position, name in enumerate(self.channel_names)}
+        self._positions = None
+        self._channels = {}
+
+    def __len__(self) -> int:
+        return len(self.index["activity_id"])
+
+    def channel(self, name: str) -> np.ndarray:
+        """Every activity's samples of one channel, concatenated (a read-only memmap)."""
+        if name not in self._channels:
+            spec = self.manifest["channels"][name]
+            shape = (spec["samples"], spec["columns"]) if spec["columns"] > 1 else (spec["samples"],)
+            if spec["samples"]:
+                self._channels[name] = np.memmap(os.path.join(self.path, f"{name}.bin"),
+                                                 dtype=spec["dtype"], mode="r", shape=shape)
+            else:
+                self._channels[name] = np.empty(shape, dtype=spec["dtype"])  # np.memmap rejects empty files
+        return self._channels[name]
+
+    def position_of(self, activity_id: int) -> int:
+        if self._positions is None:
+            self._positions = {int(a): position for position, a in enumerate(self.index["activity_id"])}
+        return self._positions[activity_id]
+
+    def info(self, position: int) -> dict:
+        """One activity's index entry as plain Python values."""
+        start_date = self.index["start_date"][position]
+        return {
+            "activity_id": int(self.index["activity_id"][position]),
+            "user_id": int(self.index["user_id"][position]),
+            "strava_activity_id": str(self.index["strava_activity_id"][position]),
+            "type": str(self.index["type"][position]),
+            "start_date": None if np.isnat(start_date) else start_date.astype(datetime),
+            "moving_time": int(self.index["moving_time"][position]),
+        }
+
+    def streams(self, position: int, channels: List[str] = None) -> Dict[str, np.ndarray]:
+        """
+        An activity's streams as zero-copy views into the channel files (channels it doesn't
+        have are left out).
+
+        Args:
+            channels: Only these channels (default: all)
+        """
+        views = {}
+        for name in channels or self.channel_names:
+            column = self._columns[name]
+            length = self.index["lengths"][position, column]
+            if length:
+                start = self.index["starts"][position, column]
+                views[name] = self.channel(name)[start:start + length]
+        return views
+
+    def select(self, user_id: int = None, types: List[str] = None, since: datetime = None) -> np.ndarray:
+        """Positions of the activities matching all given filters, in archive order."""
+        mask = np.ones(len(self), dtype=bool)
+        if user_id is not None:
+            mask &= self.index["user_id"] == user_id
+        if types is not None:
+            mask &= np.isin(self.index["type"], types)
+        if since is not None:
+            mask &= self.index["start_date"] >= np.datetime64(since, "s")
+        return np.flatnonzero(mask)
+
+    def activities(self, user_id: int = None, types: List[str] = None, since: datetime = None,
+                   channels: List[str] = None) -> Iterator[Tuple[dict, Dict[str, np.ndarray]]]:
+        """(info, streams) for each matching activity; see select() and streams()."""
+        for position in self.select(user_id, types, since):
+            yield self.info(position), self.streams(position, channels)
+
+
+def main():
+    from config import SessionLocal, STREAM_ARCHIVE_DIR
+
+    parser = argparse.ArgumentParser(description='Export or inspect a memory-mapped stream archive')
+    parser.add_argument('command', choices=['export', 'info'])
+    parser.add_argument('path', nargs='?', default=STREAM_ARCHIVE_DIR, help='Archive directory')
+    parser.add_argument('--user_id', type=int, help='Only this user (export)')
+    parser.add_argument('--since', type=lambda s: datetime.strptime(s, '%Y-%m-%d'),
+                        help='Only activities starting on or after YYYY-MM-DD (export)')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        db = SessionLocal()
+        try:
+            count = export_stream_archive(db, args.path, args.user_id, args.since)
+        except ValueError as e:
+            parser.error(str(e))
+        finally:
+            db.close()
+        print(f"✅ Archived {count} activities to {args.path}")
+    else:
+        archive = StreamArchive(args.path)
+        print(f"🗄️ {args.path}: {len(archive)} activities, {len(np.unique(archive.index['user_id']))} users "
+              f"(created {archive.manifest['created_at']})")
+        for name, spec in archive.manifest["channels"].items():
+            print(f"  {name:16} {spec['samples']:>12,} samples  {spec['dtype']}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
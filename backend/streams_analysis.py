@@ -2,6 +2,7 @@
 import numpy as np
 from typing import Dict, Any, Tuple, Optional, List
 import logging
+from metrics import cpu_timed
 
 def find_best_power_effort(power_data: List[int], time_data: List[int], duration_minutes: int) -> Tuple[float, int, int]:
     """
@@ -371,6 +372,7 @@ def analyze_running_intensity_distribution(distance_data: List[float], time_data
         return {"error": str(e)}
 
 
+@cpu_timed("analyze_activity_streams")
 def analyze_activity_streams(activity_streams: Dict) -> Dict[str, Any]:
     """
     Comprehensive analysis of activity streams data.
@@ -0,0 +1,271 @@
+# Adaptive per-user sync policy
+#
+# The fixed quick sync polls every user every 3.5 hours, so a weekly rider costs as much as
+# a daily trainer and every poll lands at the same moment. Instead, each user gets their own
+# next_sync_at, learned from when they usually train (Activity.start_date hour histogram +
+# typical duration) and how often polls actually find something. A tick job enqueues users
+# that are due; jitter spreads load; dormant accounts are polled rarely. The daily 14-day
+# sync still runs for everyone as a safety net.
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from datetime import datetime, timedelta
+from typing import Optional
+import logging
+import random
+import math
+
+from config import SessionLocal
+from models import User, Activity, UserSyncState
+from job_queue import enqueue, PRIORITY_NORMAL
+
+# Interval of the fixed quick sync this policy replaces (baseline for the savings report)
+BASELINE_INTERVAL_HOURS = 3.5
+
+PROFILE_LOOKBACK_DAYS = 60
+UPLOAD_LAG_MINUTES = 30  # Typical delay between finishing an activity and it appearing on Strava
+MIN_INTERVAL_HOURS = 0.75
+ACTIVE_MAX_INTERVAL_HOURS = 12  # Trains at least every other day
+OCCASIONAL_MAX_INTERVAL_HOURS = 24
+QUIET_INTERVAL_HOURS = 24  # Nothing for 14+ days
+DORMANT_INTERVAL_HOURS = 72  # Nothing for 30+ days
+QUIET_AFTER_DAYS = 14
+DORMANT_AFTER_DAYS = 30
+WINDOW_MIN_SHARE = 0.1  # Hours holding at least this share of activities count as training windows
+REGULAR_WINDOW_SHARE = 0.6  # Windows covering this share of activities are trusted over the interval cap
+REGULAR_MAX_INTERVAL_HOURS = 26
+LOW_HIT_RATE = 0.15  # Polls rarely find anything: widen the cap
+HIT_RATE_ALPHA = 0.2
+JITTER_FRACTION = 0.1
+MIN_JITTER_MINUTES = 10
+
+
+def build_activity_profile(start_dates, moving_times, now: datetime) -> dict:
+    """
+    Summarize a user's training cadence.
+
+    Args:
+        start_dates: Activity start times (UTC) within the lookback window
+        moving_times: Matching moving times in seconds (None allowed)
+        now: Current UTC time
+
+    Returns:
+        Dict with hour_histogram (24 counts), activities_per_day, typical_duration_s and
+        last_activity_at (ISO string or None)
+    """
+    hour_histogram = [0] * 24
+    for start in start_dates:
+        if start is not None:
+            hour_histogram[start.hour] += 1
+
+    durations = sorted(int(t) for t in moving_times if t)
+    typical_duration = durations[len(durations) // 2] if durations else 3600
+    last_activity = max((s for s in start_dates if s is not None), default=None)
+
+    return {
+        "hour_histogram": hour_histogram,
+        "activities_per_day": round(len(start_dates) / PROFILE_LOOKBACK_DAYS, 3),
+        "typical_duration_s": typical_duration,
+        "last_activity_at": last_activity.isoformat() if last_activity else None,
+    }
+
+
+def _window_hours(profile: dict):
+    """Hours of day that hold at least WINDOW_MIN_SHARE of the user's activities."""
+    histogram = profile["hour_histogram"]
+    total = sum(histogram)
+    if not total:
+        return []
+    return [hour for hour, count in enumerate(histogram) if count / total >= WINDOW_MIN_SHARE]
+
+
+def _next_expected_upload(profile: dict, now: datetime, earliest: datetime) -> Optional[datetime]:
+    """Earliest time >= `earliest` at which an activity from a usual training window should be uploaded."""
+    window_hours = _window_hours(profile)
+    if not window_hours:
+        return None
+
+    offset = timedelta(seconds=profile["typical_duration_s"], minutes=UPLOAD_LAG_MINUTES)
+    candidates = []
+    for hour in window_hours:
+        # Long activities can spill over midnight, so check a few days around now
+        for day_offset in (-1, 0, 1, 2):
+            day = (now + timedelta(days=day_offset)).replace(minute=0, second=0, microsecond=0)
+            upload_at = day.replace(hour=hour) + offset
+            if upload_at >= earliest:
+                candidates.append(upload_at)
+    return min(candidates) if candidates else None
+
+
+def compute_next_sync(profile: dict, now: datetime, hit_rate: Optional[float] = None, rng=random):
+    """
+    Decide when to poll a user next.
+
+    Returns:
+        (next_sync_at, reason) where reason is one of 'dormant', 'quiet', 'training_window', 'max_interval'
+    """
+    last_activity = profile.get("last_activity_at")
+    days_since_activity = (now - datetime.fromisoformat(last_activity)).days if last_activity else None
+
+    if days_since_activity is None or days_since_activity >= DORMANT_AFTER_DAYS:
+        interval_hours, reason = DORMANT_INTERVAL_HOURS, "dormant"
+        next_sync = now + timedelta(hours=interval_hours)
+    elif days_since_activity >= QUIET_AFTER_DAYS:
+        interval_hours, reason = QUIET_INTERVAL_HOURS, "quiet"
+        next_sync = now + timedelta(hours=interval_hours)
+    else:
+        max_hours = ACTIVE_MAX_INTERVAL_HOURS if profile["activities_per_day"] >= 0.5 else OCCASIONAL_MAX_INTERVAL_HOURS
+        if hit_rate is not None and hit_rate < LOW_HIT_RATE:
+            max_hours *= 1.5
+
+        histogram = profile["hour_histogram"]
+        if sum(histogram) and sum(histogram[h] for h in _window_hours(profile)) / sum(histogram) >= REGULAR_WINDOW_SHARE:
+            # Creature of habit: nothing is expected outside the window, so wait for the next one
+            max_hours = max(max_hours, REGULAR_MAX_INTERVAL_HOURS)
+
+        earliest = now + timedelta(hours=MIN_INTERVAL_HOURS)
+        cap = now + timedelta(hours=max_hours)
+        expected = _next_expected_upload(profile, now, earliest)
+        if expected and expected <= cap:
+            next_sync, reason = expected, "training_window"
+        else:
+            next_sync, reason = cap, "max_interval"
+        interval_hours = (next_sync - now).total_seconds() / 3600
+
+    # Jitter so users with the same habits (or the same dormant bucket) don't poll together
+    jitter_minutes = max(interval_hours * 60 * JITTER_FRACTION, MIN_JITTER_MINUTES)
+    next_sync += timedelta(minutes=rng.uniform(-jitter_minutes, jitter_minutes))
+    return max(next_sync, now + timedelta(hours=MIN_INTERVAL_HOURS)), reason
+
+
+def refresh_user_profile(db: Session, user_id: int, now: datetime = None) -> dict:
+    now = now or datetime.utcnow()
+    rows = db.query(Activity.start_date, Activity.moving_time).filter(
+        Activity.user_id == user_id,
+        Activity.start_date >= now - timedelta(days=PROFILE_LOOKBACK_DAYS)
+    ).all()
+    profile = build_activity_profile([r.start_date for r in rows], [r.moving_time for r in rows], now)
+
+    if profile["last_activity_at"] is None:
+        # Nothing in the lookback window; the latest activity still tells dormant from new
+        last = db.query(func.max(Activity.start_date)).filter(Activity.user_id == user_id).scalar()
+        profile["last_activity_at"] = last.isoformat() if last else None
+    return profile
+
+
+def _get_state(db: Session, user_id: int, now: datetime) -> UserSyncState:
+    state = db.query(UserSyncState).filter_by(user_id=user_id).first()
+    if not state:
+        state = UserSyncState(
+            user_id=user_id, tracking_since=now, polls=0, polls_with_new=0,
+            new_activities_total=0, api_calls=0, updated_at=now
+        )
+        db.add(state)
+    return state
+
+
+def record_sync_result(db: Session, user_id: int, new_activities: int, api_calls: int, now: datetime = None):
+    """Update a user's counters after an adaptive poll and schedule the next one."""
+    now = now or datetime.utcnow()
+    state = _get_state(db, user_id, now)
+
+    found = 1.0 if new_activities > 0 else 0.0
+    state.hit_rate = found if state.hit_rate is None else (1 - HIT_RATE_ALPHA) * state.hit_rate + HIT_RATE_ALPHA * found
+    state.polls = (state.polls or 0) + 1
+    state.polls_with_new = (state.polls_with_new or 0) + int(found)
+    state.new_activities_total = (state.new_activities_total or 0) + new_activities
+    state.api_calls = (state.api_calls or 0) + api_calls
+    state.last_sync_at = now
+
+    profile = refresh_user_profile(db, user_id, now)
+    state.next_sync_at, profile["reason"] = compute_next_sync(profile, now, state.hit_rate)
+    state.profile = profile
+    state.updated_at = now
+    db.commit()
+
+    logging.info(
+        f"User {user_id}: next adaptive sync {state.next_sync_at:%Y-%m-%d %H:%M} UTC "
+        f"({profile['reason']}, hit rate {state.hit_rate:.2f})"
+    )
+    return state
+
+
+def adaptive_sync_tick(now: datetime = None) -> dict:
+    """Enqueue a sync for every connected user whose next_sync_at has passed."""
+    now = now or datetime.utcnow()
+    db = SessionLocal()
+    try:
+        due = db.query(User.user_id, UserSyncState.last_sync_at).outerjoin(
+            UserSyncState, UserSyncState.user_id == User.user_id
+        ).filter(
+            User.strava_oauth_token.isnot(None),
+            (UserSyncState.next_sync_at.is_(None)) | (UserSyncState.next_sync_at <= now)
+        ).all()
+
+        enqueued = 0
+        for user_id, last_sync_at in due:
+            # Look back far enough to cover the gap since the last poll
+            gap_days = (now - last_sync_at).total_seconds() / 86400 if last_sync_at else 3
+            backfill_days = min(max(math.ceil(gap_days) + 1, 2), 14)
+            if enqueue(
+                db, "sync_user", user_id=user_id,
+                payload={"backfill_days": backfill_days, "wellness_days": 7, "adaptive": True},
+                priority=PRIORITY_NORMAL, dedup_key=f"sync_user:{user_id}:adaptive"
+            ):
+                enqueued += 1
+                # Provisional slot; replaced when the poll completes, keeps failing users at the baseline rate
+                state = _get_state(db, user_id, now)
+                state.next_sync_at = now + timedelta(hours=BASELINE_INTERVAL_HOURS)
+                state.updated_at = now
+        db.commit()
+
+        if due:
+            logging.info(f"⏱️ Adaptive sync tick: {len(due)} users due, {enqueued} enqueued")
+        return {"due": len(due), "enqueued": enqueued}
+    finally:
+        db.close()
+
+
+def sync_policy_report(db: Session, now: datetime = None) -> dict:
+    """Adaptive polls made versus what the fixed 3.5h interval would have made over the same window."""
+    now = now or datetime.utcnow()
+    states = db.query(UserSyncState).all()
+
+    users = []
+    totals = {"polls": 0, "baseline_polls": 0, "api_calls": 0, "baseline_api_calls": 0, "new_activities": 0}
+    reasons = {}
+    for state in states:
+        tracked_hours = (now - state.tracking_since).total_seconds() / 3600 if state.tracking_since else 0
+        baseline_polls = int(tracked_hours // BASELINE_INTERVAL_HOURS)
+        polls = state.polls or 0
+        # Stream fetches per new activity are the same under both policies; only list calls differ
+        baseline_api_calls = (state.api_calls or 0) - polls + baseline_polls
+
+        reason = (state.profile or {}).get("reason", "unscheduled")
+        reasons[reason] = reasons.get(reason, 0) + 1
+        totals["polls"] += polls
+        totals["baseline_polls"] += baseline_polls
+        totals["api_calls"] += state.api_calls or 0
+        totals["baseline_api_calls"] += baseline_api_calls
+        totals["new_activities"] += state.new_activities_total or 0
+
+        users.append({
+            "user_id": state.user_id,
+            "reason": reason,
+            "next_sync_at": state.next_sync_at.isoformat() if state.next_sync_at else None,
+            "polls": polls,
+            "baseline_polls": baseline_polls,
+            "hit_rate": round(state.hit_rate, 3) if state.hit_rate is not None else None,
+        })
+
+    totals["api_calls_saved"] = totals["baseline_api_calls"] - totals["api_calls"]
+    totals["savings_pct"] = round(
+        100 * totals["api_calls_saved"] / totals["baseline_api_calls"], 1
+    ) if totals["baseline_api_calls"] else 0.0
+
+    return {
+        "baseline_interval_hours": BASELINE_INTERVAL_HOURS,
+        "users_tracked": len(states),
+        "users_by_reason": reasons,
+        "totals": totals,
+        "users": sorted(users, key=lambda u: u["user_id"]),
+    }
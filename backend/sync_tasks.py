@@ -0,0 +1,262 @@
+# Per-user background tasks
+#
+# Each function handles exactly one user so it can run as an independent queue item:
+# a failure for one user is retried on its own instead of aborting a loop over everyone.
+from datetime import datetime, timedelta
+import logging
+
+from sqlalchemy.orm import defer
+
+from config import SessionLocal
+from models import User, Activity, Threshold
+from activities import _fetch_and_process_activities, _fetch_and_process_single_activity, _delete_activity
+from utils import estimate_thresholds_from_activities
+from utl_batch import score_activities
+from activity_metrics import threshold_activity_summaries
+from research_threshold_calculator import calculate_initial_thresholds_for_new_user
+from job_queue import register_task, enqueue, PRIORITY_NORMAL
+from sync_policy import record_sync_result
+from data_events import publish, ACTIVITIES_CHANGED, THRESHOLDS_CHANGED
+from metrics import count_work
+import recommendation_cache
+
+
+def enqueue_for_all_users(task_name: str, payload: dict = None, priority: int = PRIORITY_NORMAL,
+                          dedup_variant: str = None) -> dict:
+    """
+    Enqueue one item per Strava-connected user. Items are deduplicated per user (and variant),
+    so a scheduled run that fires while the previous run is still draining adds nothing.
+    """
+    db = SessionLocal()
+    try:
+        user_ids = [row.user_id for row in db.query(User.user_id).filter(User.strava_oauth_token.isnot(None)).all()]
+        enqueued = 0
+        for user_id in user_ids:
+            dedup_key = f"{task_name}:{user_id}" + (f":{dedup_variant}" if dedup_variant else "")
+            if enqueue(db, task_name, user_id=user_id, payload=payload, priority=priority, dedup_key=dedup_key):
+                enqueued += 1
+        logging.info(f"📥 Enqueued {enqueued} '{task_name}' items ({len(user_ids) - enqueued} already pending)")
+        return {"users": len(user_ids), "enqueued": enqueued}
+    finally:
+        db.close()
+
+
+@register_task("sync_user", lease_seconds=30 * 60)
+def sync_user(user_id: int, backfill_days: int = 3, wellness_days: int = 7,
+              update_resting_hr: bool = False, resting_hr_lookback_days: int = 14, adaptive: bool = False,
+              refresh_recommendations: bool = False):
+    """
+    Import recent Strava activities and intervals.icu wellness data for one user.
+    Adaptive polls (sync_policy.py) also record their outcome and schedule the user's next poll.
+    The nightly sync also refreshes cached recommendations so the first view of the day is a hit.
+    """
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter_by(user_id=user_id).first()
+        if not user or not user.strava_oauth_token:
+            logging.info(f"Skipping sync for user {user_id}: no Strava connection")
+            return {"new_activities": 0}
+
+        new_activities = _fetch_and_process_activities(user_id, db, backfill_days=backfill_days)
+
+        if new_activities > 0:
+            logging.info(f"User {user_id}: imported {new_activities} new activities")
+
+            # If new activities found, check for threshold updates
+            week_ago = datetime.now() - timedelta(days=7)
+            recent_significant = db.query(Activity).filter(
+                Activity.user_id == user_id,
+                Activity.start_date >= week_ago,
+                Activity.type.in_(['Ride', 'VirtualRide', 'Run', 'VirtualRun']),
+                Activity.moving_time > 1800  # >30 minutes
+            ).count()
+
+            if recent_significant >= 3:
+                logging.info(f"User {user_id}: {recent_significant} significant activities, updating thresholds")
+                recalculate_thresholds_for_user(user_id)
+
+        # Sync wellness data from intervals.icu
+        try:
+            if wellness_days and user.integrations and 'intervals_icu' in user.integrations:
+                intervals_config = user.integrations['intervals_icu']
+                if intervals_config.get('api_key') and intervals_config.get('athlete_id'):
+                    from intervals_icu import _sync_wellness_data_task
+                    _sync_wellness_data_task(
+                        user_id,
+                        intervals_config['api_key'],
+                        intervals_config['athlete_id'],
+                        wellness_days,
+                        db
+                    )
+                    logging.info(f"User {user_id}: synced {wellness_days} days of wellness data")
+        except Exception as wellness_error:
+            logging.debug(f"User {user_id}: wellness sync failed: {wellness_error}")
+
+        if update_resting_hr:
+            update_resting_hr_for_user(user_id, lookback_days=resting_hr_lookback_days, db_session=db)
+
+        if adaptive:
+            # One activity list call plus one streams call per new activity
+            record_sync_result(db, user_id, new_activities, api_calls=1 + new_activities)
+
+        if refresh_recommendations:
+            recommendation_cache.refresh_recommendations(db, user_id, only_if_cached=True)
+
+        return {"new_activities": new_activities}
+    finally:
+        db.close()
+
+
+@register_task("sync_strava_activity", lease_seconds=5 * 60)
+def sync_strava_activity(user_id: int, strava_activity_id: str, action: str = "fetch"):
+    """Fetch (or delete) a single activity reported by a Strava webhook event."""
+    db = SessionLocal()
+    try:
+        if action == "delete":
+            return _delete_activity(user_id, strava_activity_id, db)
+        return _fetch_and_process_single_activity(user_id, strava_activity_id, db)
+    finally:
+        db.close()
+
+
+@register_task("refresh_recommendations", lease_seconds=5 * 60)
+def refresh_recommendations_for_user(user_id: int):
+    """Recompute a user's cached recommendations after their inputs changed."""
+    db = SessionLocal()
+    try:
+        recommendation_cache.refresh_recommendations(db, user_id, only_if_cached=True)
+    finally:
+        db.close()
+
+
+@register_task("sync_wellness", lease_seconds=15 * 60)
+def sync_wellness_for_user(user_id: int, days: int = 7):
+    """Sync intervals.icu wellness data for one user (the dashboard button and new-connection backfill)."""
+    from intervals_icu import _sync_wellness_data_task
+
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter_by(user_id=user_id).first()
+        intervals_config = (user.integrations or {}).get('intervals_icu') if user else None
+        if not intervals_config or not intervals_config.get('api_key') or not intervals_config.get('athlete_id'):
+            logging.info(f"Skipping wellness sync for user {user_id}: intervals.icu not connected")
+            return False
+        _sync_wellness_data_task(user_id, intervals_config['api_key'], intervals_config['athlete_id'], days, db)
+        return True
+    finally:
+        db.close()
+
+
+@register_task("update_resting_hr", lease_seconds=5 * 60)
+def update_resting_hr_for_user(user_id: int, lookback_days: int = 14, db_session=None):
+    """Update resting HR threshold from recent wellness data."""
+    from intervals_icu import update_resting_hr_from_wellness
+
+    db = db_session or SessionLocal()
+    close_db = db_session is None
+    try:
+        updated_rhr = update_resting_hr_from_wellness(user_id, db, lookback_days=lookback_days)
+        if updated_rhr:
+            logging.info(f"User {user_id}: updated resting HR to {updated_rhr} bpm from wellness data")
+        return updated_rhr
+    finally:
+        if close_db:
+            db.close()
+
+
+@register_task("recalculate_thresholds", lease_seconds=30 * 60)
+def recalculate_thresholds_for_user(user_id: int):
+    """Recalculate thresholds for a specific user."""
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter_by(user_id=user_id).first()
+        if not user:
+            return
+
+        # Activity summaries from the last 12 months (activity_metrics columns, no JSON parsing)
+        one_year_ago = datetime.now() - timedelta(days=365)
+        activity_data = threshold_activity_summaries(db, user_id, since=one_year_ago)
+        db.commit()  # Keep any metrics rows extracted for older activities
+
+        # Calculate new thresholds
+        try:
+            estimates = calculate_initial_thresholds_for_new_user(user_id)
+        except Exception:
+            # Fall back to activity-based estimation
+            estimates = estimate_thresholds_from_activities(activity_data, user.gender or 'M', [])
+
+        if estimates:
+            # Update thresholds in database
+            threshold = db.query(Threshold).filter_by(user_id=user_id).first()
+            if not threshold:
+                threshold = Threshold(user_id=user_id)
+                db.add(threshold)
+
+            old_ftp = threshold.ftp_watts
+            old_fthp = threshold.fthp_mps
+
+            if estimates.get('ftp_watts'):
+                threshold.ftp_watts = estimates['ftp_watts']
+            if estimates.get('fthp_mps'):
+                threshold.fthp_mps = estimates['fthp_mps']
+            if estimates.get('max_hr'):
+                threshold.max_hr = estimates['max_hr']
+            if estimates.get('resting_hr'):
+                threshold.resting_hr = estimates['resting_hr']
+
+            threshold.date_updated = datetime.now()
+
+            # Check for significant changes (>5%)
+            ftp_change = abs((threshold.ftp_watts or 0) - (old_ftp or 0)) / max(old_ftp or 1, 1)
+            fthp_change = abs((threshold.fthp_mps or 0) - (old_fthp or 0)) / max(old_fthp or 1, 1)
+
+            if ftp_change > 0.05 or fthp_change > 0.05:
+                logging.info(f"Significant threshold change for user {user_id}, triggering UTL recalc")
+                db.commit()
+                recalculate_utl_for_user(user_id, db)
+            else:
+                db.commit()
+            publish(THRESHOLDS_CHANGED, user_id)
+
+    finally:
+        db.close()
+
+
+@register_task("recalculate_utl", lease_seconds=30 * 60)
+def recalculate_utl_for_user(user_id: int, db_session=None):
+    """Recalculate UTL scores for a specific user."""
+    db = db_session or SessionLocal()
+    close_db = db_session is None
+
+    try:
+        threshold = db.query(Threshold).filter_by(user_id=user_id).first()
+        if not threshold:
+            return
+
+        # Get recent activities (last 90 days)
+        cutoff_date = datetime.now() - timedelta(days=90)
+        # Scoring reads activity_metrics; the streams JSON is only loaded for rows that need it
+        activities = db.query(Activity).options(defer(Activity.data)).filter(
+            Activity.user_id == user_id,
+            Activity.start_date >= cutoff_date
+        ).all()
+
+        updated_count = 0
+        for activity, (new_utl, new_method) in zip(activities, score_activities(db, activities, threshold)):
+            # Update if significantly different
+            old_utl = activity.utl_score or 0
+            if abs(new_utl - old_utl) > 0.05 * max(old_utl, 1) or activity.calculation_method != new_method:
+                activity.utl_score = float(new_utl)
+                activity.calculation_method = new_method
+                updated_count += 1
+
+        db.commit()
+        logging.info(f"Updated UTL for {updated_count} activities for user {user_id}")
+        count_work("activities", updated_count)
+        if updated_count:
+            publish(ACTIVITIES_CHANGED, user_id)
+        return {"activities_checked": len(activities), "activities_updated": updated_count}
+
+    finally:
+        if close_db:
+            db.close()
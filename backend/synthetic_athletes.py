@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+"""
+Seeded synthetic athletes at production scale, for performance tests and benchmarks
+
+Generates N athletes x Y years of activities with 1 Hz streams (time, power, heart rate,
+velocity, distance, altitude, cadence, position) shaped like real training: endurance, tempo,
+interval, long and recovery sessions; coasting on outdoor rides; heart rate lagging effort;
+sensor dropouts and GPS gaps (auto-pause or lost signal). Each athlete also gets thresholds
+that improve over the years, a daily wellness series that responds to training load, and a
+current threshold row.
+
+Everything is derived from (seed, athlete, activity), so a dataset is reproducible however it is
+split across workers.
+
+Usage (from backend/):
+    python synthetic_athletes.py load --athletes=50 --years=2 --workers=4     # Postgres via COPY
+    python synthetic_athletes.py archive ../stream_archive --athletes=200       # Straight into a stream archive
+    python synthetic_athletes.py purge                                          # Remove synthetic users
+
+Synthetic users have emails ending in SYNTHETIC_EMAIL_DOMAIN and no Strava connection, so the
+scheduler never syncs them. Loading writes no activity_metrics rows; pass --metrics (or run
+`python maintenance_cli.py features`) to extract them.
+"""
+
+import argparse
+import io
+import json
+import logging
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import create_engine, insert, delete, select
+
+from models import Base, User, Threshold, Activity, WellnessData
+from training_rollups import rebuild_rollups
+
+SYNTHETIC_EMAIL_DOMAIN = "synthetic.invalid"
+COPY_BATCH_SIZE = 200  # Activities per COPY / multi-row insert
+
+PROFILES = {
+    # Sessions per week, share of rides (the rest are runs), outdoor share of rides
+    "cyclist": (6, 0.9, 0.7),
+    "runner": (6, 0.1, 0.5),
+    "triathlete": (9, 0.55, 0.6),
+    "casual": (3, 0.5, 0.8),
+}
+# Session kind -> (weight, duration range in minutes)
+SESSIONS = {
+    "recovery": (0.15, (30, 50)),
+    "endurance": (0.40, (45, 120)),
+    "tempo": (0.15, (50, 80)),
+    "intervals": (0.18, (50, 75)),
+    "long": (0.12, (120, 240)),
+}
+
+
+# Independent random streams per athlete, so regenerating one part never shifts another
+_PROFILE, _SCHEDULE, _WELLNESS, _ACTIVITY = range(4)
+
+
+def _rng(seed: int, *keys: int) -> np.random.Generator:
+    return np.random.default_rng([seed, *keys])
+
+
+def athlete_profile(index: int, seed: int = 0) -> dict:
+    """One athlete's physiology and habits."""
+    rng = _rng(seed, index, _PROFILE)
+    kind = rng.choice(list(PROFILES), p=[0.35, 0.3, 0.15, 0.2])
+    gender = "male" if rng.random() < 0.65 else "female"
+    age = int(rng.integers(20, 65))
+    max_hr = int(round(208 - 0.7 * age + rng.normal(0, 5)))
+    weight = float(rng.normal(75 if gender == "male" else 62, 7))
+    return {
+        "index": index,
+        "kind": kind,
+        "name": f"Synthetic {kind.title()} {index}",
+        "email": f"synthetic-{seed}-{index}@{SYNTHETIC_EMAIL_DOMAIN}",
+        "gender": gender,
+        "age": age,
+        "weight": round(weight, 1),
+        "max_hr": max_hr,
+        "resting_hr": int(rng.integers(42, 65)),
+        "ftp_watts": float(weight * rng.uniform(2.2, 4.3)),  # At the end of the period
+        "fthp_mps": float(rng.uniform(2.8, 4.6)),
+        "sessions_per_week": PROFILES[kind][0] * rng.uniform(0.7, 1.3),
+        "ride_share": PROFILES[kind][1],
+        "outdoor_share": PROFILES[kind][2],
+        "hrv": float(rng.uniform(35, 95)),
+    }
+
+
+def _fitness_factor(days_before_end: float) -> float:
+    """Thresholds relative to the final ones: slow improvement plus a seasonal swing."""
+    trend = 1.0 - 0.06 * days_before_end / 365.0
+    seasonal = 0.03 * math.sin(2 * math.pi * days_before_end / 365.0)
+    return max(0.75, trend + seasonal)
+
+
+def _plan(kind: str, minutes: int, rng: np.random.Generator) -> np.ndarray:
+    """Per-second intensity (fraction of threshold) for one session."""
+    n = minutes * 60
+    if kind == "recovery":
+        base = np.full(n, rng.uniform(0.45, 0.58))
+    elif kind in ("endurance", "long"):
+        base = np.full(n, rng.uniform(0.62, 0.74))
+        base += 0.04 * np.sin(np.arange(n) / rng.uniform(200, 600))  # Terrain
+    else:
+        warm = min(900, n // 4)
+        base = np.full(n, 0.6)
+        base[:warm] = np.linspace(0.45, 0.7, warm)
+        if kind == "tempo":
+            block = min(20 * 60, (n - 2 * warm) // 2)
+            for start in (warm, warm + block + 300):
+                base[start:start + block] = rng.uniform(0.84, 0.92)
+        else:
+            work, rest = int(rng.choice([180, 240, 300])), 180
+            reps = max(1, (n - 2 * warm) // (work + rest))
+            intensity = rng.uniform(1.05, 1.2)
+            for rep in range(reps):
+                start = warm + rep * (work + rest)
+                base[start:start + work] = intensity
+                base[start + work:start + work + rest] = 0.5
+    return base * rng.normal(1.0, 0.06, n)
+
+
+def _lag(values: np.ndarray, initial: float, tau: float) -> np.ndarray:
+    """First-order response (heart rate following effort) via an exponential kernel."""
+    kernel = np.exp(-np.arange(int(tau * 5)) / tau)
+    kernel /= kernel.sum()
+    padded = np.concatenate([np.full(len(kernel) - 1, initial), values])
+    return np.convolve(padded, kernel, mode="valid")
+
+
+def synthetic_session(profile: dict, activity_type: str, kind: str, minutes: int, fitness: float,
+                      outdoor: bool, rng: np.random.Generator) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """
+    One activity: Strava-style summary fields and 1 Hz streams as arrays.
+
+    Returns:
+        (summary without id/name/start_date, streams) with streams keyed by Strava stream type
+    """
+    intensity = np.clip(_plan(kind, minutes, rng), 0.2, 1.6)
+    n = len(intensity)
+    is_ride = activity_type in ("Ride", "VirtualRide")
+    streams = {}
+
+    if is_ride:
+        ftp = profile["ftp_watts"] * fitness
+        watts = np.clip(intensity * ftp, 0, None)
+        if outdoor:  # Coasting: downhills and junctions with no pedalling
+            for _ in range(int(n / 600 * rng.uniform(1, 4))):
+                start = int(rng.integers(0, n))
+                watts[start:start + int(rng.integers(5, 90))] = 0
+        speed = 1.54 * np.cbrt(np.maximum(watts, 30)) * rng.uniform(0.9, 1.1)
+        cadence = np.where(watts > 0, rng.normal(88, 4, n), 0)
+        effort = watts / ftp
+        streams["watts"] = np.rint(watts)
+    else:
+        speed = np.clip(profile["fthp_mps"] * fitness * (0.55 + 0.45 * intensity), 1.5, None)
+        cadence = rng.normal(86, 3, n)
+        effort = intensity
+
+    hr_reserve = profile["max_hr"] - profile["resting_hr"]
+    hr_target = profile["resting_hr"] + hr_reserve * np.clip(0.35 + 0.55 * effort, 0.3, 1.0)
+    heartrate = np.rint(np.minimum(_lag(hr_target, profile["resting_hr"] + 20, 25.0) + rng.normal(0, 1.5, n),
+                                   profile["max_hr"]))
+    if rng.random() < 0.1:  # Strap dropout
+        start = int(rng.integers(0, n))
+        heartrate[start:start + int(rng.integers(20, 180))] = 0
+    if is_ride and rng.random() < 0.05:  # Power meter dropout
+        start = int(rng.integers(0, n))
+        streams["watts"][start:start + int(rng.integers(10, 120))] = 0
+
+    grade = _lag(rng.normal(0, 0.02, n), 0.0, 120.0) * (1 if outdoor else 0)
+    altitude = 50 + rng.uniform(0, 400) + np.cumsum(speed * grade)
+    distance = np.cumsum(speed)
+    elapsed = np.arange(n, dtype=float)
+
+    keep = np.ones(n, dtype=bool)
+    if outdoor and rng.random() < 0.3:  # GPS gap / auto-pause: seconds missing from every stream
+        gap_start = int(rng.integers(60, max(61, n - 60)))
+        gap = int(rng.integers(20, 300))
+        elapsed[gap_start:] += gap
+        distance[gap_start:] += speed[gap_start] * gap * rng.uniform(0, 1)
+        drop = slice(gap_start, min(n, gap_start + int(rng.integers(5, 30))))
+        keep[drop] = False
+
+    streams.update(
+        time=elapsed,
+        heartrate=heartrate,
+        velocity_smooth=np.round(speed, 2),
+        distance=np.round(distance, 1),
+        altitude=np.round(altitude, 1),
+        cadence=np.rint(cadence),
+    )
+    if outdoor:
+        heading = rng.uniform(0, 2 * math.pi) + np.cumsum(rng.normal(0, 0.01, n))
+        lat0, lng0 = rng.uniform(35, 60), rng.uniform(-10, 30)
+        lat = lat0 + np.cumsum(speed * np.cos(heading)) / 111_320
+        lng = lng0 + np.cumsum(speed * np.sin(heading)) / (111_320 * math.cos(math.radians(lat0)))
+        streams["latlng"] = np.round(np.column_stack([lat, lng]), 6)
+    streams = {key: values[keep] for key, values in streams.items()}
+
+    moving_time = int(keep.sum())
+    summary = {
+        "type": activity_type,
+        "moving_time": moving_time,
+        "elapsed_time": int(streams["time"][-1]) + 1,
+        "distance": float(streams["distance"][-1]),
+        "average_speed": round(float(streams["distance"][-1]) / moving_time, 3),
+        "max_speed": float(streams["velocity_smooth"].max()),
+        "total_elevation_gain": round(float(np.clip(np.diff(streams["altitude"]), 0, None).sum()), 1),
+        "average_heartrate": round(float(streams["heartrate"][streams["heartrate"] > 0].mean()), 1),
+        "max_heartrate": float(streams["heartrate"].max()),
+        "average_cadence": round(float(streams["cadence"].mean()), 1),
+        "trainer": not outdoor,
+    }
+    if is_ride:
+        watts = streams["watts"]
+        rolling = np.convolve(watts, np.ones(30) / 30, mode="valid") if len(watts) >= 30 else watts
+        summary.update(
+            average_watts=round(float(watts.mean()), 1),
+            weighted_average_watts=int(round(float(np.mean(rolling ** 4) ** 0.25))),
+            max_watts=int(watts.max()),
+            kilojoules=round(float(watts.sum()) / 1000, 1),
+            device_watts=True,
+        )
+    return summary, streams
+
+
+def athlete_activities(profile: dict, years: float, end: datetime, seed: int = 0,
+                       with_streams: bool = True) -> Iterator[Tuple[dict, Optional[Dict[str, np.ndarray]]]]:
+    """
+    The athlete's activities over `years` ending at `end`, oldest first, as (summary, streams)
+    with Strava-style summaries (id, name, start_date included). Streams are None when not wanted.
+    """
+    days = int(365 * years)
+    schedule = _rng(seed, profile["index"], _SCHEDULE)
+    daily_probability = min(0.95, profile["sessions_per_week"] / 7)
+    number = 0
+    for day in range(days, 0, -1):
+        sessions = int(schedule.random() < daily_probability) + int(schedule.random() < daily_probability / 6)
+        for session in range(sessions):
+            rng = _rng(seed, profile["index"], _ACTIVITY, number)
+            is_ride = rng.random() < profile["ride_share"]
+            outdoor = rng.random() < profile["outdoor_share"]
+            activity_type = ("Ride" if outdoor else "VirtualRide") if is_ride else ("Run" if outdoor or rng.random() < 0.7 else "VirtualRun")
+            kind = rng.choice(list(SESSIONS), p=[weight for weight, _ in SESSIONS.values()])
+            low, high = SESSIONS[kind][1]
+            minutes = int(rng.integers(low, high + 1)) if is_ride else int(rng.integers(low, high + 1) * 0.6)
+            start = (end - timedelta(days=day)).replace(hour=6 + 6 * session + int(rng.integers(0, 5)),
+                                                       minute=int(rng.integers(0, 60)), second=0, microsecond=0)
+            fitness = _fitness_factor(day)
+            summary, streams = synthetic_session(profile, activity_type, kind, max(minutes, 15), fitness,
+                                                 activity_type in ("Ride", "Run"), rng)
+            summary.update(
+                id=f"syn-{seed}-{profile['index']}-{number}",
+                name=f"Synthetic {kind} {activity_type.lower()}",
+                start_date=start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            )
+            number += 1
+            yield summary, streams if with_streams else None
+
+
+def daily_loads(activities: List[dict], profile: dict) -> Dict[date, float]:
+    """Rough TSS per day from the summaries (drives the wellness series)."""
+    loads = {}
+    for summary in activities:
+        day = datetime.strptime(summary["start_date"], "%Y-%m-%dT%H:%M:%SZ").date()
+        hr_fraction = (summary["average_heartrate"] - profile["resting_hr"]) / (profile["max_hr"] - profile["resting_hr"])
+        loads[day] = loads.get(day, 0.0) + summary["moving_time"] / 3600 * 100 * max(hr_fraction, 0.3) ** 2 / 0.7
+    return loads
+
+
+def synthetic_wellness(profile: dict, loads: Dict[date, float], start: date, end: date, seed: int = 0) -> List[dict]:
+    """Daily wellness rows: HRV and resting HR dip and sleep/readiness fall after heavy days."""
+    rng = _rng(seed, profile["index"], _WELLNESS)
+    rows = []
+    fatigue = 0.0
+    day = start
+    while day <= end:
+        fatigue = fatigue * 0.75 + loads.get(day - timedelta(days=1), 0.0) * 0.25
+        strain = min(fatigue / 120, 1.0)
+        if rng.random() > 0.08:  # Some days go unrecorded
+            rows.append({
+                "date": day,
+                "hrv": round(float(profile["hrv"] * (1 - 0.25 * strain) * rng.normal(1, 0.08)), 1),
+                "resting_hr": int(round(profile["resting_hr"] + 6 * strain + rng.normal(0, 1.5))),
+                "sleep_score": round(float(np.clip(rng.normal(80 - 10 * strain, 7), 30, 100)), 1),
+                "sleep_duration": round(float(np.clip(rng.normal(7.4, 0.7), 4, 10)), 2),
+                "readiness_score": round(float(np.clip(rng.normal(75 - 25 * strain, 8), 10, 100)), 1),
+                "fatigue": round(float(np.clip(2 + 6 * strain + rng.normal(0, 1), 1, 10)), 1),
+                "weight": round(float(profile["weight"] + rng.normal(0, 0.4)), 1),
+                "source": "synthetic",
+            })
+        day += timedelta(days=1)
+    return rows
+
+
+def streams_to_json(streams: Dict[str, np.ndarray]) -> dict:
+    """Arrays to Strava's key_by_type JSON shape (integers stay integers)."""
+    result = {}
+    for key, values in streams.items():
+        data = values.astype(int).tolist() if key in ("watts", "heartrate", "cadence", "time") else values.tolist()
+        result[key] = {"data": data, "series_type": "time", "original_size": len(values), "resolution": "high"}
+    return result
+
+
+def _copy_rows(connection, table, columns: List[str], rows: List[tuple]):
+    """COPY rows into a Postgres table (text format) through the raw driver connection."""
+    def field(value):
+        if value is None:
+            return "\\N"
+        text = value if isinstance(value, str) else str(value)
+        return text.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(field(value) for value in row) + "\n")
+    sql = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN"
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        if hasattr(cursor, "copy_expert"):  # psycopg2
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+        else:  # psycopg 3
+            with cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+    finally:
+        cursor.close()
+
+
+def _write_rows(connection, table, rows: List[dict]):
+    """Bulk insert: COPY on Postgres, a multi-row INSERT elsewhere (SQLite in tests)."""
+    if not rows:
+        return
+    if connection.dialect.name == "postgresql":
+        columns = list(rows[0])
+        _copy_rows(connection, table, columns, [
+            tuple(json.dumps(row[c]) if isinstance(row[c], (dict, list)) else row[c] for c in columns) for row in rows
+        ])
+    else:
+        connection.execute(insert(table), rows)
+
+
+def load_athlete(engine, index: int, years: float, end: datetime, seed: int = 0, with_streams: bool = True) -> dict:
+    """Insert one athlete (user, thresholds, activities, wellness). Returns counts."""
+    profile = athlete_profile(index, seed)
+    activities = 0
+    summaries = []
+    with engine.begin() as connection:
+        user_id = connection.execute(insert(User).values(
+            name=profile["name"], email=profile["email"], gender=profile["gender"], weight=str(profile["weight"]),
+            dob=datetime(end.year - profile["age"], 6, 1),
+        ).returning(User.user_id)).scalar_one()
+        connection.execute(insert(Threshold).values(
+            user_id=user_id, ftp_watts=round(profile["ftp_watts"], 1), fthp_mps=round(profile["fthp_mps"], 3),
+            max_hr=profile["max_hr"], resting_hr=profile["resting_hr"], date_updated=end,
+        ))
+
+        batch = []
+        for summary, streams in athlete_activities(profile, years, end, seed, with_streams):
+            summaries.append({key: summary[key] for key in ("start_date", "moving_time", "average_heartrate")})
+            data = dict(summary)
+            if streams is not None:
+                data["streams"] = streams_to_json(streams)
+            batch.append({
+                "strava_activity_id": summary["id"], "user_id": user_id, "name": summary["name"],
+                "type": summary["type"], "distance": summary["distance"], "moving_time": summary["moving_time"],
+                "elapsed_time": summary["elapsed_time"],
+                "start_date": datetime.strptime(summary["start_date"], "%Y-%m-%dT%H:%M:%SZ"),
+                "average_speed": summary["average_speed"], "max_speed": summary["max_speed"],
+                "total_elevation_gain": summary["total_elevation_gain"], "data": data,
+            })
+            if len(batch) >= COPY_BATCH_SIZE:
+                _write_rows(connection, Activity.__table__, batch)
+                activities += len(batch)
+                batch = []
+        _write_rows(connection, Activity.__table__, batch)
+        activities += len(batch)
+        rebuild_rollups(connection, user_id)  # COPY bypasses the session hook
+
+        wellness = synthetic_wellness(profile, daily_loads(summaries, profile),
+                                      (end - timedelta(days=int(365 * years))).date(), end.date(), seed)
+        _write_rows(connection, WellnessData.__table__, [
+            {**row, "user_id": user_id, "created_at": end, "updated_at": end} for row in wellness
+        ])
+    return {"user_id": user_id, "activities": activities, "wellness": len(wellness)}
+
+
+def _load_worker(database_url: Optional[str], indexes: List[int], years: float, end: datetime, seed: int,
+                 with_streams: bool) -> List[dict]:
+    if database_url:
+        engine = create_engine(database_url)
+    else:
+        from config import engine
+        engine.dispose(close=False)
+    return [load_athlete(engine, index, years, end, seed, with_streams) for index in indexes]
+
+
+def load_synthetic_athletes(athletes: int, years: float, seed: int = 0, workers: int = 1, end: datetime = None,
+                            with_streams: bool = True, database_url: str = None, first_index: int = 0) -> dict:
+    """
+    Load athletes first_index..first_index+athletes-1 into the database, `workers` processes at a
+    time. Returns totals with activities per minute.
+    """
+    end = end or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    indexes = list(range(first_index, first_index + athletes))
+    start = time.perf_counter()
+    if workers <= 1:
+        results = _load_worker(database_url, indexes, years, end, seed, with_streams)
+    else:
+        chunks = [indexes[i::workers] for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_load_worker, database_url, chunk, years, end, seed, with_streams)
+                       for chunk in chunks if chunk]
+            results = [result for future in futures for result in future.result()]
+    seconds = time.perf_counter() - start
+    activities = sum(result["activities"] for result in results)
+    return {
+        "user_ids": sorted(result["user_id"] for result in results),
+        "athletes": len(results),
+        "activities": activities,
+        "wellness": sum(result["wellness"] for result in results),
+        "seconds": seconds,
+        "activities_per_minute": activities / seconds * 60 if seconds else 0.0,
+    }
+
+
+def archive_synthetic_athletes(path: str, athletes: int, years: float, seed: int = 0, end: datetime = None) -> dict:
+    """Write the athletes' streams straight into a stream archive (no database); user ids are index + 1."""
+    from stream_archive import StreamArchiveWriter
+
+    end = end or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    start = time.perf_counter()
+    activity_id = 0
+    with StreamArchiveWriter(path) as writer:
+        for index in range(athletes):
+            profile = athlete_profile(index, seed)
+            for summary, streams in athlete_activities(profile, years, end, seed):
+                activity_id += 1
+                writer.add(activity_id, index + 1, summary["id"], summary["type"],
+                           datetime.strptime(summary["start_date"], "%Y-%m-%dT%H:%M:%SZ"), summary["moving_time"], streams)
+    seconds = time.perf_counter() - start
+    return {"athletes": athletes, "activities": activity_id, "seconds": seconds,
+            "activities_per_minute": activity_id / seconds * 60 if seconds else 0.0}
+
+
+def purge_synthetic_athletes(engine) -> int:
+    """Delete every synthetic user and all rows referencing them. Returns the number of users."""
+    with engine.begin() as connection:
+        user_ids = select(User.user_id).where(User.email.like(f"%@{SYNTHETIC_EMAIL_DOMAIN}"))
+        count = len(connection.execute(user_ids).all())
+        activity_ids = select(Activity.activity_id).where(Activity.user_id.in_(user_ids))
+        for table in reversed(Base.metadata.sorted_tables):
+            if table.name == "users":
+                continue
+            if "activity_id" in table.c and table.name != "activities":
+                connection.execute(delete(table).where(table.c.activity_id.in_(activity_ids)))
+            elif "user_id" in table.c:
+                connection.execute(delete(table).where(table.c.user_id.in_(user_ids)))
+        connection.execute(delete(User.__table__).where(User.email.like(f"%@{SYNTHETIC_EMAIL_DOMAIN}")))
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic athletes for benchmarks')
+    parser.add_argument('command', choices=['load', 'archive', 'purge'])
+    parser.add_argument('path', nargs='?', help='Archive directory (archive)')
+    parser.add_argument('--athletes', type=int, default=10)
+    parser.add_argument('--years', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--first-index', type=int, default=0, help='Index of the first athlete (to add more later)')
+    parser.add_argument('--workers', type=int, default=1, help='Loader processes (load)')
+    parser.add_argument('--no-streams', action='store_true', help='Summaries only (load)')
+    parser.add_argument('--metrics', action='store_true', help='Extract activity_metrics after loading (load)')
+    args = parser.parse_args()
+
+    if args.command == 'archive':
+        from config import STREAM_ARCHIVE_DIR
+        try:
+            result = archive_synthetic_athletes(args.path or STREAM_ARCHIVE_DIR, args.athletes, args.years, args.seed)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"✅ Archived {result['activities']:,} activities for {result['athletes']} athletes "
+              f"in {result['seconds']:.1f} s ({result['activities_per_minute']:,.0f} activities/min)")
+    elif args.command == 'load':
+        result = load_synthetic_athletes(args.athletes, args.years, args.seed, args.workers,
+                                         with_streams=not args.no_streams, first_index=args.first_index)
+        print(f"✅ Loaded {result['activities']:,} activities and {result['wellness']:,} wellness days for "
+              f"{result['athletes']} athletes in {result['seconds']:.1f} s ({result['activities_per_minute']:,.0f} activities/min)")
+        if args.metrics:
+            from maintenance_cli import run_operation
+            run_operation("features", result["user_ids"], workers=args.workers)
+    else:
+        from config import engine
+        print(f"🗑️ Removed {purge_synthetic_athletes(engine)} synthetic athletes")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
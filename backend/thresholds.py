@@ -7,6 +7,7 @@ import logging
 from models import User, Threshold, Activity, WellnessData
 from utils import estimate_thresholds_from_activities
 from config import get_db
+from data_events import publish, THRESHOLDS_CHANGED
 
 router = APIRouter()
 
@@ -112,6 +113,7 @@ def update_thresholds(threshold_data: ThresholdUpdate, db: Session = Depends(get
 
     threshold.date_updated = datetime.now()
     db.commit()
+    publish(THRESHOLDS_CHANGED, threshold_data.user_id)
 
     return {
         "message": "Thresholds updated successfully.",
@@ -17,14 +17,17 @@ Key Research Principles Applied:
 4. Activity-specific recovery requirements (Laursen & Jenkins, 2002)
 """
 
+import itertools
 import logging
+import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Tuple, Optional, Any
 import numpy as np
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, or_
 
-from models import User, Activity, WellnessData, Threshold
+from athlete_snapshot import AthleteSnapshot
+from load_model import daily_history, project_plans, projection_points
 
 
 class TrainingRecommendationEngine:
@@ -51,37 +54,54 @@ class TrainingRecommendationEngine:
             'fair': 0.8,       # Some wellness concerns
             'poor': 0.6        # Multiple wellness red flags
         }
+
+        # Estimated UTL per hour of each session type, for projecting planned sessions
+        # (steady aerobic work is the ~60 UTL/hour the volume targets assume)
+        self.SESSION_UTL_PER_HOUR = {
+            'recovery': 35,
+            'easy': 45,
+            'aerobic': 60,
+            'tempo': 75,
+            'threshold': 90,
+            'vo2max': 100,
+            'interval': 100
+        }
+
+        # Volume scales tried for each planned day when projecting the plan (0 = rest day);
+        # scales above 1.0 are dropped when wellness or workload calls for recovery
+        self.PROJECTION_SCALES = (0.0, 0.75, 1.0, 1.25)
     
-    def generate_recommendations(self, user_id: int, db: Session) -> Dict[str, Any]:
+    def generate_recommendations(self, user_id: int, db: Session, snapshot: AthleteSnapshot = None) -> Dict[str, Any]:
         """
         Generate 5-day training recommendations based on comprehensive analysis.
+
+        All data is read once into an AthleteSnapshot (four queries); pass one in to reuse it.
         """
         logging.info(f"Generating training recommendations for user {user_id}")
         
         try:
-            # Get user data
-            user = db.query(User).filter_by(user_id=user_id).first()
-            threshold = db.query(Threshold).filter_by(user_id=user_id).first()
+            # Get user data, thresholds, 12 weeks of activities and recent wellness
+            snapshot = snapshot or AthleteSnapshot.load(db, user_id)
             
-            if not user or not threshold:
+            if not snapshot.user or not snapshot.threshold:
                 return {"error": "User or threshold data not found"}
             
             # Analyze historical patterns
-            historical_analysis = self._analyze_historical_patterns(user_id, db)
+            historical_analysis = self._analyze_historical_patterns(snapshot)
             
             # Get current wellness status
-            wellness_status = self._assess_current_wellness(user_id, db)
+            wellness_status = self._assess_current_wellness(snapshot)
             
             # Calculate workload ratios and trends
-            workload_analysis = self._calculate_workload_ratios(user_id, db)
+            workload_analysis = self._calculate_workload_ratios(snapshot)
             
             # Generate activity-specific recommendations
             cycling_recs = self._generate_cycling_recommendations(
-                user_id, db, historical_analysis, wellness_status, workload_analysis
+                snapshot, historical_analysis, wellness_status, workload_analysis
             )
             
             running_recs = self._generate_running_recommendations(
-                user_id, db, historical_analysis, wellness_status, workload_analysis
+                snapshot, historical_analysis, wellness_status, workload_analysis
             )
             
             # Create 5-day plan
@@ -89,6 +109,11 @@ class TrainingRecommendationEngine:
                 cycling_recs, running_recs, wellness_status, workload_analysis
             )
             
+            # Project the plan's effect on CTL / ATL / ACWR and pick per-day volumes
+            load_projection = self._project_daily_plan(
+                snapshot, daily_recommendations, wellness_status, workload_analysis
+            )
+            
             # Generate weekly summary
             weekly_summary = self._generate_weekly_summary(cycling_recs, running_recs)
             
@@ -102,6 +127,7 @@ class TrainingRecommendationEngine:
                 "running_recommendations": running_recs,
                 "weekly_summary": weekly_summary,
                 "daily_plan": daily_recommendations,
+                "load_projection": load_projection,
                 "safety_warnings": self._generate_safety_warnings(workload_analysis, wellness_status)
             }
             
@@ -109,42 +135,26 @@ class TrainingRecommendationEngine:
             logging.error(f"Error generating recommendations for user {user_id}: {e}")
             return {"error": str(e)}
     
-    def _analyze_historical_patterns(self, user_id: int, db: Session) -> Dict[str, Any]:
+    def _analyze_historical_patterns(self, snapshot: AthleteSnapshot) -> Dict[str, Any]:
         """
         Analyze historical training patterns to identify trends and preferences.
         """
-        # Get last 12 weeks of data
-        twelve_weeks_ago = datetime.now() - timedelta(days=84)
-        
-        activities = db.query(Activity).filter(
-            Activity.user_id == user_id,
-            Activity.start_date >= twelve_weeks_ago,
-            Activity.utl_score.isnot(None)
-        ).order_by(Activity.start_date.desc()).all()
-        
-        if not activities:
+        # Last 12 weeks of data (newest first)
+        if not snapshot.activity_count:
             return {"error": "Insufficient historical data"}
         
-        # Group by weeks and activity types
-        weekly_loads = {}
+        # Weekly loads come from the weekly rollups; the per-activity list feeds the long-run analysis
+        weekly_loads = snapshot.weekly_loads
         activity_patterns = {"cycling": [], "running": [], "other": []}
         
-        for activity in activities:
-            week_key = activity.start_date.strftime("%Y-W%U")
-            if week_key not in weekly_loads:
-                weekly_loads[week_key] = {"cycling": 0, "running": 0, "other": 0, "total": 0}
-            
-            activity_type = "cycling" if activity.type.lower() in ['ride', 'virtualride'] else \
-                           "running" if activity.type.lower() in ['run', 'virtualrun'] else "other"
-            
-            weekly_loads[week_key][activity_type] += activity.utl_score
-            weekly_loads[week_key]["total"] += activity.utl_score
-            
+        for activity_type, utl, start_date, moving_time, raw_type in zip(
+            snapshot.history_sports, snapshot.utl, snapshot.start_dates, snapshot.moving_times, snapshot.types
+        ):
             activity_patterns[activity_type].append({
-                "date": activity.start_date,
-                "utl": activity.utl_score,
-                "duration": activity.moving_time,
-                "type": activity.type
+                "date": start_date,
+                "utl": utl,
+                "duration": moving_time,
+                "type": raw_type
             })
         
         # Calculate trends
@@ -167,20 +177,15 @@ class TrainingRecommendationEngine:
             "cycling_percentage": cycling_percentage,
             "running_percentage": 1 - cycling_percentage,
             "activity_patterns": activity_patterns,
-            "total_activities_12w": len(activities)
+            "total_activities_12w": snapshot.activity_count
         }
     
-    def _assess_current_wellness(self, user_id: int, db: Session) -> Dict[str, Any]:
+    def _assess_current_wellness(self, snapshot: AthleteSnapshot) -> Dict[str, Any]:
         """
         Assess current wellness status from recent data.
         """
-        # Get last 7 days of wellness data
-        week_ago = datetime.now() - timedelta(days=7)
-        
-        wellness_entries = db.query(WellnessData).filter(
-            WellnessData.user_id == user_id,
-            WellnessData.date >= week_ago.date()
-        ).order_by(WellnessData.date.desc()).all()
+        # Last 7 days of wellness data
+        wellness_entries = snapshot.wellness
         
         if not wellness_entries:
             return {
@@ -240,34 +245,17 @@ class TrainingRecommendationEngine:
             "data_points": len(wellness_entries)
         }
     
-    def _calculate_workload_ratios(self, user_id: int, db: Session) -> Dict[str, Any]:
+    def _calculate_workload_ratios(self, snapshot: AthleteSnapshot) -> Dict[str, Any]:
         """
         Calculate Acute:Chronic Workload Ratio and related metrics for overall and sport-specific loads.
         """
-        # Get last 28 days for chronic load (4 weeks)
-        chronic_start = datetime.now() - timedelta(days=28)
-        # Get last 7 days for acute load (1 week)
-        acute_start = datetime.now() - timedelta(days=7)
-        
-        chronic_activities = db.query(Activity).filter(
-            Activity.user_id == user_id,
-            Activity.start_date >= chronic_start,
-            Activity.utl_score.isnot(None)
-        ).all()
-        
-        acute_activities = db.query(Activity).filter(
-            Activity.user_id == user_id,
-            Activity.start_date >= acute_start,
-            Activity.utl_score.isnot(None)
-        ).all()
-        
-        # Calculate overall loads
-        chronic_load = sum([a.utl_score for a in chronic_activities]) / 4.0  # Weekly average
-        acute_load = sum([a.utl_score for a in acute_activities])
+        # Last 28 days for chronic load (4 weeks), last 7 days for acute load (1 week)
+        chronic_load = sum(snapshot.window_utl["chronic"]) / 4.0  # Weekly average
+        acute_load = sum(snapshot.window_utl["acute"])
         acw_ratio = acute_load / chronic_load if chronic_load > 0 else 1.0
         
         # Calculate sport-specific loads
-        sport_specific_analysis = self._calculate_sport_specific_acwr(chronic_activities, acute_activities)
+        sport_specific_analysis = self._calculate_sport_specific_acwr(snapshot)
         
         # Assess overall risk level
         risk_assessment = self._assess_acwr_risk(acw_ratio)
@@ -286,60 +274,25 @@ class TrainingRecommendationEngine:
             "sport_specific": sport_specific_analysis
         }
     
-    def _calculate_sport_specific_acwr(self, chronic_activities: List, acute_activities: List) -> Dict[str, Any]:
+    def _calculate_sport_specific_acwr(self, snapshot: AthleteSnapshot) -> Dict[str, Any]:
         """Calculate ACWR ratios for specific sports (running, cycling)."""
-        
-        # Categorize activities by sport
-        def categorize_activity(activity):
-            activity_type = activity.type.lower() if activity.type else ""
-            if "run" in activity_type or "jog" in activity_type:
-                return "running"
-            elif "ride" in activity_type or "cycling" in activity_type or "bike" in activity_type:
-                return "cycling"
-            else:
-                return "other"
-        
-        # Calculate chronic loads by sport
-        chronic_running = sum([a.utl_score for a in chronic_activities if categorize_activity(a) == "running"]) / 4.0
-        chronic_cycling = sum([a.utl_score for a in chronic_activities if categorize_activity(a) == "cycling"]) / 4.0
-        chronic_other = sum([a.utl_score for a in chronic_activities if categorize_activity(a) == "other"]) / 4.0
-        
-        # Calculate acute loads by sport
-        acute_running = sum([a.utl_score for a in acute_activities if categorize_activity(a) == "running"])
-        acute_cycling = sum([a.utl_score for a in acute_activities if categorize_activity(a) == "cycling"])
-        acute_other = sum([a.utl_score for a in acute_activities if categorize_activity(a) == "other"])
-        
-        # Calculate sport-specific ACWR ratios
-        running_acwr = acute_running / chronic_running if chronic_running > 0 else (1.0 if acute_running > 0 else 0.0)
-        cycling_acwr = acute_cycling / chronic_cycling if chronic_cycling > 0 else (1.0 if acute_cycling > 0 else 0.0)
-        other_acwr = acute_other / chronic_other if chronic_other > 0 else (1.0 if acute_other > 0 else 0.0)
-        
-        return {
-            "running": {
-                "acute_load": acute_running,
-                "chronic_load": chronic_running,
-                "acwr": running_acwr,
-                "risk_assessment": self._assess_acwr_risk(running_acwr),
-                "activity_count_chronic": len([a for a in chronic_activities if categorize_activity(a) == "running"]),
-                "activity_count_acute": len([a for a in acute_activities if categorize_activity(a) == "running"])
-            },
-            "cycling": {
-                "acute_load": acute_cycling,
-                "chronic_load": chronic_cycling, 
-                "acwr": cycling_acwr,
-                "risk_assessment": self._assess_acwr_risk(cycling_acwr),
-                "activity_count_chronic": len([a for a in chronic_activities if categorize_activity(a) == "cycling"]),
-                "activity_count_acute": len([a for a in acute_activities if categorize_activity(a) == "cycling"])
-            },
-            "other": {
-                "acute_load": acute_other,
-                "chronic_load": chronic_other,
-                "acwr": other_acwr,
-                "risk_assessment": self._assess_acwr_risk(other_acwr),
-                "activity_count_chronic": len([a for a in chronic_activities if categorize_activity(a) == "other"]),
-                "activity_count_acute": len([a for a in acute_activities if categorize_activity(a) == "other"])
+        chronic = snapshot.window_sport_utl["chronic"]
+        acute = snapshot.window_sport_utl["acute"]
+        
+        analysis = {}
+        for sport in ("running", "cycling", "other"):
+            chronic_load = sum(chronic[sport]) / 4.0
+            acute_load = sum(acute[sport])
+            acwr = acute_load / chronic_load if chronic_load > 0 else (1.0 if acute_load > 0 else 0.0)
+            analysis[sport] = {
+                "acute_load": acute_load,
+                "chronic_load": chronic_load,
+                "acwr": acwr,
+                "risk_assessment": self._assess_acwr_risk(acwr),
+                "activity_count_chronic": len(chronic[sport]),
+                "activity_count_acute": len(acute[sport])
             }
-        }
+        return analysis
     
     def _assess_acwr_risk(self, acwr: float) -> Dict[str, str]:
         """Assess risk level for a given ACWR value."""
@@ -387,13 +340,13 @@ class TrainingRecommendationEngine:
         
         return {"level": combined_level, "note": combined_note}
     
-    def _generate_cycling_recommendations(self, user_id: int, db: Session, 
+    def _generate_cycling_recommendations(self, snapshot: AthleteSnapshot,
                                         historical: Dict, wellness: Dict, 
                                         workload: Dict) -> Dict[str, Any]:
         """
         Generate cycling-specific recommendations.
         """
-        threshold = db.query(Threshold).filter_by(user_id=user_id).first()
+        threshold = snapshot.threshold
         
         # Base recommendations on FTP if available
         if threshold and threshold.ftp_watts and threshold.ftp_watts > 0:
@@ -435,13 +388,13 @@ class TrainingRecommendationEngine:
                 "weekly_hours_target": self._calculate_cycling_hours_target(historical, workload)
             }
     
-    def _generate_running_recommendations(self, user_id: int, db: Session,
+    def _generate_running_recommendations(self, snapshot: AthleteSnapshot,
                                         historical: Dict, wellness: Dict,
                                         workload: Dict) -> Dict[str, Any]:
         """
         Generate running-specific recommendations.
         """
-        threshold = db.query(Threshold).filter_by(user_id=user_id).first()
+        threshold = snapshot.threshold
         
         # Base recommendations on threshold pace if available
         if threshold and threshold.fthp_mps and threshold.fthp_mps > 0:
@@ -571,6 +524,69 @@ class TrainingRecommendationEngine:
         
         return daily_plan
     
+    def project_plans(self, history_utl, plan_utl, fallback: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Simulate candidate plans (a plans x days matrix of UTL, day 0 = today) forward from a
+        daily UTL history and pick the one with the largest CTL gain inside the ACWR band
+        (`fallback` when there is no chronic load to measure the band against).
+        """
+        return project_plans(history_utl, plan_utl, self.MIN_ACW_RATIO, self.MAX_ACW_RATIO, fallback)
+    
+    def _estimate_session_utl(self, activity: Dict) -> float:
+        """Estimated UTL of a planned session from its duration and type."""
+        per_hour = self.SESSION_UTL_PER_HOUR.get(activity.get("session"), 60)
+        return activity.get("duration_minutes", 0) / 60.0 * per_hour
+    
+    def _project_daily_plan(self, snapshot: AthleteSnapshot, daily_plan: List[Dict],
+                            wellness: Dict, workload: Dict) -> Dict[str, Any]:
+        """
+        Project the plan with every combination of per-day volume scales (up to 4^5 = 1,024
+        candidates, evaluated in one batch from the snapshot's daily history, no extra queries)
+        and annotate each day with its estimated UTL and the volume of the chosen candidate.
+        """
+        compute_start = time.perf_counter()
+        today = snapshot.now.date()
+        history, done_today = daily_history(snapshot.start_dates, snapshot.utl, today)
+        
+        planned = []
+        for day_plan in daily_plan:
+            for activity in day_plan["activities"]:
+                activity["estimated_utl"] = round(self._estimate_session_utl(activity), 1)
+            planned.append(sum(activity["estimated_utl"] for activity in day_plan["activities"]))
+        
+        scales = self.PROJECTION_SCALES
+        if wellness["status"] in ["fair", "poor"] or workload["risk_level"] == "high":
+            scales = tuple(scale for scale in scales if scale <= 1.0)
+        combinations = list(itertools.product(*[scales if utl > 0 else (0.0,) for utl in planned]))
+        volume_scales = np.array(combinations)
+        plan_utl = volume_scales * np.array(planned)
+        plan_utl[:, 0] += done_today  # Sessions already done today count towards day 0
+        
+        as_planned = combinations.index(tuple(1.0 if utl > 0 else 0.0 for utl in planned))
+        projection = self.project_plans(history, plan_utl, fallback=as_planned)
+        best = projection["best"]
+        for day_plan, utl, scale in zip(daily_plan, planned, volume_scales[best].tolist()):
+            day_plan["estimated_utl"] = round(utl, 1)
+            day_plan["suggested_volume"] = scale
+        
+        return {
+            "candidates": len(combinations),
+            "feasible_candidates": int(projection["feasible"].sum()),
+            "acwr_band": [self.MIN_ACW_RATIO, self.MAX_ACW_RATIO],
+            "band_applied": projection["band_applied"],
+            "start": {name: round(value, 3 if name == "acwr" else 1) for name, value in projection["start"].items()},
+            "volume_scales": volume_scales[best].tolist(),
+            "within_band": bool(projection["feasible"][best]),
+            "ctl_gain": round(float(projection["ctl_gain"][best]), 1),
+            "days": projection_points(projection, plan_utl, best, today),
+            "as_planned": {
+                "within_band": bool(projection["feasible"][as_planned]),
+                "ctl_gain": round(float(projection["ctl_gain"][as_planned]), 1),
+                "max_acwr": round(float(projection["acwr"][as_planned].max()), 3)
+            },
+            "compute_ms": round((time.perf_counter() - compute_start) * 1000, 2)
+        }
+    
     def _select_session_type(self, activity_recs: Dict, day_index: int, wellness: Dict) -> str:
         """Select appropriate session type based on day and status."""
         recommended_sessions = activity_recs.get("recommended_sessions", ["aerobic"])
@@ -0,0 +1,315 @@
+# Training rollups: per-user totals by week, month and year, per sport
+#
+# The dashboard's week/month/year totals and the recommendations' weekly loads used to be
+# re-summed from raw activities on every request. training_rollups holds one row per user,
+# period, period start and Strava activity type with the count, distance, moving time,
+# elevation gain and UTL of its activities, so readers touch O(periods) rows instead.
+#
+# Periods are calendar periods of the activity's start date: ISO weeks (Monday), months, years.
+#
+# Rows are kept current inside the transaction that changes the activities: a session hook
+# notes the user and day of every activity inserted, deleted, or updated in a column the
+# rollups sum (and the old day of one moved to another date), and after the flush recomputes
+# the weeks and months containing those days from their activities, then the touched years from
+# their month rows. Recomputing a bucket instead of adding deltas keeps it exact however often
+# it is touched, and a one-activity change reads about a month of rows.
+#
+# Concurrent writers for one user (a webhook fetch next to a queued sync, a rescore next to an
+# import) would otherwise each recompute the same buckets from their own view and then collide
+# on the primary key or overwrite each other's totals. On Postgres every refresh first takes a
+# per-user transaction-level advisory lock, and its reads come after it (each statement sees
+# what committed before it under READ COMMITTED), so the second writer recomputes the buckets
+# including the first one's activities. SQLite serializes writers on its own.
+#
+# Writes that bypass the ORM unit of work (Query.update/delete, Core inserts such as the
+# synthetic athlete loader) are not seen; call rebuild_rollups() after them, or run
+# `python maintenance_cli.py rollups` to rebuild every user.
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Set, Tuple
+import logging
+
+from sqlalchemy import and_, delete, event, func, insert, inspect, or_, select, tuple_
+from sqlalchemy.orm import Session
+
+from models import Activity, TrainingRollup
+from leader_election import advisory_lock_key
+
+WEEK, MONTH, YEAR = "week", "month", "year"
+PERIODS = (WEEK, MONTH, YEAR)
+UNKNOWN_SPORT = "Unknown"  # Activities stored without a type
+
+# Activity columns the rollups sum or bucket by; changing any of them touches the activity's buckets
+_TRACKED = ("user_id", "start_date", "type", "distance", "moving_time", "total_elevation_gain", "utl_score")
+_TOUCHED = "training_rollups_touched"  # session.info key: {(user_id, date)} changed by the pending flush
+_FIELDS = ("activities", "distance", "moving_time", "elevation_gain", "utl")
+
+_LOCK_NAMESPACE = advisory_lock_key("training_rollups")  # pg_advisory_xact_lock(namespace, user_id)
+
+_ACTIVITY_COLUMNS = (Activity.user_id, Activity.start_date, Activity.type, Activity.distance, Activity.moving_time,
+                     Activity.total_elevation_gain, Activity.utl_score)
+
+
+def period_start(period: str, day: date) -> date:
+    """First day of the week (Monday), month or year containing `day`."""
+    if period == WEEK:
+        return day - timedelta(days=day.weekday())
+    if period == MONTH:
+        return day.replace(day=1)
+    if period == YEAR:
+        return day.replace(month=1, day=1)
+    raise ValueError(f"Unknown period {period!r}")
+
+
+def period_end(period: str, start: date) -> date:
+    """First day after the period starting on `start`."""
+    if period == WEEK:
+        return start + timedelta(days=7)
+    if period == MONTH:
+        return date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return date(start.year + 1, 1, 1)
+
+
+def week_key(start: date) -> str:
+    """ISO week label ('2025-W07'); sorts chronologically."""
+    year, week, _ = start.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def _empty() -> list:
+    return [0, 0.0, 0, 0.0, 0.0]
+
+
+def _add(totals: list, row):
+    totals[0] += 1
+    totals[1] += row.distance or 0
+    totals[2] += row.moving_time or 0
+    totals[3] += row.total_elevation_gain or 0
+    totals[4] += row.utl_score or 0
+
+
+def _aggregate(rows: Iterable, periods=PERIODS) -> Dict[tuple, list]:
+    """{(user_id, period, period_start, sport): [activities, distance, moving_time, elevation_gain, utl]}"""
+    totals = defaultdict(_empty)
+    for row in rows:
+        if row.start_date is None:
+            continue
+        day, sport = row.start_date.date(), row.type or UNKNOWN_SPORT
+        for period in periods:
+            _add(totals[(row.user_id, period, period_start(period, day), sport)], row)
+    return totals
+
+
+def _rows(totals: Dict[tuple, list], now: datetime) -> List[dict]:
+    return [{
+        "user_id": user_id, "period": period, "period_start": start, "sport": sport,
+        "activities": values[0], "distance": values[1], "moving_time": int(values[2]),
+        "elevation_gain": values[3], "utl": values[4], "updated_at": now,
+    } for (user_id, period, start, sport), values in totals.items()]
+
+
+def _ranges(starts: Iterable[Tuple[str, date]]) -> List[Tuple[date, date]]:
+    """Merged [start, end) date ranges covering the given periods."""
+    merged = []
+    for start, end in sorted((start, period_end(period, start)) for period, start in starts):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _at_midnight(day: date) -> datetime:
+    return datetime.combine(day, time())
+
+
+# --- Incremental maintenance --------------------------------------------------------------------
+
+def _lock_user(executor, user_id: int):
+    """Hold the user's rollup lock until the transaction ends (Postgres only)."""
+    bind = executor.get_bind() if isinstance(executor, Session) else executor
+    if bind.dialect.name == "postgresql":
+        executor.execute(select(func.pg_advisory_xact_lock(_LOCK_NAMESPACE, user_id)))
+
+
+def refresh_days(executor, user_id: int, days: Iterable[date]) -> int:
+    """
+    Recompute the user's week, month and year rows containing `days`, in two reads, a delete and
+    an insert however many days are touched.
+
+    Args:
+        executor: Session or Connection; the caller commits
+
+    Returns:
+        Rollup rows written
+    """
+    days = set(days)
+    if not days:
+        return 0
+    table = TrainingRollup.__table__
+    _lock_user(executor, user_id)  # Before any read, so they include a concurrent writer's commit
+    buckets = {(period, period_start(period, day)) for day in days for period in (WEEK, MONTH)}
+    months = {start for period, start in buckets if period == MONTH}
+    years = sorted({period_start(YEAR, day) for day in days})
+
+    activity_rows = executor.execute(select(*_ACTIVITY_COLUMNS).where(
+        Activity.user_id == user_id,
+        or_(*[and_(Activity.start_date >= _at_midnight(start), Activity.start_date < _at_midnight(end))
+              for start, end in _ranges(buckets)]),
+    )).all()
+    totals = {key: values for key, values in _aggregate(activity_rows, (WEEK, MONTH)).items()
+              if (key[1], key[2]) in buckets}  # A touched week's rows cover days of untouched months
+
+    # Years are summed from their month rows (the untouched ones stored, the touched ones just
+    # recomputed) rather than from a year of activities
+    stored_months = executor.execute(select(
+        table.c.period_start, table.c.sport, *[table.c[field] for field in _FIELDS],
+    ).where(
+        table.c.user_id == user_id, table.c.period == MONTH, table.c.period_start.notin_(sorted(months)),
+        or_(*[and_(table.c.period_start >= start, table.c.period_start < period_end(YEAR, start)) for start in years]),
+    )).all()
+    month_totals = [(start, sport, values) for (_, period, start, sport), values in totals.items() if period == MONTH]
+    month_totals += [(row.period_start, row.sport, [getattr(row, field) or 0 for field in _FIELDS])
+                     for row in stored_months]
+    for start, sport, values in month_totals:
+        year_values = totals.setdefault((user_id, YEAR, period_start(YEAR, start), sport), _empty())
+        for i, value in enumerate(values):
+            year_values[i] += value
+
+    executor.execute(delete(table).where(
+        table.c.user_id == user_id,
+        tuple_(table.c.period, table.c.period_start).in_(sorted(buckets | {(YEAR, start) for start in years})),
+    ))
+    rows = _rows(totals, datetime.utcnow())
+    if rows:
+        executor.execute(insert(table), rows)
+    return len(rows)
+
+
+def _note(touched: Set[tuple], user_id, start_date):
+    if user_id is not None and start_date is not None:
+        touched.add((user_id, start_date.date()))
+
+
+@event.listens_for(Session, "before_flush")
+def _note_changed_activities(session, flush_context, instances):
+    touched = session.info.setdefault(_TOUCHED, set())
+    for activity in list(session.new) + list(session.deleted):
+        if isinstance(activity, Activity):
+            _note(touched, activity.user_id, activity.start_date)
+    for activity in session.dirty:
+        if not isinstance(activity, Activity):
+            continue
+        attrs = inspect(activity).attrs
+        if not any(attrs[name].history.has_changes() for name in _TRACKED):
+            continue
+        _note(touched, activity.user_id, activity.start_date)
+        old_user, old_start = attrs.user_id.history.deleted, attrs.start_date.history.deleted
+        if old_user or old_start:  # Moved: its old buckets lose it
+            _note(touched, old_user[0] if old_user else activity.user_id,
+                  old_start[0] if old_start else activity.start_date)
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _refresh_touched(session, flush_context):
+    touched = session.info.pop(_TOUCHED, None)
+    if not touched:
+        return
+    by_user = defaultdict(set)
+    for user_id, day in touched:
+        by_user[user_id].add(day)
+    for user_id in sorted(by_user):  # One lock order across transactions
+        refresh_days(session, user_id, by_user[user_id])
+
+
+# --- Bulk rebuild -------------------------------------------------------------------------------
+
+def rebuild_rollups(executor, user_id: int) -> int:
+    """
+    Replace all of the user's rollup rows with totals recomputed from their activities.
+
+    Args:
+        executor: Session or Connection; the caller commits
+
+    Returns:
+        Rollup rows written
+    """
+    _lock_user(executor, user_id)
+    activity_rows = executor.execute(select(*_ACTIVITY_COLUMNS).where(Activity.user_id == user_id)).all()
+    table = TrainingRollup.__table__
+    executor.execute(delete(table).where(table.c.user_id == user_id))
+    rows = _rows(_aggregate(activity_rows), datetime.utcnow())
+    if rows:
+        executor.execute(insert(table), rows)
+    logging.info(f"📚 Rebuilt {len(rows)} training rollups from {len(activity_rows)} activities for user {user_id}")
+    return len(rows)
+
+
+def rollup_differences(db: Session, user_id: int) -> List[str]:
+    """Buckets whose stored totals differ from a recomputation (what a rebuild would change)."""
+    expected = _aggregate(db.execute(select(*_ACTIVITY_COLUMNS).where(Activity.user_id == user_id)).all())
+    stored = {(row.user_id, row.period, row.period_start, row.sport): [getattr(row, field) for field in _FIELDS]
+              for row in db.query(TrainingRollup).filter(TrainingRollup.user_id == user_id)}
+    differences = []
+    for key in sorted(set(expected) | set(stored), key=lambda key: (key[1], key[2], key[3])):
+        new, old = expected.get(key), stored.get(key)
+        if new is None or old is None or new[0] != old[0] or any(abs(a - b) > 0.01 for a, b in zip(new[1:], old[1:])):
+            _, period, start, sport = key
+            differences.append(f"{period} {start.isoformat()} {sport}: {_describe(old)} → {_describe(new)}")
+    return differences
+
+
+def _describe(values) -> str:
+    return f"{values[0]} activities, {values[4]:.1f} UTL" if values else "none"
+
+
+# --- Readers ------------------------------------------------------------------------------------
+
+def _blank() -> dict:
+    return {"activities": 0, "distance": 0.0, "moving_time": 0, "elevation_gain": 0.0, "utl": 0.0}
+
+
+def _accumulate(totals: dict, row):
+    for field in _FIELDS:
+        totals[field] += getattr(row, field) or 0
+
+
+def period_totals(db: Session, user_id: int, now: datetime = None) -> Dict[str, dict]:
+    """
+    Totals for the current week, month and year and all time, all sports, from one query over the
+    user's year rows and this week's and month's rows.
+
+    Returns:
+        {"week"|"month"|"year"|"all_time": {activities, distance, moving_time, elevation_gain, utl}}
+    """
+    today = (now or datetime.now()).date()
+    current = {period: period_start(period, today) for period in PERIODS}
+    rows = db.query(TrainingRollup).filter(
+        TrainingRollup.user_id == user_id,
+        or_(TrainingRollup.period == YEAR,
+            and_(TrainingRollup.period == MONTH, TrainingRollup.period_start == current[MONTH]),
+            and_(TrainingRollup.period == WEEK, TrainingRollup.period_start == current[WEEK])),
+    ).all()
+
+    totals = {name: _blank() for name in (WEEK, MONTH, YEAR, "all_time")}
+    for row in rows:
+        if row.period == YEAR:
+            _accumulate(totals["all_time"], row)
+        if row.period_start == current[row.period]:
+            _accumulate(totals[row.period], row)
+    return totals
+
+
+def rollup_series(db: Session, user_id: int, period: str, since: date, until: date = None) -> List[TrainingRollup]:
+    """The user's rows of one period type starting within [since, until], oldest first (for charts)."""
+    query = db.query(TrainingRollup).filter(
+        TrainingRollup.user_id == user_id, TrainingRollup.period == period,
+        TrainingRollup.period_start >= period_start(period, since),
+    )
+    if until is not None:
+        query = query.filter(TrainingRollup.period_start <= until)
+    return query.order_by(TrainingRollup.period_start, TrainingRollup.sport).all()
+
+
+def has_rollups(db: Session, user_id: int) -> bool:
+    return db.query(TrainingRollup.user_id).filter(TrainingRollup.user_id == user_id).first() is not None
@@ -0,0 +1,242 @@
+# Priority lanes and upstream API budgets
+#
+# Every unit of work runs in a lane:
+#   interactive  - a user is waiting (onboarding import, "sync now" buttons, /sync/test)
+#   backfill     - history for a newly connected user
+#   routine      - scheduled and webhook-driven syncs
+#   maintenance  - threshold/UTL recalculation and other bulk jobs
+#
+# The lane orders the work queue and decides how much of the Strava / intervals.icu rate
+# limit a request may use: the last INTERACTIVE_RESERVED_SHARE of every window is kept for
+# interactive requests, so the nightly batch can't starve a new user's first import.
+# Background requests that hit their share wait for the window to roll over - but never past
+# the wait deadline of the queue item they run in (half its lease, see job_queue.execute_job):
+# past it they raise UpstreamBudgetExceeded with the seconds until the reset, and the queue puts
+# the item back until then instead of sleeping through its lease and having it run twice.
+#
+# Counts are per process, but Strava reports app-wide usage in X-RateLimit-Usage on every
+# response, so each process catches up with the others after its next call.
+from contextlib import contextmanager
+from typing import Optional
+import contextvars
+import threading
+import logging
+import time
+
+from metrics import REGISTRY, Counter, Gauge
+from config import (
+    STRAVA_RATE_LIMIT_15MIN, STRAVA_RATE_LIMIT_DAILY, INTERVALS_RATE_LIMIT_PER_MINUTE,
+    INTERACTIVE_RESERVED_SHARE, UPSTREAM_MAX_WAIT_SECONDS,
+)
+
+LANE_INTERACTIVE = "interactive"
+LANE_BACKFILL = "backfill"
+LANE_ROUTINE = "routine"
+LANE_MAINTENANCE = "maintenance"
+LANES = (LANE_INTERACTIVE, LANE_BACKFILL, LANE_ROUTINE, LANE_MAINTENANCE)
+
+_current_lane = contextvars.ContextVar("upstream_lane", default=LANE_ROUTINE)
+_wait_deadline = contextvars.ContextVar("upstream_wait_deadline", default=None)
+
+
+def current_lane() -> str:
+    return _current_lane.get()
+
+
+@contextmanager
+def upstream_lane(lane: str):
+    """Run the enclosed upstream calls in `lane`."""
+    if lane not in LANES:
+        raise ValueError(f"Unknown lane '{lane}'")
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+@contextmanager
+def wait_deadline(deadline: float):
+    """Budget waits inside the block must end by `deadline` (time.time()); longer ones raise instead."""
+    token = _wait_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _wait_deadline.reset(token)
+
+
+class UpstreamBudgetExceeded(Exception):
+    """No budget left for this lane within the allowed wait; retry_after is the seconds until it frees up."""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UpstreamBudget:
+    """
+    Fixed-window request budget for one upstream API, with a reserve for interactive calls.
+
+    Args:
+        name: Upstream name for logs and status
+        window_seconds: Length of the short window (windows align to multiples of it, like Strava's quarter hours)
+        window_limit: Requests allowed per short window
+        daily_limit: Requests allowed per UTC day (None for no daily limit)
+        reserved_share: Fraction of each limit only interactive requests may use
+        max_wait_seconds: Longest a background request waits for budget before raising
+    """
+
+    def __init__(self, name: str, window_seconds: int, window_limit: int, daily_limit: Optional[int] = None,
+                 reserved_share: float = INTERACTIVE_RESERVED_SHARE,
+                 max_wait_seconds: int = UPSTREAM_MAX_WAIT_SECONDS, clock=time.time, sleep=time.sleep):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.window_limit = window_limit
+        self.daily_limit = daily_limit
+        self.reserved_share = reserved_share
+        self.max_wait_seconds = max_wait_seconds
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._window_start = None
+        self._day_start = None
+        self.window_used = 0
+        self.daily_used = 0
+        self.calls_by_lane = {lane: 0 for lane in LANES}
+        self.throttled_by_lane = {lane: 0 for lane in LANES}
+        self.wait_seconds_by_lane = {lane: 0.0 for lane in LANES}
+
+    def _roll(self, now: float):
+        window_start = now - now % self.window_seconds
+        if window_start != self._window_start:
+            self._window_start = window_start
+            self.window_used = 0
+        day_start = now - now % 86400
+        if day_start != self._day_start:
+            self._day_start = day_start
+            self.daily_used = 0
+
+    def _limits(self, lane: str):
+        if lane == LANE_INTERACTIVE:
+            return self.window_limit, self.daily_limit
+        share = 1 - self.reserved_share
+        daily = int(self.daily_limit * share) if self.daily_limit is not None else None
+        return int(self.window_limit * share), daily
+
+    def _seconds_until_available(self, lane: str, now: float) -> float:
+        """0 if a request in `lane` may go now, else seconds until the blocking window resets."""
+        window_limit, daily_limit = self._limits(lane)
+        if daily_limit is not None and self.daily_used >= daily_limit:
+            return self._day_start + 86400 - now
+        if self.window_used >= window_limit:
+            return self._window_start + self.window_seconds - now
+        return 0
+
+    def acquire(self, lane: str = None):
+        """
+        Reserve one request for `lane` (default: the current lane), waiting for the window
+        to roll over if the lane's share is used up.
+
+        Raises:
+            UpstreamBudgetExceeded: if the budget won't free up within max_wait_seconds or before
+                the current wait deadline
+        """
+        lane = lane or current_lane()
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._roll(now)
+                wait = self._seconds_until_available(lane, now)
+                if wait <= 0:
+                    self.window_used += 1
+                    self.daily_used += 1
+                    self.calls_by_lane[lane] += 1
+                    if waited:
+                        self.wait_seconds_by_lane[lane] += waited
+                    return
+                if waited == 0:
+                    self.throttled_by_lane[lane] += 1
+
+            deadline = _wait_deadline.get()
+            if waited + wait > self.max_wait_seconds or (deadline is not None and wait > deadline - time.time()):
+                raise UpstreamBudgetExceeded(
+                    f"{self.name} budget for {lane} lane exhausted "
+                    f"({self.window_used}/{self.window_limit} this window, {self.daily_used}/{self.daily_limit} today)",
+                    retry_after=wait,
+                )
+            if waited == 0:
+                logging.info(f"⏳ {self.name} {lane} request waiting {wait:.0f}s for rate limit window")
+            # Wake up at the reset (plus a little slack); re-check in case another thread got there first
+            step = wait + 0.5
+            self._sleep(step)
+            waited += step
+
+    def observe(self, headers):
+        """Sync usage and limits from Strava-style X-RateLimit-Usage / X-RateLimit-Limit headers."""
+        usage = _parse_pair(headers.get("X-RateLimit-Usage")) if headers else None
+        limits = _parse_pair(headers.get("X-RateLimit-Limit")) if headers else None
+        with self._lock:
+            self._roll(self._clock())
+            if limits:
+                self.window_limit, self.daily_limit = limits
+            if usage:
+                self.window_used = max(self.window_used, usage[0])
+                self.daily_used = max(self.daily_used, usage[1])
+
+    def status(self) -> dict:
+        with self._lock:
+            self._roll(self._clock())
+            background_window, background_daily = self._limits(LANE_ROUTINE)
+            return {
+                "window_seconds": self.window_seconds,
+                "window_used": self.window_used,
+                "window_limit": self.window_limit,
+                "daily_used": self.daily_used,
+                "daily_limit": self.daily_limit,
+                "background_window_limit": background_window,
+                "background_daily_limit": background_daily,
+                "calls_by_lane": dict(self.calls_by_lane),
+                "throttled_by_lane": dict(self.throttled_by_lane),
+                "wait_seconds_by_lane": {lane: round(s, 1) for lane, s in self.wait_seconds_by_lane.items()},
+            }
+
+
+def _parse_pair(value: Optional[str]):
+    try:
+        short, daily = (int(part) for part in value.split(","))
+        return short, daily
+    except (AttributeError, ValueError):
+        return None
+
+
+strava_budget = UpstreamBudget("strava", 15 * 60, STRAVA_RATE_LIMIT_15MIN, STRAVA_RATE_LIMIT_DAILY)
+intervals_budget = UpstreamBudget("intervals_icu", 60, INTERVALS_RATE_LIMIT_PER_MINUTE)
+
+
+def _budget_samples(field: str):
+    """(upstream, window) label values and remaining / limit for the short and daily windows."""
+    for budget in (strava_budget, intervals_budget):
+        status = budget.status()
+        for window, used, limit in (("short", status["window_used"], status["window_limit"]),
+                                    ("daily", status["daily_used"], status["daily_limit"])):
+            if limit is not None:
+                yield (budget.name, window), (max(limit - used, 0) if field == "remaining" else limit)
+
+
+def _lane_samples(field: str):
+    for budget in (strava_budget, intervals_budget):
+        for lane, value in budget.status()[field].items():
+            yield (budget.name, lane), value
+
+
+REGISTRY.register(Gauge("upstream_budget_remaining", "Requests left in the current rate limit window.",
+                        ("upstream", "window"), callback=lambda: _budget_samples("remaining")))
+REGISTRY.register(Gauge("upstream_budget_limit", "Rate limit per window (as last reported by the upstream).",
+                        ("upstream", "window"), callback=lambda: _budget_samples("limit")))
+REGISTRY.register(Counter("upstream_budget_calls_total", "Requests admitted by the budget, by lane.",
+                          ("upstream", "lane"), callback=lambda: _lane_samples("calls_by_lane")))
+REGISTRY.register(Counter("upstream_budget_throttled_total", "Requests that had to wait for their lane's share.",
+                          ("upstream", "lane"), callback=lambda: _lane_samples("throttled_by_lane")))
+REGISTRY.register(Counter("upstream_budget_wait_seconds_total", "Time requests spent waiting for budget.",
+                          ("upstream", "lane"), callback=lambda: _lane_samples("wait_seconds_by_lane")))
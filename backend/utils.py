@@ -1,6 +1,6 @@
 # Training Load Calculation and Threshold Estimation Utilities
 import numpy as np
-from typing import Dict, Any, Tuple, Optional, List
+from typing import Dict, Any, Tuple, Optional, List, Iterable
 import logging
 from datetime import datetime
 from streams_analysis import (
@@ -11,6 +11,56 @@ from streams_analysis import (
     analyze_running_intensity_distribution
 )
 
+# Science-based intensity factors for running intensity classification
+RUNNING_INTENSITY_MULTIPLIERS = {
+    "recovery": 0.5,
+    "aerobic_base": 0.8,
+    "tempo": 1.2,
+    "high_intensity": 1.8
+}
+
+# Activity-specific scaling factors based on MET values from 
+# 2024 Compendium of Physical Activities (evidence-based ratios)
+# 
+# Scientific basis:
+# - Running (6-8 mph): 9-12 METs (baseline = 10.5 average)
+# - Cycling (12-16 mph): 8-12 METs (average = 10) → 10/10.5 = 0.95
+# - Hiking general: 6 METs → 6/10.5 = 0.57 ≈ 0.55
+# - Walking brisk (3.5-4.5 mph): 5-7 METs (average = 6) → 6/10.5 = 0.57 ≈ 0.45
+# - Swimming (moderate): 8-12 METs (average = 10) → 10/10.5 = 0.95
+TRIMP_ACTIVITY_SCALING = {
+    "run": 1.0,           # 9-12 METs - baseline reference
+    "running": 1.0,
+    "ride": 0.95,         # 8-12 METs - mechanical efficiency advantage
+    "cycling": 0.95,
+    "hike": 0.55,         # 6 METs general hiking (evidence-based)
+    "hiking": 0.55,
+    "walk": 0.45,         # 5-7 METs brisk walking (evidence-based)
+    "walking": 0.45,
+    "swim": 0.95,         # 8-12 METs moderate swimming
+    "swimming": 0.95,
+    "workout": 0.80,      # Generic strength/cross-training
+    "crosstraining": 0.80,
+    "elliptical": 0.70,   # Lower impact, mechanical assistance
+    "alpineski": 0.90,    # Similar to cycling, equipment assistance
+    "nordicski": 0.95,    # High full-body engagement
+    "default": 0.75       # Conservative evidence-based default
+}
+
+# Conservative time-based fallback factors
+FALLBACK_INTENSITY_FACTORS = {
+    "run": 1.0,
+    "running": 1.0,
+    "ride": 0.9,
+    "cycling": 0.9,
+    "swim": 1.1,
+    "swimming": 1.1,
+    "hike": 0.4,  # Much lower for hiking
+    "walk": 0.3,  # Much lower for walking
+    "default": 0.8
+}
+
+
 def calculate_utl(activity_summary: Dict[str, Any], threshold: Any, activity_streams: Optional[Dict] = None, wellness_data: Optional[Dict] = None) -> Tuple[float, str]:
     """
     Calculate Unit Training Load (UTL) for an activity with wellness data integration.
@@ -80,15 +130,7 @@ def calculate_utl(activity_summary: Dict[str, Any], threshold: Any, activity_str
                         # Calculate UTL based on intensity distribution
                         intensity_type = intensity_analysis["intensity_classification"]
                         
-                        # Science-based intensity factors
-                        intensity_multipliers = {
-                            "recovery": 0.5,
-                            "aerobic_base": 0.8, 
-                            "tempo": 1.2,
-                            "high_intensity": 1.8
-                        }
-                        
-                        multiplier = intensity_multipliers.get(intensity_type, 1.0)
+                        multiplier = RUNNING_INTENSITY_MULTIPLIERS.get(intensity_type, 1.0)
                         intensity_utl = moving_time_hours * multiplier * 100
                         
                         return intensity_utl, f"running_intensity_{intensity_type}"
@@ -141,19 +183,7 @@ def calculate_utl(activity_summary: Dict[str, Any], threshold: Any, activity_str
         
         # 6. Conservative fallback - avoid inflated scores for long, easy activities
         # Use activity type but cap the duration impact
-        intensity_factors = {
-            "run": 1.0,
-            "running": 1.0,
-            "ride": 0.9,
-            "cycling": 0.9,
-            "swim": 1.1,
-            "swimming": 1.1,
-            "hike": 0.4,  # Much lower for hiking
-            "walk": 0.3,  # Much lower for walking
-            "default": 0.8
-        }
-        
-        intensity = intensity_factors.get(activity_type, intensity_factors["default"])
+        intensity = FALLBACK_INTENSITY_FACTORS.get(activity_type, FALLBACK_INTENSITY_FACTORS["default"])
         
         # Cap the time factor to prevent inflated scores for very long activities
         # Use logarithmic scaling for activities over 2 hours
@@ -249,35 +279,7 @@ def calculate_improved_trimp(hr_data: List[int], max_hr: int, resting_hr: int, d
         duration_minutes = duration_seconds / 60.0
         base_trimp = duration_minutes * hr_fraction * (0.5 * np.exp(1.5 * hr_fraction))
         
-        # Activity-specific scaling factors based on MET values from 
-        # 2024 Compendium of Physical Activities (evidence-based ratios)
-        # 
-        # Scientific basis:
-        # - Running (6-8 mph): 9-12 METs (baseline = 10.5 average)
-        # - Cycling (12-16 mph): 8-12 METs (average = 10) → 10/10.5 = 0.95
-        # - Hiking general: 6 METs → 6/10.5 = 0.57 ≈ 0.55
-        # - Walking brisk (3.5-4.5 mph): 5-7 METs (average = 6) → 6/10.5 = 0.57 ≈ 0.45
-        # - Swimming (moderate): 8-12 METs (average = 10) → 10/10.5 = 0.95
-        activity_scaling = {
-            "run": 1.0,           # 9-12 METs - baseline reference
-            "running": 1.0,
-            "ride": 0.95,         # 8-12 METs - mechanical efficiency advantage
-            "cycling": 0.95,
-            "hike": 0.55,         # 6 METs general hiking (evidence-based)
-            "hiking": 0.55,
-            "walk": 0.45,         # 5-7 METs brisk walking (evidence-based)
-            "walking": 0.45,
-            "swim": 0.95,         # 8-12 METs moderate swimming
-            "swimming": 0.95,
-            "workout": 0.80,      # Generic strength/cross-training
-            "crosstraining": 0.80,
-            "elliptical": 0.70,   # Lower impact, mechanical assistance
-            "alpineski": 0.90,    # Similar to cycling, equipment assistance
-            "nordicski": 0.95,    # High full-body engagement
-            "default": 0.75       # Conservative evidence-based default
-        }
-        
-        scaling_factor = activity_scaling.get(activity_type, activity_scaling["default"])
+        scaling_factor = TRIMP_ACTIVITY_SCALING.get(activity_type, TRIMP_ACTIVITY_SCALING["default"])
         
         # Apply activity scaling
         adjusted_trimp = base_trimp * scaling_factor
@@ -555,7 +557,9 @@ def enhanced_threshold_estimation(activities_with_streams: List[Tuple[Dict, Dict
 def estimate_thresholds_from_activities(
     activities: List[Dict],
     gender: str,
-    activities_with_streams: List[Tuple[Dict, Dict]] = None
+    activities_with_streams: List[Tuple[Dict, Dict]] = None,
+    hr_sketch=None,
+    stream_curves: Tuple[Dict[int, float], Dict[int, float]] = None
 ) -> Optional[Dict]:
     """
     Estimate thresholds from activity data using stream analysis when available.
@@ -564,6 +568,9 @@ def estimate_thresholds_from_activities(
         activities: List of activity summaries
         gender: User gender for HR estimation  
         activities_with_streams: List of (activity, streams) tuples for detailed analysis
+        hr_sketch: Optional merged heart-rate HistogramSketch of the activities (replaces their HR streams)
+        stream_curves: Optional (power_curve, speed_curve) already folded from the streams
+            (fold_stream_curves), so streams can be read one at a time instead of listed
     
     Returns:
         Dict with estimated thresholds or None if insufficient data
@@ -581,20 +588,22 @@ def estimate_thresholds_from_activities(
     
     # Estimate FTP from cycling activities
     if cycling_activities:
-        ftp = estimate_ftp_from_activities(cycling_activities, activities_with_streams)
+        ftp = estimate_ftp_from_activities(cycling_activities, activities_with_streams,
+                                           stream_curves[0] if stream_curves else None)
         if ftp:
             thresholds['ftp_watts'] = ftp
             logging.info(f"Estimated FTP: {ftp}W")
     
     # Estimate FTHP from running activities  
     if running_activities:
-        fthp = estimate_fthp_from_activities(running_activities, activities_with_streams)
+        fthp = estimate_fthp_from_activities(running_activities, activities_with_streams,
+                                             stream_curves[1] if stream_curves else None)
         if fthp:
             thresholds['fthp_mps'] = fthp
             logging.info(f"Estimated FTHP: {fthp:.2f} m/s")
     
     # Estimate heart rate zones from all activities
-    hr_zones = estimate_hr_zones_from_activities(activities, gender, activities_with_streams)
+    hr_zones = estimate_hr_zones_from_activities(activities, gender, activities_with_streams, hr_sketch)
     thresholds.update(hr_zones)
     
     return thresholds if thresholds else None
@@ -602,7 +611,8 @@ def estimate_thresholds_from_activities(
 
 def estimate_ftp_from_activities(
     cycling_activities: List[Dict],
-    activities_with_streams: List[Tuple[Dict, Dict]] = None
+    activities_with_streams: List[Tuple[Dict, Dict]] = None,
+    power_curve: Dict[int, float] = None
 ) -> Optional[float]:
     """
     Estimate FTP using multiple methods:
@@ -613,8 +623,10 @@ def estimate_ftp_from_activities(
     """
     
     # Method 1: Stream-based power curve analysis
-    if activities_with_streams:
-        ftp_from_streams = estimate_ftp_from_power_streams(activities_with_streams)
+    if power_curve is None and activities_with_streams:
+        power_curve = fold_stream_curves(activities_with_streams)[0]
+    if power_curve:
+        ftp_from_streams = ftp_from_power_curve(power_curve)
         if ftp_from_streams:
             return ftp_from_streams
     
@@ -632,30 +644,44 @@ def estimate_ftp_from_activities(
     return None
 
 
+def fold_stream_curves(activities_with_streams: Iterable[Tuple[Dict, Dict]]) -> Tuple[Dict[int, float], Dict[int, float]]:
+    """
+    Best power (rides) and speed (runs) per effort duration, in one pass.
+
+    Each activity's streams are folded into the running curves and can be dropped right after,
+    so `activities_with_streams` may be a generator reading one activity at a time.
+
+    Returns:
+        (power_curve, speed_curve): duration in seconds -> best average watts / m/s
+    """
+    power_curve, speed_curve = {}, {}
+    for activity, streams in activities_with_streams:
+        if activity['type'] in ['Ride', 'VirtualRide']:
+            watts_stream = streams.get('watts', {}).get('data', [])
+            if watts_stream and len(watts_stream) >= 300:  # Need at least 5 minutes
+                for effort in extract_power_efforts(watts_stream):
+                    if effort['duration'] not in power_curve or effort['power'] > power_curve[effort['duration']]:
+                        power_curve[effort['duration']] = effort['power']
+        elif activity['type'] in ['Run', 'VirtualRun']:
+            velocity_stream = streams.get('velocity_smooth', {}).get('data', [])
+            if velocity_stream and len(velocity_stream) >= 300:  # Need at least 5 minutes
+                for effort in extract_pace_efforts(velocity_stream):
+                    if effort['duration'] not in speed_curve or effort['speed'] > speed_curve[effort['duration']]:
+                        speed_curve[effort['duration']] = effort['speed']
+    return power_curve, speed_curve
+
+
 def estimate_ftp_from_power_streams(activities_with_streams: List[Tuple[Dict, Dict]]) -> Optional[float]:
     """
     Analyze power streams to build power curve and estimate FTP.
     """
-    all_power_efforts = []
-    
-    for activity, streams in activities_with_streams:
-        if activity['type'] not in ['Ride', 'VirtualRide']:
-            continue
-            
-        watts_stream = streams.get('watts', {}).get('data', [])
-        if not watts_stream or len(watts_stream) < 300:  # Need at least 5 minutes
-            continue
-        
-        # Extract efforts of different durations
-        power_efforts = extract_power_efforts(watts_stream)
-        all_power_efforts.extend(power_efforts)
-    
-    if not all_power_efforts:
-        return None
-    
-    # Build power curve
-    power_curve = build_power_curve(all_power_efforts)
-    
+    return ftp_from_power_curve(fold_stream_curves(activities_with_streams)[0])
+
+
+def ftp_from_power_curve(power_curve: Dict[int, float]) -> Optional[float]:
+    """
+    Estimate FTP from a power curve (best average watts per duration).
+    """
     # Estimate FTP as best 1-hour effort, or extrapolate from shorter efforts
     if 3600 in power_curve:  # 1-hour effort available
         return power_curve[3600]
@@ -783,15 +809,18 @@ def estimate_ftp_from_average_power(cycling_activities: List[Dict]) -> Optional[
 
 def estimate_fthp_from_activities(
     running_activities: List[Dict],
-    activities_with_streams: List[Tuple[Dict, Dict]] = None
+    activities_with_streams: List[Tuple[Dict, Dict]] = None,
+    speed_curve: Dict[int, float] = None
 ) -> Optional[float]:
     """
     Estimate Functional Threshold Heart Rate Pace (FTHP) for running.
     """
     
     # Method 1: Stream-based critical speed analysis
-    if activities_with_streams:
-        fthp_from_streams = estimate_fthp_from_pace_streams(activities_with_streams)
+    if speed_curve is None and activities_with_streams:
+        speed_curve = fold_stream_curves(activities_with_streams)[1]
+    if speed_curve:
+        fthp_from_streams = fthp_from_speed_curve(speed_curve)
         if fthp_from_streams:
             return fthp_from_streams
     
@@ -813,26 +842,13 @@ def estimate_fthp_from_pace_streams(activities_with_streams: List[Tuple[Dict, Di
     """
     Analyze velocity streams to estimate critical speed (FTHP).
     """
-    all_pace_efforts = []
-    
-    for activity, streams in activities_with_streams:
-        if activity['type'] not in ['Run', 'VirtualRun']:
-            continue
-            
-        velocity_stream = streams.get('velocity_smooth', {}).get('data', [])
-        if not velocity_stream or len(velocity_stream) < 300:  # Need at least 5 minutes
-            continue
-        
-        # Extract pace efforts of different durations
-        pace_efforts = extract_pace_efforts(velocity_stream)
-        all_pace_efforts.extend(pace_efforts)
-    
-    if not all_pace_efforts:
-        return None
-    
-    # Build critical speed curve
-    speed_curve = build_speed_curve(all_pace_efforts)
-    
+    return fthp_from_speed_curve(fold_stream_curves(activities_with_streams)[1])
+
+
+def fthp_from_speed_curve(speed_curve: Dict[int, float]) -> Optional[float]:
+    """
+    Estimate FTHP from a critical speed curve (best average m/s per duration).
+    """
     # Estimate FTHP as best 1-hour pace, or extrapolate
     if 3600 in speed_curve:  # 1-hour effort
         return speed_curve[3600]
@@ -944,13 +960,18 @@ def estimate_fthp_from_tempo_runs(running_activities: List[Dict]) -> Optional[fl
 def estimate_hr_zones_from_activities(
     activities: List[Dict],
     gender: str,
-    activities_with_streams: List[Tuple[Dict, Dict]] = None
+    activities_with_streams: List[Tuple[Dict, Dict]] = None,
+    hr_sketch=None
 ) -> Dict[str, int]:
     """
     Estimate heart rate zones from activity data.
+
+    With `hr_sketch` (stored per-activity sketches merged, see activity_metrics.merged_sketch) the
+    stream percentiles come from its counts instead of every sample of activities_with_streams.
     """
     all_hr_values = []
     max_hr_observed = 0
+    resting_percentile = None
     
     # Collect HR data from activities
     for activity in activities:
@@ -958,8 +979,12 @@ def estimate_hr_zones_from_activities(
         if max_hr and max_hr > max_hr_observed:
             max_hr_observed = max_hr
     
+    if hr_sketch is not None:
+        resting_percentile = hr_sketch.quantile(0.05, above=60, below=220)
+        if hr_sketch.maximum and hr_sketch.maximum > max_hr_observed:
+            max_hr_observed = hr_sketch.maximum
     # Collect HR data from streams if available
-    if activities_with_streams:
+    elif activities_with_streams:
         for activity, streams in activities_with_streams:
             hr_stream = streams.get('heartrate', {}).get('data', [])
             if hr_stream:
@@ -978,8 +1003,10 @@ def estimate_hr_zones_from_activities(
     # Estimate resting HR from lowest observed values
     resting_hr = 60  # Default
     if all_hr_values:
+        resting_percentile = np.percentile(all_hr_values, 5)
+    if resting_percentile is not None:
         # Take 5th percentile as resting HR estimate
-        resting_hr = max(int(np.percentile(all_hr_values, 5)), 40)
+        resting_hr = max(int(resting_percentile), 40)
     
     return {
         'max_hr': max_hr_observed,
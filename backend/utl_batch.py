@@ -0,0 +1,333 @@
+# Batch UTL scoring
+#
+# calculate_utl() walks its method hierarchy one activity at a time, and every recalculation
+# loop (monthly UTL job, threshold changes, wellness backfill, onboarding) used to call it per
+# row, re-reducing each activity's streams in Python. Scoring here runs over per-activity
+# features (activity_metrics.py): the method for every row is chosen with masks, and TSS / rTSS /
+# TRIMP / fallback scores are computed with array math for the whole batch.
+#
+# Stored activities are scored from their activity_metrics row, so a threshold change never
+# touches the streams JSON. Each row also keeps a fingerprint of the inputs its stored score was
+# computed from (the threshold fields its method can use, wellness, features); rows whose
+# fingerprint is unchanged are skipped.
+#
+# Results equal calculate_utl() row by row (same method strings, scores within float rounding).
+# Rows the vectorized path can't represent exactly (missing or non-numeric fields, malformed
+# streams) are scored by calculate_utl() itself.
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import numbers
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from models import WellnessData
+from activity_metrics import (
+    FEATURES_VERSION, stream_features, running_intensity_class, metrics_features, load_activity_metrics,
+)
+from utils import (
+    calculate_utl, RUNNING_INTENSITY_MULTIPLIERS, TRIMP_ACTIVITY_SCALING, FALLBACK_INTENSITY_FACTORS,
+)
+from metrics import cpu_timed
+
+BATCH_SIZE = 500  # Activities scored per call; bounds memory when a user has years of streams
+
+CYCLING_TYPES = ["ride", "cycling"]
+RUNNING_TYPES = ["run", "running"]
+SCORING_VERSION = 1  # Bump when calculate_utl's formulas change so stored fingerprints expire
+
+
+def _wellness_values(wellness_data: Optional[dict]):
+    """(applies, hrv, sleep, readiness) with NaN for missing values; ValueError if non-numeric."""
+    if not wellness_data:
+        return False, np.nan, np.nan, np.nan
+    values = []
+    for key in ("hrv", "sleepScore", "readiness"):
+        value = wellness_data.get(key)
+        if value is None:
+            values.append(np.nan)
+        elif isinstance(value, numbers.Real):
+            values.append(float(value))
+        else:
+            raise ValueError(f"non-numeric wellness value {key}")
+    return (True, *values)
+
+
+@cpu_timed("calculate_utl_batch")
+def calculate_utl_batch(activity_summaries: List[dict], threshold, streams=None,
+                        wellness: List[Optional[dict]] = None, features: List[Optional[dict]] = None
+                        ) -> List[Tuple[float, str]]:
+    """
+    Score many activities of one athlete at once.
+
+    Args:
+        activity_summaries: Summary dicts (type, moving_time, distance), as for calculate_utl
+        threshold: The athlete's Threshold
+        streams: Stream dicts (or None) per activity; with `features`, only read for rows that
+            need the pace-distribution analysis or calculate_utl, so it may be a lazy sequence
+        wellness: Wellness dicts (or None) per activity, as for calculate_utl
+        features: Precomputed stream_features() dicts per activity (None entries are extracted
+            from `streams`). A pace class computed here is written back into the dict.
+
+    Returns:
+        (utl_score, calculation_method) per activity, equal to calling calculate_utl on each
+    """
+    count = len(activity_summaries)
+    streams = streams if streams is not None else [None] * count
+    wellness = wellness if wellness is not None else [None] * count
+    features = features if features is not None else [None] * count
+    if count == 0:
+        return []
+
+    types = np.full(count, "", dtype=object)
+    moving_time = np.zeros(count)
+    distance = np.zeros(count)
+    columns = {name: np.zeros(count, dtype=bool) for name in ("has_watts", "has_heartrate", "has_distance")}
+    columns.update({name: np.zeros(count) for name in ("watts_samples", "hr_samples")})
+    columns.update({name: np.full(count, np.nan) for name in ("normalized_power", "avg_power", "avg_hr")})
+    wellness_applies = np.zeros(count, dtype=bool)
+    wellness_columns = np.full((3, count), np.nan)
+    scalar_rows = np.zeros(count, dtype=bool)
+
+    for i, (summary, wellness_data) in enumerate(zip(activity_summaries, wellness)):
+        try:
+            activity_type = summary.get("type", "")
+            row_moving_time = summary.get("moving_time", 0)
+            row_distance = summary.get("distance", 0)
+            if not isinstance(activity_type, str) or not isinstance(row_moving_time, numbers.Real) \
+                    or not isinstance(row_distance, numbers.Real):
+                raise ValueError("missing summary fields")
+            if features[i] is None:
+                features[i] = stream_features(streams[i])
+            applies, hrv, sleep, readiness = _wellness_values(wellness_data)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            scalar_rows[i] = True
+            continue
+        types[i] = activity_type.lower()
+        wellness_applies[i] = applies
+        wellness_columns[:, i] = (hrv, sleep, readiness)
+        moving_time[i] = row_moving_time
+        distance[i] = row_distance
+        for name, column in columns.items():
+            column[i] = features[i][name]
+
+    ftp = threshold.ftp_watts
+    fthp = threshold.fthp_mps
+    max_hr = threshold.max_hr
+    resting_hr = threshold.resting_hr
+
+    hours = moving_time / 3600.0
+    is_cycling = np.isin(types, CYCLING_TYPES)
+    is_running = np.isin(types, RUNNING_TYPES)
+    has_power = columns["has_watts"] & (columns["watts_samples"] > 0)
+    has_hr = columns["has_heartrate"] & (columns["hr_samples"] > 0)
+
+    scores = np.zeros(count)
+    methods = np.empty(count, dtype=object)
+    done = scalar_rows.copy()
+
+    def assign(mask, values, method):
+        mask = mask & ~done
+        scores[mask] = values[mask] if isinstance(values, np.ndarray) else values
+        methods[mask] = method
+        done[mask] = True
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        assign(moving_time == 0, 0.0, "no_time")
+
+        # 1. TSS for cycling with power
+        if ftp and ftp > 0:
+            normalized_power = columns["normalized_power"]
+            tss = (moving_time * normalized_power * (normalized_power / ftp)) / (ftp * 36)
+            assign(is_cycling & has_power, tss, "TSS")
+
+        # 2. rTSS for running with pace
+        if fthp and fthp > 0:
+            intensity_factor = fthp / (distance / moving_time)
+            assign(is_running & (distance > 0), hours * intensity_factor * intensity_factor * 100, "rTSS")
+
+        # 3. Activity-scaled TRIMP from heart rate
+        if max_hr and resting_hr:
+            if max_hr <= resting_hr:
+                assign(has_hr, 0.0, "TRIMP")
+            else:
+                hr_fraction = np.clip((columns["avg_hr"] - resting_hr) / (max_hr - resting_hr), 0, 1)
+                duration_minutes = moving_time / 60.0
+                base_trimp = duration_minutes * hr_fraction * (0.5 * np.exp(1.5 * hr_fraction))
+                scaling = np.array([TRIMP_ACTIVITY_SCALING.get(t, TRIMP_ACTIVITY_SCALING["default"]) for t in types])
+                assign(has_hr, np.minimum(base_trimp * scaling, duration_minutes * 1.2), "TRIMP")
+
+        # 4a. Running pace distribution (per row, analysed from the distance stream once)
+        for i in np.flatnonzero(is_running & columns["has_distance"] & ~done):
+            if "running_intensity" not in features[i]:
+                features[i]["running_intensity"] = running_intensity_class(streams[i])
+            intensity_type = features[i]["running_intensity"]
+            if intensity_type:
+                multiplier = RUNNING_INTENSITY_MULTIPLIERS.get(intensity_type, 1.0)
+                scores[i] = hours[i] * multiplier * 100
+                methods[i] = f"running_intensity_{intensity_type}"
+                done[i] = True
+
+        # 4b. Cycling average power intensity
+        if ftp:
+            assign(is_cycling & has_power, (columns["avg_power"] / ftp) ** 2 * hours * 100, "power_intensity")
+
+        # calculate_utl's step 5 (average HR intensity) repeats step 3's conditions, so it never applies
+
+        # 6. Conservative time-based fallback with wellness modifiers
+        intensity = np.array([FALLBACK_INTENSITY_FACTORS.get(t, FALLBACK_INTENSITY_FACTORS["default"]) for t in types])
+        time_factor = np.where(hours > 2, 2 + (hours - 2) * 0.5, hours)
+        conservative = time_factor * intensity * 100
+
+        hrv, sleep, readiness = wellness_columns
+        modifier = np.ones(count)
+        modifier *= np.where(hrv < 20, 0.8, np.where(hrv > 50, 1.1, 1.0))
+        modifier *= np.where(sleep < 60, 0.85, np.where(sleep > 85, 1.05, 1.0))
+        modifier *= np.where(readiness < 50, 0.8, np.where(readiness > 80, 1.1, 1.0))
+        conservative = np.where(wellness_applies, conservative * modifier, conservative)
+
+    for i in np.flatnonzero(~done):
+        scores[i] = conservative[i]
+        methods[i] = "conservative_time_based"
+        if wellness_applies[i]:
+            flags = [
+                "low_hrv" if hrv[i] < 20 else "high_hrv" if hrv[i] > 50 else None,
+                "poor_sleep" if sleep[i] < 60 else "great_sleep" if sleep[i] > 85 else None,
+                "low_readiness" if readiness[i] < 50 else "high_readiness" if readiness[i] > 80 else None,
+            ]
+            flags = [flag for flag in flags if flag]
+            if flags:
+                methods[i] += f"_wellness_{'_'.join(flags)}"
+
+    results = [(float(score), method) for score, method in zip(scores, methods)]
+    for i in np.flatnonzero(scalar_rows):
+        results[i] = calculate_utl(activity_summaries[i], threshold, streams[i], wellness[i])
+    return results
+
+
+def activity_summary_for(activity) -> dict:
+    """The summary dict the recalculation loops pass to calculate_utl for a stored Activity."""
+    return {
+        'type': activity.type,
+        'moving_time': activity.moving_time,
+        'distance': activity.distance,
+        'average_speed': activity.average_speed,
+        'start_date': activity.start_date.isoformat() if activity.start_date else None
+    }
+
+
+def load_wellness_by_date(db: Session, user_id: int, since: date = None) -> Dict[date, dict]:
+    """All of a user's wellness days (optionally from `since`) as the dicts calculate_utl expects, in one query."""
+    query = db.query(
+        WellnessData.date, WellnessData.hrv, WellnessData.sleep_score,
+        WellnessData.readiness_score, WellnessData.resting_hr
+    ).filter(WellnessData.user_id == user_id)
+    if since:
+        query = query.filter(WellnessData.date >= since)
+    lookup = {}
+    for row in query.order_by(WellnessData.date, WellnessData.wellness_id):
+        # First entry per day wins, as the per-activity .first() lookups did
+        lookup.setdefault(row.date, {
+            'hrv': row.hrv,
+            'sleepScore': row.sleep_score,
+            'readiness': row.readiness_score,
+            'restingHR': row.resting_hr
+        })
+    return lookup
+
+
+def utl_fingerprint(summary: dict, threshold, features: Optional[dict], wellness_data: Optional[dict]) -> Optional[str]:
+    """
+    Hash of everything a stored activity's UTL score depends on: summary fields, features, wellness,
+    and only the threshold fields its method can use (an FTP change doesn't void runs' scores).
+
+    Returns:
+        Hex digest, or None for rows without features or a usable summary (always rescored)
+    """
+    activity_type = summary.get("type")
+    if features is None or not isinstance(activity_type, str):
+        return None
+    activity_type = activity_type.lower()
+    inputs = [SCORING_VERSION, FEATURES_VERSION, activity_type, summary.get("moving_time"), summary.get("distance"),
+              sorted((name, repr(value)) for name, value in features.items())]
+    if activity_type in CYCLING_TYPES and features["has_watts"] and features["watts_samples"]:
+        inputs.append(("ftp", threshold.ftp_watts))
+    if activity_type in RUNNING_TYPES and isinstance(summary.get("distance"), numbers.Real) and summary["distance"] > 0:
+        inputs.append(("fthp", threshold.fthp_mps))
+    if features["has_heartrate"] and features["hr_samples"]:
+        inputs.append(("hr", threshold.max_hr, threshold.resting_hr))
+    if wellness_data:
+        inputs.append(tuple(repr(wellness_data.get(key)) for key in ("hrv", "sleepScore", "readiness")))
+    return hashlib.sha1(repr(inputs).encode()).hexdigest()
+
+
+class _LazyStreams:
+    """Streams per activity, read from Activity.data only for the rows that need them."""
+
+    def __init__(self, activities: list):
+        self.activities = activities
+
+    def __len__(self):
+        return len(self.activities)
+
+    def __getitem__(self, index):
+        data = self.activities[index].data
+        return data.get('streams') if data and isinstance(data, dict) else None
+
+
+def score_activities(db: Session, activities: list, threshold, wellness_by_date: Dict[date, dict] = None,
+                     batch_size: int = BATCH_SIZE) -> List[Tuple[float, str]]:
+    """
+    Score stored Activity rows in batches of `batch_size`, from their activity_metrics features.
+
+    Activities whose stored score was computed from the same inputs keep it (see utl_fingerprint);
+    the rest are scored and their metrics rows get the new fingerprint, written on the caller's commit.
+
+    Args:
+        db: Session the activities belong to
+        wellness_by_date: Optional lookup (see load_wellness_by_date); same-day wellness is applied
+
+    Returns:
+        (utl_score, calculation_method) per activity, in order
+    """
+    results = []
+    for start in range(0, len(activities), batch_size):
+        chunk = activities[start:start + batch_size]
+        metrics_by_id = load_activity_metrics(db, chunk)
+        chunk_results = [None] * len(chunk)
+        pending, fingerprints = [], []
+        for i, activity in enumerate(chunk):
+            summary = activity_summary_for(activity)
+            metrics = metrics_by_id.get(activity.activity_id)
+            features = metrics_features(metrics) if metrics is not None else None
+            wellness_data = None
+            if wellness_by_date is not None and activity.start_date:
+                wellness_data = wellness_by_date.get(activity.start_date.date())
+            fingerprint = utl_fingerprint(summary, threshold, features, wellness_data)
+            if fingerprint is not None and metrics.utl_fingerprint == fingerprint \
+                    and activity.utl_score is not None and activity.calculation_method:
+                chunk_results[i] = (activity.utl_score, activity.calculation_method)
+                continue
+            pending.append((i, summary, features, wellness_data))
+            fingerprints.append(fingerprint)
+
+        if pending:
+            rows, summaries, features, wellness = zip(*pending)
+            features = list(features)
+            scored = calculate_utl_batch(list(summaries), threshold, _LazyStreams([chunk[i] for i in rows]),
+                                         list(wellness), features)
+            for j, (i, result) in enumerate(zip(rows, scored)):
+                chunk_results[i] = result
+                metrics = metrics_by_id.get(chunk[i].activity_id)
+                if metrics is None:
+                    continue
+                fingerprint = fingerprints[j]
+                if "running_intensity" in features[j] and not metrics.running_intensity_checked:
+                    # Store the pace class; it's part of the features the next fingerprint sees
+                    metrics.running_intensity_checked = True
+                    metrics.running_intensity = features[j]["running_intensity"]
+                    fingerprint = utl_fingerprint(summaries[j], threshold, features[j], wellness[j])
+                metrics.utl_fingerprint = fingerprint
+        results.extend(chunk_results)
+    return results
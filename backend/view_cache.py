@@ -0,0 +1,142 @@
+# View cache for per-user API responses
+#
+# The dashboard is fetched on mount and again after every threshold override or UTL
+# recalculation, and each call re-assembles user, thresholds, every activity and 30 days of
+# wellness. Rendered responses are cached per user as JSON bytes with a content-hash ETag:
+#
+# - unchanged data: served from memory, or 304 Not Modified when the client sends If-None-Match
+# - data change events (data_events.py) drop the user's entries immediately
+# - entries also expire after a TTL and at midnight (week/month/year totals roll over),
+#   which bounds staleness for changes published in another process (dedicated queue workers)
+#
+# The backend is pluggable: LRUBackend keeps entries in this process; anything with the same
+# get/set/delete methods (e.g. a shared Redis client wrapper) can be passed to ViewCache.
+from collections import OrderedDict
+from datetime import date
+from typing import Optional
+import hashlib
+import json
+import threading
+import time
+
+from config import VIEW_CACHE_MAX_ENTRIES, DASHBOARD_CACHE_TTL_SECONDS
+from data_events import subscribe, ACTIVITIES_CHANGED, WELLNESS_CHANGED, THRESHOLDS_CHANGED
+
+
+class CachedView:
+    """A rendered response: JSON body bytes and their ETag."""
+
+    def __init__(self, body: bytes, etag: str, day: date):
+        self.body = body
+        self.etag = etag
+        self.day = day
+
+
+class LRUBackend:
+    """In-process LRU with per-entry TTL."""
+
+    def __init__(self, max_entries: int = VIEW_CACHE_MAX_ENTRIES, clock=time.monotonic):
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl_seconds: int):
+        with self._lock:
+            self._entries[key] = (value, self._clock() + ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ViewCache:
+    """
+    Per-user cache for one view.
+
+    Args:
+        name: View name, used as the key prefix
+        backend: Storage with get/set/delete (default: a new LRUBackend)
+        ttl_seconds: Longest an entry is served without an invalidation
+    """
+
+    def __init__(self, name: str, backend=None, ttl_seconds: int = DASHBOARD_CACHE_TTL_SECONDS):
+        self.name = name
+        self.backend = backend if backend is not None else LRUBackend()
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.invalidations = 0
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.name}:{user_id}"
+
+    def get(self, user_id: int) -> Optional[CachedView]:
+        view = self.backend.get(self._key(user_id))
+        if view is not None and view.day != date.today():
+            view = None
+        if view is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return view
+
+    def set(self, user_id: int, data) -> CachedView:
+        """Render `data` (JSON-compatible) once and store it."""
+        body = json.dumps(data, separators=(",", ":")).encode()
+        view = CachedView(body, f'"{hashlib.sha1(body).hexdigest()[:20]}"', date.today())
+        if self.ttl_seconds > 0:
+            self.backend.set(self._key(user_id), view, self.ttl_seconds)
+        return view
+
+    def invalidate(self, user_id: int):
+        self.backend.delete(self._key(user_id))
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "entries": len(self.backend) if hasattr(self.backend, "__len__") else None,
+        }
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match header value covers `etag` (weak comparison, as RFC 9110 requires)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+
+dashboard_cache = ViewCache("dashboard")
+
+
+@subscribe(ACTIVITIES_CHANGED, WELLNESS_CHANGED, THRESHOLDS_CHANGED)
+def invalidate_dashboard(user_id: int, event: str):
+    dashboard_cache.invalidate(user_id)
@@ -2,6 +2,8 @@
 """
 Background Processing System for TrainingLoad using APScheduler
 
+Scheduled jobs enqueue per-user work items; run backend/queue_worker.py to process them.
+
 This system handles:
 1. Periodic activity import from Strava (daily)
 2. Threshold recalculation when new significant activities are imported
@@ -13,6 +15,8 @@ Usage:
     python background_processor.py --mode=full_import --user_id=1    # One-time operations
     python background_processor.py --mode=daily_sync
     python background_processor.py --mode=threshold_update --user_id=1
+    python background_processor.py --mode=metrics_backfill    # activity_metrics rows for older activities
+    python background_processor.py --mode=utl_recalc --user_id=1 --profile    # Profile under logs/profiles/
 """
 
 import argparse
@@ -24,6 +28,7 @@ import atexit
 from datetime import datetime, timedelta
 from typing import Optional, List
 
+from sqlalchemy.orm import defer
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
@@ -45,7 +50,14 @@ from config import SessionLocal
 from models import User, Activity, Threshold
 from activities import _fetch_and_process_activities
 from research_threshold_calculator import calculate_initial_thresholds_for_new_user
-from utils import calculate_utl, estimate_thresholds_from_activities
+from utl_batch import score_activities
+from activity_metrics import (
+    threshold_activity_summaries, estimate_thresholds_from_history, backfill_activity_metrics,
+)
+from job_queue import PRIORITY_NORMAL, PRIORITY_LOW
+from sync_tasks import enqueue_for_all_users
+from leader_election import LeaderElector
+from profiling import profiled, profiled_job
 
 # Configure logging
 logging.basicConfig(
@@ -150,55 +162,38 @@ def setup_scheduled_jobs():
     logging.info(f"All {len(scheduler.get_jobs())} background jobs scheduled successfully!")
 
 
+@profiled_job("daily_sync")
 def daily_sync_job():
-    """Daily job: sync activities and check for threshold updates."""
+    """Daily job: enqueue activity sync per user (threshold checks run inside each item)."""
     logging.info("🔄 Starting daily sync job")
     try:
-        processor = BackgroundProcessor()
-        result = processor.daily_sync()
-        logging.info(f"Daily sync completed: {result}")
+        result = enqueue_for_all_users(
+            'sync_user', payload={'backfill_days': 7, 'wellness_days': 0},
+            priority=PRIORITY_NORMAL, dedup_variant='daily'
+        )
+        logging.info(f"Daily sync enqueued: {result}")
     except Exception as e:
         logging.error(f"Daily sync failed: {e}")
 
 
+@profiled_job("weekly_thresholds")
 def weekly_threshold_job():
-    """Weekly job: full threshold recalculation for all users."""
+    """Weekly job: enqueue full threshold recalculation for all users."""
     logging.info("🧮 Starting weekly threshold recalculation")
     try:
-        processor = BackgroundProcessor()
-        db = SessionLocal()
-        
-        users = db.query(User).filter(User.strava_oauth_token.isnot(None)).all()
-        db.close()
-        
-        for user in users:
-            try:
-                result = processor.recalculate_thresholds(user.user_id)
-                logging.info(f"Weekly threshold update for user {user.user_id}: {result.get('message', 'completed')}")
-            except Exception as e:
-                logging.error(f"Weekly threshold update failed for user {user.user_id}: {e}")
-                
+        result = enqueue_for_all_users('recalculate_thresholds', priority=PRIORITY_LOW)
+        logging.info(f"Weekly threshold recalculation enqueued: {result}")
     except Exception as e:
         logging.error(f"Weekly threshold job failed: {e}")
 
 
+@profiled_job("monthly_utl")
 def monthly_utl_job():
-    """Monthly job: recalculate UTL scores for accuracy."""
+    """Monthly job: enqueue UTL recalculation for all users."""
     logging.info("📊 Starting monthly UTL recalculation")
     try:
-        processor = BackgroundProcessor()
-        db = SessionLocal()
-        
-        users = db.query(User).filter(User.strava_oauth_token.isnot(None)).all()
-        db.close()
-        
-        for user in users:
-            try:
-                result = processor.recalculate_utl_scores(user.user_id, days_back=90)
-                logging.info(f"Monthly UTL recalc for user {user.user_id}: {result.get('message', 'completed')}")
-            except Exception as e:
-                logging.error(f"Monthly UTL recalc failed for user {user.user_id}: {e}")
-                
+        result = enqueue_for_all_users('recalculate_utl', priority=PRIORITY_LOW)
+        logging.info(f"Monthly UTL recalculation enqueued: {result}")
     except Exception as e:
         logging.error(f"Monthly UTL job failed: {e}")
 
@@ -241,7 +236,17 @@ def start_scheduler_daemon():
     
     try:
         logging.info("🚀 Starting TrainingLoad background scheduler...")
-        scheduler.start()
+        # Start paused: only the elected daemon instance runs jobs, others stand by
+        scheduler.start(paused=True)
+        elector = LeaderElector(
+            "background_processor",
+            on_elected=scheduler.resume,
+            on_demoted=scheduler.pause,
+        )
+        elector.start()
+        atexit.register(elector.stop)
+        if not elector.is_leader:
+            logging.info(f"⏸️ Another background processor is leader; standing by (retry every {elector.retry_seconds}s)")
         
         # Log initial job status
         jobs = scheduler.get_jobs()
@@ -334,35 +339,12 @@ class BackgroundProcessor:
         if not user:
             return {"error": f"User {user_id} not found"}
         
-        # Get all activities from the last 12 months for threshold analysis
+        # Summaries of all activities from the last 12 months, from activity_metrics columns
         one_year_ago = datetime.now() - timedelta(days=365)
-        activities = self.db.query(Activity).filter(
-            Activity.user_id == user_id,
-            Activity.start_date >= one_year_ago
-        ).all()
+        activity_data = threshold_activity_summaries(self.db, user_id, since=one_year_ago)
+        self.db.commit()  # Keep any metrics rows extracted for older activities
         
-        logging.info(f"Analyzing {len(activities)} activities for threshold calculation")
-        
-        # Prepare activity data for threshold estimation
-        activity_data = []
-        activities_with_streams = []
-        
-        for act in activities:
-            activity_summary = {
-                'type': act.type,
-                'moving_time': act.moving_time,
-                'average_speed': act.average_speed,
-                'average_watts': act.data.get('average_watts') if act.data else None,
-                'max_heartrate': act.data.get('max_heartrate') if act.data else None,
-                'distance': act.distance,
-                'start_date': act.start_date,
-                'name': act.name
-            }
-            activity_data.append(activity_summary)
-            
-            # Include stream data for advanced analysis
-            if act.data and 'streams' in act.data and act.data['streams']:
-                activities_with_streams.append((activity_summary, act.data['streams']))
+        logging.info(f"Analyzing {len(activity_data)} activities for threshold calculation")
         
         # Calculate new thresholds
         try:
@@ -371,8 +353,8 @@ class BackgroundProcessor:
             logging.info(f"Research-based thresholds: {estimates}")
         except Exception as e:
             logging.warning(f"Research-based calculation failed, using activity analysis: {e}")
-            # Fall back to activity-based estimation
-            estimates = estimate_thresholds_from_activities(activity_data, user.gender, activities_with_streams)
+            estimates = estimate_thresholds_from_history(self.db, user_id, user.gender, activity_data,
+                                                         since=one_year_ago)
         
         if not estimates:
             return {"error": "Could not calculate thresholds from available data"}
@@ -407,7 +389,7 @@ class BackgroundProcessor:
             "old_fthp": old_fthp,
             "new_fthp": threshold.fthp_mps,
             "significant_change": significant_change,
-            "activities_analyzed": len(activities)
+            "activities_analyzed": len(activity_data)
         }
         
         # If thresholds changed significantly, trigger UTL recalculation
@@ -418,6 +400,15 @@ class BackgroundProcessor:
         
         return result
     
+    def backfill_metrics(self, user_id: Optional[int] = None) -> dict:
+        """
+        Write activity_metrics rows for activities imported before they existed (or before a
+        FEATURES_VERSION bump). Safe to re-run; activities with current rows are skipped.
+        """
+        logging.info(f"Backfilling activity metrics for {'user ' + str(user_id) if user_id else 'all users'}")
+        written = backfill_activity_metrics(self.db, user_id)
+        return {"message": "Activity metrics backfill complete", "metrics_written": written}
+    
     def recalculate_utl_scores(self, user_id: int, days_back: int = 90) -> dict:
         """
         Recalculate UTL scores for recent activities using current thresholds.
@@ -430,43 +421,24 @@ class BackgroundProcessor:
         
         # Get recent activities
         cutoff_date = datetime.now() - timedelta(days=days_back)
-        activities = self.db.query(Activity).filter(
+        # Scoring reads activity_metrics; the streams JSON is only loaded for rows that need it
+        activities = self.db.query(Activity).options(defer(Activity.data)).filter(
             Activity.user_id == user_id,
             Activity.start_date >= cutoff_date
         ).all()
         
         updated_count = 0
         
-        for activity in activities:
-            try:
-                activity_summary = {
-                    'type': activity.type,
-                    'moving_time': activity.moving_time,
-                    'distance': activity.distance,
-                    'average_speed': activity.average_speed,
-                    'start_date': activity.start_date.isoformat() if activity.start_date else None
-                }
-                
-                activity_streams = None
-                if activity.data and isinstance(activity.data, dict):
-                    activity_streams = activity.data.get('streams')
+        for activity, (new_utl, new_method) in zip(activities, score_activities(self.db, activities, threshold)):
+            # Update if significantly different (>5% or method changed)
+            old_utl = activity.utl_score or 0
+            if abs(new_utl - old_utl) > 0.05 * max(old_utl, 1) or activity.calculation_method != new_method:
+                activity.utl_score = float(new_utl)
+                activity.calculation_method = new_method
+                updated_count += 1
                 
-                # Recalculate UTL
-                new_utl, new_method = calculate_utl(activity_summary, threshold, activity_streams)
-                
-                # Update if significantly different (>5% or method changed)
-                old_utl = activity.utl_score or 0
-                if abs(new_utl - old_utl) > 0.05 * max(old_utl, 1) or activity.calculation_method != new_method:
-                    activity.utl_score = float(new_utl)
-                    activity.calculation_method = new_method
-                    updated_count += 1
-                    
-                    if updated_count <= 5:  # Log first few for verification
-                        logging.info(f"Updated UTL for {activity.strava_activity_id}: {old_utl:.2f} -> {new_utl:.2f}")
-            
-            except Exception as e:
-                logging.error(f"Error recalculating UTL for activity {activity.strava_activity_id}: {e}")
-                continue
+                if updated_count <= 5:  # Log first few for verification
+                    logging.info(f"Updated UTL for {activity.strava_activity_id}: {old_utl:.2f} -> {new_utl:.2f}")
         
         self.db.commit()
         
@@ -534,7 +506,7 @@ def main():
     parser.add_argument('--start-scheduler', action='store_true', 
                       help='Start the background scheduler daemon')
     parser.add_argument('--mode', 
-                      choices=['full_import', 'daily_sync', 'threshold_update', 'utl_recalc'],
+                      choices=['full_import', 'daily_sync', 'threshold_update', 'utl_recalc', 'metrics_backfill'],
                       help='One-time processing mode')
     parser.add_argument('--user_id', type=int, help='User ID for user-specific operations')
     parser.add_argument('--days', type=int, default=730, help='Days to look back for full import')
@@ -542,6 +514,8 @@ def main():
                       help='List currently scheduled jobs')
     parser.add_argument('--stop-scheduler', action='store_true',
                       help='Stop the background scheduler')
+    parser.add_argument('--profile', action='store_true',
+                      help='Profile the --mode operation (written under logs/profiles/, see PROFILE_MODE)')
     
     args = parser.parse_args()
     
@@ -589,32 +563,38 @@ def main():
         print("  python background_processor.py --start-scheduler")
         print("  python background_processor.py --mode=full_import --user_id=1")
         print("  python background_processor.py --list-jobs")
+        print("  python background_processor.py --mode=metrics_backfill")
         return
     
     # One-time operations
     processor = BackgroundProcessor()
     
     try:
-        if args.mode == 'full_import':
-            if not args.user_id:
-                print("--user_id required for full_import mode")
-                return
-            result = processor.full_historical_import(args.user_id, args.days)
+        with profiled(f"mode {args.mode}", kind="cli", enabled=args.profile):
+            if args.mode == 'full_import':
+                if not args.user_id:
+                    print("--user_id required for full_import mode")
+                    return
+                result = processor.full_historical_import(args.user_id, args.days)
+            
+            elif args.mode == 'daily_sync':
+                result = processor.daily_sync()
             
-        elif args.mode == 'daily_sync':
-            result = processor.daily_sync()
+            elif args.mode == 'threshold_update':
+                if not args.user_id:
+                    print("--user_id required for threshold_update mode")
+                    return
+                result = processor.recalculate_thresholds(args.user_id)
             
-        elif args.mode == 'threshold_update':
-            if not args.user_id:
-                print("--user_id required for threshold_update mode")
-                return
-            result = processor.recalculate_thresholds(args.user_id)
+            elif args.mode == 'utl_recalc':
+                if not args.user_id:
+                    print("--user_id required for utl_recalc mode")
+                    return
+                result = processor.recalculate_utl_scores(args.user_id)
             
-        elif args.mode == 'utl_recalc':
-            if not args.user_id:
-                print("--user_id required for utl_recalc mode")
-                return
-            result = processor.recalculate_utl_scores(args.user_id)
+            elif args.mode == 'metrics_backfill':
+                # All users unless --user_id is given
+                result = processor.backfill_metrics(args.user_id)
         
         print(f"Result: {result}")
         logging.info(f"Operation {args.mode} completed: {result}")
@@ -12,79 +12,8 @@ calculate_utl_for_existing() {
     echo "📊 Calculating UTL scores for existing activities..."
     cd "$BACKEND_DIR"
     
-    uv run python3 -c "
-import sys
-sys.path.append('.')
-
-from config import SessionLocal
-from models import User, Activity, Threshold
-from utils import calculate_utl
-import logging
-
-logging.basicConfig(level=logging.INFO)
-
-# Get database session
-db = SessionLocal()
-
-try:
-    # Get all users with Strava data
-    users = db.query(User).filter(User.strava_user_id.isnot(None)).all()
-    print(f'Found {len(users)} users with Strava data')
-    
-    for user in users:
-        print(f'Processing user {user.user_id}: {user.name}')
-        
-        # Get user's threshold data
-        threshold = db.query(Threshold).filter_by(user_id=user.user_id).first()
-        if not threshold:
-            print(f'  No thresholds found for user {user.user_id}, skipping UTL calculation')
-            continue
-            
-        # Get activities without UTL scores
-        activities = db.query(Activity).filter(
-            Activity.user_id == user.user_id,
-            Activity.utl_score.is_(None)
-        ).all()
-        
-        print(f'  Found {len(activities)} activities without UTL scores')
-        
-        updated_count = 0
-        for activity in activities:
-            try:
-                # Prepare activity summary data (simplified)
-                act_summary = {
-                    'type': activity.type,
-                    'moving_time': activity.moving_time,
-                    'distance': activity.distance,
-                    'average_speed': activity.average_speed,
-                }
-                
-                # Calculate UTL (no detailed streams available for existing data)
-                utl_score, method = calculate_utl(act_summary, threshold, None)
-                
-                if utl_score > 0:
-                    activity.utl_score = utl_score
-                    activity.calculation_method = method
-                    updated_count += 1
-                    
-            except Exception as e:
-                print(f'    Error calculating UTL for activity {activity.activity_id}: {e}')
-                continue
-        
-        if updated_count > 0:
-            db.commit()
-            print(f'  Updated {updated_count} activities with UTL scores')
-        else:
-            print(f'  No activities updated')
-            
-    print('\\n✅ UTL calculation complete')
-    
-except Exception as e:
-    print(f'❌ Error: {e}')
-    db.rollback()
-finally:
-    db.close()
-"
+    # Scores activities without UTL and refreshes stale ones (see maintenance_cli.py for options)
+    uv run python3 maintenance_cli.py rescore --strava-only
 }
 
 # Function to import recent Strava activities
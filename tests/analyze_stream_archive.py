@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Best-effort power and pace per user from the stream archive (no database needed).
+
+Export the archive first:
+    cd backend && python stream_archive.py export
+Then:
+    python tests/analyze_stream_archive.py [ARCHIVE_DIR] [--months=12]
+"""
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+import argparse
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from stream_archive import StreamArchive
+
+DURATIONS = [300, 1200, 1800, 3600]  # 5, 20, 30 and 60 minute efforts
+
+
+def best_averages(samples: np.ndarray, durations=DURATIONS) -> dict:
+    """Best rolling average of 1 Hz samples for each duration that fits."""
+    samples = np.nan_to_num(np.asarray(samples, dtype=float))
+    sums = np.concatenate(([0.0], np.cumsum(samples)))
+    return {d: float((sums[d:] - sums[:-d]).max() / d) for d in durations if len(samples) >= d}
+
+
+def analyze_stream_archive(path: str, months: int = 12):
+    archive = StreamArchive(path)
+    since = datetime.now() - timedelta(days=30 * months)
+    print(f'🔍 BEST EFFORTS FROM {path} ({len(archive)} activities, last {months} months)')
+    print('=' * 60)
+
+    for user_id in np.unique(archive.index["user_id"]):
+        power, speed = {}, {}
+        for _, streams in archive.activities(int(user_id), ["Ride", "VirtualRide"], since, channels=["watts"]):
+            if "watts" in streams:
+                for d, watts in best_averages(streams["watts"]).items():
+                    power[d] = max(power.get(d, 0), watts)
+        for _, streams in archive.activities(int(user_id), ["Run", "VirtualRun"], since, channels=["velocity_smooth"]):
+            if "velocity_smooth" in streams:
+                for d, mps in best_averages(streams["velocity_smooth"]).items():
+                    speed[d] = max(speed.get(d, 0), mps)
+
+        print(f'User {user_id}:')
+        if power:
+            print('  Power: ' + ', '.join(f'{d // 60}min {w:.0f}W' for d, w in sorted(power.items())))
+            if 1200 in power:
+                print(f'  🎯 FTP (95% of best 20min): {power[1200] * 0.95:.0f}W')
+        if speed:
+            print('  Pace:  ' + ', '.join(f'{d // 60}min {1000 / v / 60:.2f} min/km' for d, v in sorted(speed.items()) if v > 0))
+
+
+if __name__ == "__main__":
+    from config import STREAM_ARCHIVE_DIR
+
+    parser = argparse.ArgumentParser(description='Best efforts per user from the stream archive')
+    parser.add_argument('path', nargs='?', default=STREAM_ARCHIVE_DIR)
+    parser.add_argument('--months', type=int, default=12)
+    args = parser.parse_args()
+    analyze_stream_archive(args.path, args.months)
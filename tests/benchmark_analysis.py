@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the stream analysis hot paths, compared against stored baselines
+
+Times best-effort search, normalized power, UTL scoring, activity stream analysis, running
+intensity distribution, research FTP estimation and HR zone estimation on fixed synthetic inputs
+(a 30-minute run up to a 6-hour ride, generated by backend/synthetic_athletes.py). Runs offline:
+no database is touched.
+
+Timings are divided by a calibration loop timed in the same run, so baselines recorded on one
+machine stay comparable on another. Exits non-zero when a case is slower than its baseline by
+more than the tolerance.
+
+Usage:
+    python tests/benchmark_analysis.py                  # Compare with tests/benchmark_baselines.json
+    python tests/benchmark_analysis.py --quick          # Skip inputs longer than two hours
+    python tests/benchmark_analysis.py -k power         # Only cases whose name contains "power"
+    python tests/benchmark_analysis.py --update         # Record the current timings as the baselines
+"""
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+# Modules import the app config; point it at a throwaway database
+for _var, _default in [("DB_USER", "test"), ("DB_PASSWORD", "test"), ("DB_HOST", "localhost"),
+                       ("DB_PORT", "5432"), ("DB_NAME", "test")]:
+    os.environ.setdefault(_var, _default)
+
+import argparse
+import json
+import logging
+import platform
+import time
+import timeit
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+
+from models import Threshold
+from synthetic_athletes import athlete_profile, athlete_activities, synthetic_session, streams_to_json
+from streams_analysis import (find_best_power_effort, find_best_pace_effort, analyze_activity_streams,
+                              analyze_running_intensity_distribution)
+from research_threshold_calculator import ResearchBasedThresholdCalculator
+from utils import calculate_normalized_power, calculate_utl, estimate_hr_zones_from_activities
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baselines.json")
+TOLERANCE = 0.5  # Allowed slowdown over baseline (fraction); single runs vary by ~30% on shared machines
+MIN_SECONDS = 1.0  # Repeat each case until this much time has been spent (best run counts)
+MAX_REPEATS = 20
+LONG_MINUTES = 120  # --quick skips inputs longer than this
+
+# Input name -> (activity type, session kind, minutes, outdoor)
+INPUTS = {
+    "run_30min": ("Run", "endurance", 30, True),
+    "run_90min": ("Run", "long", 90, True),
+    "ride_1h": ("Ride", "intervals", 60, True),
+    "ride_3h": ("Ride", "long", 180, True),
+    "ride_6h": ("Ride", "long", 360, True),
+}
+PROFILE = athlete_profile(0, seed=42)
+THRESHOLD = Threshold(ftp_watts=250.0, fthp_mps=4.0, max_hr=PROFILE["max_hr"], resting_hr=PROFILE["resting_hr"])
+
+
+@lru_cache(maxsize=None)
+def activity(name: str) -> tuple:
+    """(summary, streams in Strava JSON shape) for a named input; identical on every run."""
+    activity_type, kind, minutes, outdoor = INPUTS[name]
+    rng = np.random.default_rng([42, list(INPUTS).index(name)])
+    summary, streams = synthetic_session(PROFILE, activity_type, kind, minutes, 1.0, outdoor, rng)
+    return summary, streams_to_json(streams)
+
+
+def _data(name: str, key: str) -> list:
+    return activity(name)[1][key]["data"]
+
+
+@lru_cache(maxsize=None)
+def year_of_activities() -> list:
+    """An athlete's year as (summary, streams) pairs, for the HR zone estimate."""
+    profile = athlete_profile(1, seed=42)
+    return [(summary, streams_to_json(streams))
+            for summary, streams in athlete_activities(profile, 1.0, datetime(2026, 1, 1), seed=42)]
+
+
+def _cases() -> dict:
+    """Case name -> (input name, callable). Inputs are built before timing starts."""
+    cases = {}
+    for name in ("ride_1h", "ride_3h", "ride_6h"):
+        cases[f"find_best_power_effort[20min,{name}]"] = (name, lambda n=name: find_best_power_effort(_data(n, "watts"), _data(n, "time"), 20))
+    for name in ("run_30min", "run_90min"):
+        cases[f"find_best_pace_effort[20min,{name}]"] = (name, lambda n=name: find_best_pace_effort(_data(n, "distance"), _data(n, "time"), 20))
+    for name in ("ride_1h", "ride_6h"):
+        cases[f"calculate_normalized_power[{name}]"] = (name, lambda n=name: calculate_normalized_power(_data(n, "watts")))
+    for name in ("run_30min", "ride_1h", "ride_6h"):
+        cases[f"calculate_utl[{name}]"] = (name, lambda n=name: calculate_utl(activity(n)[0], THRESHOLD, activity(n)[1]))
+        cases[f"analyze_activity_streams[{name}]"] = (name, lambda n=name: analyze_activity_streams(activity(n)[1]))
+    for name in ("run_30min", "run_90min"):
+        cases[f"analyze_running_intensity_distribution[{name}]"] = (
+            name, lambda n=name: analyze_running_intensity_distribution(_data(n, "distance"), _data(n, "time"), _data(n, "heartrate")))
+    for name in ("ride_1h", "ride_6h"):
+        cases[f"calculate_cycling_ftp_from_streams[{name}]"] = (
+            name, lambda n=name: ResearchBasedThresholdCalculator().calculate_cycling_ftp_from_streams(_data(n, "watts"), _data(n, "time")))
+    cases["estimate_hr_zones_from_activities[1 year]"] = (None, lambda: estimate_hr_zones_from_activities(
+        [summary for summary, _ in year_of_activities()], "M", year_of_activities()))
+    return cases
+
+
+def calibrate() -> float:
+    """Seconds for a fixed mix of interpreter and NumPy work (best of five)."""
+    values = np.random.default_rng(0).random(200_000)
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        total = 0.0
+        for value in values.tolist():
+            total += value * value
+        np.sort(values)
+        np.convolve(values, np.ones(30) / 30, mode="valid")
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def time_case(function) -> tuple:
+    """
+    (best seconds per call, repeats). Fast calls are looped so each timed batch takes at least
+    0.2 s; batches repeat until MIN_SECONDS or MAX_REPEATS.
+    """
+    timer = timeit.Timer(function)
+    number, elapsed = timer.autorange()
+    best, spent, repeats = elapsed / number, elapsed, 1
+    while spent < MIN_SECONDS and repeats < MAX_REPEATS:
+        elapsed = timer.timeit(number)
+        best, spent, repeats = min(best, elapsed / number), spent + elapsed, repeats + 1
+    return best, repeats
+
+
+def run_benchmarks(pattern: str = None, quick: bool = False, out=sys.stdout) -> dict:
+    """Time every selected case. Returns {"calibration": s, "cases": {name: {"seconds", "relative"}}}."""
+    calibration = calibrate()
+    results = {}
+    for name, (input_name, function) in _cases().items():
+        if pattern and pattern not in name:
+            continue
+        if quick and input_name and INPUTS[input_name][2] > LONG_MINUTES:
+            continue
+        activity(input_name) if input_name else year_of_activities()  # Build inputs outside the timed region
+        seconds, repeats = time_case(function)
+        results[name] = {"seconds": float(f"{seconds:.4g}"), "relative": float(f"{seconds / calibration:.4g}")}
+        print(f"  {name:58} {seconds * 1000:>10.3f} ms  (best of {repeats})", file=out)
+    return {"calibration": round(calibration, 6), "cases": results}
+
+
+def compare(results: dict, baselines: dict, tolerance: float = TOLERANCE) -> tuple:
+    """
+    Compare relative timings with the baselines.
+
+    Returns:
+        (regressions, lines): names slower than baseline x (1 + tolerance), and one report line per case
+    """
+    regressions, lines = [], []
+    for name, result in results["cases"].items():
+        baseline = baselines.get("cases", {}).get(name)
+        if baseline is None:
+            lines.append(f"  {name:58} no baseline")
+            continue
+        ratio = result["relative"] / baseline["relative"]
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            marker = "❌ slower"
+        elif ratio < 1 / (1 + tolerance):
+            marker = "🚀 faster (consider --update)"
+        else:
+            marker = "✅"
+        lines.append(f"  {name:58} {ratio:>6.2f}x baseline  {marker}")
+    return regressions, lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the stream analysis hot paths')
+    parser.add_argument('-k', dest='pattern', help='Only cases whose name contains this')
+    parser.add_argument('--quick', action='store_true', help=f'Skip inputs longer than {LONG_MINUTES} minutes')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='Allowed slowdown, e.g. 0.5 for 50%%')
+    parser.add_argument('--baselines', default=BASELINES)
+    parser.add_argument('--update', action='store_true', help='Store these timings as the baselines')
+    args = parser.parse_args()
+
+    print(f"📊 Benchmarking ({platform.python_implementation()} {platform.python_version()}, {platform.machine()})")
+    results = run_benchmarks(args.pattern, args.quick)
+    print(f"  calibration {results['calibration'] * 1000:.1f} ms")
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+    if args.update:
+        cases = {**baselines.get("cases", {}), **results["cases"]}
+        with open(args.baselines, "w") as f:
+            json.dump({"recorded_at": datetime.now().isoformat(timespec="seconds"),
+                       "machine": f"{platform.machine()} {platform.python_version()}",
+                       "calibration": results["calibration"], "cases": dict(sorted(cases.items()))}, f, indent=2)
+            f.write("\n")
+        print(f"💾 Baselines for {len(results['cases'])} cases written to {args.baselines}")
+        return 0
+
+    regressions, lines = compare(results, baselines, args.tolerance)
+    print("\n".join(lines))
+    if regressions:
+        print(f"❌ {len(regressions)} regressions beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        return 1
+    print("✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(main())
@@ -0,0 +1,18 @@
+# pytest fixtures shared by the test modules; the path and environment setup lives in support.py
+import pytest
+
+from support import memory_session_factory
+
+
+@pytest.fixture
+def db_factory():
+    """Session factory over a new in-memory SQLite database."""
+    return memory_session_factory()
+
+
+@pytest.fixture
+def db(db_factory):
+    """A session on a new, empty in-memory database, closed after the test."""
+    session = db_factory()
+    yield session
+    session.close()
@@ -0,0 +1,60 @@
+# Shared test setup: backend/ on sys.path, a throwaway database config and in-memory SQLite
+#
+# Test modules import this first (before any backend module) so they also run as scripts
+# (python tests/test_x.py); conftest.py imports it for pytest and wraps the helpers in fixtures.
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+# Modules import the app config; point it at a throwaway database
+for _var, _default in [("DB_USER", "test"), ("DB_PASSWORD", "test"), ("DB_HOST", "localhost"),
+                       ("DB_PORT", "5432"), ("DB_NAME", "test")]:
+    os.environ.setdefault(_var, _default)
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from models import Base
+
+
+def memory_session_factory(shared: bool = False) -> sessionmaker:
+    """
+    Session factory over a new in-memory SQLite database with every table created.
+
+    Args:
+        shared: One connection for every session and thread (needed when a TestClient serves
+            requests from its own thread)
+    """
+    if shared:
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    else:
+        engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+def memory_session() -> Session:
+    """A session on a new, empty in-memory database."""
+    return memory_session_factory()()
+
+
+def dashboard_client(factory: sessionmaker):
+    """TestClient for the dashboard router (under /dashboard) with get_db served from `factory`."""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from config import get_db
+    from dashboard import router as dashboard_router
+
+    def override_db():
+        session = factory()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    app = FastAPI()
+    app.include_router(dashboard_router, prefix="/dashboard")
+    app.dependency_overrides[get_db] = override_db
+    return TestClient(app)
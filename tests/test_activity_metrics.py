@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Test stored activity metrics (UTL features, derived values, time histograms), fingerprint-skipped
+UTL rescoring and metrics-based threshold summaries against an in-memory SQLite database
+
+Run directly to also print a JSON vs activity_metrics timing for threshold recalculation's inputs.
+"""
+
+from support import memory_session  # Also puts backend/ on sys.path
+
+import math
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import defer
+
+from models import User, Threshold, Activity, ActivityMetrics
+from utils import calculate_utl
+from utl_batch import calculate_utl_batch, score_activities
+from activity_metrics import (
+    extract_features, apply_features, metrics_features, zone_seconds,
+    backfill_activity_metrics, threshold_activity_summaries, iter_activities_with_streams,
+)
+from strava_event_simulator import synthetic_activity, synthetic_streams
+
+
+def _session():
+    db = memory_session()
+    db.add(User(user_id=1, name="Test Athlete", email="athlete@example.com"))
+    db.add(Threshold(user_id=1, ftp_watts=250, fthp_mps=4.0, max_hr=190, resting_hr=50))
+    rides = {"watts": {"data": [180 + (i % 40) for i in range(600)]}}
+    runs = {"distance": {"data": [3.5 * i for i in range(600)]}, "heartrate": {"data": [150] * 600}}
+    walks = {"heartrate": {"data": [110] * 600}}
+    for day in range(9):
+        activity_type, streams = [("Ride", rides), ("Run", runs), ("Walk", walks)][day % 3]
+        db.add(Activity(strava_activity_id=str(day), user_id=1, type=activity_type, distance=10000,
+                        moving_time=3600, start_date=datetime.now() - timedelta(days=day),
+                        data={"streams": streams}))
+    db.commit()
+    return db
+
+
+def _score_and_store(db):
+    activities = db.query(Activity).options(defer(Activity.data)).order_by(Activity.activity_id).all()
+    threshold = db.query(Threshold).filter_by(user_id=1).first()
+    scores = score_activities(db, activities, threshold)
+    for activity, (utl_score, method) in zip(activities, scores):
+        activity.utl_score = utl_score
+        activity.calculation_method = method
+    db.commit()
+    return activities, scores
+
+
+def test_unchanged_inputs_skip_rescoring():
+    """Features are stored on first scoring; a second pass never reads the streams"""
+    db = _session()
+    _, first = _score_and_store(db)
+    assert db.query(ActivityMetrics).count() == 9
+    assert {method for _, method in first} == {"TSS", "rTSS", "TRIMP"}
+
+    db.expire_all()
+    activities, second = _score_and_store(db)
+    assert second == first
+    assert not any("data" in activity.__dict__ for activity in activities)  # Deferred column never loaded
+    print('✅ Unchanged inputs reuse stored scores')
+
+
+def test_ftp_change_rescores_only_power_rides():
+    """A new FTP voids the rides' fingerprints and leaves runs and walks untouched"""
+    db = _session()
+    _score_and_store(db)
+    before = {m.activity_id: m.utl_fingerprint for m in db.query(ActivityMetrics)}
+
+    threshold = db.query(Threshold).filter_by(user_id=1).first()
+    threshold.ftp_watts = 280
+    db.commit()
+    activities, scores = _score_and_store(db)
+
+    after = {m.activity_id: m.utl_fingerprint for m in db.query(ActivityMetrics)}
+    for activity, (utl_score, method) in zip(activities, scores):
+        changed = before[activity.activity_id] != after[activity.activity_id]
+        assert changed == (activity.type == "Ride"), activity.type
+        expected = calculate_utl({"type": activity.type, "moving_time": 3600, "distance": 10000},
+                                 threshold, activity.data["streams"])
+        assert method == expected[1] and math.isclose(utl_score, expected[0])
+    print('✅ FTP change rescored rides only')
+
+
+def test_stored_features_score_like_streams():
+    """Features round-tripped through an ActivityMetrics row give calculate_utl's results"""
+    rng = random.Random(3)
+    threshold = Threshold(ftp_watts=240, fthp_mps=None, max_hr=None, resting_hr=None)
+    summaries, streams, features = [], [], []
+    for _ in range(60):
+        activity_type = rng.choice(["Ride", "Run", "Hike", "VirtualRide"])
+        samples = rng.randint(5, 400)
+        activity_streams = {"watts": {"data": [rng.randint(50, 350) for _ in range(samples)]}}
+        if activity_type == "Run":
+            activity_streams = {"distance": {"data": [3.0 * i for i in range(samples)]}}
+        metrics = ActivityMetrics()
+        apply_features(metrics, extract_features(None, activity_streams))
+        summaries.append({"type": activity_type, "moving_time": rng.randint(600, 7200), "distance": 0})
+        streams.append(activity_streams)
+        features.append(metrics_features(metrics))
+
+    batch = calculate_utl_batch(summaries, threshold, streams, features=features)
+    for summary, activity_streams, result in zip(summaries, streams, batch):
+        expected = calculate_utl(summary, threshold, activity_streams)
+        assert result[1] == expected[1] and math.isclose(result[0], expected[0], rel_tol=1e-9), (summary, result)
+    print('✅ Stored features score like raw streams')
+
+
+def test_derived_features_and_zones():
+    """Maxima, summary values and histograms; zones come from the histograms for any threshold"""
+    streams = {
+        "time": {"data": [0, 1, 2, 3, 4, 5, 65, 66]},  # A one-minute pause before sample 6
+        "heartrate": {"data": [0, 120, 130, 150, 150, 175, 160, 160]},  # 0 is a dropout
+        "watts": {"data": [0, 100, 200, 250, 250, 300, 400, 120]},
+        "velocity_smooth": {"data": [0.0, 2.0, 3.0, 3.5, 4.0, 4.2, 4.0, 3.9]},
+    }
+    features = extract_features({"average_watts": 205, "max_heartrate": 176.0}, streams)
+    assert features["has_streams"] and features["has_velocity"] and features["velocity_samples"] == 8
+    assert features["max_power"] == 400 and features["max_hr"] == 175
+    assert features["average_watts"] == 205 and features["max_heartrate"] == 176
+    assert sum(features["hr_seconds"]) == 1 + 1 + 1 + 1 + 1 + 30 + 1  # Dropout dropped, pause capped
+    assert sum(features["power_seconds"]) == sum(features["speed_seconds"]) == 1 + 1 + 1 + 1 + 1 + 1 + 30 + 1
+
+    metrics = ActivityMetrics()
+    apply_features(metrics, features)
+    zones = zone_seconds(metrics, Threshold(ftp_watts=250, fthp_mps=None, max_hr=190, resting_hr=50))
+    assert zones["pace"] is None
+    # FTP 250: <137 W zone 1, 200 W zone 3 (75-90%), 250 W zone 4, 300 W zone 6 (120-150%), 400 W zone 7
+    assert zones["power"] == [3, 0, 1, 2, 0, 1, 30]
+    # Max HR 190: 120 bpm zone 2 (60-70%), 130 zone 2, 150 zone 3, 160 zone 4, 175 zone 5
+    assert zones["hr"] == [0, 2, 2, 31, 1]
+    print('✅ Derived features and time in zones')
+
+
+def test_backfill_and_threshold_summaries():
+    """Backfill writes each missing row once; summaries equal what the JSON-parsing loops built"""
+    db = _session()
+    for activity in db.query(Activity):
+        activity.data = {**activity.data, "average_watts": 210 if activity.type == "Ride" else None,
+                         "max_heartrate": 182}
+    db.commit()
+
+    assert backfill_activity_metrics(db, user_id=1) == 9
+    assert backfill_activity_metrics(db, user_id=1) == 0
+
+    summaries = threshold_activity_summaries(db, 1)
+    for summary, activity in zip(summaries, db.query(Activity).order_by(Activity.activity_id)):
+        assert summary["average_watts"] == activity.data.get("average_watts")
+        assert summary["max_heartrate"] == activity.data.get("max_heartrate")
+        assert summary["type"] == activity.type and summary["has_streams"]
+    assert len(list(iter_activities_with_streams(db, summaries))) == 9
+    print('✅ Backfill and metrics-based threshold summaries')
+
+
+def benchmark(count=365):
+    """A year of daily 20-150 minute activities: threshold summaries from JSON vs activity_metrics"""
+    db = _session()
+    for i in range(count):
+        summary = {**synthetic_activity(10000 + i), "max_heartrate": 185}
+        db.add(Activity(strava_activity_id=str(summary["id"]), user_id=1, type=summary["type"],
+                        moving_time=summary["moving_time"], distance=summary["distance"],
+                        average_speed=summary["average_speed"], name=summary["name"],
+                        start_date=datetime.now() - timedelta(days=i),
+                        data={**summary, "streams": synthetic_streams(summary)}))
+    db.commit()
+    backfill_activity_metrics(db)
+    since = datetime.now() - timedelta(days=365)
+
+    db.expire_all()
+    start = time.perf_counter()
+    activity_data = []
+    for act in db.query(Activity).filter(Activity.user_id == 1, Activity.start_date >= since):
+        activity_data.append({
+            'type': act.type, 'moving_time': act.moving_time, 'average_speed': act.average_speed,
+            'average_watts': act.data.get('average_watts') if act.data else None,
+            'max_heartrate': act.data.get('max_heartrate') if act.data else None,
+            'distance': act.distance, 'start_date': act.start_date, 'name': act.name
+        })
+    json_ms = (time.perf_counter() - start) * 1000
+
+    db.expire_all()
+    start = time.perf_counter()
+    threshold_activity_summaries(db, 1, since=since)
+    metrics_ms = (time.perf_counter() - start) * 1000
+    print(f'📊 {len(activity_data)} activities: JSON {json_ms:.1f} ms, activity_metrics {metrics_ms:.1f} ms')
+
+
+if __name__ == "__main__":
+    test_unchanged_inputs_skip_rescoring()
+    test_ftp_change_rescores_only_power_rides()
+    test_stored_features_score_like_streams()
+    test_derived_features_and_zones()
+    test_backfill_and_threshold_summaries()
+    benchmark()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Test the single-snapshot loader behind TrainingRecommendationEngine (in-memory SQLite)
+
+Run directly to also print a query count / latency benchmark.
+"""
+
+from support import memory_session  # Also puts backend/ on sys.path
+
+import random
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event
+
+from models import User, Threshold, Activity, WellnessData
+from athlete_snapshot import AthleteSnapshot
+from training_recommendations import TrainingRecommendationEngine
+
+NOW = datetime.now()
+TYPES = ["Ride", "VirtualRide", "Run", "VirtualRun", "TrailRun", "Swim", "Walk"]
+
+
+def _seeded_session(days=100, seed=3):
+    db = memory_session()
+    queries = {"count": 0}
+    event.listen(db.get_bind(), "before_cursor_execute", lambda *args: queries.__setitem__("count", queries["count"] + 1))
+
+    rng = random.Random(seed)
+    db.add(User(user_id=1, name="Test Athlete", email="athlete@example.com"))
+    db.add(Threshold(user_id=1, ftp_watts=250, fthp_mps=4.0))
+    strava_id = 0
+    for day in range(days):
+        for _ in range(rng.choice([0, 1, 1, 2])):
+            strava_id += 1
+            db.add(Activity(
+                strava_activity_id=str(strava_id), user_id=1, type=rng.choice(TYPES),
+                start_date=NOW - timedelta(days=day, hours=rng.random() * 10),
+                moving_time=rng.randint(1200, 9000), utl_score=rng.random() * 150,
+                data={"raw": "x" * 2000}
+            ))
+    for day in range(9):
+        db.add(WellnessData(user_id=1, date=(NOW - timedelta(days=day)).date(), hrv=rng.uniform(30, 60),
+                            sleep_score=rng.uniform(50, 95), readiness_score=rng.uniform(40, 90)))
+    db.commit()
+    return db, queries
+
+
+def test_recommendations_use_four_queries():
+    """User+threshold, activities, weekly rollups and wellness are each read once"""
+    db, queries = _seeded_session()
+    queries["count"] = 0
+    result = TrainingRecommendationEngine().generate_recommendations(1, db)
+    assert "error" not in result, result
+    assert queries["count"] == 4, queries["count"]
+    print(f'✅ Recommendations generated with {queries["count"]} queries')
+
+
+def test_snapshot_windows_match_activity_dates():
+    """Acute/chronic per-sport loads agree with a direct filter over the activity list"""
+    db, _ = _seeded_session()
+    snapshot = AthleteSnapshot.load(db, 1, now=NOW)
+    rows = db.query(Activity).filter(Activity.start_date >= NOW - timedelta(days=84)).all()
+
+    acute = [a for a in rows if a.start_date >= NOW - timedelta(days=7)]
+    assert abs(sum(snapshot.window_utl["acute"]) - sum(a.utl_score for a in acute)) < 1e-9
+    running = [a for a in acute if "run" in a.type.lower()]
+    assert len(snapshot.window_sport_utl["acute"]["running"]) == len(running)
+    assert snapshot.activity_count == len(rows)
+    assert snapshot.start_dates == sorted(snapshot.start_dates, reverse=True)
+    print('✅ Snapshot windows match activity dates')
+
+
+def test_missing_threshold_short_circuits():
+    """No threshold: error returned after the single user query"""
+    db, queries = _seeded_session(days=5)
+    db.query(Threshold).delete()
+    db.commit()
+    queries["count"] = 0
+    result = TrainingRecommendationEngine().generate_recommendations(1, db)
+    assert result == {"error": "User or threshold data not found"}
+    assert queries["count"] == 1
+    print('✅ Missing threshold short-circuits')
+
+
+def benchmark(runs=50):
+    db, queries = _seeded_session(days=100)
+    engine = TrainingRecommendationEngine()
+    queries["count"] = 0
+    start = time.perf_counter()
+    for _ in range(runs):
+        db.expire_all()
+        engine.generate_recommendations(1, db)
+    elapsed_ms = (time.perf_counter() - start) / runs * 1000
+    print(f'📊 generate_recommendations: {queries["count"] / runs:.0f} queries, {elapsed_ms:.2f} ms per call (SQLite, ~125 activities)')
+
+
+if __name__ == "__main__":
+    test_recommendations_use_four_queries()
+    test_snapshot_windows_match_activity_dates()
+    test_missing_threshold_short_circuits()
+    benchmark()
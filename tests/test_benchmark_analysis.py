@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Test the benchmark suite's bookkeeping: every case has a stored baseline, inputs are fixed, and
+regressions beyond the tolerance are reported (the timings themselves run via benchmark_analysis.py)
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import json
+
+from benchmark_analysis import BASELINES, INPUTS, activity, compare, _cases
+
+
+def test_every_case_has_a_baseline():
+    """Adding a case without recording its baseline fails here"""
+    with open(BASELINES) as f:
+        baselines = json.load(f)
+    assert set(_cases()) == set(baselines["cases"]), set(_cases()) ^ set(baselines["cases"])
+    assert all(case["relative"] > 0 for case in baselines["cases"].values())
+    print('✅ Every case has a baseline')
+
+
+def test_inputs_are_fixed():
+    """Inputs are regenerated identically, from a 30-minute run to a 6-hour ride"""
+    summary, streams = activity("ride_6h")
+    activity.cache_clear()
+    assert activity("ride_6h") == (summary, streams)
+    assert len(streams["watts"]["data"]) > 5.5 * 3600
+    assert min(minutes for _, _, minutes, _ in INPUTS.values()) == 30
+    print('✅ Inputs are fixed')
+
+
+def test_compare_flags_regressions_beyond_tolerance():
+    baselines = {"cases": {"a": {"relative": 10.0}, "b": {"relative": 10.0}, "c": {"relative": 10.0}}}
+    results = {"cases": {"a": {"relative": 12.0}, "b": {"relative": 16.0}, "c": {"relative": 5.0},
+                         "new": {"relative": 1.0}}}
+    regressions, lines = compare(results, baselines, tolerance=0.5)
+    assert regressions == ["b"]
+    assert "faster" in lines[2] and "no baseline" in lines[3]
+    assert compare(results, baselines, tolerance=0.1)[0] == ["a", "b"]
+    print('✅ Regressions beyond the tolerance are flagged')
+
+
+if __name__ == "__main__":
+    test_every_case_has_a_baseline()
+    test_inputs_are_fixed()
+    test_compare_flags_regressions_beyond_tolerance()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Test mergeable histogram sketches and sketch-based resting/max HR estimation
+
+Run directly to also print a merged-sketch vs all-samples timing for a year of activities.
+"""
+
+import support  # noqa: F401  (backend/ on sys.path, throwaway database config)
+
+import math
+import random
+import time
+
+import numpy as np
+
+from histogram_sketch import HistogramSketch, merge_sketches
+from activity_metrics import extract_features, SKETCHES
+from utils import estimate_hr_zones_from_activities
+
+HR_BINS = SKETCHES["hr_sketch"][1:]
+
+
+def _hr_streams(rng, count):
+    streams = []
+    for _ in range(count):
+        base = rng.randint(95, 165)
+        data = [base + rng.randint(-25, 30) for _ in range(rng.randint(50, 400))]
+        data[rng.randrange(len(data))] = rng.choice([0, 45, 230])  # Dropouts and spikes
+        streams.append({"heartrate": {"data": data}})
+    return streams
+
+
+def test_merged_quantiles_equal_percentile():
+    """Merging per-activity sketches gives np.percentile over every sample, and the exact maximum"""
+    rng = random.Random(7)
+    streams = _hr_streams(rng, 40)
+    stored = [extract_features(None, activity_streams)["hr_sketch"] for activity_streams in streams]
+    merged = merge_sketches(stored, *HR_BINS)
+
+    samples = [hr for activity_streams in streams for hr in activity_streams["heartrate"]["data"]]
+    in_range = [hr for hr in samples if 60 < hr < 220]
+    for q in (0.0, 0.05, 0.5, 0.95, 1.0):
+        assert math.isclose(merged.quantile(q, above=60, below=220), np.percentile(in_range, q * 100)), q
+    assert merged.maximum == max(samples) and isinstance(merged.maximum, int)
+
+    pairwise = HistogramSketch(*HR_BINS)
+    for sketch in stored:
+        pairwise.merge(HistogramSketch.from_stored(sketch, *HR_BINS))
+    assert np.array_equal(pairwise.counts, merged.counts)
+    try:
+        merged.merge(HistogramSketch(0, 10.0, 200))
+        assert False, "merged sketches with different bins"
+    except ValueError:
+        pass
+    print('✅ Merged sketch quantiles equal np.percentile')
+
+
+def test_hr_estimate_from_sketch_matches_streams():
+    """Resting and max HR from the merged sketch equal the all-samples estimate"""
+    rng = random.Random(9)
+    streams = _hr_streams(rng, 25)
+    summaries = [{"type": "Run", "max_heartrate": 188 if i == 3 else None} for i in range(len(streams))]
+    sketch = merge_sketches((extract_features(None, s)["hr_sketch"] for s in streams), *HR_BINS)
+
+    from_streams = estimate_hr_zones_from_activities(summaries, "M", list(zip(summaries, streams)))
+    from_sketch = estimate_hr_zones_from_activities(summaries, "M", hr_sketch=sketch)
+    assert from_sketch == from_streams, (from_sketch, from_streams)
+    assert estimate_hr_zones_from_activities(summaries, "M", hr_sketch=HistogramSketch(*HR_BINS))["resting_hr"] == 60
+    print('✅ HR estimate from sketch matches streams')
+
+
+def benchmark(count=365):
+    rng = random.Random(1)
+    streams = []
+    for _ in range(count):
+        base = rng.randint(100, 160)
+        streams.append({"heartrate": {"data": [base + rng.randint(-20, 25) for _ in range(rng.randint(1200, 9000))]}})
+    summaries = [{"type": "Ride"} for _ in streams]
+    stored = [extract_features(None, s)["hr_sketch"] for s in streams]
+
+    start = time.perf_counter()
+    estimate_hr_zones_from_activities(summaries, "M", list(zip(summaries, streams)))
+    samples_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    estimate_hr_zones_from_activities(summaries, "M", hr_sketch=merge_sketches(stored, *HR_BINS))
+    sketch_ms = (time.perf_counter() - start) * 1000
+    total = sum(len(s["heartrate"]["data"]) for s in streams)
+    print(f'📊 {count} activities ({total:,} HR samples): all samples {samples_ms:.1f} ms, merged sketches {sketch_ms:.2f} ms')
+
+
+if __name__ == "__main__":
+    test_merged_quantiles_equal_percentile()
+    test_hr_estimate_from_sketch_matches_streams()
+    benchmark()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Test work queue semantics (dedup, leases, retries) against an in-memory SQLite database
+"""
+
+from support import memory_session, memory_session_factory  # Also puts backend/ on sys.path
+
+from datetime import datetime, timedelta
+
+from models import JobQueueItem, JobRun
+from job_queue import (enqueue, lease_jobs, run_next, register_task, lane_stats, complete_job, fail_job, RERUN_FLAG,
+                       PRIORITY_INTERACTIVE, PRIORITY_BACKFILL, PRIORITY_NORMAL, PRIORITY_LOW)
+from upstream_budget import current_lane, UpstreamBudgetExceeded
+
+
+calls = []
+
+
+@register_task("test_ok")
+def _ok_task(user_id, value=None):
+    calls.append((user_id, value))
+
+
+@register_task("test_lane")
+def _lane_task(user_id):
+    calls.append((user_id, current_lane()))
+
+
+@register_task("test_fail")
+def _failing_task(user_id):
+    raise RuntimeError("upstream unavailable")
+
+
+@register_task("test_budget", lease_seconds=60)
+def _budget_task(user_id):
+    raise UpstreamBudgetExceeded("strava budget for routine lane exhausted", retry_after=600)
+
+
+def test_dedup_key_allows_one_active_item(db):
+    """A second enqueue with the same key is dropped until the first completes"""
+    assert enqueue(db, "test_ok", user_id=1, dedup_key="test_ok:1")
+    assert not enqueue(db, "test_ok", user_id=1, dedup_key="test_ok:1")
+    assert enqueue(db, "test_ok", user_id=2, dedup_key="test_ok:2")
+
+    assert run_next(db, "w1") is True
+    assert run_next(db, "w1") is True
+    assert run_next(db, "w1") is None
+
+    # Completed items no longer block the key
+    assert enqueue(db, "test_ok", user_id=1, dedup_key="test_ok:1")
+    print('✅ Dedup key allows one active item')
+
+
+def test_rerun_if_running(db):
+    """A request deduplicated against a running item queues it again when it completes"""
+    key = "test_ok:1:fetch"
+    assert enqueue(db, "test_ok", user_id=1, payload={"value": "v"}, dedup_key=key, rerun_if_running=True)
+    assert not enqueue(db, "test_ok", user_id=1, payload={"value": "v"}, dedup_key=key, rerun_if_running=True)
+    assert RERUN_FLAG not in db.query(JobQueueItem).one().payload  # Still queued: it will see the change anyway
+
+    [job] = lease_jobs(db, "w1")
+    assert not enqueue(db, "test_ok", user_id=1, payload={"value": "v"}, dedup_key=key)
+    assert RERUN_FLAG not in db.query(JobQueueItem).one().payload  # Plain dedup leaves the running item alone
+    for _ in range(2):
+        assert not enqueue(db, "test_ok", user_id=1, payload={"value": "v"}, dedup_key=key, rerun_if_running=True)
+    assert db.query(JobQueueItem).one().payload[RERUN_FLAG] is True
+
+    assert complete_job(db, job, "w1")
+    rerun = db.query(JobQueueItem).filter_by(status="queued").one()
+    assert rerun.dedup_key == key and rerun.payload == {"value": "v"}
+
+    del calls[:]
+    assert run_next(db, "w2") is True and calls == [(1, "v")]
+    assert db.query(JobQueueItem).filter_by(status="queued").count() == 0
+    print('✅ Rerun if running')
+
+
+def test_priority_order(db):
+    """Lower priority numbers are leased first"""
+    enqueue(db, "test_ok", user_id=1, priority=100)
+    enqueue(db, "test_ok", user_id=2, priority=10)
+    jobs = lease_jobs(db, "w1", batch_size=2)
+    assert [job.user_id for job in jobs] == [2, 1]
+    print('✅ Priority order respected')
+
+
+def test_failed_job_backs_off_then_dies(db):
+    """Failures retry with backoff and park as dead after max_attempts"""
+    enqueue(db, "test_fail", user_id=1, max_attempts=2)
+
+    assert run_next(db, "w1") is False
+    job = db.query(JobQueueItem).one()
+    assert job.status == "queued" and job.attempts == 1
+    assert job.available_at > datetime.utcnow()
+    assert run_next(db, "w1") is None  # Not visible during backoff
+
+    job.available_at = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+    assert run_next(db, "w1") is False
+    job = db.query(JobQueueItem).one()
+    assert job.status == "dead" and "upstream unavailable" in job.last_error
+    print('✅ Failed job backs off then dies')
+
+
+def test_expired_lease_is_released(db):
+    """A lease that outlives its visibility timeout is picked up by another worker"""
+    enqueue(db, "test_ok", user_id=1)
+    [job] = lease_jobs(db, "crashed-worker")
+    assert lease_jobs(db, "w2") == []
+
+    job.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+    [job] = lease_jobs(db, "w2")
+    assert job.leased_by == "w2" and job.attempts == 2
+    print('✅ Expired lease re-leased')
+
+
+def test_expired_last_lease_is_parked(db):
+    """An item whose lease keeps expiring (hung handler, killed worker) dies after max_attempts"""
+    enqueue(db, "test_ok", user_id=1, max_attempts=2)
+    for worker in ("w1", "w2"):
+        [job] = lease_jobs(db, worker)
+        job.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+        db.commit()
+
+    assert lease_jobs(db, "w3") == []
+    job = db.query(JobQueueItem).one()
+    assert job.status == "dead" and job.attempts == 2 and "Lease expired" in job.last_error
+    print('✅ Expired last lease parked as dead')
+
+
+def test_lost_lease_cannot_finish_item(db):
+    """A worker whose lease was taken over can neither complete nor requeue the item"""
+    enqueue(db, "test_ok", user_id=1)
+    [job] = lease_jobs(db, "slow-worker")
+    job.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+    [job] = lease_jobs(db, "w2")
+
+    assert complete_job(db, job, "slow-worker") is False
+    assert fail_job(db, job, "late failure", "slow-worker") is False
+    job = db.query(JobQueueItem).one()
+    assert job.status == "leased" and job.leased_by == "w2" and job.last_error is None
+
+    assert complete_job(db, job, "w2") is True
+    assert db.query(JobQueueItem).one().status == "done"
+    print('✅ Lost lease cannot finish the item')
+
+
+def test_budget_exhaustion_defers_item(db):
+    """An item that can't get upstream budget within its lease goes back until the reset, attempt refunded"""
+    enqueue(db, "test_budget", user_id=1, max_attempts=1)
+    assert run_next(db, "w1") is False
+    job = db.query(JobQueueItem).one()
+    assert job.status == "queued" and job.attempts == 0 and job.lease_expires_at is None
+    assert 590 < (job.available_at - datetime.utcnow()).total_seconds() <= 601
+    assert "budget" in job.last_error
+    print('✅ Budget exhaustion defers the item')
+
+
+def test_interactive_lane_preempts_batch(db):
+    """An interactive item enqueued behind a nightly batch is leased first and runs in its lane"""
+    for user_id in range(1, 51):
+        enqueue(db, "test_ok", user_id=user_id, priority=PRIORITY_NORMAL)
+    enqueue(db, "test_ok", user_id=99, priority=PRIORITY_LOW)
+    enqueue(db, "test_lane", user_id=100, priority=PRIORITY_BACKFILL)
+    enqueue(db, "test_lane", user_id=101, priority=PRIORITY_INTERACTIVE)
+
+    # A dedicated interactive worker only sees its lane
+    del calls[:]
+    assert run_next(db, "interactive", lanes=["interactive"]) is True
+    assert run_next(db, "interactive", lanes=["interactive"]) is None
+    assert calls == [(101, "interactive")]
+
+    # A general worker takes backfill before routine, maintenance last
+    [job] = lease_jobs(db, "w1")
+    assert job.user_id == 100 and job.lane == "backfill"
+    assert db.query(JobQueueItem).filter_by(user_id=99).one().lane == "maintenance"
+
+    stats = lane_stats(db)
+    assert stats["interactive"]["started"] == 1 and stats["interactive"]["wait_seconds"]["max"] < 5
+    assert stats["routine"]["queued"] == 50 and stats["backfill"]["leased"] == 1
+    print('✅ Interactive lane preempts batch')
+
+
+def test_scheduled_cleanup_purges_finished_items(db_factory):
+    """The leader's daily cleanup deletes done and dead items past retention, never pending work"""
+    import main
+
+    db = db_factory()
+    old, recent = datetime.utcnow() - timedelta(days=40), datetime.utcnow() - timedelta(days=1)
+    for user_id, status, finished in [(1, "done", old), (2, "done", recent), (3, "dead", old), (4, "dead", recent),
+                                      (5, "queued", old), (6, "leased", old)]:
+        db.add(JobQueueItem(task_name="test_ok", user_id=user_id, status=status, payload={}, created_at=old,
+                            updated_at=finished, available_at=old,
+                            completed_at=finished if status == "done" else None))
+    db.add(JobRun(job_name="daily_sync", trigger="schedule", status="enqueued", started_at=old - timedelta(days=60)))
+    db.commit()
+
+    original = main.SessionLocal
+    main.SessionLocal = db_factory
+    try:
+        main.add_scheduled_jobs()
+        assert main.scheduler.get_job("queue_cleanup") is not None
+        main.queue_cleanup_job()
+    finally:
+        main.SessionLocal = original
+    db.expire_all()
+    assert sorted(user_id for (user_id,) in db.query(JobQueueItem.user_id)) == [2, 4, 5, 6]
+    assert db.query(JobRun).count() == 0
+    print('✅ Scheduled cleanup purges finished items')
+
+
+if __name__ == "__main__":
+    test_dedup_key_allows_one_active_item(memory_session())
+    test_rerun_if_running(memory_session())
+    test_priority_order(memory_session())
+    test_failed_job_backs_off_then_dies(memory_session())
+    test_expired_lease_is_released(memory_session())
+    test_expired_last_lease_is_parked(memory_session())
+    test_lost_lease_cannot_finish_item(memory_session())
+    test_budget_exhaustion_defers_item(memory_session())
+    test_interactive_lane_preempts_batch(memory_session())
+    test_scheduled_cleanup_purges_finished_items(memory_session_factory())
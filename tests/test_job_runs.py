@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Test the job run ledger: runs recorded around scheduled jobs, per-user executions written by the
+queue with timings, API calls, activities and errors, and the run and slowest-user reports
+"""
+
+from support import memory_session_factory  # Also puts backend/ on sys.path
+
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import JobRunUser, JobQueueItem
+import job_runs
+from job_queue import enqueue, drain, register_task
+from job_runs import recorded_job, manual_trigger, list_runs, run_detail, slowest_users, purge_job_runs
+from metrics import count_work
+
+
+@register_task("job_runs_probe")
+def _probe(user_id, seconds=0.0, fail=False):
+    count_work("api_calls", user_id)
+    count_work("activities", 2)
+    time.sleep(seconds)
+    if fail:
+        raise RuntimeError(f"user {user_id} broke")
+    return {"new_activities": 2}
+
+
+def test_run_is_recorded_per_user(db_factory):
+    """A scheduled run tags its items; each execution is written with timing, work done and outcome"""
+    factory, original = db_factory, job_runs.SessionLocal
+    job_runs.SessionLocal = factory
+    db = factory()
+
+    @recorded_job("probe_sync")
+    def probe_job():
+        enqueue(db, "job_runs_probe", user_id=1)
+        enqueue(db, "job_runs_probe", user_id=2, payload={"seconds": 0.05})
+        enqueue(db, "job_runs_probe", user_id=3, payload={"fail": True}, max_attempts=1)
+
+    try:
+        probe_job()
+        enqueue(db, "job_runs_probe", user_id=4)  # Outside any run: no ledger rows
+        run = list_runs(db)[0]
+        assert (run["job_name"], run["trigger"], run["state"]) == ("probe_sync", "schedule", "draining")
+        assert run["users_enqueued"] == 3 and run["pending"] == 3 and run["finished_at"] is None
+
+        assert drain(db) == {"succeeded": 3, "failed": 1}
+        run = list_runs(db, job_name="probe_sync")[0]
+        assert run["state"] == "completed" and run["finished_at"] and run["wall_seconds"] >= 0
+        assert (run["users_processed"], run["attempts"], run["failed_attempts"], run["dead"]) == (3, 3, 1, 1)
+        assert run["api_calls"] == 6 and run["activities"] == 6 and run["max_user_seconds"] >= 0.05
+
+        detail = run_detail(db, run["run_id"])
+        slowest = detail["executions"][0]
+        assert slowest["user_id"] == 2 and slowest["result"] == {"new_activities": 2} and slowest["api_calls"] == 2
+        assert slowest["queries"] == 0  # The probe doesn't touch the database
+        assert detail["errors"] == [{"user_id": 3, "attempt": 1, "error": "RuntimeError: user 3 broke"}]
+        assert db.query(JobRunUser).filter(JobRunUser.user_id == 4).count() == 0
+        assert run_detail(db, 999) is None
+    finally:
+        job_runs.SessionLocal = original
+    print('✅ Run recorded per user')
+
+
+def test_slowest_users(db_factory):
+    """Users are ranked by total time across runs, with their mean, max, failures and work done"""
+    factory, original = db_factory, job_runs.SessionLocal
+    job_runs.SessionLocal = factory
+    db = factory()
+
+    @recorded_job("probe_daily")
+    def probe_job():
+        enqueue(db, "job_runs_probe", user_id=1)
+        enqueue(db, "job_runs_probe", user_id=2, payload={"seconds": 0.03})
+
+    try:
+        probe_job()
+        drain(db)
+        probe_job()
+        drain(db)
+        report = slowest_users(db, days=1)
+        assert [row["user_id"] for row in report] == [2, 1]
+        assert report[0]["executions"] == 2 and report[0]["failures"] == 0
+        assert report[0]["total_seconds"] >= 0.06 and report[0]["mean_seconds"] >= 0.03
+        assert report[0]["api_calls"] == 4 and report[0]["activities"] == 4
+        assert slowest_users(db, days=1, job_name="other_job") == []
+        assert len(slowest_users(db, days=1, task_name="job_runs_probe", limit=1)) == 1
+    finally:
+        job_runs.SessionLocal = original
+    print('✅ Slowest users')
+
+
+def test_manual_and_failed_runs(db_factory):
+    """Manual triggers are marked; a scheduler call that raises is recorded as failed; old runs are purged"""
+    factory, original = db_factory, job_runs.SessionLocal
+    job_runs.SessionLocal = factory
+    db = factory()
+
+    @recorded_job("probe_broken")
+    def broken_job():
+        enqueue(db, "job_runs_probe", user_id=5)
+        raise ValueError("no users table")
+
+    try:
+        with manual_trigger():
+            try:
+                broken_job()
+                assert False, "the job's exception was swallowed"
+            except ValueError:
+                pass
+        run = list_runs(db)[0]
+        assert (run["trigger"], run["state"], run["users_enqueued"]) == ("manual", "failed", 1)
+        assert run["error"] == "ValueError: no users table"
+        assert job_runs.current_run_id() is None
+
+        assert purge_job_runs(db, older_than_days=1) == 0
+        assert purge_job_runs(db, older_than_days=-1) == 1
+        assert db.query(JobQueueItem).filter(JobQueueItem.run_id.isnot(None)).count() == 0
+    finally:
+        job_runs.SessionLocal = original
+    print('✅ Manual and failed runs')
+
+
+def test_ledger_failure_does_not_stop_job():
+    """If the ledger can't be written, the job still runs, unrecorded"""
+    original = job_runs.SessionLocal
+    job_runs.SessionLocal = sessionmaker(bind=create_engine("sqlite://"))  # No tables
+    calls = []
+
+    @recorded_job("probe_unrecorded")
+    def job():
+        calls.append(job_runs.current_run_id())
+
+    try:
+        job()
+    finally:
+        job_runs.SessionLocal = original
+    assert calls == [None]
+    print('✅ Ledger failure tolerated')
+
+
+if __name__ == "__main__":
+    test_run_is_recorded_per_user(memory_session_factory())
+    test_slowest_users(memory_session_factory())
+    test_manual_and_failed_runs(memory_session_factory())
+    test_ledger_failure_does_not_stop_job()
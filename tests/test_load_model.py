@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Test the daily load model behind the Performance Management Chart: the blocked EWMA against the
+plain recurrence, ACWR against the engine's window sums, weekly downsampling and the endpoint
+
+Run directly to also print a 5-year series benchmark.
+"""
+
+from support import memory_session_factory, dashboard_client  # Also puts backend/ on sys.path
+
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from models import User, Activity
+from dashboard import PMC_MAX_DAYS
+from load_model import ewma, acwr, pmc_series, performance_management_chart, CTL_DAYS, ATL_DAYS, WARMUP_DAYS
+
+
+def _loop_ewma(values, days, initial=0.0):
+    state, out = initial, []
+    for value in values:
+        state += (value - state) / days
+        out.append(state)
+    return np.array(out)
+
+
+def _daily_loads(days, seed=1):
+    rng = np.random.default_rng(seed)
+    return np.where(rng.random(days) < 0.7, rng.gamma(2.0, 40.0, days), 0.0)
+
+
+def test_ewma_matches_recurrence():
+    """Every length (partial blocks included), 2-D batches and per-row starting states"""
+    for n in (1, 5, 63, 64, 65, 200, 1826):
+        values = _daily_loads(n)
+        for days in (CTL_DAYS, ATL_DAYS):
+            assert np.allclose(ewma(values, days, initial=30.0), _loop_ewma(values, days, 30.0), rtol=1e-10, atol=1e-9)
+
+    batch = np.stack([_daily_loads(100, seed) for seed in range(4)])
+    initial = np.array([0.0, 10.0, 50.0, 90.0])
+    result = ewma(batch, CTL_DAYS, initial)
+    assert result.shape == batch.shape
+    for row in range(4):
+        assert np.allclose(result[row], _loop_ewma(batch[row], CTL_DAYS, initial[row]))
+    assert ewma([], CTL_DAYS).shape == (0,)
+    print('✅ EWMA matches the recurrence')
+
+
+def test_series_definitions():
+    """TSB is yesterday's CTL - ATL; ACWR is the engine's 7-day sum over the 28-day sum / 4"""
+    values = _daily_loads(120)
+    series = pmc_series(values)
+    assert series["tsb"][0] == 0.0
+    assert np.allclose(series["tsb"][1:], series["ctl"][:-1] - series["atl"][:-1])
+    for day in (3, 40, 119):
+        acute = values[max(0, day - 6):day + 1].sum()
+        chronic = values[max(0, day - 27):day + 1].sum() / 4.0
+        assert np.isclose(series["acwr"][day], acute / chronic)
+    assert list(acwr([0, 0, 5])) == [0.0, 0.0, 4.0]  # A first session reads as a spike, like in the engine
+    print('✅ Series definitions')
+
+
+def _seeded_client(days=3 * 365):
+    factory = memory_session_factory(shared=True)
+    db = factory()
+    db.add(User(user_id=1, name="PMC Athlete", email="pmc@example.com"))
+    end = datetime(2025, 6, 30, 7, 0)
+    for day, utl in enumerate(_daily_loads(days)):
+        if utl:
+            db.add(Activity(strava_activity_id=str(day), user_id=1, type="Ride", utl_score=float(utl),
+                            start_date=end - timedelta(days=day)))
+    db.commit()
+    return dashboard_client(factory), db
+
+
+def test_pmc_endpoint():
+    """Daily points from stored activities (warm-up history included), weekly downsampling, validation"""
+    client, db = _seeded_client()
+    response = client.get("/dashboard/1/pmc", params={"start": "2025-01-01", "end": "2025-06-30"})
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["resolution"] == "daily" and len(body["points"]) == 181
+    assert body["points"][0]["date"] == "2025-01-01" and body["points"][-1]["date"] == "2025-06-30"
+
+    daily = np.zeros(181 + WARMUP_DAYS)
+    first = date(2025, 1, 1) - timedelta(days=WARMUP_DAYS)
+    for activity in db.query(Activity):
+        offset = (activity.start_date.date() - first).days
+        if 0 <= offset < len(daily):
+            daily[offset] += activity.utl_score
+    ctl = _loop_ewma(daily, CTL_DAYS)[WARMUP_DAYS:]
+    assert np.allclose([point["ctl"] for point in body["points"]], ctl, atol=0.05)
+    assert abs(body["current"]["ctl"] - ctl[-1]) < 0.05
+
+    weekly = client.get("/dashboard/1/pmc", params={"start": "2023-01-02", "end": "2025-06-30"}).json()
+    assert weekly["resolution"] == "weekly"
+    assert len(weekly["points"]) == len({(date(2023, 1, 2) + timedelta(days=d)).isocalendar()[:2]
+                                         for d in range((date(2025, 6, 30) - date(2023, 1, 2)).days + 1)})
+    assert all(date.fromisoformat(point["date"]).weekday() == 6 for point in weekly["points"][:-1])  # Sundays
+    assert weekly["points"][-1]["date"] == "2025-06-30"  # A Monday: the last week is cut at the range end
+    assert weekly["points"][-1]["ctl"] == body["points"][-1]["ctl"]
+    assert weekly["points"][-1]["utl"] == body["points"][-1]["utl"]
+    full_week = [point["utl"] for point in body["points"][-8:-1]]
+    assert abs(weekly["points"][-2]["utl"] - sum(full_week)) < 0.5
+
+    assert client.get("/dashboard/1/pmc", params={"start": "2025-02-01", "end": "2025-01-01"}).status_code == 400
+    assert client.get("/dashboard/1/pmc", params={"resolution": "monthly"}).status_code == 400
+    longest = (date(2025, 6, 30) - timedelta(days=PMC_MAX_DAYS - 1)).isoformat()
+    assert client.get("/dashboard/1/pmc", params={"start": longest, "end": "2025-06-30"}).status_code == 200
+    assert client.get("/dashboard/1/pmc", params={"start": "0001-01-01", "end": "2025-06-30"}).status_code == 400
+    assert client.get("/dashboard/99/pmc").status_code == 404
+    print('✅ PMC endpoint')
+
+
+def benchmark(years=5, runs=20):
+    _, db = _seeded_client(days=years * 365 + WARMUP_DAYS)
+    start, end = date(2025, 6, 30) - timedelta(days=years * 365 - 1), date(2025, 6, 30)
+    totals, compute = [], []
+    for _ in range(runs):
+        began = time.perf_counter()
+        result = performance_management_chart(db, 1, start, end, resolution="daily")
+        totals.append((time.perf_counter() - began) * 1000)
+        compute.append(result["compute_ms"])
+    print(f'📊 {years}-year PMC ({len(result["points"])} points): {np.median(compute):.2f} ms compute, '
+          f'{np.median(totals):.2f} ms including the query and JSON rows (SQLite)')
+
+
+if __name__ == "__main__":
+    test_ewma_matches_recurrence()
+    test_series_definitions()
+    test_pmc_endpoint()
+    benchmark()
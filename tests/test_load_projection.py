@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Test the what-if load projection: batched plan simulation against the plain recurrence, the
+choice of plan inside the ACWR band, the projection attached to the recommendations and the
+candidate plan endpoint
+
+Run directly to also print a 1,024-candidate benchmark.
+"""
+
+from support import memory_session_factory, dashboard_client  # Also puts backend/ on sys.path
+
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from models import User, Threshold, Activity
+from athlete_snapshot import AthleteSnapshot
+from training_recommendations import TrainingRecommendationEngine
+from load_model import project_plans, daily_history, CTL_DAYS, ATL_DAYS
+
+MIN_RATIO, MAX_RATIO = 0.8, 1.3
+
+
+def _loop_ewma(values, days, initial):
+    state, out = initial, []
+    for value in values:
+        state += (value - state) / days
+        out.append(state)
+    return np.array(out)
+
+
+def _daily_loads(days, seed=1):
+    rng = np.random.default_rng(seed)
+    return np.where(rng.random(days) < 0.7, rng.gamma(2.0, 40.0, days), 0.0)
+
+
+def test_projection_matches_recurrence():
+    """Every candidate's CTL / ATL / TSB / ACWR equals a one-plan loop; the pick is the brute-force one"""
+    history = _daily_loads(84)
+    plans = np.random.default_rng(7).uniform(0, 200, (300, 5))
+    projection = project_plans(history, plans, MIN_RATIO, MAX_RATIO)
+
+    seed = history[:28].mean()
+    start_ctl, start_atl = _loop_ewma(history, CTL_DAYS, seed)[-1], _loop_ewma(history, ATL_DAYS, seed)[-1]
+    assert np.isclose(projection["start"]["ctl"], start_ctl)
+    for row in (0, 123, 299):
+        ctl = _loop_ewma(plans[row], CTL_DAYS, start_ctl)
+        atl = _loop_ewma(plans[row], ATL_DAYS, start_atl)
+        assert np.allclose(projection["ctl"][row], ctl) and np.allclose(projection["atl"][row], atl)
+        assert np.allclose(projection["tsb"][row], np.r_[start_ctl - start_atl, (ctl - atl)[:-1]])
+        series = np.r_[history, plans[row]]
+        for day in range(5):
+            end = 84 + day + 1
+            assert np.isclose(projection["acwr"][row, day], series[end - 7:end].sum() / (series[end - 28:end].sum() / 4))
+
+    inside = [(row, ctl[-1]) for row, (ratios, ctl) in enumerate(zip(projection["acwr"], projection["ctl"]))
+              if ((ratios >= MIN_RATIO) & (ratios <= MAX_RATIO)).all()]
+    assert inside and projection["feasible"].sum() == len(inside)
+    assert projection["best"] == max(inside, key=lambda item: item[1])[0]
+
+    # Nothing fits after a layoff: the plan closest to the band wins
+    rested = project_plans(np.r_[np.full(70, 60.0), np.zeros(14)], [[0] * 3, [40] * 3, [150] * 3, [300] * 3], MIN_RATIO, MAX_RATIO)
+    assert not rested["feasible"].any() and rested["best"] == 2
+
+    # No chronic load: the band cannot be evaluated, so the lightest training plan (or the fallback) wins
+    fresh = project_plans(np.zeros(84), [[0] * 3, [300] * 3, [60] * 3, [90] * 3], MIN_RATIO, MAX_RATIO)
+    assert not fresh["band_applied"] and not fresh["feasible"].any() and fresh["best"] == 2
+    assert project_plans(np.zeros(84), [[0] * 3, [300] * 3], MIN_RATIO, MAX_RATIO, fallback=0)["best"] == 0
+    assert project_plans([], [[0] * 3, [0] * 3], MIN_RATIO, MAX_RATIO)["best"] == 0
+    print('✅ Projection matches the recurrence')
+
+
+def test_daily_history_buckets():
+    """Activities land on their calendar day; today's go to the separate total"""
+    today = date(2025, 6, 30)
+    starts = [datetime(2025, 6, 30, 6), datetime(2025, 6, 29, 18), datetime(2025, 6, 29, 7), datetime(2025, 4, 7, 7),
+              datetime(2025, 1, 1, 7)]
+    history, done_today = daily_history(starts, [10.0, 20.0, 5.0, 7.0, 99.0], today)
+    assert len(history) == 84 and done_today == 10.0
+    assert history[-1] == 25.0 and history[0] == 7.0 and history.sum() == 32.0
+    print('✅ Daily history buckets')
+
+
+def _session(now, loads=None):
+    factory = memory_session_factory(shared=True)
+    db = factory()
+    db.add(User(user_id=1, name="Projection Athlete", email="projection@example.com"))
+    db.add(Threshold(user_id=1, ftp_watts=250, fthp_mps=4.0))
+    for day, utl in enumerate(_daily_loads(120, seed=4) if loads is None else loads):
+        if utl and day:
+            db.add(Activity(strava_activity_id=str(day), user_id=1, type="Ride" if day % 3 else "Run",
+                            utl_score=float(utl), moving_time=3600, start_date=now - timedelta(days=day)))
+    db.commit()
+    return db, factory
+
+
+def test_recommendations_projection():
+    """The engine projects every per-day volume combination of its plan and annotates the days"""
+    now = datetime.now()
+    db, _ = _session(now)
+    engine = TrainingRecommendationEngine()
+    result = engine.generate_recommendations(1, db, AthleteSnapshot.load(db, 1, now=now))
+    assert "error" not in result, result
+    projection, plan = result["load_projection"], result["daily_plan"]
+
+    planned_days = sum(1 for day in plan if day["estimated_utl"] > 0)
+    scales = 4 if result["wellness_status"]["status"] in ("excellent", "good") and \
+        result["workload_analysis"]["risk_level"] != "high" else 3
+    assert projection["candidates"] == scales ** planned_days
+    assert len(projection["days"]) == 5 and projection["acwr_band"] == [0.8, 1.3]
+    for day, point, scale in zip(plan, projection["days"], projection["volume_scales"]):
+        assert day["suggested_volume"] == scale and point["date"] == day["date"]
+        assert abs(point["utl"] - day["estimated_utl"] * scale) < 0.1
+    if projection["feasible_candidates"]:
+        assert projection["within_band"]
+        assert all(0.8 <= point["acwr"] <= 1.3 for point in projection["days"])
+        assert projection["ctl_gain"] >= projection["as_planned"]["ctl_gain"] or not projection["as_planned"]["within_band"]
+    print(f'✅ Recommendations projection ({projection["candidates"]} candidates, {projection["compute_ms"]} ms)')
+
+
+def test_empty_history_keeps_plan():
+    """A new athlete without any load gets the plan as planned, not the heaviest candidate"""
+    now = datetime.now()
+    db, _ = _session(now, loads=np.zeros(120))
+    result = TrainingRecommendationEngine().generate_recommendations(1, db, AthleteSnapshot.load(db, 1, now=now))
+    assert "error" not in result, result
+    projection = result["load_projection"]
+    assert not projection["band_applied"] and projection["feasible_candidates"] == 0
+    assert not projection["within_band"]
+    assert all(day["suggested_volume"] == (1.0 if day["estimated_utl"] > 0 else 0.0) for day in result["daily_plan"])
+    assert projection["ctl_gain"] == projection["as_planned"]["ctl_gain"]
+    print('✅ Empty history keeps the plan')
+
+
+def test_projection_endpoint():
+    """Candidate plans in, the best in-band plan out; validation"""
+    db, factory = _session(datetime.combine(date.today(), datetime.min.time()) + timedelta(hours=7),
+                           loads=np.full(120, 60.0))  # A steady 60 UTL a day: ACWR 1.0 coming in
+    client = dashboard_client(factory)
+
+    steady = 60.0
+    plans = [
+        {"name": "rest", "sessions": []},
+        {"name": "steady", "sessions": [{"day": day, "utl": steady, "type": "Ride"} for day in range(5)]},
+        {"name": "build", "sessions": [{"day": day, "utl": steady * 1.15} for day in range(5)]},
+        {"name": "crash", "sessions": [{"day": day, "utl": steady * 4} for day in range(5)]},
+    ]
+    response = client.post("/dashboard/1/pmc/projection", json={"plans": plans})
+    assert response.status_code == 200, response.text
+    body = response.json()
+    by_name = {plan["name"]: plan for plan in body["plans"]}
+    assert not by_name["crash"]["within_band"] and by_name["crash"]["max_acwr"] > 1.3
+    assert by_name["build"]["ctl_gain"] > by_name["steady"]["ctl_gain"] > by_name["rest"]["ctl_gain"]
+    feasible = [plan for plan in body["plans"] if plan["within_band"]]
+    assert body["feasible_plans"] == len(feasible) > 0
+    assert body["best"]["name"] == max(feasible, key=lambda plan: plan["ctl_gain"])["name"]
+    assert len(body["best"]["days"]) == 5 and body["best"]["days"][0]["date"] == date.today().isoformat()
+
+    assert client.post("/dashboard/1/pmc/projection", json={"plans": []}).status_code == 400
+    bad_day = {"plans": [{"sessions": [{"day": 40, "utl": 50}]}]}
+    assert client.post("/dashboard/1/pmc/projection", json=bad_day).status_code == 400
+    assert client.post("/dashboard/99/pmc/projection", json={"plans": plans}).status_code == 404
+
+    # An athlete with no history: the lightest plan that trains, nothing reported as within the band
+    db.add(User(user_id=2, name="New Athlete", email="new@example.com"))
+    db.commit()
+    body = client.post("/dashboard/2/pmc/projection", json={"plans": plans}).json()
+    assert not body["band_applied"] and body["feasible_plans"] == 0 and body["best"]["name"] == "steady"
+    print('✅ Projection endpoint')
+
+
+def benchmark(runs=50):
+    history = _daily_loads(84)
+    plans = np.array(np.meshgrid(*[[0.0, 45.0, 60.0, 75.0]] * 5)).reshape(5, -1).T * 1.5
+    timings = []
+    for _ in range(runs):
+        began = time.perf_counter()
+        project_plans(history, plans, MIN_RATIO, MAX_RATIO)
+        timings.append((time.perf_counter() - began) * 1000)
+    print(f'📊 {len(plans)} candidate plans x 5 days: {np.median(timings):.2f} ms')
+
+
+if __name__ == "__main__":
+    test_projection_matches_recurrence()
+    test_daily_history_buckets()
+    test_recommendations_projection()
+    test_empty_history_keeps_plan()
+    test_projection_endpoint()
+    benchmark()
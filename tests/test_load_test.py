@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Test the load test harness pieces that run without Postgres: the stub Strava feed and
+intervals.icu wellness API, traffic mix parsing and the latency summary (per-request query counts
+are covered by test_query_stats.py)
+"""
+
+import support  # noqa: F401  (backend/ on sys.path, throwaway database config)
+
+import argparse
+import threading
+from http.server import ThreadingHTTPServer
+
+import requests
+from load_test import StubIntervalsHandler, Recorder, _free_port, parse_mix, summarize, DEFAULT_MIX
+from strava_event_simulator import StubStravaHandler, athlete_feed_ids
+
+
+def _serve(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", _free_port()), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def test_stub_feeds():
+    """Each athlete's stub Strava feed holds their own activities; intervals.icu serves one entry per day"""
+    assert set(athlete_feed_ids("loadtest-7", 5)).isdisjoint(athlete_feed_ids("loadtest-8", 5))
+    StubStravaHandler.feed_size = 3
+    strava, strava_url = _serve(StubStravaHandler)
+    intervals, intervals_url = _serve(StubIntervalsHandler)
+    try:
+        headers = {"Authorization": "Bearer loadtest-7"}
+        feed = requests.get(f"{strava_url}/api/v3/athlete/activities", params={"page": 1, "per_page": 200},
+                            headers=headers, timeout=10).json()
+        assert [activity["id"] for activity in feed] == athlete_feed_ids("loadtest-7", 3)
+        assert requests.get(f"{strava_url}/api/v3/athlete/activities", params={"page": 2},
+                            headers=headers, timeout=10).json() == []
+
+        wellness = requests.get(f"{intervals_url}/api/v1/athlete/i7/wellness",
+                                params={"oldest": "2026-01-01", "newest": "2026-01-10"}, timeout=10).json()
+        assert [entry["id"] for entry in wellness][::9] == ["2026-01-01", "2026-01-10"] and len(wellness) == 10
+        assert requests.get(f"{intervals_url}/api/v1/athlete/i7", timeout=10).json()["id"] == "i7"
+    finally:
+        StubStravaHandler.feed_size = 0
+        strava.shutdown()
+        intervals.shutdown()
+    print('✅ Stub feeds')
+
+
+def test_mix_and_summary():
+    assert parse_mix("dashboard=80,onboarding=20") == {"dashboard": 80, "onboarding": 20}
+    try:
+        parse_mix("dashbord=1")
+        assert False, "accepted an unknown endpoint"
+    except argparse.ArgumentTypeError:
+        pass
+    assert set(DEFAULT_MIX) == {"dashboard", "recommendations", "wellness_sync", "onboarding"}
+
+    recorder = Recorder()
+    for i in range(100):
+        recorder.record("dashboard", (i + 1) / 1000, i != 0, 4)
+    recorder.record("scheduler:daily_sync", 2.0, True, None)
+    report = summarize(recorder, duration=10)
+    assert report["dashboard"]["requests"] == 100 and report["dashboard"]["errors"] == 1
+    assert report["dashboard"]["per_second"] == 10 and report["dashboard"]["queries_mean"] == 4
+    assert 50 <= report["dashboard"]["p50_ms"] <= 51 and 99 <= report["dashboard"]["p99_ms"] <= 100
+    assert report["scheduler:daily_sync"]["queries_mean"] is None
+    print('✅ Mix parsing and summary')
+
+
+if __name__ == "__main__":
+    test_stub_feeds()
+    test_mix_and_summary()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Test the maintenance CLI's operations, dry runs, checkpoint resume and process workers against a
+file-backed SQLite database (worker processes open their own connections to it)
+"""
+
+import os
+import support  # noqa: F401  (backend/ on sys.path, throwaway database config)
+
+import io
+import json
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, User, Threshold, Activity, ActivityMetrics
+from maintenance_cli import run_operation, select_users, load_checkpoint
+
+
+def _database(tmp, users=3, activities=6):
+    url = f"sqlite:///{os.path.join(tmp, 'maintenance.db')}"
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    rides = {"watts": {"data": [150 + (i % 50) for i in range(900)]}}
+    runs = {"distance": {"data": [3.2 * i for i in range(900)]}, "heartrate": {"data": [148] * 900}}
+    for user_id in range(1, users + 1):
+        db.add(User(user_id=user_id, name=f"Athlete {user_id}", email=f"a{user_id}@example.com",
+                    strava_user_id=str(user_id) if user_id != 3 else None))
+        db.add(Threshold(user_id=user_id, ftp_watts=220 + 10 * user_id, fthp_mps=3.8, max_hr=188, resting_hr=52))
+        for i in range(activities):
+            activity_type, streams = ("Ride", rides) if i % 2 else ("Run", runs)
+            db.add(Activity(strava_activity_id=f"{user_id}-{i}", user_id=user_id, type=activity_type,
+                            moving_time=900, distance=3000, utl_score=1.0, calculation_method="stale",
+                            start_date=datetime.now() - timedelta(days=i * 20 * user_id),
+                            data={"streams": streams}))
+    db.commit()
+    return url, db
+
+
+def _scores(db):
+    db.expire_all()
+    return {a.activity_id: (a.utl_score, a.calculation_method) for a in db.query(Activity)}
+
+
+def test_rescore_dry_run_then_apply():
+    """A dry run lists the changes and writes nothing; the real run applies exactly those"""
+    with tempfile.TemporaryDirectory() as tmp:
+        url, db = _database(tmp)
+        before = _scores(db)
+
+        out = io.StringIO()
+        totals = run_operation("rescore", [1, 2], dry_run=True, database_url=url, out=out)
+        assert totals["activities"] == 12 and totals["changed"] == 12
+        assert "→" in out.getvalue() and "activities/s" in out.getvalue()
+        assert _scores(db) == before and db.query(ActivityMetrics).count() == 0
+
+        totals = run_operation("rescore", [1, 2], database_url=url, out=io.StringIO())
+        after = _scores(db)
+        assert totals["changed"] == 12
+        assert all(after[a.activity_id][1] in ("TSS", "rTSS") for a in db.query(Activity).filter(Activity.user_id < 3))
+        assert all(after[a.activity_id] == (1.0, "stale") for a in db.query(Activity).filter(Activity.user_id == 3))
+        assert run_operation("rescore", [1, 2], database_url=url, out=io.StringIO())["changed"] == 0
+        print('✅ Rescore dry run and apply')
+
+
+def test_checkpoint_resume_and_workers():
+    """Finished users are recorded and skipped on rerun; parallel workers give the serial result"""
+    with tempfile.TemporaryDirectory() as tmp:
+        url, db = _database(tmp)
+        checkpoint = os.path.join(tmp, "features.jsonl")
+        with open(checkpoint, "w") as f:  # An earlier run finished user 1, then was interrupted mid-line
+            f.write(json.dumps({"operation": "features", "user_id": 1}) + "\n" + '{"operation": "feat')
+
+        out = io.StringIO()
+        totals = run_operation("features", [1, 2, 3], workers=2, checkpoint=checkpoint, database_url=url, out=out)
+        assert totals["users"] == 2 and totals["changed"] == 12 and totals["errors"] == 0
+        assert "Skipping 1 users" in out.getvalue()
+        assert load_checkpoint(checkpoint, "features") == {1, 2, 3}
+        assert load_checkpoint(checkpoint, "rescore") == set()
+        assert {m.activity_id for m in db.query(ActivityMetrics)} == {
+            a.activity_id for a in db.query(Activity).filter(Activity.user_id > 1)}
+
+        assert run_operation("features", [1, 2, 3], checkpoint=checkpoint, database_url=url,
+                             out=io.StringIO())["users"] == 0
+
+        os.mkdir(os.path.join(tmp, "serial"))
+        serial_url, serial_db = _database(os.path.join(tmp, "serial"))
+        run_operation("rescore", [1, 2, 3], database_url=serial_url, out=io.StringIO())
+        run_operation("rescore", [1, 2, 3], workers=3, database_url=url, out=io.StringIO())
+        assert sorted(_scores(db).values()) == sorted(_scores(serial_db).values())
+        print('✅ Checkpoint resume and parallel workers')
+
+
+def test_user_selection():
+    """Filters combine: explicit ids, Strava connection and recent activity"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _, db = _database(tmp)
+        assert select_users(db) == [1, 2, 3]
+        assert select_users(db, strava_only=True) == [1, 2]
+        assert select_users(db, user_ids=[2, 3], strava_only=True) == [2]
+        db.query(Activity).filter(Activity.user_id == 2).update({Activity.start_date: datetime(2020, 1, 1)})
+        db.commit()
+        assert select_users(db, active_within_days=30) == [1, 3]
+        print('✅ User selection filters')
+
+
+if __name__ == "__main__":
+    test_rescore_dry_run_then_apply()
+    test_checkpoint_resume_and_workers()
+    test_user_selection()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Test the metrics registry and its wiring: Prometheus text format, per-route latency, scheduler
+and queue job durations, upstream calls and 429s, rate limit headroom and stream analysis CPU time
+"""
+
+from support import memory_session  # Also puts backend/ on sys.path
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fastapi import APIRouter, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+import metrics
+from metrics import (Registry, Counter, Gauge, Histogram, MetricsMiddleware, timed_job, render,
+                     HTTP_REQUEST_SECONDS, SCHEDULER_JOB_SECONDS, QUEUE_TASK_SECONDS, UPSTREAM_REQUESTS,
+                     UPSTREAM_RATE_LIMITED, STREAM_ANALYSIS_CALLS, STREAM_ANALYSIS_CPU)
+import activities
+import job_queue
+from job_queue import enqueue, run_next, register_task
+from streams_analysis import analyze_activity_streams
+from strava_event_simulator import synthetic_activity, synthetic_streams
+from upstream_budget import strava_budget
+
+
+def test_text_format():
+    """Counters, gauges and histograms render as Prometheus text, labels escaped, buckets cumulative"""
+    registry = Registry()
+    counter = registry.register(Counter("things_total", "Things.", ("kind",)))
+    gauge = registry.register(Gauge("level", "Level."))
+    histogram = registry.register(Histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0)))
+    counter.inc(kind='say "hi"\n')
+    counter.inc(2.5, kind="b")
+    gauge.set(3)
+    for value in (0.05, 0.5, 0.7, 5.0):
+        histogram.observe(value, route="/x")
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP trainingload_things_total Things.", "# TYPE trainingload_things_total counter"]
+    assert 'trainingload_things_total{kind="say \\"hi\\"\\n"} 1' in lines
+    assert 'trainingload_things_total{kind="b"} 2.5' in lines and "trainingload_level 3" in lines
+    assert [line.rsplit(" ", 1)[1] for line in lines if line.startswith("trainingload_latency_seconds_bucket")] == ["1", "3", "4"]
+    assert 'trainingload_latency_seconds_bucket{route="/x",le="+Inf"} 4' in lines
+    assert 'trainingload_latency_seconds_sum{route="/x"} 6.25' in lines
+    assert 'trainingload_latency_seconds_count{route="/x"} 4' in lines
+
+    try:
+        counter.inc(kind="a", extra="b")
+        assert False, "accepted an unknown label"
+    except ValueError:
+        pass
+    try:
+        registry.register(Counter("things_total", "Again."))
+        assert False, "registered a duplicate name"
+    except ValueError:
+        pass
+    print('✅ Text format')
+
+
+def test_route_latency():
+    """Requests are labelled by route template (router prefixes included), not by raw path"""
+    router = APIRouter()
+
+    @router.get("/{item_id}")
+    def get_item(item_id: int):
+        if item_id == 0:
+            raise HTTPException(status_code=404, detail="missing")
+        return {"id": item_id}
+
+    app = FastAPI()
+    app.include_router(router, prefix="/metrics_items")
+    app.add_api_route("/metrics_boom", lambda: 1 / 0)
+    app.add_middleware(MetricsMiddleware)
+    client = TestClient(app, raise_server_exceptions=False)
+
+    route = "/metrics_items/{item_id}"
+    before = HTTP_REQUEST_SECONDS.count(method="GET", route=route, status="200")
+    for item_id in (1, 2, 3):
+        assert client.get(f"/metrics_items/{item_id}").status_code == 200
+    client.get("/metrics_items/0")
+    client.get("/metrics_boom")
+    assert HTTP_REQUEST_SECONDS.count(method="GET", route=route, status="200") == before + 3
+    assert HTTP_REQUEST_SECONDS.count(method="GET", route=route, status="404") >= 1
+    assert HTTP_REQUEST_SECONDS.count(method="GET", route="/metrics_boom", status="500") >= 1
+    assert '/metrics_items/1"' not in render()
+    print('✅ Route latency')
+
+
+def test_scheduler_and_queue_jobs():
+    """Scheduled jobs record duration and outcome; queue tasks record task, lane, outcome and user time"""
+    @timed_job("metrics_test_job")
+    def failing_job():
+        raise RuntimeError("boom")
+
+    try:
+        failing_job()
+    except RuntimeError:
+        pass
+    assert SCHEDULER_JOB_SECONDS.count(job="metrics_test_job", outcome="error") == 1
+
+    db = memory_session()
+
+    @register_task("metrics_probe")
+    def probe(user_id, fail=False):
+        if fail:
+            raise ValueError("nope")
+
+    try:
+        enqueue(db, "metrics_probe", user_id=424242)
+        enqueue(db, "metrics_probe", user_id=424243, payload={"fail": True})
+        assert run_next(db) is True and run_next(db) is False
+    finally:
+        job_queue.TASK_REGISTRY.pop("metrics_probe", None)
+    assert QUEUE_TASK_SECONDS.count(task="metrics_probe", lane="routine", outcome="succeeded") == 1
+    assert QUEUE_TASK_SECONDS.count(task="metrics_probe", lane="routine", outcome="failed") == 1
+    assert 'trainingload_queue_task_user_seconds{user_id="424242"}' in render()
+    print('✅ Scheduler and queue jobs')
+
+
+def test_user_seconds_keeps_top_users():
+    user_seconds = metrics._UserSeconds(top=2)
+    for user_id, seconds in [(1, 5.0), (2, 1.0), (3, 9.0), (4, 0.5)]:
+        user_seconds.add(user_id, seconds)
+    assert user_seconds.samples() == [(("3",), 9.0), (("1",), 5.0), (("other",), 1.5)]
+    print('✅ Top users')
+
+
+class _RateLimitedStrava(BaseHTTPRequestHandler):
+    """Answers 200 for activity 1 and 429 for anything else, with Strava's usage headers."""
+
+    def do_GET(self):
+        status = 200 if self.path.startswith("/api/v3/activities/1") else 429
+        body = json.dumps(synthetic_activity(1)).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-RateLimit-Limit", "100,1000")
+        self.send_header("X-RateLimit-Usage", "40,300")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_upstream_calls_and_headroom():
+    """Strava calls are counted by status, 429s separately, and budget headroom is exposed"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _RateLimitedStrava)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}/api/v3"
+    ok_before = UPSTREAM_REQUESTS.value(upstream="strava", status="200")
+    limited_before = UPSTREAM_RATE_LIMITED.value(upstream="strava")
+    try:
+        assert activities._strava_get(f"{base}/activities/1", {}).status_code == 200
+        assert activities._strava_get(f"{base}/activities/2", {}).status_code == 429
+    finally:
+        server.shutdown()
+    assert UPSTREAM_REQUESTS.value(upstream="strava", status="200") == ok_before + 1
+    assert UPSTREAM_RATE_LIMITED.value(upstream="strava") == limited_before + 1
+
+    text = render()
+    status = strava_budget.status()
+    remaining = status["window_limit"] - status["window_used"]
+    strava_budget.window_used, strava_budget.daily_used = 0, 0  # The stub's usage headers don't leak into other tests
+    assert f'trainingload_upstream_budget_remaining{{upstream="strava",window="short"}} {remaining}' in text
+    assert 'trainingload_upstream_budget_limit{upstream="strava",window="short"} 100' in text
+    assert 'trainingload_upstream_budget_remaining{upstream="intervals_icu",window="short"}' in text
+    assert 'trainingload_upstream_budget_calls_total{upstream="strava",lane="routine"}' in text
+    print('✅ Upstream calls and headroom')
+
+
+def test_stream_analysis_cpu():
+    activity = dict(synthetic_activity(7), moving_time=600)  # Short: the analysis is quadratic in samples
+    calls = STREAM_ANALYSIS_CALLS.value(function="analyze_activity_streams")
+    cpu = STREAM_ANALYSIS_CPU.value(function="analyze_activity_streams")
+    analyze_activity_streams(synthetic_streams(activity))
+    assert STREAM_ANALYSIS_CALLS.value(function="analyze_activity_streams") == calls + 1
+    assert STREAM_ANALYSIS_CPU.value(function="analyze_activity_streams") > cpu
+    print('✅ Stream analysis CPU')
+
+
+if __name__ == "__main__":
+    test_text_format()
+    test_route_latency()
+    test_scheduler_and_queue_jobs()
+    test_user_seconds_keeps_top_users()
+    test_upstream_calls_and_headroom()
+    test_stream_analysis_cpu()
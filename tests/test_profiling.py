@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Test opt-in profiling: cProfile and sampled profiles of jobs, queue tasks and requests, the
+written pstats / collapsed-stack / metadata files, listing and retention
+"""
+
+import os
+from support import memory_session  # Also puts backend/ on sys.path
+
+import pstats
+import tempfile
+import threading
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import profiling
+import job_queue
+from job_queue import enqueue, run_next, register_task
+from profiling import (profiled, profiled_job, list_profiles, profile_file, current_profile, ProfilingMiddleware,
+                       PROFILE_HEADER, MODE_CPROFILE, MODE_SAMPLE)
+
+
+def _busy_loop(seconds):
+    total, end = 0, time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        total += sum(i * i for i in range(200))
+    return total
+
+
+class _ProfileDir:
+    """Points profiling at a fresh directory (and optionally PROFILE_JOBS) for the block."""
+
+    def __init__(self, jobs=()):
+        self.jobs = set(jobs)
+
+    def __enter__(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved = profiling.PROFILE_DIR, profiling.PROFILE_JOBS
+        profiling.PROFILE_DIR, profiling.PROFILE_JOBS = self.tmp.name, self.jobs
+        return self.tmp.name
+
+    def __exit__(self, *exc):
+        profiling.PROFILE_DIR, profiling.PROFILE_JOBS = self.saved
+        self.tmp.cleanup()
+
+
+def test_cprofile_job():
+    """A job named in PROFILE_JOBS writes pstats, a text report and listable metadata"""
+    @profiled_job("profile_probe")
+    def probe_job():
+        return _busy_loop(0.05)
+
+    with _ProfileDir(jobs={"profile_probe"}) as directory:
+        probe_job()
+        [meta] = list_profiles()
+        assert (meta["name"], meta["kind"], meta["mode"]) == ("job profile_probe", "job", MODE_CPROFILE)
+        assert meta["seconds"] >= 0.05 and meta["files"] == [meta["profile"] + ".prof", meta["profile"] + ".txt"]
+        assert sorted(os.listdir(directory)) == sorted(meta["files"] + [meta["profile"] + ".json"])
+        assert any("_busy_loop" in row["function"] for row in meta["top"]), meta["top"]
+        stats = pstats.Stats(profile_file(meta["profile"] + ".prof"))
+        assert any(function == "_busy_loop" for (_, _, function) in stats.stats)
+        assert "cumulative" in open(profile_file(meta["profile"] + ".txt")).read()
+
+    with _ProfileDir() as directory:
+        probe_job()  # Not named: no profile
+        assert os.listdir(directory) == []
+    print('✅ cProfile job')
+
+
+def test_sampled_profile():
+    """The sampler writes collapsed stacks, root first, and ranks functions by self samples"""
+    with _ProfileDir() as directory:
+        with profiled("offline analysis", kind="cli", mode=MODE_SAMPLE) as profile:
+            _busy_loop(0.2)
+        meta = list_profiles(kind="cli")[0]
+        assert meta["mode"] == MODE_SAMPLE and meta["samples"] > 5 and meta["profile"] == profile.base
+        lines = open(os.path.join(directory, profile.base + ".collapsed")).read().splitlines()
+        stack, count = lines[0].rsplit(" ", 1)
+        assert int(count) > 0 and "test_profiling.py:_busy_loop" in stack
+        assert stack.split(";").index("test_profiling.py:test_sampled_profile") < stack.split(";").index(
+            "test_profiling.py:_busy_loop")
+        assert not any(line.startswith("thread:") for line in lines)  # Only the calling thread
+    print('✅ Sampled profile')
+
+
+def test_nesting_and_fallback():
+    """Profiles don't nest, and a second concurrent cProfile falls back to sampling"""
+    with _ProfileDir() as directory:
+        with profiled("outer", mode=MODE_CPROFILE) as outer:
+            with profiled("inner") as inner:
+                assert inner is None and current_profile() is outer
+            with profiled("disabled", enabled=False) as disabled:
+                assert disabled is None
+
+            modes = []
+            thread = threading.Thread(target=lambda: modes.append(_profile_mode_in_thread()))
+            thread.start()
+            thread.join()
+        assert current_profile() is None
+        assert modes == [MODE_SAMPLE]
+        assert {meta["name"] for meta in list_profiles()} == {"outer", "other thread"}
+        try:
+            with profiled("bad", mode="perf"):
+                pass
+            assert False, "accepted an unknown mode"
+        except ValueError:
+            pass
+        # Only the two listed profiles were written; the rejected mode left nothing behind
+        assert {name.rsplit(".", 1)[0] for name in os.listdir(directory)} == {
+            meta["profile"] for meta in list_profiles()}
+    print('✅ Nesting and fallback')
+
+
+def _profile_mode_in_thread():
+    with profiled("other thread", mode=MODE_CPROFILE) as profile:
+        _busy_loop(0.02)
+    return profile.mode
+
+
+def test_request_profiles():
+    """Requests are sampled across threads (sync endpoints run in the threadpool) and name their profile"""
+    app = FastAPI()
+
+    @app.get("/reports/slow")
+    def slow_report():
+        return {"total": _busy_loop(0.15)}
+
+    app.add_middleware(ProfilingMiddleware, paths=("/reports/",), on_demand=False)
+    on_demand = FastAPI()
+    on_demand.add_api_route("/reports/slow", slow_report)
+    on_demand.add_middleware(ProfilingMiddleware, paths=(), on_demand=True)
+
+    with _ProfileDir() as directory:
+        response = TestClient(app).get("/reports/slow")
+        base = response.headers[PROFILE_HEADER]
+        collapsed = open(os.path.join(directory, base + ".collapsed")).read()
+        assert "test_profiling.py:_busy_loop" in collapsed and "thread:" in collapsed
+        assert list_profiles()[0]["name"] == "GET /reports/slow"
+
+        client = TestClient(on_demand)
+        assert PROFILE_HEADER not in client.get("/reports/slow").headers
+        assert PROFILE_HEADER in client.get("/reports/slow?profile=1").headers
+        assert len(list_profiles(kind="request")) == 2
+    print('✅ Request profiles')
+
+
+def test_queue_task_profile():
+    """Queue tasks named in PROFILE_JOBS are profiled per item, wherever the worker runs"""
+    db = memory_session()
+
+    @register_task("profile_probe_task")
+    def probe(user_id):
+        _busy_loop(0.02)
+
+    try:
+        with _ProfileDir(jobs={"profile_probe_task"}):
+            enqueue(db, "profile_probe_task", user_id=9)
+            assert run_next(db) is True
+            [meta] = list_profiles()
+            assert (meta["name"], meta["kind"]) == ("task profile_probe_task user 9", "task")
+    finally:
+        job_queue.TASK_REGISTRY.pop("profile_probe_task", None)
+    print('✅ Queue task profile')
+
+
+def test_retention_and_file_names():
+    with _ProfileDir() as directory:
+        saved = profiling.PROFILE_KEEP
+        profiling.PROFILE_KEEP = 2
+        try:
+            for name in ("first", "second", "third"):
+                with profiled(name, kind="cli"):
+                    pass
+        finally:
+            profiling.PROFILE_KEEP = saved
+        assert [meta["name"] for meta in list_profiles()] == ["third", "second"]
+        assert not any("first" in name for name in os.listdir(directory))
+        assert profile_file("../config.py") is None and profile_file("missing.prof") is None
+        assert profile_file(list_profiles()[0]["profile"] + ".json")
+    print('✅ Retention and file names')
+
+
+if __name__ == "__main__":
+    test_cprofile_job()
+    test_sampled_profile()
+    test_nesting_and_fallback()
+    test_request_profiles()
+    test_queue_task_profile()
+    test_retention_and_file_names()
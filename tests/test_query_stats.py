@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Test per-request / per-job query statistics and the N+1 detector, and cap the number of queries
+the dashboard, recommendations and Strava import paths run
+"""
+
+from support import memory_session  # Also puts backend/ on sys.path
+
+import logging
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from models import User, Threshold, Activity, WellnessData
+import activities
+import job_queue
+from dashboard import _build_dashboard_data
+from job_queue import enqueue, run_next, register_task
+from query_stats import (QueryStatsMiddleware, QUERIES_HEADER, ROWS_HEADER, TIME_HEADER, KIND_JOB,
+                         track, assert_max_queries, current_stats, statement_totals)
+from strava_event_simulator import StubStravaHandler
+from training_recommendations import TrainingRecommendationEngine
+
+NOW = datetime.now()
+
+
+class _Records(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def _seeded_session(days=120, seed=3):
+    db = memory_session()
+    rng = random.Random(seed)
+    db.add(User(user_id=1, name="Test Athlete", email="athlete@example.com", strava_oauth_token="stub-1"))
+    db.add(Threshold(user_id=1, ftp_watts=250, fthp_mps=4.0, max_hr=190, resting_hr=50))
+    strava_id = 0
+    for day in range(days):
+        for _ in range(rng.choice([0, 1, 1, 2])):
+            strava_id += 1
+            db.add(Activity(
+                strava_activity_id=f"old-{strava_id}", user_id=1, type=rng.choice(["Ride", "Run"]),
+                start_date=NOW - timedelta(days=day, hours=rng.random() * 10), distance=rng.uniform(5e3, 6e4),
+                moving_time=rng.randint(1200, 9000), utl_score=rng.random() * 150
+            ))
+    for day in range(30):
+        db.add(WellnessData(user_id=1, date=(NOW - timedelta(days=day)).date(), hrv=rng.uniform(30, 60),
+                            sleep_score=rng.uniform(50, 95), readiness_score=rng.uniform(40, 90)))
+    db.commit()
+    return db
+
+
+def test_response_headers():
+    """Statements, rows and database time per request, in headers only when enabled"""
+    engine = create_engine("sqlite://")
+    app = FastAPI()
+
+    @app.get("/queries/{count}")
+    def run_queries(count: int):  # Sync endpoint: runs in the threadpool with a copy of the context
+        with engine.connect() as connection:
+            for _ in range(count):
+                connection.execute(text("SELECT 1"))
+        return {"ok": True}
+
+    app.add_middleware(QueryStatsMiddleware, headers=True)
+    client = TestClient(app)
+    response = client.get("/queries/3")
+    assert response.headers[QUERIES_HEADER] == "3" and response.headers[ROWS_HEADER] == "0"
+    assert float(response.headers[TIME_HEADER]) >= 0
+    assert client.get("/queries/0").headers[QUERIES_HEADER] == "0"
+
+    quiet = FastAPI()
+    quiet.add_api_route("/queries/{count}", run_queries)
+    quiet.add_middleware(QueryStatsMiddleware, headers=False)
+    assert QUERIES_HEADER not in TestClient(quiet).get("/queries/2").headers
+    print('✅ Query stats headers')
+
+
+def test_n_plus_one_is_logged():
+    """A statement repeated in a loop is reported once, with its count; nested units add to the outer one"""
+    engine = create_engine("sqlite://")
+    records, root = _Records(), logging.getLogger()
+    level = root.level
+    root.addHandler(records)
+    root.setLevel(logging.DEBUG)  # Small units log their totals at DEBUG
+    try:
+        with engine.connect() as connection, track("GET /loop") as outer:
+            connection.execute(text("SELECT 2"))
+            with track("job inner", kind=KIND_JOB) as inner:
+                assert current_stats() is inner
+                for i in range(12):
+                    connection.execute(text("SELECT :i"), {"i": i})
+            assert current_stats() is outer
+    finally:
+        root.removeHandler(records)
+        root.setLevel(level)
+    assert (inner.statements, outer.statements) == (12, 13)
+    assert inner.repeated() == [("SELECT ?", 12)] and outer.repeated() == [("SELECT ?", 12)]
+    warnings = [message for message in records.messages if "N+1 suspected" in message]
+    assert len(warnings) == 2 and "12x SELECT ?" in warnings[0], warnings
+    assert any(message.startswith("🗄️ GET /loop: 13 queries") for message in records.messages)
+    assert current_stats() is None
+    print('✅ N+1 logged')
+
+
+def test_jobs_are_tracked():
+    """Queue jobs run in their own unit, counted under the job kind"""
+    db = memory_session()
+    seen = {}
+
+    @register_task("query_stats_probe")
+    def probe(user_id):
+        db.execute(text("SELECT 1"))
+        seen["stats"] = current_stats()
+
+    try:
+        before = statement_totals().get(KIND_JOB, 0)
+        enqueue(db, "query_stats_probe", user_id=7)
+        assert run_next(db) is True
+        assert seen["stats"].name == "job query_stats_probe user 7" and seen["stats"].statements == 1
+        assert statement_totals()[KIND_JOB] == before + 1
+    finally:
+        job_queue.TASK_REGISTRY.pop("query_stats_probe", None)
+    print('✅ Jobs tracked')
+
+
+def test_dashboard_query_cap():
+    db = _seeded_session()
+    with assert_max_queries(6, "dashboard") as stats:
+        _build_dashboard_data(1, db)
+    print(f'✅ Dashboard in {stats.statements} queries')
+
+
+def test_recommendations_query_cap():
+    db = _seeded_session()
+    with assert_max_queries(4, "recommendations") as stats:
+        result = TrainingRecommendationEngine().generate_recommendations(1, db)
+    assert "error" not in result, result
+    print(f'✅ Recommendations in {stats.statements} queries')
+
+
+def test_import_query_cap():
+    """Importing a page of activities costs the same number of reads whatever its size"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubStravaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = activities.STRAVA_API_BASE_URL
+    activities.STRAVA_API_BASE_URL = f"http://127.0.0.1:{server.server_address[1]}/api/v3"
+    analyze = activities._analyze_activity_thresholds
+    activities._analyze_activity_thresholds = lambda *args: None  # Reads through the app engine, not this session
+    counts = {}
+    try:
+        for feed_size in (3, 15):
+            StubStravaHandler.feed_size = feed_size
+            db = _seeded_session(days=0)
+            # SQLite inserts the page's activities row by row (Postgres batches them); the change event
+            # may add a recommendation cache invalidation and refresh job; the touched training
+            # rollups are recomputed in the same transaction (two reads, a delete and an insert)
+            with assert_max_queries(12 + feed_size, f"import {feed_size}") as stats:
+                assert activities._fetch_and_process_activities(1, db, backfill_days=7) == feed_size
+            assert not stats.repeated() and stats.reads() == 6, stats.describe()
+            scored = db.query(Activity).filter(Activity.strava_activity_id.notlike("old-%")).all()
+            assert len(scored) == feed_size and all(activity.utl_score is not None for activity in scored)
+            counts[feed_size] = stats.reads()
+
+            # Everything is a duplicate the second time round
+            with assert_max_queries(3, "re-import"):
+                assert activities._fetch_and_process_activities(1, db, backfill_days=7) == 0
+    finally:
+        StubStravaHandler.feed_size = 0
+        activities.STRAVA_API_BASE_URL = base_url
+        activities._analyze_activity_thresholds = analyze
+        server.shutdown()
+    assert counts[3] == counts[15], counts
+    print(f'✅ Import in {counts[15]} reads per page')
+
+
+def test_wellness_reaches_imported_activities():
+    """The page's wellness prefetch gives the same modifiers as the per-activity lookup"""
+    db = _seeded_session(days=0)
+    start = datetime.now(timezone.utc)
+    assert activities._wellness_for_days(1, [start.date()], db)[start.date()] == activities._get_wellness_for_activity(
+        1, start.strftime("%Y-%m-%dT%H:%M:%SZ"), db)
+    assert activities._get_wellness_for_activity(1, None, db) is None
+    print('✅ Wellness prefetch')
+
+
+if __name__ == "__main__":
+    test_response_headers()
+    test_n_plus_one_is_logged()
+    test_jobs_are_tracked()
+    test_dashboard_query_cap()
+    test_recommendations_query_cap()
+    test_import_query_cap()
+    test_wellness_reaches_imported_activities()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Test the per-user recommendation cache: fingerprints, stale-while-revalidate and
+invalidation through data change events (in-memory SQLite)
+"""
+
+from support import memory_session_factory  # Also puts backend/ on sys.path
+
+import random
+from datetime import datetime, timedelta
+
+from models import User, Threshold, Activity, RecommendationCache, JobQueueItem
+import recommendation_cache
+from recommendation_cache import get_recommendations, refresh_recommendations, input_fingerprint
+from data_events import publish, THRESHOLDS_CHANGED
+from job_queue import PRIORITY_INTERACTIVE, PRIORITY_NORMAL
+from training_recommendations import TrainingRecommendationEngine
+
+NOW = datetime.now()
+
+
+class CountingEngine(TrainingRecommendationEngine):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def generate_recommendations(self, user_id, db, snapshot=None):
+        self.calls += 1
+        return super().generate_recommendations(user_id, db, snapshot)
+
+
+def _seeded_session(users=(1,)):
+    factory = memory_session_factory()
+    recommendation_cache.SessionLocal = factory  # Event subscriber opens its own session
+    db = factory()
+
+    rng = random.Random(5)
+    for user_id in users:
+        db.add(User(user_id=user_id, name=f"Athlete {user_id}", email=f"athlete{user_id}@example.com"))
+        db.add(Threshold(user_id=user_id, ftp_watts=250, fthp_mps=4.0))
+        for day in range(40):
+            db.add(Activity(
+                strava_activity_id=f"{user_id}-{day}", user_id=user_id, type=rng.choice(["Ride", "Run"]),
+                start_date=NOW - timedelta(days=day, hours=2), moving_time=3600, utl_score=rng.uniform(40, 120)
+            ))
+    db.commit()
+    return db
+
+
+def _queued(db, user_id):
+    return db.query(JobQueueItem).filter_by(task_name="refresh_recommendations", user_id=user_id).all()
+
+
+def test_miss_then_hit():
+    """First view computes and stores the plan; the next view is served without recomputing"""
+    db = _seeded_session()
+    engine = CountingEngine()
+
+    payload, info = get_recommendations(db, 1, engine)
+    assert info["status"] == "miss" and "error" not in payload
+    payload_again, info = get_recommendations(db, 1, engine)
+    assert info["status"] == "hit"
+    assert payload_again == payload
+    assert engine.calls == 1
+    print('✅ Miss then hit')
+
+
+def test_new_activity_serves_stale_and_queues_refresh():
+    """Changed inputs serve the previous plan at once and queue an interactive refresh"""
+    db = _seeded_session()
+    engine = CountingEngine()
+    get_recommendations(db, 1, engine)
+    before = input_fingerprint(db, 1, NOW)
+
+    db.add(Activity(strava_activity_id="new", user_id=1, type="Ride", start_date=NOW - timedelta(hours=1),
+                    moving_time=5400, utl_score=150))
+    db.commit()
+    assert input_fingerprint(db, 1, NOW) != before
+
+    _, info = get_recommendations(db, 1, engine)
+    assert info["status"] == "stale" and info["refresh"] == "pending"
+    assert engine.calls == 1
+    queued = _queued(db, 1)
+    assert len(queued) == 1 and queued[0].priority == PRIORITY_INTERACTIVE
+
+    refresh_recommendations(db, 1, engine, only_if_cached=True)
+    _, info = get_recommendations(db, 1, engine)
+    assert info["status"] == "hit"
+    assert engine.calls == 2
+    print('✅ Stale plan served while refresh is queued')
+
+
+def test_event_marks_cached_users_stale():
+    """A data event invalidates cached users only and queues a delayed background refresh"""
+    db = _seeded_session(users=(1, 2))
+    get_recommendations(db, 1)
+
+    publish(THRESHOLDS_CHANGED, 1)
+    publish(THRESHOLDS_CHANGED, 2)
+    db.expire_all()
+
+    assert db.get(RecommendationCache, 1).stale is True
+    assert db.get(RecommendationCache, 2) is None
+    queued = _queued(db, 1)
+    assert len(queued) == 1 and queued[0].priority == PRIORITY_NORMAL
+    assert queued[0].available_at > datetime.now()
+    assert _queued(db, 2) == []
+
+    # The stale flag alone forces a recompute even though the fingerprint is unchanged
+    engine = CountingEngine()
+    refresh_recommendations(db, 1, engine, only_if_cached=True)
+    assert engine.calls == 1
+    assert db.get(RecommendationCache, 1).stale is False
+    print('✅ Data events invalidate cached users')
+
+
+if __name__ == "__main__":
+    test_miss_then_hit()
+    test_new_activity_serves_stale_and_queues_refresh()
+    test_event_marks_cached_users_stale()
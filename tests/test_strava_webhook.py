@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Test Strava webhook event debouncing on the work queue using the local event simulator (no Strava
+needed; in-memory SQLite)
+"""
+
+from support import memory_session  # Also puts backend/ on sys.path
+
+from datetime import timedelta
+
+from models import User, JobQueueItem
+from job_queue import lease_jobs, complete_job, RERUN_FLAG
+from strava_webhook import (queue_activity_event, StravaWebhookEvent, WEBHOOK_DEBOUNCE_SECONDS,
+                            WEBHOOK_MAX_WAIT_SECONDS)
+from strava_event_simulator import build_event_burst, synthetic_activity, synthetic_streams
+
+
+def _session():
+    db = memory_session()
+    db.add(User(user_id=1, name="Webhook Athlete", email="webhook@example.com", strava_user_id="42"))
+    db.commit()
+    return db
+
+
+def _queue(db, events):
+    return [queue_activity_event(db, StravaWebhookEvent(**event)) for event in events]
+
+
+def test_burst_is_coalesced_per_activity():
+    """A create followed by several edits results in one queued fetch per activity, after the burst"""
+    db = _session()
+    results = _queue(db, build_event_burst(owner_id=42, activity_ids=[1001, 1002], updates_per_activity=4))
+    assert results.count(True) == 2 and results.count(False) == 8
+
+    items = db.query(JobQueueItem).order_by(JobQueueItem.job_id).all()
+    assert [item.payload for item in items] == [{"strava_activity_id": "1001"}, {"strava_activity_id": "1002"}]
+    assert all(item.task_name == "sync_strava_activity" and item.user_id == 1 for item in items)
+    for item in items:
+        assert abs((item.available_at - item.updated_at).total_seconds() - WEBHOOK_DEBOUNCE_SECONDS) < 1
+
+    # Nothing is leased while the burst is still settling
+    assert lease_jobs(db, "w1") == []
+    print('✅ Burst coalesced into one fetch per activity')
+
+
+def test_delete_wins():
+    """A delete in the burst is never downgraded back to a fetch, also when it arrives mid-fetch"""
+    db = _session()
+    events = build_event_burst(owner_id=42, activity_ids=[2001], updates_per_activity=1, delete_count=1)
+    _queue(db, events + [events[1]])  # Late update after the delete
+    item = db.query(JobQueueItem).one()
+    assert item.payload == {"strava_activity_id": "2001", "action": "delete"}
+
+    # A delete while the fetch runs: the item is queued again afterwards, as a delete
+    item.payload, item.available_at = {"strava_activity_id": "2001"}, item.created_at
+    db.commit()
+    [job] = lease_jobs(db, "w1")
+    _queue(db, [events[-1]])
+    assert complete_job(db, job, "w1")
+    rerun = db.query(JobQueueItem).filter_by(status="queued").one()
+    assert rerun.payload == {"strava_activity_id": "2001", "action": "delete"} and RERUN_FLAG not in rerun.payload
+    print('✅ Delete wins over later updates')
+
+
+def test_max_wait_caps_debounce():
+    """An activity edited continuously is still processed once max wait is reached"""
+    db = _session()
+    event = build_event_burst(owner_id=42, activity_ids=[3001])[0]
+    _queue(db, [event])
+    item = db.query(JobQueueItem).one()
+    item.created_at -= timedelta(seconds=WEBHOOK_MAX_WAIT_SECONDS - 10)  # First event almost 5 minutes ago
+    db.commit()
+
+    _queue(db, [event])
+    db.refresh(item)
+    assert item.available_at == item.created_at + timedelta(seconds=WEBHOOK_MAX_WAIT_SECONDS)
+    print('✅ Max wait caps the debounce window')
+
+
+def test_unknown_athlete_is_ignored():
+    db = _session()
+    assert _queue(db, build_event_burst(owner_id=7, activity_ids=[4001])) == [None]
+    assert db.query(JobQueueItem).count() == 0
+    print('✅ Unknown athlete ignored')
+
+
+def test_synthetic_activity_is_consistent():
+    """Stub Strava data is deterministic and streams match the summary"""
+    activity = synthetic_activity(5001)
+    assert activity == synthetic_activity(5001)
+
+    streams = synthetic_streams(activity)
+    assert len(streams["time"]["data"]) == activity["moving_time"]
+    assert len(streams["heartrate"]["data"]) == activity["moving_time"]
+    print('✅ Synthetic activity and streams are consistent')
+
+
+if __name__ == "__main__":
+    test_burst_is_coalesced_per_activity()
+    test_delete_wins()
+    test_max_wait_caps_debounce()
+    test_unknown_athlete_is_ignored()
+    test_synthetic_activity_is_consistent()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Test the memory-mapped stream archive: export from an in-memory SQLite database, zero-copy
+per-activity views equal to the streams JSON, and filters
+
+Run directly to also print a JSON vs archive timing for a best 20-minute power scan.
+"""
+
+import os
+from support import memory_session  # Also puts backend/ on sys.path
+
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from models import User, Activity
+from stream_archive import export_stream_archive, StreamArchive
+from strava_event_simulator import synthetic_activity, synthetic_streams
+
+
+def _session(count=12, minutes=20):
+    db = memory_session()
+    for user_id in (1, 2):
+        db.add(User(user_id=user_id, name=f"Athlete {user_id}", email=f"athlete{user_id}@example.com"))
+    for i in range(count):
+        summary = {**synthetic_activity(30000 + i), "moving_time": minutes * 60}
+        streams = synthetic_streams(summary)
+        if i == 0:
+            streams["watts"] = {"data": [200, None, 210] + [220] * (summary["moving_time"] - 3)}  # Dropouts
+            streams["latlng"] = {"data": [[51.5 + j * 1e-5, -0.12] for j in range(summary["moving_time"])]}
+        db.add(Activity(strava_activity_id=str(summary["id"]), user_id=1 + i % 2, type=summary["type"],
+                        moving_time=summary["moving_time"], distance=summary["distance"],
+                        start_date=datetime(2025, 1, 1) + timedelta(days=i),
+                        data={**summary, "streams": streams}))
+    db.add(Activity(strava_activity_id="no-streams", user_id=1, type="Ride", moving_time=600,
+                    start_date=datetime(2025, 3, 1), data={"name": "Manual entry"}))
+    db.commit()
+    return db
+
+
+def test_export_round_trip():
+    """Every channel of every activity comes back as a read-only view equal to the JSON"""
+    db = _session()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "archive")
+        assert export_stream_archive(db, path) == 12
+        archive = StreamArchive(path)
+        assert len(archive) == 12
+
+        for activity in db.query(Activity).filter(Activity.strava_activity_id != "no-streams"):
+            position = archive.position_of(activity.activity_id)
+            info = archive.info(position)
+            assert info["user_id"] == activity.user_id and info["type"] == activity.type
+            assert info["start_date"] == activity.start_date
+            views = archive.streams(position)
+            assert set(views) == set(activity.data["streams"])
+            for name, view in views.items():
+                expected = np.asarray(activity.data["streams"][name]["data"], dtype=float)
+                assert np.allclose(view, expected.reshape(view.shape), rtol=1e-6, equal_nan=True), name
+                assert isinstance(view, np.memmap) and not view.flags.writeable  # A view, not a copy
+                assert np.shares_memory(view, archive.channel(name))
+
+        first = archive.streams(archive.position_of(1))
+        assert np.isnan(first["watts"][1]) and first["latlng"].shape == (1200, 2)
+        print('✅ Archive round trip')
+
+
+def test_filters_and_replace():
+    """Selections by user, type and date; re-exporting replaces the archive"""
+    db = _session()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "archive")
+        export_stream_archive(db, path)
+        archive = StreamArchive(path)
+        rides = [info for info, _ in archive.activities(user_id=2, types=["Ride", "VirtualRide"])]
+        expected = db.query(Activity).filter(Activity.user_id == 2, Activity.type.in_(["Ride", "VirtualRide"]))
+        assert [info["activity_id"] for info in rides] == [a.activity_id for a in expected.order_by(Activity.start_date)]
+        since = datetime(2025, 1, 8)
+        assert all(info["start_date"] >= since for info, _ in archive.activities(since=since))
+        assert len(archive.select(since=since)) == 5
+        assert set(next(archive.activities(channels=["heartrate"]))[1]) == {"heartrate"}
+
+        assert export_stream_archive(db, path, user_id=1) == 6
+        assert len(StreamArchive(path)) == 6 and not os.path.exists(f"{path}.tmp")
+        print('✅ Archive filters and re-export')
+
+
+def test_refuses_to_replace_other_paths():
+    """Exporting onto a directory or file that isn't an archive leaves it untouched"""
+    db = _session(count=2)
+    with tempfile.TemporaryDirectory() as tmp:
+        notes = os.path.join(tmp, "notes.txt")
+        with open(notes, "w") as f:
+            f.write("keep me")
+        for target in (tmp, notes):
+            try:
+                export_stream_archive(db, target)
+                assert False, f"{target} should not have been replaced"
+            except ValueError as e:
+                assert "not a stream archive" in str(e)
+        assert open(notes).read() == "keep me" and not os.path.exists(f"{tmp}.tmp")
+
+        empty = os.path.join(tmp, "empty")
+        os.makedirs(empty)
+        assert export_stream_archive(db, empty) == 2 and len(StreamArchive(empty)) == 2
+        print('✅ Refuses to replace non-archive paths')
+
+
+def _best_20min(watts):
+    watts = np.nan_to_num(np.asarray(watts, dtype=float))
+    if len(watts) < 1200:
+        return 0.0
+    sums = np.cumsum(np.concatenate(([0.0], watts)))
+    return float((sums[1200:] - sums[:-1200]).max() / 1200)
+
+
+def benchmark(count=365):
+    """A year of 90-minute activities: best 20-minute power from the database JSON vs the archive"""
+    db = _session(count, minutes=90)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "archive")
+        start = time.perf_counter()
+        export_stream_archive(db, path)
+        export_ms = (time.perf_counter() - start) * 1000
+
+        db.expire_all()
+        start = time.perf_counter()
+        from_json = max(_best_20min(a.data["streams"]["watts"]["data"]) for a in db.query(Activity)
+                        if a.data.get("streams", {}).get("watts"))
+        json_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        archive = StreamArchive(path)
+        from_archive = max(_best_20min(streams["watts"]) for _, streams in archive.activities(channels=["watts"])
+                           if "watts" in streams)
+        archive_ms = (time.perf_counter() - start) * 1000
+        assert abs(from_json - from_archive) < 1e-3
+        print(f'📊 {count} activities: export {export_ms:.0f} ms once, then JSON {json_ms:.0f} ms vs archive {archive_ms:.0f} ms')
+
+
+if __name__ == "__main__":
+    test_export_round_trip()
+    test_filters_and_replace()
+    test_refuses_to_replace_other_paths()
+    benchmark()
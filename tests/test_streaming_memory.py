@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Test that threshold estimation's stream reads are bounded in memory: a synthetic heavy athlete's
+streams are read a few rows at a time (yield_per) and folded into power/pace curves, and the
+metrics backfill drops each activity's streams JSON once extracted. Peaks measured with tracemalloc.
+"""
+
+from support import memory_session  # Also puts backend/ on sys.path
+
+import gc
+import tracemalloc
+from datetime import datetime, timedelta
+
+
+from models import User, Activity
+from activity_metrics import (
+    backfill_activity_metrics, threshold_activity_summaries, iter_activities_with_streams, STREAM_CURVE_TYPES,
+    STREAM_YIELD_PER,
+)
+from utils import fold_stream_curves, estimate_thresholds_from_activities
+from strava_event_simulator import synthetic_activity, synthetic_streams
+
+
+def _heavy_athlete(count=60):
+    """One user with `count` long 1 Hz activities (about 2 hours each, all streams)."""
+    db = memory_session()
+    db.add(User(user_id=1, name="Heavy Athlete", email="heavy@example.com"))
+    for i in range(count):
+        summary = {**synthetic_activity(20000 + i), "moving_time": 7200}
+        db.add(Activity(strava_activity_id=str(summary["id"]), user_id=1, type=summary["type"],
+                        moving_time=summary["moving_time"], distance=summary["distance"],
+                        average_speed=summary["average_speed"], name=summary["name"],
+                        start_date=datetime.now() - timedelta(days=i),
+                        data={**summary, "streams": synthetic_streams(summary)}))
+    db.commit()
+    db.expunge_all()
+    return db
+
+
+def _peak(function):
+    """(result, peak bytes allocated while it ran)"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = function()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _row_bound(db):
+    """Peak memory of reading a few fetch batches' worth of activity rows: what streaming may hold."""
+    _, one_row_peak = _peak(lambda: db.query(Activity.data).filter(Activity.activity_id == 1).one())
+    db.expunge_all()
+    return 2 * STREAM_YIELD_PER * one_row_peak
+
+
+def test_backfill_memory_is_bounded():
+    """Backfilling every activity peaks at a few rows' streams, not all of them"""
+    db = _heavy_athlete()
+    all_rows, listed_peak = _peak(lambda: [a.data for a in db.query(Activity).all()])
+    del all_rows
+    db.expunge_all()
+
+    written, streamed_peak = _peak(lambda: backfill_activity_metrics(db, user_id=1))
+    assert written == 60
+    assert streamed_peak < _row_bound(db) < listed_peak, (streamed_peak, listed_peak)
+    print(f'✅ Backfill peak {streamed_peak / 1e6:.1f} MB vs {listed_peak / 1e6:.1f} MB loading all rows')
+
+
+def test_streamed_curves_match_and_memory_is_bounded():
+    """Folding streamed rows gives the listed rows' estimates at a fraction of the peak memory"""
+    db = _heavy_athlete()
+    summaries = threshold_activity_summaries(db, 1)
+    db.commit()
+    db.expunge_all()
+
+    def listed():
+        pairs = list(iter_activities_with_streams(db, summaries, types=STREAM_CURVE_TYPES))
+        return fold_stream_curves(pairs)
+
+    def streamed():
+        return fold_stream_curves(iter_activities_with_streams(db, summaries, types=STREAM_CURVE_TYPES))
+
+    listed_curves, listed_peak = _peak(listed)
+    streamed_curves, streamed_peak = _peak(streamed)
+    assert streamed_curves == listed_curves and listed_curves[0] and listed_curves[1]
+    assert streamed_peak < _row_bound(db) < listed_peak, (streamed_peak, listed_peak)
+
+    pairs = list(iter_activities_with_streams(db, summaries, types=STREAM_CURVE_TYPES))
+    from_curves = estimate_thresholds_from_activities(summaries, "M", stream_curves=streamed_curves)
+    from_pairs = estimate_thresholds_from_activities(summaries, "M", pairs)
+    for key in ("ftp_watts", "fthp_mps"):
+        assert from_curves[key] == from_pairs[key] and from_curves[key], key
+    print(f'✅ Streamed curves peak {streamed_peak / 1e6:.1f} MB vs {listed_peak / 1e6:.1f} MB listed')
+
+
+if __name__ == "__main__":
+    test_backfill_memory_is_bounded()
+    test_streamed_curves_match_and_memory_is_bounded()
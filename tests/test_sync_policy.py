@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Test adaptive sync scheduling decisions (pure functions, no database needed)
+"""
+
+import support  # noqa: F401  (backend/ on sys.path, throwaway database config)
+
+import random
+from datetime import datetime, timedelta
+
+from sync_policy import build_activity_profile, compute_next_sync, BASELINE_INTERVAL_HOURS
+
+NOW = datetime(2025, 9, 10, 10, 0)
+
+
+def _morning_trainer_profile(days=60, hour=7, duration_s=3600):
+    starts = [NOW.replace(hour=hour) - timedelta(days=d) for d in range(1, days + 1)]
+    return build_activity_profile(starts, [duration_s] * len(starts), NOW)
+
+
+def test_dormant_user_polled_rarely():
+    """No activity for over a month: poll about every 3 days"""
+    profile = build_activity_profile([], [], NOW)
+    profile["last_activity_at"] = (NOW - timedelta(days=45)).isoformat()
+    next_sync, reason = compute_next_sync(profile, NOW, rng=random.Random(1))
+    assert reason == "dormant"
+    assert next_sync - NOW > timedelta(hours=60)
+    print('✅ Dormant user polled rarely')
+
+
+def test_poll_follows_training_window():
+    """A 7am one-hour trainer is polled shortly after their next ride would be uploaded"""
+    profile = _morning_trainer_profile()
+    next_sync, reason = compute_next_sync(profile, NOW, rng=random.Random(1))
+    assert reason == "training_window"
+    expected = (NOW + timedelta(days=1)).replace(hour=8, minute=30)
+    assert abs(next_sync - expected) <= timedelta(hours=2.5)
+    print(f'✅ Next sync at {next_sync} follows the training window')
+
+
+def test_jitter_spreads_identical_users():
+    """Users with the same habits don't all poll at the same moment"""
+    profile = _morning_trainer_profile()
+    rng = random.Random(42)
+    times = {compute_next_sync(profile, NOW, rng=rng)[0] for _ in range(50)}
+    assert len(times) == 50
+    assert max(times) - min(times) > timedelta(minutes=30)
+    print('✅ Jitter spreads identical users')
+
+
+def test_simulated_polls_fewer_than_fixed_interval():
+    """Over two weeks a daily trainer and a weekly rider need far fewer polls than every 3.5h"""
+    rng = random.Random(7)
+    daily = _morning_trainer_profile()
+    weekly = build_activity_profile(
+        [NOW.replace(hour=9) - timedelta(days=d) for d in range(2, 60, 7)], [7200] * 9, NOW
+    )
+
+    for profile in (daily, weekly):
+        now, polls = NOW, 0
+        while now < NOW + timedelta(days=14):
+            now, _ = compute_next_sync(profile, now, hit_rate=0.5, rng=rng)
+            polls += 1
+        baseline = int(14 * 24 // BASELINE_INTERVAL_HOURS)
+        assert polls < baseline / 2, (polls, baseline)
+        print(f'✅ {polls} adaptive polls vs {baseline} fixed-interval polls')
+
+
+if __name__ == "__main__":
+    test_dormant_user_polled_rarely()
+    test_poll_follows_training_window()
+    test_jitter_spreads_identical_users()
+    test_simulated_polls_fewer_than_fixed_interval()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Test the synthetic athlete generator: reproducibility, realistic streams, database loading and
+purging, and writing straight into a stream archive
+
+Run directly to also print generation throughput (activities per minute).
+"""
+
+import os
+import support  # noqa: F401  (backend/ on sys.path, throwaway database config)
+
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import create_engine, func, select
+
+from models import Base, User, Threshold, Activity, WellnessData
+from stream_archive import StreamArchive
+from synthetic_athletes import (athlete_profile, athlete_activities, load_synthetic_athletes,
+                                archive_synthetic_athletes, purge_synthetic_athletes, streams_to_json)
+from utils import calculate_utl
+
+END = datetime(2026, 6, 1)
+
+
+def _activities(index=0, years=0.25, seed=0):
+    return list(athlete_activities(athlete_profile(index, seed), years, END, seed))
+
+
+def test_same_seed_same_data():
+    """Activities depend only on (seed, athlete, activity); another seed gives different data"""
+    first, again = _activities(2), _activities(2)
+    assert len(first) == len(again) and len(first) > 10
+    for (summary, streams), (summary_again, streams_again) in zip(first, again):
+        assert summary == summary_again
+        assert all(np.array_equal(streams[key], streams_again[key]) for key in streams)
+    assert _activities(2, seed=1)[0][0] != first[0][0]
+    print('✅ Same seed, same data')
+
+
+def test_streams_look_like_real_training():
+    """HR stays within the athlete's range, outdoor rides coast, and gaps and dropouts occur"""
+    coasting = gaps = dropouts = 0
+    for index in range(6):
+        profile = athlete_profile(index)
+        for summary, streams in athlete_activities(profile, 0.3, END):
+            lengths = {len(values) for values in streams.values()}
+            assert len(lengths) == 1, summary["id"]  # Every stream covers the same samples
+            heartrate = streams["heartrate"]
+            assert heartrate.max() <= profile["max_hr"]
+            assert heartrate[heartrate > 0].min() >= profile["resting_hr"] - 10
+            assert np.all(np.diff(streams["time"]) >= 1) and np.all(np.diff(streams["distance"]) >= 0)
+            if summary["type"] == "Ride":
+                coasting += int(np.any(streams["watts"] == 0))
+                assert "latlng" in streams and summary["weighted_average_watts"] >= summary["average_watts"] * 0.95
+            gaps += int(summary["elapsed_time"] > summary["moving_time"])
+            dropouts += int(np.any(heartrate == 0))
+    assert coasting and gaps and dropouts, (coasting, gaps, dropouts)
+    print(f'✅ Realistic streams ({coasting} coasting rides, {gaps} gaps, {dropouts} HR dropouts)')
+
+
+def test_rides_score_as_tss():
+    """Generated rides carry power the UTL scorer uses, at believable intensities"""
+    profile = athlete_profile(0)
+    threshold = Threshold(ftp_watts=profile["ftp_watts"], fthp_mps=profile["fthp_mps"],
+                          max_hr=profile["max_hr"], resting_hr=profile["resting_hr"])
+    scored = 0
+    for summary, streams in athlete_activities(profile, 0.25, END):
+        if summary["type"] == "Ride":
+            score, method = calculate_utl(summary, threshold, streams_to_json(streams))
+            assert method == "TSS" and 5 < score < 150 * summary["moving_time"] / 3600, (summary, score)
+            scored += 1
+    assert scored
+    print(f'✅ {scored} rides scored as TSS')
+
+
+def test_load_and_purge():
+    """Loading writes users, thresholds, activities with streams and wellness; purge removes them all"""
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'synthetic.db')}"
+        engine = create_engine(url)
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(User.__table__.insert().values(name="Real", email="real@example.com"))
+
+        result = load_synthetic_athletes(3, 0.2, end=END, database_url=url)
+        with engine.connect() as connection:
+            count = lambda table: connection.execute(select(func.count()).select_from(table)).scalar()
+            assert count(User.__table__) == 4 and count(Threshold.__table__) == 3
+            assert count(Activity.__table__) == result["activities"] > 0
+            assert count(WellnessData.__table__) == result["wellness"] > 3 * 60
+            data = connection.execute(select(Activity.data).limit(1)).scalar()
+            assert {"time", "heartrate", "distance"} <= set(data["streams"])
+            assert len(data["streams"]["time"]["data"]) == data["streams"]["time"]["original_size"]
+
+        # Worker processes load athletes side by side
+        load_synthetic_athletes(3, 0.2, seed=5, workers=2, end=END, database_url=url, with_streams=False)
+        assert purge_synthetic_athletes(engine) == 6
+        with engine.connect() as connection:
+            count = lambda table: connection.execute(select(func.count()).select_from(table)).scalar()
+            assert connection.execute(select(User.email)).scalars().all() == ["real@example.com"]
+            assert count(Activity.__table__) == 0 and count(WellnessData.__table__) == 0
+        engine.dispose()
+    print(f'✅ Loaded and purged {result["activities"]} activities')
+
+
+def test_archive_round_trip():
+    """The archive target holds exactly the generated streams"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "archive")
+        result = archive_synthetic_athletes(path, 2, 0.1, end=END)
+        archive = StreamArchive(path)
+        assert len(archive) == result["activities"]
+        expected = _activities(1, 0.1)
+        positions = archive.select(user_id=2)
+        assert len(positions) == len(expected)
+        (summary, streams), position = expected[-1], positions[-1]
+        assert archive.info(position)["strava_activity_id"] == summary["id"]
+        for key, values in streams.items():
+            assert np.allclose(archive.streams(position)[key], values), key
+    print('✅ Archive round trip')
+
+
+def benchmark(athletes=5, years=1.0):
+    start = time.perf_counter()
+    activities = samples = 0
+    for index in range(athletes):
+        for _, streams in athlete_activities(athlete_profile(index), years, END):
+            activities += 1
+            samples += len(streams["time"])
+    seconds = time.perf_counter() - start
+    print(f'📊 Generated {activities:,} activities ({samples:,} samples) in {seconds:.1f} s '
+          f'({activities / seconds * 60:,.0f} activities/min)')
+
+
+if __name__ == "__main__":
+    test_same_seed_same_data()
+    test_streams_look_like_real_training()
+    test_rides_score_as_tss()
+    test_load_and_purge()
+    test_archive_round_trip()
+    benchmark()
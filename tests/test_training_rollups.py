@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Test the training rollups: per-user week / month / year totals per sport kept current by the
+session hook on insert, rescore, move and delete, the bulk rebuild, concurrent writers for one
+user (Postgres, set TEST_POSTGRES_URL), and the dashboard and recommendation readers
+"""
+
+import os
+from support import memory_session  # Also puts backend/ on sys.path
+
+import random
+import threading
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, User, Threshold, Activity, TrainingRollup
+from training_rollups import (rebuild_rollups, rollup_differences, period_totals, period_start, week_key,
+                              WEEK, MONTH, YEAR)
+from athlete_snapshot import AthleteSnapshot
+from dashboard import _build_dashboard_data
+from activities import _apply_activity_summary
+
+NOW = datetime(2025, 3, 12, 15, 0)  # A Wednesday
+POSTGRES_URL = os.environ.get("TEST_POSTGRES_URL")  # e.g. postgresql://postgres:pw@localhost:5432/trainingload
+TYPES = ["Ride", "Run", "Swim", None]
+
+
+def _session():
+    db = memory_session()
+    db.add(User(user_id=1, name="Rollup Athlete", email="rollups@example.com"))
+    db.add(Threshold(user_id=1, ftp_watts=250, fthp_mps=4.0))
+    db.commit()
+    return db
+
+
+def _activity(number, start, activity_type="Ride", utl=50.0, distance=20000.0):
+    return Activity(strava_activity_id=f"r{number}", user_id=1, type=activity_type, start_date=start,
+                    distance=distance, moving_time=3600, total_elevation_gain=100.0, utl_score=utl)
+
+
+def _expected(db):
+    """Rollups recomputed the slow way: every activity, grouped in Python."""
+    totals = defaultdict(lambda: [0, 0.0, 0.0])
+    for activity in db.query(Activity).filter(Activity.user_id == 1):
+        for period in (WEEK, MONTH, YEAR):
+            key = (period, period_start(period, activity.start_date.date()), activity.type or "Unknown")
+            totals[key][0] += 1
+            totals[key][1] += activity.distance or 0
+            totals[key][2] += activity.utl_score or 0
+    return {key: (count, round(distance, 6), round(utl, 6)) for key, (count, distance, utl) in totals.items()}
+
+
+def _stored(db):
+    return {(row.period, row.period_start, row.sport): (row.activities, round(row.distance, 6), round(row.utl, 6))
+            for row in db.query(TrainingRollup).filter(TrainingRollup.user_id == 1)}
+
+
+def test_incremental_updates_match_raw_totals():
+    """Inserts, rescores, moves across a month and year boundary and deletes keep every bucket exact"""
+    db = _session()
+    rng = random.Random(5)
+    for number in range(120):
+        start = NOW - timedelta(days=rng.randint(0, 500), hours=rng.random() * 12)
+        db.add(_activity(number, start, rng.choice(TYPES), utl=rng.random() * 120, distance=rng.random() * 40000))
+        if number % 30 == 29:
+            db.commit()  # Several flushes, like paged imports
+    db.commit()
+    assert _stored(db) == _expected(db)
+
+    activities = db.query(Activity).order_by(Activity.activity_id).all()
+    for activity in activities[:40]:
+        activity.utl_score = (activity.utl_score or 0) * 1.2  # Rescore
+    activities[50].start_date = datetime(2024, 12, 31, 23, 0)
+    activities[51].start_date = datetime(2025, 1, 1, 6, 0)
+    activities[52].type = "VirtualRide"
+    db.delete(activities[60])
+    db.commit()
+    assert _stored(db) == _expected(db)
+
+    activities[50].name = "Renamed"  # Not a rolled-up column: no rollup statements
+    statements = []
+    event.listen(db.get_bind(), "before_cursor_execute", lambda conn, cursor, sql, *args: statements.append(sql))
+    db.commit()
+    assert not any("training_rollups" in sql for sql in statements)
+    assert rollup_differences(db, 1) == []
+    print('✅ Incremental updates match raw totals')
+
+
+def test_rebuild_after_bulk_writes():
+    """Core inserts bypass the hook; rebuild_rollups brings the user back in line"""
+    db = _session()
+    db.execute(insert(Activity), [
+        {"strava_activity_id": f"b{day}", "user_id": 1, "type": "Run", "start_date": NOW - timedelta(days=day),
+         "distance": 10000.0, "moving_time": 3000, "total_elevation_gain": 50.0, "utl_score": 40.0}
+        for day in range(60)
+    ])
+    db.commit()
+    assert db.query(TrainingRollup).count() == 0
+    assert len(rollup_differences(db, 1)) > 0
+
+    rows = rebuild_rollups(db, 1)
+    db.commit()
+    assert rows == db.query(TrainingRollup).count() > 0
+    assert _stored(db) == _expected(db) and rollup_differences(db, 1) == []
+    print('✅ Rebuild after bulk writes')
+
+
+def test_concurrent_writers_same_user():
+    """Two transactions writing the same user's week: the second waits for the first and includes its activity"""
+    if not POSTGRES_URL:
+        pytest.skip("set TEST_POSTGRES_URL to run against Postgres")
+    engine = create_engine(POSTGRES_URL)
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    setup = factory()
+    user = User(name="Concurrent Rollups", email=f"rollups-{datetime.now().timestamp()}@example.com")
+    setup.add(user)
+    setup.commit()
+    user_id = user.user_id
+
+    def activity(number):
+        return Activity(strava_activity_id=f"concurrent-{user_id}-{number}", user_id=user_id, type="Ride",
+                        start_date=NOW - timedelta(hours=number), distance=10000.0, moving_time=1800, utl_score=40.0)
+
+    first, second = factory(), factory()
+    errors, flushed = [], threading.Event()
+
+    def second_writer():
+        try:
+            second.add(activity(2))
+            second.flush()  # Blocks on the user's rollup lock until the first transaction commits
+            flushed.set()
+            second.commit()
+        except Exception as e:
+            errors.append(e)
+            second.rollback()
+
+    try:
+        first.add(activity(1))
+        first.flush()
+        writer = threading.Thread(target=second_writer)
+        writer.start()
+        assert not flushed.wait(1.0), "second writer did not wait for the first"
+        first.commit()
+        writer.join(10)
+        assert not errors, errors
+
+        week = setup.query(TrainingRollup).filter_by(user_id=user_id, period=WEEK).one()
+        assert week.activities == 2 and week.utl == 80.0
+        assert rollup_differences(setup, user_id) == []
+    finally:
+        first.close()
+        second.close()
+        setup.query(Activity).filter_by(user_id=user_id).delete()
+        setup.query(TrainingRollup).filter_by(user_id=user_id).delete()
+        setup.query(User).filter_by(user_id=user_id).delete()
+        setup.commit()
+        setup.close()
+    print('✅ Concurrent writers for one user')
+
+
+def test_period_totals_and_dashboard():
+    """Calendar week / month / year and all-time totals; the dashboard reads them (building them once if missing)"""
+    db = _session()
+    dates = [NOW, NOW - timedelta(days=2), NOW - timedelta(days=5), NOW - timedelta(days=20), datetime(2024, 6, 1)]
+    for number, start in enumerate(dates):
+        db.add(_activity(number, start, utl=10.0 * (number + 1)))
+    db.commit()
+
+    totals = period_totals(db, 1, now=NOW)
+    assert totals[WEEK]["activities"] == 2  # Monday 10th onwards
+    assert totals[MONTH]["activities"] == 3 and totals[YEAR]["activities"] == 4
+    assert totals["all_time"]["activities"] == 5 and totals["all_time"]["distance"] == 100000.0
+    assert totals[WEEK]["utl"] == 30.0
+
+    db.query(TrainingRollup).delete()
+    db.commit()
+    dashboard = _build_dashboard_data(1, db)
+    assert dashboard.activity_summary.total_activities == 5
+    assert dashboard.training_totals.this_year["activities"] == period_totals(db, 1)[YEAR]["activities"]
+    assert dashboard.activity_summary.total_elevation_gain == 500.0
+    print('✅ Period totals and dashboard')
+
+
+def test_strava_summaries_roll_up():
+    """Activities imported from Strava summaries (ISO start_date strings) reach the rollups"""
+    db = _session()
+    for number, start in enumerate(["2025-03-01T10:00:00Z", "2025-03-11T23:30:00+02:00"]):
+        activity = Activity(strava_activity_id=f"s{number}", user_id=1)
+        _apply_activity_summary(activity, {"name": "Import", "type": "Ride", "distance": 20000.0,
+                                           "moving_time": 3600, "start_date": start}, None)
+        db.add(activity)
+    db.commit()
+
+    imported = db.query(Activity).order_by(Activity.start_date).all()
+    assert [activity.start_date for activity in imported] == [datetime(2025, 3, 1, 10), datetime(2025, 3, 11, 23, 30)]
+    assert _stored(db) == _expected(db)
+    assert period_totals(db, 1, now=NOW)[WEEK]["activities"] == 1
+    print('✅ Strava summaries roll up')
+
+
+def test_snapshot_weekly_loads():
+    """The recommendations' weekly loads come from the weekly rollups, bucketed like before"""
+    db = _session()
+    for number, (days_ago, activity_type, utl) in enumerate([(0, "Ride", 80.0), (1, "VirtualRun", 30.0),
+                                                             (2, "Swim", 20.0), (9, "Run", 60.0)]):
+        db.add(_activity(number, NOW - timedelta(days=days_ago), activity_type, utl=utl))
+    db.add(_activity(99, NOW - timedelta(days=200), "Ride", utl=500.0))  # Outside the window
+    db.commit()
+
+    snapshot = AthleteSnapshot.load(db, 1, now=NOW)
+    this_week = week_key(period_start(WEEK, (NOW - timedelta(days=1)).date()))
+    last_week = week_key(period_start(WEEK, (NOW - timedelta(days=9)).date()))
+    assert set(snapshot.weekly_loads) == {this_week, last_week}
+    assert snapshot.weekly_loads[this_week] == {"cycling": 80.0, "running": 30.0, "other": 20.0, "total": 130.0}
+    assert snapshot.weekly_loads[last_week]["running"] == 60.0
+    assert week_key(date(2025, 1, 6)) < week_key(date(2025, 3, 10))
+    print('✅ Snapshot weekly loads')
+
+
+if __name__ == "__main__":
+    test_incremental_updates_match_raw_totals()
+    test_rebuild_after_bulk_writes()
+    if POSTGRES_URL:
+        test_concurrent_writers_same_user()
+    test_period_totals_and_dashboard()
+    test_strava_summaries_roll_up()
+    test_snapshot_weekly_loads()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Test upstream rate limit budgets: interactive reserve, window rollover, wait deadlines, header sync
+"""
+
+from support import memory_session_factory  # Also puts backend/ on sys.path
+
+import time
+
+from fastapi import BackgroundTasks
+
+import activities
+from models import User, JobQueueItem
+from upstream_budget import UpstreamBudget, UpstreamBudgetExceeded, upstream_lane, current_lane, wait_deadline
+
+
+class FakeClock:
+    def __init__(self, start=900 * 1000):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def _budget(clock, max_wait=900):
+    return UpstreamBudget("strava", 15 * 60, 100, 1000, reserved_share=0.2,
+                          max_wait_seconds=max_wait, clock=clock.time, sleep=clock.sleep)
+
+
+def test_reserve_kept_for_interactive():
+    """Background lanes stop at 80% of the window; interactive can use the rest immediately"""
+    clock = FakeClock()
+    budget = _budget(clock, max_wait=0)
+    for _ in range(80):
+        budget.acquire("routine")
+
+    try:
+        budget.acquire("maintenance")
+        assert False, "background request should have been refused"
+    except UpstreamBudgetExceeded:
+        pass
+
+    for _ in range(20):
+        budget.acquire("interactive")
+    assert clock.now == 900 * 1000  # No waiting
+    status = budget.status()
+    assert status["calls_by_lane"]["interactive"] == 20 and status["throttled_by_lane"]["maintenance"] == 1
+    print('✅ Reserve kept for interactive requests')
+
+
+def test_background_waits_for_next_window():
+    """A background request past its share sleeps until the 15-minute window rolls over"""
+    clock = FakeClock(start=900 * 1000 + 300)
+    budget = _budget(clock)
+    for _ in range(80):
+        budget.acquire("routine")
+    budget.acquire("routine")
+    assert 900 * 1001 <= clock.now < 900 * 1001 + 5
+    assert budget.status()["window_used"] == 1
+    print('✅ Background request waits for the next window')
+
+
+def test_wait_deadline_raises_with_retry_after():
+    """Inside a wait deadline (a queue item's lease) a long wait raises with the time to the reset instead"""
+    clock = FakeClock(start=900 * 1000 + 300)
+    budget = _budget(clock)
+    for _ in range(80):
+        budget.acquire("routine")
+    with wait_deadline(time.time() + 60):
+        try:
+            budget.acquire("routine")
+            assert False, "a 600s wait should not fit before the deadline"
+        except UpstreamBudgetExceeded as e:
+            assert e.retry_after == 600
+    assert clock.now == 900 * 1000 + 300  # Never slept
+    print('✅ Wait deadline raises with retry_after')
+
+
+def test_headers_sync_usage_across_processes():
+    """Strava's usage headers reflect calls made by other processes"""
+    clock = FakeClock()
+    budget = _budget(clock, max_wait=0)
+    budget.observe({"X-RateLimit-Limit": "200,2000", "X-RateLimit-Usage": "160,900"})
+    try:
+        budget.acquire("routine")
+        assert False, "usage reported by Strava should block background requests"
+    except UpstreamBudgetExceeded:
+        pass
+    budget.acquire("interactive")
+    assert budget.status()["window_used"] == 161
+    print('✅ Usage headers synced')
+
+
+def test_lane_context():
+    """Lanes nest and default to routine"""
+    assert current_lane() == "routine"
+    with upstream_lane("interactive"):
+        assert current_lane() == "interactive"
+        with upstream_lane("maintenance"):
+            assert current_lane() == "maintenance"
+        assert current_lane() == "interactive"
+    assert current_lane() == "routine"
+    print('✅ Lane context')
+
+
+def test_direct_callers_handle_exhausted_budget():
+    """Outside the queue, an exhausted budget defers the import to the queue and stops the all-users sync"""
+    factory = memory_session_factory()
+    db = factory()
+    db.add_all([User(user_id=user_id, name=f"Athlete {user_id}", email=f"athlete{user_id}@example.com",
+                     strava_oauth_token="token") for user_id in (1, 2)])
+    db.commit()
+
+    calls = []
+
+    def exhausted(user_id, session, backfill_days=90):
+        calls.append(user_id)
+        raise UpstreamBudgetExceeded("strava budget exhausted", retry_after=120)
+
+    original = (activities.SessionLocal, activities._fetch_and_process_activities)
+    activities.SessionLocal, activities._fetch_and_process_activities = factory, exhausted
+    try:
+        tasks = BackgroundTasks()
+        activities.import_activities(activities.ActivityImportRequest(user_id=1), tasks)
+        for task in tasks.tasks:
+            task.func(*task.args, **task.kwargs)
+        activities.sync_strava_activities()
+    finally:
+        activities.SessionLocal, activities._fetch_and_process_activities = original
+
+    assert calls == [1, 1]  # The sync stopped after the first user
+    item = db.query(JobQueueItem).one()
+    assert (item.task_name, item.user_id, item.payload) == ("sync_user", 1, {"backfill_days": 90, "wellness_days": 0})
+    assert abs((item.available_at - item.created_at).total_seconds() - 121) < 1
+    db.close()
+    print('✅ Direct callers handle an exhausted budget')
+
+
+if __name__ == "__main__":
+    test_reserve_kept_for_interactive()
+    test_background_waits_for_next_window()
+    test_wait_deadline_raises_with_retry_after()
+    test_headers_sync_usage_across_processes()
+    test_lane_context()
+    test_direct_callers_handle_exhausted_budget()
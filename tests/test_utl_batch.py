@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Test that batch UTL scoring equals calculate_utl row by row
+
+Run directly to also print a batch vs per-activity timing.
+"""
+
+import support  # noqa: F401  (backend/ on sys.path, throwaway database config)
+
+import math
+import random
+import time
+
+from utils import calculate_utl
+from utl_batch import calculate_utl_batch
+
+TYPES = ["Ride", "Run", "VirtualRide", "Hike", "Walk", "Swim", "Workout", "running", "cycling", "AlpineSki"]
+
+
+class FakeThreshold:
+    def __init__(self, ftp_watts=250, fthp_mps=4.0, max_hr=190, resting_hr=50):
+        self.ftp_watts = ftp_watts
+        self.fthp_mps = fthp_mps
+        self.max_hr = max_hr
+        self.resting_hr = resting_hr
+
+
+def _streams(rng, activity_type, samples):
+    streams = {}
+    if rng.random() < 0.5:
+        streams["watts"] = {"data": [rng.randint(80, 400) for _ in range(rng.choice([0, 10, samples]))]}
+    if rng.random() < 0.5:
+        streams["heartrate"] = {"data": [rng.randint(90, 185) for _ in range(rng.choice([0, samples]))]}
+    if activity_type.lower() in ("run", "running") and rng.random() < 0.7:
+        speed = rng.uniform(2.2, 4.5)
+        distance, total = [], 0.0
+        for _ in range(samples):
+            total += speed * rng.uniform(0.7, 1.3)
+            distance.append(total)
+        streams["distance"] = {"data": distance}
+        streams["time"] = {"data": list(range(samples))}
+    return streams or None
+
+
+def _activities(count=300, seed=11):
+    rng = random.Random(seed)
+    summaries, streams, wellness = [], [], []
+    for _ in range(count):
+        activity_type = rng.choice(TYPES)
+        moving_time = rng.choice([0, rng.randint(300, 4 * 3600), rng.randint(5 * 3600, 9 * 3600)])
+        summaries.append({"type": activity_type, "moving_time": moving_time,
+                          "distance": rng.choice([0, rng.uniform(2000, 40000)])})
+        streams.append(_streams(rng, activity_type, rng.randint(40, 600)))
+        wellness.append(rng.choice([
+            None, {},
+            {"hrv": rng.uniform(10, 70), "sleepScore": rng.uniform(40, 95), "readiness": rng.uniform(30, 95)},
+            {"hrv": None, "sleepScore": rng.uniform(40, 95), "readiness": None},
+        ]))
+    # A long run without summary distance or heart rate reaches the pace-distribution analysis
+    summaries.append({"type": "Run", "moving_time": 1500, "distance": 0})
+    streams.append({"distance": {"data": [3.2 * t for t in range(1500)]}, "time": {"data": list(range(1500))}})
+    wellness.append(None)
+    return summaries, streams, wellness
+
+
+def _assert_equal(summaries, threshold, streams, wellness):
+    batch = calculate_utl_batch(summaries, threshold, streams, wellness)
+    for i, (summary, activity_streams, wellness_data) in enumerate(zip(summaries, streams, wellness)):
+        expected = calculate_utl(summary, threshold, activity_streams, wellness_data)
+        assert batch[i][1] == expected[1], (i, summary, batch[i], expected)
+        assert math.isclose(batch[i][0], expected[0], rel_tol=1e-9, abs_tol=1e-9), (i, summary, batch[i], expected)
+    return batch
+
+
+def test_batch_matches_scalar_across_thresholds():
+    """Every method branch, with full, partial and missing thresholds"""
+    summaries, streams, wellness = _activities()
+    methods = set()
+    for threshold in (FakeThreshold(), FakeThreshold(fthp_mps=None),
+                      FakeThreshold(fthp_mps=None, max_hr=None),
+                      FakeThreshold(ftp_watts=-1, fthp_mps=0, max_hr=180, resting_hr=185)):  # -1 FTP: power_intensity
+        methods.update(method.split("_wellness")[0] for _, method in
+                       _assert_equal(summaries, threshold, streams, wellness))
+    for expected in ("no_time", "TSS", "rTSS", "TRIMP", "power_intensity", "conservative_time_based"):
+        assert expected in methods, (expected, methods)
+    assert any(method.startswith("running_intensity_") for method in methods), methods
+    print(f'✅ Batch matches scalar for {len(summaries)} activities x 4 thresholds ({len(methods)} methods)')
+
+
+def test_malformed_rows_use_scalar_path():
+    """Missing fields and non-numeric streams give exactly what calculate_utl gives"""
+    threshold = FakeThreshold()
+    summaries = [
+        {"type": None, "moving_time": 3600},
+        {"type": "Ride", "moving_time": None},
+        {"type": "Run", "moving_time": 3600, "distance": None},
+        {"type": "Ride", "moving_time": 3600},
+        {"type": "Walk", "moving_time": 3600},
+    ]
+    streams = [None, None, None, {"watts": {"data": [200, None, 210]}}, None]
+    wellness = [None, None, None, None, {"hrv": "high"}]
+    _assert_equal(summaries, threshold, streams, wellness)
+    print('✅ Malformed rows fall back to calculate_utl')
+
+
+def benchmark(count=500):
+    summaries, streams, wellness = _activities(count=count, seed=5)
+    for summary in summaries:
+        summary["distance"] = summary["distance"] or 8000  # Real runs have a distance (rTSS, not pace analysis)
+    threshold = FakeThreshold()
+    start = time.perf_counter()
+    for summary, activity_streams, wellness_data in zip(summaries, streams, wellness):
+        calculate_utl(summary, threshold, activity_streams, wellness_data)
+    scalar_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    calculate_utl_batch(summaries, threshold, streams, wellness)
+    batch_ms = (time.perf_counter() - start) * 1000
+    print(f'📊 {count} activities: per-activity {scalar_ms:.1f} ms, batch {batch_ms:.1f} ms')
+
+
+if __name__ == "__main__":
+    test_batch_matches_scalar_across_thresholds()
+    test_malformed_rows_use_scalar_path()
+    benchmark()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Test the per-user view cache (LRU/TTL, ETags) and the cached dashboard endpoint
+against an in-memory SQLite database
+"""
+
+from support import memory_session_factory, dashboard_client  # Also puts backend/ on sys.path
+
+from datetime import datetime, timedelta
+
+from models import User, Threshold, Activity
+from data_events import publish, ACTIVITIES_CHANGED
+from view_cache import LRUBackend, ViewCache, dashboard_cache, etag_matches
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _client():
+    factory = memory_session_factory(shared=True)
+    db = factory()
+    db.add(User(user_id=1, name="Test Athlete", email="athlete@example.com"))
+    db.add(Threshold(user_id=1, ftp_watts=250, fthp_mps=4.0))
+    for day in range(5):
+        db.add(Activity(strava_activity_id=str(day), user_id=1, type="Ride", distance=30000,
+                        moving_time=3600, start_date=datetime.now() - timedelta(days=day), utl_score=60))
+    db.commit()
+    dashboard_cache.invalidate(1)
+    return dashboard_client(factory), db
+
+
+def test_lru_evicts_oldest_and_expires():
+    """Least recently used entries go first; entries expire after their TTL"""
+    clock = FakeClock()
+    backend = LRUBackend(max_entries=2, clock=clock)
+    backend.set("a", 1, 60)
+    backend.set("b", 2, 60)
+    assert backend.get("a") == 1  # a is now most recent
+    backend.set("c", 3, 60)
+    assert backend.get("b") is None
+    assert backend.get("a") == 1 and backend.get("c") == 3
+
+    clock.now += 61
+    assert backend.get("a") is None
+    assert len(backend) == 1
+    print('✅ LRU eviction and TTL')
+
+
+def test_etag_is_content_hash():
+    """Re-rendering identical data gives the same ETag; If-None-Match parsing handles lists and weak tags"""
+    cache = ViewCache("test", backend=LRUBackend(clock=FakeClock()))
+    first = cache.set(1, {"a": 1})
+    cache.invalidate(1)
+    assert cache.get(1) is None
+    assert cache.set(1, {"a": 1}).etag == first.etag
+    assert cache.set(1, {"a": 2}).etag != first.etag
+
+    assert etag_matches(first.etag, first.etag)
+    assert etag_matches(f'"other", W/{first.etag}', first.etag)
+    assert etag_matches("*", first.etag)
+    assert not etag_matches(None, first.etag)
+    print('✅ Content-hash ETags')
+
+
+def test_dashboard_returns_304_until_data_changes():
+    """Unchanged dashboards are 304s; an activity event forces a rebuild with a new ETag"""
+    client, db = _client()
+    first = client.get("/dashboard/1")
+    assert first.status_code == 200
+    assert first.json()["activity_summary"]["total_activities"] == 5
+    etag = first.headers["etag"]
+
+    misses = dashboard_cache.misses
+    again = client.get("/dashboard/1", headers={"If-None-Match": etag})
+    assert again.status_code == 304 and again.headers["etag"] == etag
+    assert dashboard_cache.misses == misses
+
+    db.add(Activity(strava_activity_id="new", user_id=1, type="Run", distance=10000,
+                    moving_time=3000, start_date=datetime.now(), utl_score=50))
+    db.commit()
+    publish(ACTIVITIES_CHANGED, 1)
+
+    changed = client.get("/dashboard/1", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert changed.json()["activity_summary"]["total_activities"] == 6
+    print('✅ Dashboard 304s until invalidated')
+
+
+def test_dashboard_errors_are_not_cached():
+    """Users who haven't onboarded still get the 400, every time"""
+    client, db = _client()
+    db.query(Threshold).delete()
+    db.commit()
+    assert client.get("/dashboard/1").status_code == 400
+    assert client.get("/dashboard/1").status_code == 400
+    print('✅ Errors are not cached')
+
+
+if __name__ == "__main__":
+    test_lru_evicts_oldest_and_expires()
+    test_etag_is_content_hash()
+    test_dashboard_returns_304_until_data_changes()
+    test_dashboard_errors_are_not_cached()